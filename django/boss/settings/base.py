@@ -15,6 +15,7 @@
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 import os
 import sys
+import tempfile
 from pathlib import Path
 
 
@@ -64,6 +65,7 @@ INSTALLED_APPS = [
     'bosscore',
     'bossmeta',
     'bossspatialdb',
+    'bosstiles',
     'sso',
     'mgmt', # for templating to work
     'bootstrapform', # style management console
@@ -149,6 +151,112 @@ REST_FRAMEWORK = {
 BOSS_VERSION = 'v0.7'
 # Maximum number of bytes in an uncompressed matrix supported by the Cutout Service
 CUTOUT_MAX_SIZE = 5 * 10 ** 8
+# Maximum number of uncompressed bytes in each block of a streamed cutout
+CUTOUT_STREAM_BLOCK_SIZE = 64 * 2 ** 20
+# Maximum number of uncompressed bytes in a cutout that the client has asked the server to split into a block stream
+CUTOUT_SPLIT_MAX_SIZE = 64 * 2 ** 30
+# Maximum number of uncompressed bytes in a cutout that is reduced to a projection along one axis
+CUTOUT_PROJECTION_MAX_SIZE = 16 * 2 ** 30
+# Maximum number of regions in a single batch cutout request
+CUTOUT_BATCH_MAX_REGIONS = 256
+# Maximum number of ids an annotation cutout can be filtered on
+CUTOUT_FILTER_MAX_IDS = 2 ** 20
+# Uncompressed cutouts larger than this many bytes are sent from a temp file so the server can use sendfile
+CUTOUT_RAW_SENDFILE_SIZE = 16 * 2 ** 20
+# npygz cutouts larger than this many uncompressed bytes are streamed as they are compressed, instead of rendered
+CUTOUT_NPYGZ_STREAM_SIZE = 16 * 2 ** 20
+# Default and maximum number of threads a client can request to compress or decompress a cutout
+CODEC_DEFAULT_THREADS = 4
+CODEC_MAX_THREADS = 16
+# Maximum number of idle SpatialDB instances each process keeps, and how long (in seconds) one can sit idle before
+# its connections are checked when it is reused
+SPATIALDB_POOL_SIZE = 4
+SPATIALDB_POOL_HEALTH_CHECK_INTERVAL = 30
+# Number of background jobs (eg. downsampling) each process runs at once
+BACKGROUND_JOB_WORKERS = 2
+# Seconds between the heartbeats a process sends for the jobs it is running, and seconds without a heartbeat after
+# which a queued or running job is marked failed. The timeout should be several intervals.
+BACKGROUND_JOB_HEARTBEAT_INTERVAL = 60
+BACKGROUND_JOB_HEARTBEAT_TIMEOUT = 600
+# Cutout jobs: maximum number of uncompressed bytes in a job, directory results are saved to, and how long (in
+# seconds) a result is kept after the job completes. With more than one API server the directory must be shared
+# storage mounted on every server (eg. EFS). Otherwise a result can only be downloaded from the server that ran the job.
+CUTOUT_JOB_MAX_SIZE = 64 * 2 ** 30
+CUTOUT_JOB_RESULT_DIR = os.path.join(tempfile.gettempdir(), 'boss_cutout_jobs')
+CUTOUT_JOB_RESULT_TTL = 7 * 24 * 3600
+# Region statistics: maximum number of uncompressed bytes in a region, number of cuboids each process reads and
+# aggregates at once, and how long (in seconds) the aggregate of a cuboid is cached
+STATISTICS_MAX_SIZE = 16 * 2 ** 30
+STATISTICS_WORKERS = 8
+STATISTICS_CACHE_TTL = 7 * 24 * 3600
+# Single-flight reads: coalesce identical concurrent reads within a process (local) or across processes (redis), how
+# long (in seconds) to wait on another process's read, how long its result is kept, the largest result shared, and
+# how many reads each process makes between logging its counters (0 to never log them).
+# 'local' only shares reads between the threads of a process, so it does nothing with single threaded uWSGI workers.
+SINGLE_FLIGHT_BACKEND = 'redis'
+SINGLE_FLIGHT_WAIT = 10
+SINGLE_FLIGHT_RESULT_TTL = 5
+SINGLE_FLIGHT_MAX_SHARED_SIZE = 64 * 2 ** 20
+SINGLE_FLIGHT_LOG_INTERVAL = 10000
+# Per-process cache of decompressed cuboids: maximum number of bytes each process keeps, and the largest read (in bytes
+# of the cuboids it touches) that goes through the cache. Set CUBOID_CACHE_SIZE to 0 to disable it.
+CUBOID_CACHE_SIZE = 256 * 2 ** 20
+CUBOID_CACHE_MAX_READ_SIZE = 64 * 2 ** 20
+# Tile cache: tiers encoded tiles and images are kept in (checked in order), bytes of tiles kept in each process's
+# memory, directory and bytes of tiles kept on each server's disk, how long (in seconds) a tile is kept in redis, and
+# the largest tile that is cached
+TILE_CACHE_TIERS = ['memory', 'disk', 'redis']
+TILE_CACHE_MEMORY_SIZE = 128 * 2 ** 20
+TILE_CACHE_DIR = os.path.join(tempfile.gettempdir(), 'boss_tiles')
+TILE_CACHE_DISK_SIZE = 4 * 2 ** 30
+TILE_CACHE_REDIS_TTL = 3600
+TILE_CACHE_MAX_TILE_SIZE = 4 * 2 ** 20
+# Tile pre-rendering: default tile sizes, blocks (threads in a job, processes in the render_tiles command) rendered at
+# once, maximum number of uncompressed bytes cut out for a block, maximum number of tiles in a job, and the directory
+# tiles are written to for the web server to send
+TILE_RENDER_TILE_SIZES = [512]
+TILE_RENDER_WORKERS = 4
+TILE_RENDER_BLOCK_SIZE = 64 * 2 ** 20
+TILE_RENDER_MAX_TILES = 10 ** 7
+TILE_RENDER_DIR = os.path.join(tempfile.gettempdir(), 'boss_tile_pyramid')
+# xz and yz tiles: number of consecutive planes read together as a slab, bytes of slabs cached per process and maximum
+# number of uncompressed bytes in a slab
+TILE_SLAB_DEPTH = 16
+TILE_SLAB_CACHE_SIZE = 256 * 2 ** 20
+TILE_SLAB_MAX_SIZE = 32 * 2 ** 20
+# Batch tiles: number of threads per process that read and encode tiles, maximum number of tiles in a request and
+# maximum number of uncompressed bytes read for a group of tiles
+TILE_BATCH_WORKERS = 8
+TILE_BATCH_MAX_TILES = 256
+TILE_BATCH_MAX_READ_SIZE = 64 * 2 ** 20
+# Tile display settings: percentiles of a channel's histogram used as its default window, and number of seconds each
+# process keeps a channel's default window
+TILE_DEFAULT_WINDOW_PERCENTILES = (0.5, 99.5)
+TILE_DEFAULT_WINDOW_TTL = 300
+# Tile prefetching: whether the neighbours of a served tile or image are rendered in the background, number of planes
+# prefetched on either side along the axis normal to the image, number of prefetch threads per process, maximum number
+# of prefetches a user can have queued or running and maximum number queued or running per process
+TILE_PREFETCH = False
+TILE_PREFETCH_DEPTH = 2
+TILE_PREFETCH_WORKERS = 2
+TILE_PREFETCH_USER_BUDGET = 8
+TILE_PREFETCH_MAX_PENDING = 128
+# Neuroglancer precomputed volumes: gzip level of chunks sent to clients that accept it (0 disables compression) and
+# number of seconds clients may reuse a chunk or info file before revalidating it
+NEUROGLANCER_GZIP_LEVEL = 6
+NEUROGLANCER_CHUNK_MAX_AGE = 60
+NEUROGLANCER_INFO_MAX_AGE = 300
+# Composite images: number of threads per process that read the layers of composites, maximum number of channels in
+# a composite (including the tile or image's own channel) and opacity of annotation layers
+TILE_COMPOSITE_WORKERS = 8
+TILE_COMPOSITE_MAX_CHANNELS = 4
+TILE_COMPOSITE_ANNOTATION_OPACITY = 0.5
+# Downsampling: reduction used for image channels (mean or slice), number of blocks reduced in parallel by a job,
+# maximum number of uncompressed bytes read for a block, and whether to start a job when an ingest job completes
+DOWNSAMPLE_IMAGE_METHOD = 'mean'
+DOWNSAMPLE_NUM_WORKERS = 4
+DOWNSAMPLE_BLOCK_SIZE = 64 * 2 ** 20
+DOWNSAMPLE_AFTER_INGEST = True
 
 # Allow all cross site origins
 CORS_ORIGIN_ALLOW_ALL = True
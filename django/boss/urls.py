@@ -55,6 +55,14 @@ urlpatterns = [
     url(r'^v0.7/permissions/?', include('bosscore.urls.permission-urls', namespace='v0.7')),
     url(r'^v0.7/groups/', include('bosscore.urls.group-urls', namespace='v0.7')),
     url(r'^v0.7/cutout/', include('bossspatialdb.urls', namespace='v0.7')),
+    url(r'^v0.7/batch/cutout/', include('bossspatialdb.batch_urls', namespace='v0.7')),
+    url(r'^v0.7/batch/tile/', include('bosstiles.batch_urls', namespace='v0.7')),
+    url(r'^v0.7/filter/cutout/', include('bossspatialdb.filter_urls', namespace='v0.7')),
+    url(r'^v0.7/jobs/cutout/', include('bossspatialdb.job_urls', namespace='v0.7')),
+    url(r'^v0.7/jobs/tiles/', include('bosstiles.job_urls', namespace='v0.7')),
+    url(r'^v0.7/downsample/', include('bossspatialdb.downsample_urls', namespace='v0.7')),
+    url(r'^v0.7/statistics/', include('bossspatialdb.statistics_urls', namespace='v0.7')),
+    url(r'^v0.7/neuroglancer/', include('bossspatialdb.neuroglancer_urls', namespace='v0.7')),
     url(r'^v0.7/image/', include('bosstiles.image_urls', namespace='v0.7')),
     url(r'^v0.7/tile/', include('bosstiles.tile_urls', namespace='v0.7')),
     url(r'^v0.7/ingest/', include('bossingest.urls', namespace='v0.7')),
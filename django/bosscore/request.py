@@ -73,9 +73,10 @@ class BossRequest:
         self.time_stop = 0
         self.time_request = False  # Flag indicating if the REQUEST contained a time range (True) or if auto-pop (False)
 
-        # Request variables
+        # Request variables. Services that read data using a POST body (eg. batch cutouts) can override the method
+        # used when checking permissions
         self.user = request.user
-        self.method = request.method
+        self.method = self.bossrequest.get('method', request.method)
         self.version = request.version
 
         # object service
@@ -147,9 +148,14 @@ class BossRequest:
                 raise BossError("The channel in request has type {}. Filter is only valid for annotation channels"
                       .format(self.channel.type), ErrorCodes.DATATYPE_NOT_SUPPORTED)
             else:
-                # convert ids to ints
+                # convert ids to ints, sorted so a cutout can be filtered with a binary search. Ids from a request
+                # body have already been parsed into an array.
                 try:
-                    self.filter_ids = np.fromstring(self.bossrequest['ids'], sep= ',', dtype=np.uint64)
+                    if isinstance(self.bossrequest['ids'], np.ndarray):
+                        filter_ids = self.bossrequest['ids'].astype(np.uint64)
+                    else:
+                        filter_ids = np.fromstring(self.bossrequest['ids'], sep= ',', dtype=np.uint64)
+                    self.filter_ids = np.unique(filter_ids)
                 except (TypeError, ValueError)as e:
                     raise BossError("Invalid id in list of filter ids {}. {}".format(self.bossrequest['ids'], str(e)),
                                     ErrorCodes.INVALID_CUTOUT_ARGS)
@@ -17,6 +17,8 @@ import jsonschema
 import boto3
 import io
 
+from django.utils import timezone
+
 from ingest.core.config import Configuration
 from ingest.core.backend import BossBackend
 
@@ -244,6 +246,29 @@ class IngestManager:
             raise BossError("The ingest job with id {} does not exist".format(str(ingest_job_id)),
                             ErrorCodes.OBJECT_NOT_FOUND)
 
+    def complete_ingest_job(self, ingest_job_id):
+        """
+        Mark an ingest job as complete
+        Args:
+            ingest_job_id: Id of the ingest job
+
+        Returns:
+            IngestJob : Data model of the completed ingest job
+
+        Raises:
+            BossError : If the ingest job id does not exist or the job is not uploading
+
+        """
+        ingest_job = self.get_ingest_job(ingest_job_id)
+        if ingest_job.status != 1:
+            raise BossError("Ingest job {} is not uploading and cannot be completed".format(ingest_job_id),
+                            ErrorCodes.INVALID_ARGUMENT)
+
+        ingest_job.status = 2
+        ingest_job.end_date = timezone.now()
+        ingest_job.save()
+        return ingest_job
+
     def get_ingest_job_upload_queue(self, ingest_job):
         """
         Return the upload queue for an ingest job
@@ -15,6 +15,7 @@ from __future__ import absolute_import
 import json
 from unittest.mock import patch
 
+from bosscore.error import BossError
 from bossingest.ingest_manager import IngestManager
 from bossingest.test.setup import SetupTests
 from bosscore.test.setup_db import SetupTestDB
@@ -77,6 +78,20 @@ class BossIngestManagerTest(APITestCase):
         job = ingest_mgmr.create_ingest_job()
         assert (job.id is not None)
 
+    def test_complete_ingest_job_not_uploading(self):
+        """Test completing an ingest job that isn't uploading is a client error"""
+        ingest_mgmr = IngestManager()
+        ingest_mgmr.validate_config_file(self.example_config_data)
+        ingest_mgmr.validate_properties()
+        ingest_mgmr.owner = self.user.pk
+        job = ingest_mgmr.create_ingest_job()
+        job.status = 2
+        job.save()
+
+        with self.assertRaises(BossError) as err:
+            ingest_mgmr.complete_ingest_job(job.id)
+        assert (err.exception.status_code == 400)
+
 
     def test_create_upload_task_message(self):
         """Test method that creates an upload task message"""
@@ -15,7 +15,7 @@
 from rest_framework.test import APITestCase
 from django.core.urlresolvers import resolve
 from django.conf import settings
-from bossingest.views import IngestJobView
+from bossingest.views import IngestJobView, IngestJobCompleteView
 
 version = settings.BOSS_VERSION
 
@@ -40,3 +40,11 @@ class BossIngestServiceRoutingTests(APITestCase):
         match = resolve('/' + version + '/ingest/1')
         self.assertEqual(match.func.__name__, IngestJobView.as_view().__name__)
 
+    def test_ingest_complete_url_resolves_to_complete_view(self):
+        """
+        Test that the ingest complete url resolves to the complete view
+
+        Returns: None
+        """
+        match = resolve('/' + version + '/ingest/1/complete/')
+        self.assertEqual(match.func.__name__, IngestJobCompleteView.as_view().__name__)
@@ -17,6 +17,8 @@ from bossingest import views
 
 urlpatterns = [
 
+    url(r'(?P<ingest_job_id>[\d]+)/complete/?$', views.IngestJobCompleteView.as_view()),
+
     url(r'(?P<ingest_job_id>[\d]+)/?$', views.IngestJobView.as_view()),
 
     url(r'^$', views.IngestJobView.as_view()),
@@ -21,7 +21,10 @@ from rest_framework import status
 from bosscore.error import BossError, ErrorCodes
 from bossingest.ingest_manager import IngestManager
 from bossingest.serializers import IngestJobListSerializer
-from bosscore.models import Collection, Experiment, Channel
+from bosscore.lookup import LookUpKey
+from bosscore.models import BossLookup, Collection, Experiment, Channel
+from bossspatialdb.jobs import create_downsample_job
+from bossspatialdb.versioning import rotate_epochs
 
 import bossutils
 from bossutils.ingestcreds import IngestCredentials
@@ -152,3 +155,62 @@ class IngestJobView(APIView):
             return Response(status=status.HTTP_204_NO_CONTENT)
         except BossError as err:
                 return err.to_http()
+
+
+class IngestJobCompleteView(APIView):
+    """
+    View to mark an ingest job as complete
+
+    Ingest writes cuboids without recording write generations, so completing a job retires the ETags and cached data
+    of the channel. If settings.DOWNSAMPLE_AFTER_INGEST is set, a job to build the resolution hierarchy of the
+    ingested region is started once the ingest job is complete.
+    """
+
+    def post(self, request, ingest_job_id):
+        """
+        Complete an ingest job
+
+        Args:
+            ingest_job_id: Id of the ingest job
+
+        Returns:
+            The ingest job, and the id of the downsample job if one was started
+
+        """
+        try:
+            ingest_mgmr = IngestManager()
+            ingest_job = ingest_mgmr.get_ingest_job(ingest_job_id)
+            if ingest_job.creator != request.user:
+                raise BossError("Only the creator of ingest job {} can complete it".format(ingest_job_id),
+                                ErrorCodes.MISSING_PERMISSION)
+
+            # Look up the channel first, so a job whose channel has been deleted isn't marked complete
+            try:
+                experiment = Experiment.objects.get(name=ingest_job.experiment,
+                                                    collection=Collection.objects.get(name=ingest_job.collection))
+                lookup_key = LookUpKey.get_lookup_key('&'.join([ingest_job.collection, ingest_job.experiment,
+                                                                ingest_job.channel])).lookup_key
+            except (Collection.DoesNotExist, Experiment.DoesNotExist, BossLookup.DoesNotExist):
+                raise BossError("{}/{}/{} does not exist.".format(ingest_job.collection, ingest_job.experiment,
+                                                                  ingest_job.channel), ErrorCodes.RESOURCE_NOT_FOUND)
+
+            ingest_job = ingest_mgmr.complete_ingest_job(ingest_job_id)
+
+            data = {'ingest_job': IngestJobListSerializer(ingest_job).data, 'downsample_job': None}
+
+            # The ingest wrote cuboids without bumping their write generations, so retire every ETag and cached copy
+            # of the channel's data, at every resolution
+            rotate_epochs(lookup_key, range(experiment.num_hierarchy_levels))
+
+            if settings.DOWNSAMPLE_AFTER_INGEST and ingest_job.resolution < experiment.num_hierarchy_levels - 1:
+                region = ((ingest_job.x_start, ingest_job.y_start, ingest_job.z_start),
+                          (ingest_job.x_stop, ingest_job.y_stop, ingest_job.z_stop))
+                downsample_job = create_downsample_job(request, ingest_job.collection, ingest_job.experiment,
+                                                       ingest_job.channel, resolution=ingest_job.resolution,
+                                                       region=region,
+                                                       time_range=[ingest_job.t_start, ingest_job.t_stop])
+                data['downsample_job'] = downsample_job.id
+
+            return Response(data, status=status.HTTP_200_OK)
+        except BossError as err:
+            return err.to_http()
@@ -20,6 +20,7 @@ from rest_framework.test import force_authenticate
 from rest_framework import status
 
 from bossspatialdb.views import Cutout
+from bossspatialdb.pool import clear_pools
 from bossobject.views import Ids
 
 from bosscore.test.setup_db import SetupTestDB
@@ -107,3 +108,6 @@ class TestCutoutInterfaceView(IdsMixin, APITestCase):
         # Populate DB
         dbsetup.insert_spatialdb_test_data()
 
+    def tearDown(self):
+        # Drop pooled SpatialDB instances created with the mocks
+        clear_pools()
@@ -18,10 +18,9 @@ from rest_framework.response import Response
 from bosscore.request import BossRequest
 from bosscore.error import BossError, BossHTTPError, ErrorCodes
 
-from spdb.spatialdb.spatialdb import SpatialDB
 from spdb import project
 
-from django.conf import settings
+from bossspatialdb.pool import get_spatialdb
 
 
 class Reserve(APIView):
@@ -66,8 +65,8 @@ class Reserve(APIView):
         resource = project.BossResourceDjango(req)
         try:
             # Reserve ids
-            spdb = SpatialDB(settings.KVIO_SETTINGS, settings.STATEIO_CONFIG, settings.OBJECTIO_CONFIG)
-            start_id = spdb.reserve_ids(resource, int(num_ids))
+            with get_spatialdb() as spdb:
+                start_id = spdb.reserve_ids(resource, int(num_ids))
             data = {'start_id': start_id[0], 'count': num_ids}
             return Response(data, status=200)
         except (TypeError, ValueError)as e:
@@ -124,8 +123,8 @@ class Ids(APIView):
 
         try:
             # Reserve ids
-            spdb = SpatialDB(settings.KVIO_SETTINGS, settings.STATEIO_CONFIG, settings.OBJECTIO_CONFIG)
-            ids = spdb.get_ids_in_region(resource, int(resolution), corner, extent)
+            with get_spatialdb() as spdb:
+                ids = spdb.get_ids_in_region(resource, int(resolution), corner, extent)
             return Response(ids, status=200)
         except (TypeError, ValueError) as e:
             return BossHTTPError("Type error in the ids view. {}".format(e), ErrorCodes.TYPE_ERROR)
@@ -184,8 +183,8 @@ class BoundingBox(APIView):
 
         try:
             # Get interface to SPDB cache
-            spdb = SpatialDB(settings.KVIO_SETTINGS, settings.STATEIO_CONFIG, settings.OBJECTIO_CONFIG)
-            data = spdb.get_bounding_box(resource, int(resolution), int(id), bb_type=bb_type)
+            with get_spatialdb() as spdb:
+                data = spdb.get_bounding_box(resource, int(resolution), int(id), bb_type=bb_type)
             if data is None:
                 return BossHTTPError("The id does not exist. {}".format(id), ErrorCodes.OBJECT_NOT_FOUND)
             return Response(data, status=200)
@@ -0,0 +1,218 @@
+# Copyright 2016 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Methods to split a cutout region into cuboid aligned blocks so large cutouts can be processed piece by piece
+from collections import namedtuple
+import itertools
+
+from spdb.c_lib.ndtype import CUBOIDSIZE
+
+
+# A sub-region of a cutout. corner and extent are (x, y, z) tuples in voxel coordinates
+CutoutBlock = namedtuple('CutoutBlock', ['corner', 'extent'])
+
+
+def get_cuboid_size(resolution):
+    """ Method to get the cuboid dimensions used by spdb at a resolution
+
+    Args:
+        resolution (int): Level in the resolution hierarchy
+
+    Returns:
+        (list(int)): The [x, y, z] size of a cuboid
+
+    """
+    return CUBOIDSIZE[resolution]
+
+
+def split_axis(start, stop, step):
+    """ Method to split a range along the cuboid boundaries of a single axis
+
+    Args:
+        start (int): Start of the range (inclusive)
+        stop (int): End of the range (exclusive)
+        step (int): Cuboid size along the axis
+
+    Returns:
+        (list((int, int))): A list of (start, stop) tuples, with all interior boundaries on a multiple of step
+
+    """
+    pieces = []
+    current = start
+    while current < stop:
+        boundary = min((current // step + 1) * step, stop)
+        pieces.append((current, boundary))
+        current = boundary
+    return pieces
+
+
+def _group_pieces(pieces, size):
+    """ Method to merge consecutive pieces of an axis into groups of `size` pieces
+
+    Args:
+        pieces (list((int, int))): Output of split_axis
+        size (int): Number of pieces per group
+
+    Returns:
+        (list((int, int))): Merged (start, stop) tuples
+    """
+    groups = []
+    for idx in range(0, len(pieces), size):
+        chunk = pieces[idx:idx + size]
+        groups.append((chunk[0][0], chunk[-1][1]))
+    return groups
+
+
+def plan_blocks(corner, extent, cuboid_size, bytes_per_voxel, num_time_samples=1, max_bytes=None):
+    """ Method to split a cutout region into cuboid aligned blocks
+
+    Blocks are grown along x first, then y, then z so each block stays as contiguous as possible in C-order while
+    holding no more than max_bytes of uncompressed data. A single cuboid is the smallest block that will be returned,
+    so if max_bytes is smaller than one cuboid each block will contain exactly one (possibly partial) cuboid.
+
+    Blocks are returned in z, y, x order.
+
+    Args:
+        corner ((int, int, int)): (x, y, z) corner of the region
+        extent ((int, int, int)): (x, y, z) size of the region
+        cuboid_size ((int, int, int)): (x, y, z) size of a cuboid at the requested resolution
+        bytes_per_voxel (int|float): Number of bytes in a single voxel
+        num_time_samples (int): Number of time samples included in each block
+        max_bytes (int): Maximum number of uncompressed bytes in a block. If None the region is a single block.
+
+    Returns:
+        (list(CutoutBlock)): The blocks that tile the region
+
+    """
+    if max_bytes is None:
+        return [CutoutBlock(tuple(corner), tuple(extent))]
+
+    x_pieces = split_axis(corner[0], corner[0] + extent[0], cuboid_size[0])
+    y_pieces = split_axis(corner[1], corner[1] + extent[1], cuboid_size[1])
+    z_pieces = split_axis(corner[2], corner[2] + extent[2], cuboid_size[2])
+
+    # Number of voxels that fit in a block
+    max_voxels = max(1, int(max_bytes // (bytes_per_voxel * num_time_samples)))
+
+    # Largest possible piece along each axis is a full cuboid
+    cuboid_voxels = min(extent[0], cuboid_size[0]) * min(extent[1], cuboid_size[1]) * min(extent[2], cuboid_size[2])
+    cells = max(1, max_voxels // cuboid_voxels)
+
+    # Grow along x, then y, then z
+    num_x = min(len(x_pieces), cells)
+    num_y = 1
+    num_z = 1
+    if num_x == len(x_pieces):
+        num_y = min(len(y_pieces), max(1, cells // num_x))
+        if num_y == len(y_pieces):
+            num_z = min(len(z_pieces), max(1, cells // (num_x * num_y)))
+
+    x_groups = _group_pieces(x_pieces, num_x)
+    y_groups = _group_pieces(y_pieces, num_y)
+    z_groups = _group_pieces(z_pieces, num_z)
+
+    blocks = []
+    for (z0, z1), (y0, y1), (x0, x1) in itertools.product(z_groups, y_groups, x_groups):
+        blocks.append(CutoutBlock((x0, y0, z0), (x1 - x0, y1 - y0, z1 - z0)))
+    return blocks
+
+
+def align_region(corner, extent, cuboid_size):
+    """ Method to expand a region out to the cuboid boundaries that contain it
+
+    Args:
+        corner ((int, int, int)): (x, y, z) corner of the region
+        extent ((int, int, int)): (x, y, z) size of the region
+        cuboid_size ((int, int, int)): (x, y, z) size of a cuboid at the requested resolution
+
+    Returns:
+        ((int, int, int), (int, int, int)): (x, y, z) start (inclusive) and stop (exclusive) of the aligned region
+    """
+    start = tuple(c // s * s for c, s in zip(corner, cuboid_size))
+    stop = tuple(-(-(c + e) // s) * s for c, e, s in zip(corner, extent, cuboid_size))
+    return start, stop
+
+
+def _intersects(start_a, stop_a, start_b, stop_b):
+    """ Method to check if two boxes overlap
+
+    Returns:
+        (bool): True if the boxes share at least one voxel
+    """
+    return all(a0 < b1 and b0 < a1 for a0, a1, b0, b1 in zip(start_a, stop_a, start_b, stop_b))
+
+
+def _merge_groups(group_a, group_b, bytes_per_voxel, max_bytes):
+    """ Method to merge two groups of regions if they share a cuboid and their bounding box is small enough
+
+    Returns:
+        (list): The merged group, or None if the groups can't be merged
+    """
+    if not _intersects(group_a[0], group_a[1], group_b[0], group_b[1]):
+        return None
+
+    bbox_start = tuple(min(a, b) for a, b in zip(group_a[2], group_b[2]))
+    bbox_stop = tuple(max(a, b) for a, b in zip(group_a[3], group_b[3]))
+    num_voxels = 1
+    for a, b in zip(bbox_start, bbox_stop):
+        num_voxels *= b - a
+    if max_bytes is not None and num_voxels * bytes_per_voxel > max_bytes:
+        return None
+
+    return [tuple(min(a, b) for a, b in zip(group_a[0], group_b[0])),
+            tuple(max(a, b) for a, b in zip(group_a[1], group_b[1])),
+            bbox_start, bbox_stop,
+            sorted(group_a[4] + group_b[4])]
+
+
+def merge_regions(regions, cuboid_size, bytes_per_voxel, num_time_samples=1, max_bytes=None):
+    """ Method to group regions that touch the same cuboids so each group can be fetched with a single cutout
+
+    Regions are merged when their cuboid aligned bounds intersect, as long as the bounding box of the merged group
+    stays within max_bytes. Regions that don't share a cuboid are never merged, so no extra cuboids are fetched.
+
+    Args:
+        regions (list(CutoutBlock)): Requested regions
+        cuboid_size ((int, int, int)): (x, y, z) size of a cuboid at the requested resolution
+        bytes_per_voxel (int|float): Number of bytes in a single voxel
+        num_time_samples (int): Number of time samples included in each cutout
+        max_bytes (int): Maximum number of uncompressed bytes in a group's cutout. If None there is no limit.
+
+    Returns:
+        (list((CutoutBlock, list(int)))): The region to cut out for each group and the indices of the requested regions
+        it contains, in the order the groups were first referenced
+    """
+    # Each group is [aligned start, aligned stop, bbox start, bbox stop, region indices]. No two groups in the list
+    # can be merged. A new region is merged until nothing else can be, since a group that grows can reach groups that
+    # didn't touch it before.
+    groups = []
+    for idx, region in enumerate(regions):
+        stop = tuple(c + e for c, e in zip(region.corner, region.extent))
+        aligned_start, aligned_stop = align_region(region.corner, region.extent, cuboid_size)
+        candidate = [aligned_start, aligned_stop, tuple(region.corner), stop, [idx]]
+
+        merged = True
+        while merged:
+            merged = False
+            for group_idx, group in enumerate(groups):
+                combined = _merge_groups(candidate, group, bytes_per_voxel * num_time_samples, max_bytes)
+                if combined is not None:
+                    candidate = combined
+                    del groups[group_idx]
+                    merged = True
+                    break
+        groups.append(candidate)
+
+    groups.sort(key=lambda g: g[4][0])
+    return [(CutoutBlock(g[2], tuple(b - a for a, b in zip(g[2], g[3]))), g[4]) for g in groups]
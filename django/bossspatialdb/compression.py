@@ -0,0 +1,493 @@
+# Copyright 2016 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Codecs shared by the cutout renderers and parsers
+#
+# Clients can tune compression with media type parameters, for example:
+#
+#   Accept: application/blosc; cname=zstd; clevel=3; shuffle=bit; nthreads=8
+#   Accept: application/npygz; clevel=1
+#
+# Any parameter that isn't provided falls back to a default chosen for the channel's datatype.
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import struct
+import threading
+import zlib
+
+import blosc
+from django.conf import settings
+
+from bosscore.error import BossError, ErrorCodes
+
+SHUFFLE_OPTIONS = {'none': blosc.NOSHUFFLE,
+                   'byte': blosc.SHUFFLE,
+                   'bit': blosc.BITSHUFFLE}
+
+# Default blosc parameters for each channel datatype. Bit shuffle works best on 8-bit image data where byte shuffle
+# is a no-op, byte shuffle on wider types groups the mostly zero high order bytes.
+DEFAULT_BLOSC_PARAMS = {
+    'uint8': {'cname': 'lz4', 'clevel': 5, 'shuffle': 'bit'},
+    'uint16': {'cname': 'lz4', 'clevel': 5, 'shuffle': 'byte'},
+    'uint32': {'cname': 'lz4', 'clevel': 5, 'shuffle': 'byte'},
+    'uint64': {'cname': 'lz4', 'clevel': 5, 'shuffle': 'byte'},
+}
+
+DEFAULT_ZLIB_LEVEL = 6
+
+# Number of bytes zlib compresses as an independent block when compressing with more than one thread
+ZLIB_BLOCK_SIZE = 2 ** 20
+
+# Size of the deflate window. Each block is primed with this much of the data before it.
+ZLIB_WINDOW_SIZE = 2 ** 15
+
+# zlib window bits that accept either a zlib or a gzip header when decompressing
+ZLIB_AUTO_HEADER = 32 + zlib.MAX_WBITS
+
+# Number of bytes in the header blosc prepends to a compressed buffer
+BLOSC_HEADER_SIZE = 16
+
+# blosc.set_nthreads() is process wide. It is only called when a codec asks for a different thread count, and the
+# lock only covers that check, so compression and decompression run concurrently. A request can end up using the
+# thread count another request set just before it, which only affects speed.
+_blosc_nthreads = None
+_blosc_nthreads_lock = threading.Lock()
+
+# Threads shared by every request that compresses zlib blocks in parallel. zlib releases the GIL while it compresses.
+_zlib_executor = None
+_zlib_executor_lock = threading.Lock()
+
+
+def parse_media_type_params(media_type):
+    """
+    Parse the parameters out of a media type string
+
+    Args:
+        media_type (str): Media type such as 'application/blosc; cname=lz4; nthreads=4'
+
+    Returns:
+        (dict): Parameter names (lower case) mapped to their values
+    """
+    params = {}
+    if not media_type:
+        return params
+
+    for part in media_type.split(';')[1:]:
+        if '=' not in part:
+            continue
+        key, value = part.split('=', 1)
+        params[key.strip().lower()] = value.strip().strip('"')
+    return params
+
+
+def _parse_int(params, key, default, minimum, maximum):
+    """
+    Get an integer parameter and make sure it is in range
+
+    Args:
+        params (dict): Parsed media type parameters
+        key (str): Parameter name
+        default (int): Value to use if the parameter isn't provided
+        minimum (int): Smallest valid value
+        maximum (int): Largest valid value
+
+    Returns:
+        (int): The value
+
+    Raises:
+        BossError: If the value isn't an integer or is out of range
+    """
+    if key not in params:
+        return default
+    try:
+        value = int(params[key])
+    except ValueError:
+        raise BossError("Invalid {} '{}' in media type. Must be an integer.".format(key, params[key]),
+                        ErrorCodes.INVALID_ARGUMENT)
+    if not minimum <= value <= maximum:
+        raise BossError("Invalid {} '{}' in media type. Must be between {} and {}.".format(
+            key, value, minimum, maximum), ErrorCodes.INVALID_ARGUMENT)
+    return value
+
+
+def get_num_threads(params):
+    """
+    Get the number of threads a codec should use, capped at settings.CODEC_MAX_THREADS
+
+    Args:
+        params (dict): Parsed media type parameters
+
+    Returns:
+        (int): Number of threads
+    """
+    return _parse_int(params, 'nthreads', settings.CODEC_DEFAULT_THREADS, 1, settings.CODEC_MAX_THREADS)
+
+
+def set_blosc_threads(nthreads):
+    """
+    Set the number of threads blosc uses, if it isn't already set to it
+
+    Args:
+        nthreads (int): Number of threads
+    """
+    global _blosc_nthreads
+    with _blosc_nthreads_lock:
+        if _blosc_nthreads != nthreads:
+            blosc.set_nthreads(nthreads)
+            _blosc_nthreads = nthreads
+
+
+class BloscCodec(object):
+    """
+    Blosc compression with negotiated codec, level, shuffle filter and thread count
+    """
+    def __init__(self, cname='lz4', clevel=5, shuffle='byte', nthreads=1):
+        """
+        Args:
+            cname (str): Blosc compressor name (blosclz, lz4, lz4hc, zlib, zstd)
+            clevel (int): Compression level, 0-9
+            shuffle (str): Shuffle filter, one of 'none', 'byte' or 'bit'
+            nthreads (int): Number of threads blosc uses
+        """
+        self.cname = cname
+        self.clevel = clevel
+        self.shuffle = shuffle
+        self.nthreads = nthreads
+
+    @classmethod
+    def from_media_type(cls, media_type, datatype):
+        """
+        Create a codec from the parameters of a negotiated media type
+
+        Args:
+            media_type (str): Media type, possibly with parameters
+            datatype (str): Channel datatype (eg. 'uint8'), used to select defaults
+
+        Returns:
+            (BloscCodec)
+
+        Raises:
+            BossError: If a parameter is invalid
+        """
+        params = parse_media_type_params(media_type)
+        defaults = DEFAULT_BLOSC_PARAMS.get(datatype, DEFAULT_BLOSC_PARAMS['uint8'])
+
+        cname = params.get('cname', defaults['cname']).lower()
+        if cname not in blosc.cnames:
+            raise BossError("Unsupported blosc codec '{}'. Supported codecs: {}".format(
+                cname, ", ".join(blosc.cnames)), ErrorCodes.INVALID_ARGUMENT)
+
+        shuffle = params.get('shuffle', defaults['shuffle']).lower()
+        if shuffle not in SHUFFLE_OPTIONS:
+            raise BossError("Unsupported shuffle '{}'. Supported values: {}".format(
+                shuffle, ", ".join(SHUFFLE_OPTIONS)), ErrorCodes.INVALID_ARGUMENT)
+
+        clevel = _parse_int(params, 'clevel', defaults['clevel'], 0, 9)
+        return cls(cname, clevel, shuffle, get_num_threads(params))
+
+    def compress(self, data):
+        """
+        Compress an array using its element size as the blosc typesize
+
+        Args:
+            data (numpy.ndarray): C-ordered array to compress
+
+        Returns:
+            (bytes): Blosc compressed data
+        """
+        set_blosc_threads(self.nthreads)
+        return blosc.compress(data, typesize=data.dtype.itemsize, clevel=self.clevel,
+                              shuffle=SHUFFLE_OPTIONS[self.shuffle], cname=self.cname)
+
+    def pack_array(self, data):
+        """
+        Compress an array with blosc.pack_array() so shape and dtype are included
+
+        Args:
+            data (numpy.ndarray): Array to compress
+
+        Returns:
+            (bytes): Blosc compressed, pickled array
+        """
+        set_blosc_threads(self.nthreads)
+        return blosc.pack_array(data, clevel=self.clevel, shuffle=SHUFFLE_OPTIONS[self.shuffle], cname=self.cname)
+
+    def decompress_into(self, data_bytes, output):
+        """
+        Decompress directly into the memory of a preallocated array
+
+        Args:
+            data_bytes (bytes): Blosc compressed data
+            output (numpy.ndarray): C-ordered array large enough to hold the data
+        """
+        set_blosc_threads(self.nthreads)
+        blosc.decompress_ptr(data_bytes, output.__array_interface__['data'][0])
+
+    def unpack_array(self, data_bytes):
+        """
+        Decompress data created with blosc.pack_array()
+
+        Args:
+            data_bytes (bytes): Blosc compressed, pickled array
+
+        Returns:
+            (numpy.ndarray)
+        """
+        set_blosc_threads(self.nthreads)
+        return blosc.unpack_array(data_bytes)
+
+
+class ZlibCodec(object):
+    """
+    zlib compression with a negotiated compression level
+    """
+    def __init__(self, clevel=DEFAULT_ZLIB_LEVEL, nthreads=1):
+        """
+        Args:
+            clevel (int): Compression level, 0-9
+            nthreads (int): Number of threads to compress with
+        """
+        self.clevel = clevel
+        self.nthreads = nthreads
+
+    @classmethod
+    def from_media_type(cls, media_type, datatype):
+        """
+        Create a codec from the parameters of a negotiated media type
+
+        Args:
+            media_type (str): Media type, possibly with parameters
+            datatype (str): Channel datatype (eg. 'uint8')
+
+        Returns:
+            (ZlibCodec)
+
+        Raises:
+            BossError: If a parameter is invalid
+        """
+        params = parse_media_type_params(media_type)
+        return cls(_parse_int(params, 'clevel', DEFAULT_ZLIB_LEVEL, 0, 9), get_num_threads(params))
+
+    def compress(self, data_bytes):
+        """
+        Compress a buffer
+
+        Args:
+            data_bytes (bytes-like): Data to compress
+
+        Returns:
+            (bytes): zlib compressed data
+        """
+        return zlib.compress(data_bytes, self.clevel)
+
+    def compress_stream(self, buffers):
+        """
+        Compress a sequence of buffers as a single zlib stream, yielding the compressed data a block at a time
+
+        The input is split into blocks of ZLIB_BLOCK_SIZE bytes that are compressed independently on a thread pool,
+        the same way pigz compresses in parallel. Each block is raw deflate data primed with the end of the block
+        before it, so matches still reach back across block boundaries, and ends with a sync flush so the blocks can
+        be concatenated. The output is one ordinary zlib stream that zlib.decompress() and existing tools read.
+
+        At most `nthreads` blocks are compressed or waiting to be sent at once, so memory use doesn't grow with the
+        size of the input.
+
+        Args:
+            buffers (list): Bytes-like objects to compress, in order. Not copied, so must not change until the
+                generator is exhausted.
+
+        Returns:
+            (generator): bytes of the zlib stream
+        """
+        yield get_zlib_header(self.clevel)
+
+        blocks = list(_split_blocks(buffers))
+        checksum = zlib.adler32(b'')
+        if self.nthreads == 1:
+            for block, zdict, last in blocks:
+                checksum = zlib.adler32(block, checksum)
+                yield _deflate_block(block, zdict, last, self.clevel)
+        else:
+            executor = get_zlib_executor()
+            pending = deque()
+            try:
+                for block, zdict, last in blocks:
+                    pending.append((block, executor.submit(_deflate_block, block, zdict, last, self.clevel)))
+                    if len(pending) >= self.nthreads:
+                        block, future = pending.popleft()
+                        checksum = zlib.adler32(block, checksum)
+                        yield future.result()
+                while pending:
+                    block, future = pending.popleft()
+                    checksum = zlib.adler32(block, checksum)
+                    yield future.result()
+            finally:
+                # Don't compress the rest of the data if the client went away
+                for _, future in pending:
+                    future.cancel()
+
+        yield struct.pack('>I', checksum & 0xffffffff)
+
+    def decompressobj(self):
+        """
+        Get an object that decompresses data incrementally
+
+        Accepts data with either a zlib or a gzip header.
+
+        Returns:
+            (zlib.Decompress)
+        """
+        return zlib.decompressobj(ZLIB_AUTO_HEADER)
+
+    def decompress_stream(self, chunks, max_length=2 ** 20):
+        """
+        Decompress zlib or gzip data incrementally
+
+        Gzip data may be made of several members one after the other, as written by pigz and `cat a.gz b.gz`, and
+        each one is decompressed in turn. No more than `max_length` bytes are decompressed from the input at a time,
+        so a small, highly compressed input can't expand into a large amount of memory.
+
+        Args:
+            chunks: Iterable of the compressed bytes, in order
+            max_length (int): Largest number of bytes to yield at a time
+
+        Returns:
+            (generator): Decompressed bytes
+
+        Raises:
+            zlib.error: If the data is invalid or ends before the end of the stream
+        """
+        decompressor = self.decompressobj()
+        for chunk in chunks:
+            while chunk:
+                if decompressor.eof:
+                    # Data after the end of a member is the start of the next member
+                    decompressor = self.decompressobj()
+                yield decompressor.decompress(chunk, max_length)
+                chunk = decompressor.unused_data if decompressor.eof else decompressor.unconsumed_tail
+
+        if not decompressor.eof:
+            yield decompressor.flush()
+            if not decompressor.eof:
+                raise zlib.error("Incomplete or truncated stream")
+
+
+def get_zlib_executor():
+    """
+    Get this process's thread pool for compressing zlib blocks
+
+    Returns:
+        (concurrent.futures.ThreadPoolExecutor)
+    """
+    global _zlib_executor
+    with _zlib_executor_lock:
+        if _zlib_executor is None:
+            _zlib_executor = ThreadPoolExecutor(max_workers=settings.CODEC_MAX_THREADS)
+        return _zlib_executor
+
+
+def get_zlib_header(clevel):
+    """
+    Build the two byte header that starts a zlib stream
+
+    Args:
+        clevel (int): Compression level, 0-9. Only recorded as a hint in the header.
+
+    Returns:
+        (bytes)
+    """
+    # Deflate with a 32 KiB window, then the level hint zlib itself writes
+    cmf = 0x78
+    flevel = 0 if clevel < 2 else 1 if clevel < 6 else 2 if clevel == 6 else 3
+    flg = flevel << 6
+    flg += 31 - ((cmf << 8) + flg) % 31
+    return bytes((cmf, flg))
+
+
+def _split_blocks(buffers):
+    """
+    Split buffers into blocks to compress independently
+
+    Returns:
+        (generator): Tuples of (block, dictionary, last). The dictionary is the end of the data before the block, or
+            None for the first block. last is True for the final block.
+    """
+    views = [memoryview(buf).cast('B') for buf in buffers]
+    views = [view for view in views if view.nbytes] or [memoryview(b'')]
+    previous = None
+    for index, view in enumerate(views):
+        for start in range(0, max(view.nbytes, 1), ZLIB_BLOCK_SIZE):
+            block = view[start:start + ZLIB_BLOCK_SIZE]
+            last = index == len(views) - 1 and start + ZLIB_BLOCK_SIZE >= view.nbytes
+            yield block, previous, last
+            previous = block[-ZLIB_WINDOW_SIZE:] if block.nbytes else previous
+
+
+def _deflate_block(block, zdict, last, clevel):
+    """
+    Compress a block as raw deflate data that can be concatenated with the blocks after it
+
+    Args:
+        block (memoryview): Data to compress
+        zdict (memoryview): End of the data before the block, or None
+        last (bool): True if this is the final block of the stream
+        clevel (int): Compression level
+
+    Returns:
+        (bytes)
+    """
+    if zdict is not None and zdict.nbytes:
+        compressor = zlib.compressobj(clevel, zlib.DEFLATED, -zlib.MAX_WBITS, zdict=zdict)
+    else:
+        compressor = zlib.compressobj(clevel, zlib.DEFLATED, -zlib.MAX_WBITS)
+    return compressor.compress(block) + compressor.flush(zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+
+
+def get_blosc_nbytes(data_bytes):
+    """
+    Read the uncompressed size out of a blosc header
+
+    Args:
+        data_bytes (bytes): Blosc compressed buffer
+
+    Returns:
+        (int): Number of uncompressed bytes, or None if the buffer is too short or the header is inconsistent
+    """
+    if len(data_bytes) < BLOSC_HEADER_SIZE:
+        return None
+    num_bytes, _, compressed_bytes = struct.unpack('<III', data_bytes[4:BLOSC_HEADER_SIZE])
+    if compressed_bytes != len(data_bytes):
+        return None
+    return num_bytes
+
+
+def get_codec(renderer_or_parser, media_type, datatype):
+    """
+    Create the codec a renderer or parser should use for a request
+
+    Args:
+        renderer_or_parser: DRF renderer or parser instance. Its `codec` attribute is the codec class it uses.
+        media_type (str): Negotiated media type, possibly with parameters
+        datatype (str): Channel datatype (eg. 'uint8')
+
+    Returns:
+        The codec instance, or None if the renderer or parser doesn't compress
+
+    Raises:
+        BossError: If a parameter is invalid
+    """
+    codec_class = getattr(renderer_or_parser, 'codec', None)
+    if codec_class is None:
+        return None
+    return codec_class.from_media_type(media_type, datatype)
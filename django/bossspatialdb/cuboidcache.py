@@ -0,0 +1,331 @@
+# Copyright 2016 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# In-process LRU cache of decoded cuboids
+#
+# Consecutive tile requests (z, z+1, ...) and overlapping cutouts keep reading and decompressing the same cuboids.
+# Each process keeps the most recently used cuboids, decompressed, up to settings.CUBOID_CACHE_SIZE bytes, and cuts
+# small regions out of them, only reading the cuboids it doesn't have from the spatial database.
+#
+# Entries are keyed by the channel's lookup key, resolution, time sample and the cuboid's morton index, and remember
+# the write generation (see versioning.py) of the cuboid when it was read. An entry whose generation no longer
+# matches is a miss, so a write made through any process is never served from a stale copy. Cutout.post also drops
+# the cuboids it writes from the writing process's cache straight away.
+import itertools
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from django.conf import settings
+from spdb.spatialdb import Cube
+
+from .blocks import get_cuboid_size
+from .versioning import get_cuboid_fields, get_generations
+
+
+class CuboidCache(object):
+    """
+    Thread safe LRU cache of cuboid arrays with a byte budget
+
+    Any versioned array can be cached under a tuple key; bosstiles/slabs.py uses one for slabs of xz and yz planes.
+    """
+    def __init__(self, max_bytes):
+        """
+        Args:
+            max_bytes (int): Maximum number of bytes of cuboid data to keep
+        """
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'stale': 0, 'evictions': 0, 'invalidations': 0}
+
+    def get(self, key, version):
+        """
+        Get a cuboid, if it is cached and current
+
+        Args:
+            key (tuple): (lookup key, resolution, time sample, morton index) of the cuboid
+            version (tuple): (epoch, generation) the cuboid must have been read at
+
+        Returns:
+            (numpy.ndarray|None): The (z, y, x) cuboid, read-only, or None on a miss
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.stats['misses'] += 1
+                return None
+            if entry[0] != version:
+                self.stats['stale'] += 1
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            self.stats['hits'] += 1
+            return entry[1]
+
+    def put(self, key, version, data):
+        """
+        Add a cuboid, evicting the least recently used ones to stay within the budget
+
+        Args:
+            key (tuple): (lookup key, resolution, time sample, morton index) of the cuboid
+            version (tuple): (epoch, generation) the cuboid was read at
+            data (numpy.ndarray): The (z, y, x) cuboid. It is made read-only and must not be modified by the caller.
+        """
+        if data.nbytes > self.max_bytes:
+            return
+        data.setflags(write=False)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (version, data)
+            self.nbytes += data.nbytes
+            while self.nbytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.stats['evictions'] += 1
+
+    def invalidate(self, keys):
+        """
+        Drop cuboids from the cache
+
+        Args:
+            keys (iterable(tuple)): Keys of the cuboids
+        """
+        with self._lock:
+            for key in keys:
+                if key in self._entries:
+                    self._remove(key)
+                    self.stats['invalidations'] += 1
+
+    def clear(self):
+        """
+        Drop all cuboids from the cache
+        """
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+    def get_stats(self):
+        """
+        Get the cache's counters
+
+        Returns:
+            (dict): Number of hits, misses, stale entries found, evictions and invalidations, and the current number of
+            cuboids ('entries') and bytes ('bytes') held
+        """
+        with self._lock:
+            stats = dict(self.stats)
+            stats['entries'] = len(self._entries)
+            stats['bytes'] = self.nbytes
+        return stats
+
+    def _remove(self, key):
+        """
+        Remove an entry. Call with the lock held.
+        """
+        _, data = self._entries.pop(key)
+        self.nbytes -= data.nbytes
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cuboid_cache():
+    """
+    Get the process's cuboid cache
+
+    Returns:
+        (CuboidCache)
+    """
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = CuboidCache(settings.CUBOID_CACHE_SIZE)
+        return _cache
+
+
+def clear_cuboid_cache():
+    """
+    Drop all cuboids from the process's cache
+    """
+    get_cuboid_cache().clear()
+
+
+def get_morton(x, y, z):
+    """
+    Get the morton index of a cuboid, interleaving the bits of its indices as spdb does (x lowest)
+
+    Args:
+        x (int): x index of the cuboid
+        y (int): y index of the cuboid
+        z (int): z index of the cuboid
+
+    Returns:
+        (int)
+    """
+    morton = 0
+    bit = 0
+    while x or y or z:
+        morton |= (x & 1) << bit | (y & 1) << (bit + 1) | (z & 1) << (bit + 2)
+        x >>= 1
+        y >>= 1
+        z >>= 1
+        bit += 3
+    return morton
+
+
+def get_cuboid_key(resource, resolution, t, x, y, z):
+    """
+    Get the cache key of a cuboid
+
+    Args:
+        resource (spdb.project.BossResource): Resource for the channel
+        resolution (int): Resolution level
+        t (int): Time sample
+        x (int): x index of the cuboid
+        y (int): y index of the cuboid
+        z (int): z index of the cuboid
+
+    Returns:
+        (tuple)
+    """
+    return resource.get_lookup_key(), resolution, t, get_morton(x, y, z)
+
+
+def _get_cuboid_ranges(corner, extent, cuboid_size):
+    """
+    Get the indices of the cuboids a region touches along each axis
+
+    Returns:
+        (list(range)): x, y and z ranges of cuboid indices
+    """
+    return [range(corner[dim] // cuboid_size[dim], (corner[dim] + extent[dim] - 1) // cuboid_size[dim] + 1)
+            for dim in range(3)]
+
+
+def invalidate_region(resource, resolution, corner, extent, time_range):
+    """
+    Drop the cuboids a write touched from this process's cache. Call after the data has been written.
+
+    Args:
+        resource (spdb.project.BossResource): Resource for the channel
+        resolution (int): Resolution level
+        corner ((int, int, int)): (x, y, z) corner of the region
+        extent ((int, int, int)): (x, y, z) size of the region
+        time_range (list(int)): [start, stop) time samples of the region
+    """
+    ranges = _get_cuboid_ranges(corner, extent, get_cuboid_size(resolution))
+    get_cuboid_cache().invalidate(get_cuboid_key(resource, resolution, t, x, y, z)
+                                  for t, x, y, z in itertools.product(range(time_range[0], time_range[1]), *ranges))
+
+
+def cached_cutout(cache, resource, corner, extent, resolution, time_range, generations=None):
+    """
+    Cut out a region, reading through the process's cuboid cache
+
+    Regions whose cuboids take more than settings.CUBOID_CACHE_MAX_READ_SIZE bytes, or all regions when the cache is
+    disabled (settings.CUBOID_CACHE_SIZE = 0), are cut out directly so large cutouts don't flush the cache.
+
+    Args:
+        cache (spdb.spatialdb.SpatialDB): Interface to the spatial database
+        resource (spdb.project.BossResource): Resource for the channel being cut out
+        corner ((int, int, int)): (x, y, z) corner of the region
+        extent ((int, int, int)): (x, y, z) size of the region
+        resolution (int): Resolution of the cutout
+        time_range (list(int)): [start, stop) time samples of the cutout
+        generations ((str, list(int))): Optional output of get_generations() for the region's get_cuboid_fields(), if
+            the caller has already read them
+
+    Returns:
+        (spdb.spatialdb.Cube): The cutout
+    """
+    cuboid_cache = get_cuboid_cache()
+    cuboid_size = get_cuboid_size(resolution)
+    dtype = np.dtype(resource.get_numpy_data_type())
+    ranges = _get_cuboid_ranges(corner, extent, cuboid_size)
+    num_time_samples = time_range[1] - time_range[0]
+    num_cuboids = num_time_samples * len(ranges[0]) * len(ranges[1]) * len(ranges[2])
+    cuboid_bytes = cuboid_size[0] * cuboid_size[1] * cuboid_size[2] * dtype.itemsize
+    if not cuboid_cache.max_bytes or num_cuboids * cuboid_bytes > settings.CUBOID_CACHE_MAX_READ_SIZE:
+        return cache.cutout(resource, corner, extent, resolution, time_range)
+
+    if generations is None:
+        generations = get_generations(resource, resolution,
+                                      get_cuboid_fields(corner, extent, resolution, time_range))
+    epoch, cuboid_generations = generations
+
+    # Same order as get_cuboid_fields()
+    indices = list(itertools.product(range(time_range[0], time_range[1]), *ranges))
+    cuboids = {}
+    missing = []
+    for index, generation in zip(indices, cuboid_generations):
+        key = get_cuboid_key(resource, resolution, *index)
+        data = cuboid_cache.get(key, (epoch, generation))
+        if data is None:
+            missing.append((index, key, (epoch, generation)))
+        else:
+            cuboids[index] = data
+
+    if missing:
+        cuboids.update(_read_cuboids(cache, resource, resolution, cuboid_size, missing))
+
+    output = np.zeros((num_time_samples, extent[2], extent[1], extent[0]), dtype=dtype)
+    for (t, x, y, z), data in cuboids.items():
+        # Overlap of the cuboid and the region, in voxel coordinates
+        start = [max(corner[dim], idx * cuboid_size[dim]) for dim, idx in enumerate((x, y, z))]
+        stop = [min(corner[dim] + extent[dim], (idx + 1) * cuboid_size[dim]) for dim, idx in enumerate((x, y, z))]
+        src = [slice(start[dim] - idx * cuboid_size[dim], stop[dim] - idx * cuboid_size[dim])
+               for dim, idx in enumerate((x, y, z))]
+        dst = [slice(start[dim] - corner[dim], stop[dim] - corner[dim]) for dim in range(3)]
+        output[t - time_range[0], dst[2], dst[1], dst[0]] = data[src[2], src[1], src[0]]
+
+    cube = Cube.create_cube(resource, list(extent), time_range)
+    cube.data = output
+    return cube
+
+
+def _read_cuboids(cache, resource, resolution, cuboid_size, missing):
+    """
+    Read the cuboids missing from the cache in a single cutout of their bounding box, and cache them
+
+    Args:
+        cache (spdb.spatialdb.SpatialDB): Interface to the spatial database
+        resource (spdb.project.BossResource): Resource for the channel being cut out
+        resolution (int): Resolution of the cutout
+        cuboid_size (list(int)): [x, y, z] size of a cuboid
+        missing (list(((int, int, int, int), tuple, tuple))): (t, x, y, z) index, cache key and version of each
+            missing cuboid
+
+    Returns:
+        (dict): (t, x, y, z) index to (z, y, x) array for each missing cuboid
+    """
+    lo = [min(index[dim] for index, _, _ in missing) for dim in range(4)]
+    hi = [max(index[dim] for index, _, _ in missing) + 1 for dim in range(4)]
+    block_corner = [lo[dim + 1] * cuboid_size[dim] for dim in range(3)]
+    block_extent = [(hi[dim + 1] - lo[dim + 1]) * cuboid_size[dim] for dim in range(3)]
+    data = cache.cutout(resource, block_corner, block_extent, resolution, [lo[0], hi[0]]).data
+
+    cuboid_cache = get_cuboid_cache()
+    single = len(missing) == 1 and data.shape[0] == 1
+    cuboids = {}
+    for (t, x, y, z), key, version in missing:
+        xs, ys, zs = [(idx - lo[dim + 1]) * cuboid_size[dim] for dim, idx in enumerate((x, y, z))]
+        cuboid = data[t - lo[0], zs:zs + cuboid_size[2], ys:ys + cuboid_size[1], xs:xs + cuboid_size[0]]
+        # Copy slices of a larger read so each entry only holds its own cuboid's memory
+        cuboid = cuboid if single else cuboid.copy()
+        cuboid_cache.put(key, version, cuboid)
+        cuboids[(t, x, y, z)] = cuboid
+    return cuboids
@@ -0,0 +1,277 @@
+# Copyright 2016 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+# Methods to build the resolution hierarchy of a channel
+#
+# Each level is built from the level below it. The region at resolution N+1 is split into cuboid aligned blocks, and
+# for each block the matching region at resolution N is cut out, reduced and written back with write_cuboid(). Image
+# channels are reduced with a mean (or by taking every Nth voxel), annotation channels with the mode so no new ids
+# are created.
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from .blocks import CutoutBlock, get_cuboid_size, plan_blocks
+from .pool import get_spatialdb
+from .versioning import bump_generation
+
+# Reductions supported for each channel type
+IMAGE_METHODS = ('mean', 'slice')
+ANNOTATION_METHODS = ('mode',)
+
+# The region of a level in the hierarchy. start and stop are (x, y, z) tuples in that level's voxel coordinates.
+LevelBounds = namedtuple('LevelBounds', ['start', 'stop'])
+
+
+def get_scale_factors(hierarchy_method, voxel_size, resolution):
+    """ Method to get the factors a level is reduced by to build the next level
+
+    * slice: x and y are halved at every level, z is never reduced
+    * iso: x, y and z are halved at every level
+    * near_iso: x and y are halved at every level. z is halved once the x/y voxel size has caught up with z, so voxels
+      stay as close to isotropic as possible.
+
+    Args:
+        hierarchy_method (str): Experiment hierarchy method (slice, iso or near_iso)
+        voxel_size ((float, float, float)): (x, y, z) voxel size at resolution 0
+        resolution (int): Level being reduced
+
+    Returns:
+        ((int, int, int)): (x, y, z) reduction factors to build resolution + 1
+    """
+    if hierarchy_method == 'slice':
+        return 2, 2, 1
+    if hierarchy_method == 'iso':
+        return 2, 2, 2
+
+    xy_size = max(voxel_size[0], voxel_size[1])
+    z_size = voxel_size[2]
+    for _ in range(resolution):
+        if xy_size >= z_size:
+            z_size *= 2
+        xy_size *= 2
+    return (2, 2, 2) if xy_size >= z_size else (2, 2, 1)
+
+
+def get_next_bounds(bounds, factors):
+    """ Method to get the region of the next level from the region of a level
+
+    Args:
+        bounds (LevelBounds): Region of the level being reduced
+        factors ((int, int, int)): (x, y, z) reduction factors
+
+    Returns:
+        (LevelBounds): Region of the next level
+    """
+    start = tuple(s // f for s, f in zip(bounds.start, factors))
+    stop = tuple(-(-s // f) for s, f in zip(bounds.stop, factors))
+    return LevelBounds(start, stop)
+
+
+def _pad_blocks(data, factors, offset):
+    """ Method to pad a (t, z, y, x) matrix to whole reduction blocks and group each reduction block
+
+    Args:
+        data (numpy.ndarray): 4D (t, z, y, x) matrix
+        factors ((int, int, int)): (x, y, z) reduction factors
+        offset ((int, int, int)): (x, y, z) number of voxels of the first block that are missing before the matrix
+
+    Returns:
+        (numpy.ndarray, numpy.ndarray): The values and a validity mask, each shaped (t, z, y, x, fz * fy * fx)
+    """
+    fx, fy, fz = factors
+    ox, oy, oz = offset
+    t, z, y, x = data.shape
+    pad = ((0, 0), (oz, -(z + oz) % fz), (oy, -(y + oy) % fy), (ox, -(x + ox) % fx))
+
+    values = np.pad(data, pad, mode='constant')
+    valid = np.pad(np.ones((1, z, y, x), dtype=bool), pad, mode='constant')
+
+    def group(arr):
+        tt, zz, yy, xx = arr.shape
+        arr = arr.reshape(tt, zz // fz, fz, yy // fy, fy, xx // fx, fx)
+        return arr.transpose(0, 1, 3, 5, 2, 4, 6).reshape(tt, zz // fz, yy // fy, xx // fx, fz * fy * fx)
+
+    return group(values), group(valid)
+
+
+def reduce_mean(data, factors, offset=(0, 0, 0)):
+    """ Method to reduce a matrix by averaging each block of voxels
+
+    Blocks that extend past either edge of the matrix are averaged over the voxels that exist.
+
+    Args:
+        data (numpy.ndarray): 4D (t, z, y, x) matrix
+        factors ((int, int, int)): (x, y, z) reduction factors
+        offset ((int, int, int)): (x, y, z) number of voxels of the first block that are missing before the matrix
+
+    Returns:
+        (numpy.ndarray): The reduced matrix, with the same dtype as data
+    """
+    values, valid = _pad_blocks(data, factors, offset)
+    totals = values.sum(axis=-1, dtype=np.float64)
+    counts = valid.sum(axis=-1)
+    return np.rint(totals / counts).astype(data.dtype)
+
+
+def reduce_slice(data, factors, offset=(0, 0, 0)):
+    """ Method to reduce a matrix by taking the first voxel of each block
+
+    Args:
+        data (numpy.ndarray): 4D (t, z, y, x) matrix
+        factors ((int, int, int)): (x, y, z) reduction factors
+        offset ((int, int, int)): (x, y, z) number of voxels of the first block that are missing before the matrix.
+            The first block's first voxel is then the first one that exists.
+
+    Returns:
+        (numpy.ndarray): The reduced matrix
+    """
+    if not any(offset):
+        return np.ascontiguousarray(data[:, ::factors[2], ::factors[1], ::factors[0]])
+
+    z, y, x = (np.maximum(np.arange(-o, n, f), 0) for n, f, o in zip(data.shape[1:], factors[::-1], offset[::-1]))
+    return data[:, z[:, None, None], y[None, :, None], x[None, None, :]]
+
+
+def reduce_mode(data, factors, offset=(0, 0, 0)):
+    """ Method to reduce a matrix by taking the most common value of each block of voxels
+
+    Ties are broken by taking the value that appears first in the block, in z, y, x order.
+
+    Args:
+        data (numpy.ndarray): 4D (t, z, y, x) matrix
+        factors ((int, int, int)): (x, y, z) reduction factors
+        offset ((int, int, int)): (x, y, z) number of voxels of the first block that are missing before the matrix
+
+    Returns:
+        (numpy.ndarray): The reduced matrix
+    """
+    values, valid = _pad_blocks(data, factors, offset)
+
+    # Count how many valid voxels in the block match each voxel. Blocks are small, so comparing every pair is cheaper
+    # than sorting.
+    num_voxels = values.shape[-1]
+    counts = np.zeros(values.shape, dtype=np.int32)
+    for idx in range(num_voxels):
+        counts[..., idx] = np.sum((values == values[..., idx:idx + 1]) & valid, axis=-1)
+    counts[~valid] = -1
+
+    winner = np.argmax(counts, axis=-1)
+    values = values.reshape(-1, num_voxels)
+    return values[np.arange(values.shape[0]), winner.ravel()].reshape(winner.shape)
+
+
+REDUCTIONS = {'mean': reduce_mean,
+              'slice': reduce_slice,
+              'mode': reduce_mode}
+
+
+def plan_level(bounds, factors, resolution, bytes_per_voxel, num_time_samples, max_bytes):
+    """ Method to split the next level of the hierarchy into blocks
+
+    Args:
+        bounds (LevelBounds): Region of the level being reduced
+        factors ((int, int, int)): (x, y, z) reduction factors
+        resolution (int): Level being reduced
+        bytes_per_voxel (int|float): Number of bytes in a single voxel
+        num_time_samples (int): Number of time samples reduced at once
+        max_bytes (int): Maximum number of uncompressed bytes read for a block
+
+    Returns:
+        (list((CutoutBlock, CutoutBlock))): For each block, the region to write at resolution + 1 and the region to
+        read at resolution
+    """
+    next_bounds = get_next_bounds(bounds, factors)
+    next_extent = tuple(b - a for a, b in zip(next_bounds.start, next_bounds.stop))
+    scale = factors[0] * factors[1] * factors[2]
+
+    plan = []
+    for block in plan_blocks(next_bounds.start, next_extent, get_cuboid_size(resolution + 1), bytes_per_voxel,
+                             num_time_samples=num_time_samples, max_bytes=max(1, max_bytes // scale)):
+        read_start = tuple(max(c * f, s) for c, f, s in zip(block.corner, factors, bounds.start))
+        read_stop = tuple(min((c + e) * f, s) for c, e, f, s in zip(block.corner, block.extent, factors, bounds.stop))
+        plan.append((block, CutoutBlock(read_start, tuple(b - a for a, b in zip(read_start, read_stop)))))
+    return plan
+
+
+def downsample_block(resource, resolution, factors, write_block, read_block, time_range, method):
+    """ Method to build one block of the next level
+
+    Args:
+        resource (spdb.project.BossResource): Resource for the channel
+        resolution (int): Level being reduced
+        factors ((int, int, int)): (x, y, z) reduction factors
+        write_block (CutoutBlock): Region to write at resolution + 1
+        read_block (CutoutBlock): Region to read at resolution
+        time_range (list(int)): [start, stop) time samples to reduce
+        method (str): Reduction to use. One of REDUCTIONS.
+    """
+    with get_spatialdb() as cache:
+        data = cache.cutout(resource, read_block.corner, read_block.extent, resolution, time_range)
+
+        # The read region may start inside a reduction block at the edge of the level. The voxels of that block
+        # outside the level are left out of the reduction, so the reduced matrix still lines up with write_block.
+        offset = tuple(r - w * f for r, w, f in zip(read_block.corner, write_block.corner, factors))
+        reduced = REDUCTIONS[method](data.data, factors, offset)
+        reduced = reduced[:, :write_block.extent[2], :write_block.extent[1], :write_block.extent[0]]
+        cache.write_cuboid(resource, write_block.corner, resolution + 1, np.ascontiguousarray(reduced),
+                           time_range[0])
+
+    bump_generation(resource, resolution + 1, write_block.corner, write_block.extent, time_range)
+
+
+def downsample(resource, bounds, start_resolution, stop_resolution, hierarchy_method, voxel_size, time_range, method,
+               num_workers=1, max_bytes=64 * 2 ** 20, progress=None):
+    """ Method to build the levels of the hierarchy above a resolution
+
+    Levels are built one at a time since each depends on the one below it. The blocks of a level are reduced in
+    parallel by a pool of worker threads.
+
+    Args:
+        resource (spdb.project.BossResource): Resource for the channel
+        bounds (LevelBounds): Region of start_resolution to reduce
+        start_resolution (int): Level to start from
+        stop_resolution (int): Highest level to build (exclusive)
+        hierarchy_method (str): Experiment hierarchy method (slice, iso or near_iso)
+        voxel_size ((float, float, float)): (x, y, z) voxel size at resolution 0
+        time_range (list(int)): [start, stop) time samples to reduce
+        method (str): Reduction to use. One of REDUCTIONS.
+        num_workers (int): Number of blocks reduced in parallel
+        max_bytes (int): Maximum number of uncompressed bytes read for a block
+        progress (callable): Optional function called with (resolution, blocks complete, total blocks) as blocks finish
+
+    Returns:
+        None
+    """
+    bytes_per_voxel = resource.get_bit_depth() / 8
+    num_time_samples = time_range[1] - time_range[0]
+
+    for resolution in range(start_resolution, stop_resolution - 1):
+        factors = get_scale_factors(hierarchy_method, voxel_size, resolution)
+        plan = plan_level(bounds, factors, resolution, bytes_per_voxel, num_time_samples, max_bytes)
+
+        if progress:
+            progress(resolution + 1, 0, len(plan))
+        with ThreadPoolExecutor(max_workers=num_workers) as executor:
+            futures = [executor.submit(downsample_block, resource, resolution, factors, write_block, read_block,
+                                       time_range, method)
+                       for write_block, read_block in plan]
+            for num_complete, future in enumerate(futures, 1):
+                future.result()
+                if progress:
+                    progress(resolution + 1, num_complete, len(plan))
+
+        bounds = get_next_bounds(bounds, factors)
@@ -0,0 +1,136 @@
+# Copyright 2016 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Methods to filter annotation cutouts on a list of ids
+#
+# Filter ids are kept as a sorted array of unique uint64 ids. Cutouts are filtered in place with a binary search into
+# the ids, so the cost grows with log(number of ids) instead of linearly. Annotations are mostly long runs of the same
+# id along x, so each run is looked up once instead of every voxel.
+import hashlib
+
+import numpy as np
+from django.conf import settings
+
+from bosscore.error import BossError, ErrorCodes
+
+# Number of voxels filtered at a time, which bounds the memory used by temporary arrays
+FILTER_CHUNK_SIZE = 2 ** 22
+
+# With this many ids or fewer, comparing every voxel against each id is faster than a binary search
+FILTER_SEARCH_THRESHOLD = 4
+
+# Chunks with more runs than this fraction of their voxels are searched voxel by voxel
+FILTER_MAX_RUN_FRACTION = 0.25
+
+
+def get_filter_ids(value):
+    """ Method to convert filter ids from a request body into a sorted array of unique ids
+
+    Args:
+        value (dict|list|numpy.ndarray): A JSON object with an "ids" list, a list of ids or an array of ids
+
+    Returns:
+        (numpy.ndarray): Sorted uint64 array of unique ids
+
+    Raises:
+        BossError: If the ids are invalid or there are too many of them
+    """
+    if isinstance(value, dict):
+        value = value.get("ids")
+    if not isinstance(value, (list, np.ndarray)):
+        raise BossError("Filter ids must be provided as a list of ids", ErrorCodes.INVALID_POST_ARGUMENT)
+
+    if isinstance(value, list):
+        # Check each id, since numpy converts lists that mix large and small ids to floats
+        if not all(type(i) is int and 0 <= i < 2 ** 64 for i in value):
+            raise BossError("Filter ids must be non-negative integers less than 2^64",
+                            ErrorCodes.INVALID_POST_ARGUMENT)
+        ids = np.array(value, dtype=np.uint64)
+    else:
+        ids = value
+        if ids.ndim != 1 or ids.dtype.kind not in 'ui' or (ids.dtype.kind == 'i' and np.any(ids < 0)):
+            raise BossError("Filter ids must be non-negative integers less than 2^64",
+                            ErrorCodes.INVALID_POST_ARGUMENT)
+    if ids.size > settings.CUTOUT_FILTER_MAX_IDS:
+        raise BossError("Cutouts can be filtered on at most {} ids".format(settings.CUTOUT_FILTER_MAX_IDS),
+                        ErrorCodes.REQUEST_TOO_LARGE)
+
+    return np.unique(ids.astype(np.uint64))
+
+
+def get_filter_key(filter_ids):
+    """ Method to get a short string that identifies a set of filter ids, for use in cache keys and ETags
+
+    Args:
+        filter_ids (numpy.ndarray): Sorted array of unique ids, or None
+
+    Returns:
+        (str): Digest of the ids, or None if the cutout isn't filtered
+    """
+    if filter_ids is None:
+        return None
+    return hashlib.sha1(np.ascontiguousarray(filter_ids, dtype='<u8').tobytes()).hexdigest()
+
+
+def filter_cutout(data, filter_ids):
+    """ Method to zero every voxel of a cutout that isn't one of the filter ids
+
+    Args:
+        data (numpy.ndarray): Cutout data. Filtered in place if it is C-contiguous and writeable.
+        filter_ids (numpy.ndarray): Sorted array of unique ids to keep, or None to keep everything
+
+    Returns:
+        (numpy.ndarray): The filtered data
+    """
+    if filter_ids is None:
+        return data
+    if not data.flags['C_CONTIGUOUS'] or not data.flags['WRITEABLE']:
+        data = np.array(data, order='C')
+    flat = data.reshape(-1)
+
+    # Ids that can't be stored in the channel's datatype can't match, and the ids have to have the same dtype as the
+    # data or the search compares them as floats
+    ids = filter_ids[filter_ids <= np.iinfo(data.dtype).max].astype(data.dtype)
+    if ids.size == 0:
+        flat[:] = 0
+        return data
+
+    for start in range(0, flat.size, FILTER_CHUNK_SIZE):
+        chunk = flat[start:start + FILTER_CHUNK_SIZE]
+        if ids.size <= FILTER_SEARCH_THRESHOLD:
+            keep = chunk == ids[0]
+            for value in ids[1:]:
+                keep |= chunk == value
+        else:
+            starts = np.flatnonzero(chunk[1:] != chunk[:-1])
+            if starts.size < FILTER_MAX_RUN_FRACTION * chunk.size:
+                starts = np.concatenate(([0], starts + 1))
+                lengths = np.diff(np.append(starts, chunk.size))
+                keep = np.repeat(_search(ids, chunk[starts]), lengths)
+            else:
+                keep = _search(ids, chunk)
+        chunk[~keep] = 0
+
+    return data
+
+
+def _search(ids, values):
+    """ Method to check which values are in a sorted array of ids
+
+    Returns:
+        (numpy.ndarray): Boolean array, True where the value is one of the ids
+    """
+    index = np.searchsorted(ids, values)
+    np.minimum(index, ids.size - 1, out=index)
+    return ids[index] == values
@@ -0,0 +1,505 @@
+# Copyright 2016 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+# Background jobs that run in a thread pool inside the web server process
+#
+# Jobs are recorded in the database when they are submitted and update their status as they run, so clients can poll
+# any server for progress. uWSGI must be started with enable-threads for the pool's threads to run.
+#
+# A job only runs in the process it was submitted to. While it is queued or running that process updates the job's
+# heartbeat every settings.BACKGROUND_JOB_HEARTBEAT_INTERVAL seconds. If the process goes away, eg. because uWSGI
+# recycled the worker, the heartbeat stops and the job is marked failed the next time jobs of its type are looked up.
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+import json
+import threading
+import time
+
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+
+from bosscore.error import BossError, ErrorCodes
+from bosscore.models import Collection, Experiment, Channel
+from bosscore.permissions import BossPermissionManager
+from bosscore.request import BossRequest
+from bossutils.logger import BossLogger
+from spdb import project
+
+from .blocks import get_cuboid_size, plan_blocks
+from .downsample import IMAGE_METHODS, ANNOTATION_METHODS, LevelBounds, downsample
+from .models import DownsampleJob, CutoutJob
+from .pool import get_spatialdb
+from .results import get_result_store
+from .stream import cutout_stream, get_manifest
+
+_executor = None
+_executor_lock = threading.Lock()
+
+# Ids of the jobs queued or running in this process, by model
+_active_jobs = {}
+_active_jobs_lock = threading.Lock()
+
+ORPHANED_JOB_ERROR = "The server running the job stopped before it finished"
+
+
+class JobCancelled(Exception):
+    """
+    Raised in a job's thread when the job has been cancelled
+    """
+    pass
+
+
+def get_executor():
+    """
+    Get this process's background job thread pool
+
+    Returns:
+        (concurrent.futures.ThreadPoolExecutor)
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=settings.BACKGROUND_JOB_WORKERS)
+            threading.Thread(target=_send_heartbeats, daemon=True).start()
+        return _executor
+
+
+def submit_job(model, job_id, func, *args):
+    """
+    Run a job in this process's background pool, sending heartbeats for it until it calls finish_job()
+
+    Args:
+        model (class): Model of the job. Must have status and heartbeat fields.
+        job_id (int): Id of the job
+        func (callable): Called with job_id and args to run the job
+
+    Returns:
+        None
+    """
+    with _active_jobs_lock:
+        _active_jobs.setdefault(model, set()).add(job_id)
+    get_executor().submit(func, job_id, *args)
+
+
+def finish_job(model, job_id):
+    """
+    Stop sending heartbeats for a job once its thread is done with it
+
+    Args:
+        model (class): Model of the job
+        job_id (int): Id of the job
+
+    Returns:
+        None
+    """
+    with _active_jobs_lock:
+        _active_jobs.get(model, set()).discard(job_id)
+
+
+def _send_heartbeats():
+    while True:
+        time.sleep(settings.BACKGROUND_JOB_HEARTBEAT_INTERVAL)
+        with _active_jobs_lock:
+            active = [(model, list(ids)) for model, ids in _active_jobs.items() if ids]
+        try:
+            now = timezone.now()
+            for model, ids in active:
+                model.objects.filter(id__in=ids, status__in=(0, 1)).update(heartbeat=now)
+        except Exception:
+            BossLogger().logger.exception("Updating background job heartbeats failed")
+        finally:
+            connection.close()
+
+
+def fail_orphaned_jobs(model):
+    """
+    Mark queued and running jobs as failed if the process running them has stopped sending heartbeats
+
+    Args:
+        model (class): Model of the jobs to check
+
+    Returns:
+        None
+    """
+    now = timezone.now()
+    cutoff = now - timedelta(seconds=settings.BACKGROUND_JOB_HEARTBEAT_TIMEOUT)
+    model.objects.filter(status__in=(0, 1), heartbeat__lt=cutoff).update(
+        status=3, error=ORPHANED_JOB_ERROR, end_date=now)
+
+
+def get_channel(collection, experiment, channel):
+    """
+    Look up the experiment and channel models for a channel
+
+    Args:
+        collection (str): Collection name
+        experiment (str): Experiment name
+        channel (str): Channel name
+
+    Returns:
+        (bosscore.models.Experiment, bosscore.models.Channel)
+
+    Raises:
+        BossError: If the channel doesn't exist
+    """
+    try:
+        exp = Experiment.objects.get(name=experiment, collection=Collection.objects.get(name=collection))
+        return exp, Channel.objects.get(name=channel, experiment=exp)
+    except (Collection.DoesNotExist, Experiment.DoesNotExist, Channel.DoesNotExist):
+        raise BossError("{}/{}/{} does not exist.".format(collection, experiment, channel),
+                        ErrorCodes.RESOURCE_NOT_FOUND)
+
+
+def get_latest_downsample_job(request, collection, experiment, channel):
+    """
+    Get the most recent downsample job for a channel
+
+    Args:
+        request (rest_framework.request.Request): The request. The user must be able to read the channel.
+        collection (str): Collection name
+        experiment (str): Experiment name
+        channel (str): Channel name
+
+    Returns:
+        (bossspatialdb.models.DownsampleJob): The job
+
+    Raises:
+        BossError: If the channel or job doesn't exist or the user can't read the channel
+    """
+    _, chan = get_channel(collection, experiment, channel)
+    if not BossPermissionManager.check_data_permissions(request.user, chan, 'GET'):
+        raise BossError("Missing read permissions on the resource {}".format(channel), ErrorCodes.MISSING_PERMISSION)
+
+    fail_orphaned_jobs(DownsampleJob)
+    job = DownsampleJob.objects.filter(collection=collection, experiment=experiment,
+                                       channel=channel).order_by('-id').first()
+    if job is None:
+        raise BossError("No downsample jobs exist for {}/{}/{}".format(collection, experiment, channel),
+                        ErrorCodes.OBJECT_NOT_FOUND)
+    return job
+
+
+def create_downsample_job(request, collection, experiment, channel, resolution=None, region=None, time_range=None,
+                          method=None):
+    """
+    Validate a downsample request, record the job and start it in the background
+
+    Args:
+        request (rest_framework.request.Request): Request that is starting the job. The user must be able to add data
+                                                  to the channel.
+        collection (str): Collection name
+        experiment (str): Experiment name
+        channel (str): Channel name
+        resolution (int): Level to build the hierarchy from. Defaults to the channel's base resolution.
+        region (((int, int, int), (int, int, int))): (x, y, z) start and stop of the region to downsample. Defaults to
+                                                     the experiment's coordinate frame.
+        time_range (list(int)): [start, stop) time samples to downsample. Defaults to all time samples.
+        method (str): Reduction to use for image channels (mean or slice). Annotation channels always use mode.
+
+    Returns:
+        (bossspatialdb.models.DownsampleJob): The job
+
+    Raises:
+        BossError: If the request is invalid
+    """
+    exp, chan = get_channel(collection, experiment, channel)
+
+    frame = exp.coord_frame
+    if resolution is None:
+        resolution = chan.base_resolution
+    if region is None:
+        region = ((frame.x_start, frame.y_start, frame.z_start), (frame.x_stop, frame.y_stop, frame.z_stop))
+    if time_range is None:
+        time_range = [0, exp.num_time_samples]
+
+    if chan.type == 'annotation':
+        method = ANNOTATION_METHODS[0]
+    elif method is None:
+        method = settings.DOWNSAMPLE_IMAGE_METHOD
+    elif method not in IMAGE_METHODS:
+        raise BossError("Unsupported downsample method '{}'. Supported methods: {}".format(
+            method, ", ".join(IMAGE_METHODS)), ErrorCodes.INVALID_ARGUMENT)
+
+    # Validate the region and check the user can write to the channel
+    request_args = {
+        "service": "cutout",
+        "method": "POST",
+        "collection_name": collection,
+        "experiment_name": experiment,
+        "channel_name": channel,
+        "resolution": resolution,
+        "x_args": "{}:{}".format(region[0][0], region[1][0]),
+        "y_args": "{}:{}".format(region[0][1], region[1][1]),
+        "z_args": "{}:{}".format(region[0][2], region[1][2]),
+        "time_args": "{}:{}".format(time_range[0], time_range[1]),
+    }
+    req = BossRequest(request, request_args)
+    if req.get_resolution() >= exp.num_hierarchy_levels - 1:
+        raise BossError("Resolution {} is already the top of the hierarchy ({} levels)".format(
+            req.get_resolution(), exp.num_hierarchy_levels), ErrorCodes.INVALID_ARGUMENT)
+
+    job = DownsampleJob.objects.create(creator=request.user, method=method, collection=collection,
+                                       experiment=experiment, channel=channel, start_resolution=req.get_resolution(),
+                                       x_start=req.get_x_start(), y_start=req.get_y_start(), z_start=req.get_z_start(),
+                                       t_start=req.get_time().start, x_stop=req.get_x_stop(), y_stop=req.get_y_stop(),
+                                       z_stop=req.get_z_stop(), t_stop=req.get_time().stop,
+                                       heartbeat=timezone.now())
+
+    submit_job(DownsampleJob, job.id, run_downsample_job, project.BossResourceDjango(req), exp.hierarchy_method,
+               (frame.x_voxel_size, frame.y_voxel_size, frame.z_voxel_size), exp.num_hierarchy_levels)
+    return job
+
+
+def run_downsample_job(job_id, resource, hierarchy_method, voxel_size, num_hierarchy_levels):
+    """
+    Run a downsample job, recording its progress in the database
+
+    Args:
+        job_id (int): Id of the DownsampleJob
+        resource (spdb.project.BossResource): Resource for the channel
+        hierarchy_method (str): Experiment hierarchy method (slice, iso or near_iso)
+        voxel_size ((float, float, float)): (x, y, z) voxel size at resolution 0
+        num_hierarchy_levels (int): Number of levels in the experiment's hierarchy
+
+    Returns:
+        None
+    """
+    try:
+        job = DownsampleJob.objects.get(id=job_id)
+        job.status = 1
+        job.save()
+
+        def progress(resolution, blocks_complete, blocks_total):
+            job.current_resolution = resolution
+            job.blocks_complete = blocks_complete
+            job.blocks_total = blocks_total
+            job.save(update_fields=['current_resolution', 'blocks_complete', 'blocks_total'])
+
+        bounds = LevelBounds((job.x_start, job.y_start, job.z_start), (job.x_stop, job.y_stop, job.z_stop))
+        downsample(resource, bounds, job.start_resolution, num_hierarchy_levels, hierarchy_method, voxel_size,
+                   [job.t_start, job.t_stop], job.method, num_workers=settings.DOWNSAMPLE_NUM_WORKERS,
+                   max_bytes=settings.DOWNSAMPLE_BLOCK_SIZE, progress=progress)
+
+        job.status = 2
+        job.end_date = timezone.now()
+        job.save()
+    except Exception as e:
+        BossLogger().logger.exception("Downsample job {} failed".format(job_id))
+        DownsampleJob.objects.filter(id=job_id).update(status=3, error=str(e), end_date=timezone.now())
+    finally:
+        finish_job(DownsampleJob, job_id)
+        # Each thread gets its own database connection, which isn't closed by the request cycle
+        connection.close()
+
+
+def get_result_key(job):
+    """
+    Get the key a cutout job's result is stored under
+
+    Args:
+        job (bossspatialdb.models.CutoutJob): The job
+
+    Returns:
+        (str): Result key
+    """
+    return "cutout-{}.bin".format(job.id)
+
+
+def get_cutout_job(request, job_id):
+    """
+    Get a cutout job
+
+    Args:
+        request (rest_framework.request.Request): The request. Only the user that created the job can access it.
+        job_id (int): Id of the job
+
+    Returns:
+        (bossspatialdb.models.CutoutJob): The job
+
+    Raises:
+        BossError: If the job doesn't exist or belongs to another user
+    """
+    fail_orphaned_jobs(CutoutJob)
+    try:
+        job = CutoutJob.objects.get(id=job_id)
+    except CutoutJob.DoesNotExist:
+        raise BossError("The cutout job with id {} does not exist".format(job_id), ErrorCodes.OBJECT_NOT_FOUND)
+    if job.creator != request.user:
+        raise BossError("Only the creator can access cutout job {}".format(job_id), ErrorCodes.MISSING_PERMISSION)
+    return job
+
+
+def create_cutout_job(request, collection, experiment, channel, resolution, x_range, y_range, z_range, t_range=None,
+                      ids=None):
+    """
+    Validate a cutout request, record the job and start it in the background
+
+    Args:
+        request (rest_framework.request.Request): Request that is starting the job. The user must be able to read the
+                                                  channel.
+        collection (str): Collection name
+        experiment (str): Experiment name
+        channel (str): Channel name
+        resolution (str): Resolution level
+        x_range (str): Python style range of the X coordinates (eg. 100:200)
+        y_range (str): Python style range of the Y coordinates (eg. 100:200)
+        z_range (str): Python style range of the Z coordinates (eg. 100:200)
+        t_range (str): Python style range of the time samples. Defaults to the channel's default time sample.
+        ids (str|numpy.ndarray): Optional ids to filter an annotation cutout on
+
+    Returns:
+        (bossspatialdb.models.CutoutJob): The job
+
+    Raises:
+        BossError: If the request is invalid
+    """
+    purge_expired_cutout_jobs()
+
+    # Validate the region and check the user can read the channel
+    request_args = {
+        "service": "cutout",
+        "method": "GET",
+        "collection_name": collection,
+        "experiment_name": experiment,
+        "channel_name": channel,
+        "resolution": resolution,
+        "x_args": x_range,
+        "y_args": y_range,
+        "z_args": z_range,
+        "time_args": t_range,
+        "ids": ids
+    }
+    req = BossRequest(request, request_args)
+    resource = project.BossResourceDjango(req)
+
+    try:
+        bit_depth = resource.get_bit_depth()
+    except ValueError:
+        raise BossError("Unsupported data type: {}".format(resource.get_data_type()), ErrorCodes.TYPE_ERROR)
+
+    total_bytes = req.get_x_span() * req.get_y_span() * req.get_z_span() * len(req.get_time()) * bit_depth / 8
+    if total_bytes > settings.CUTOUT_JOB_MAX_SIZE:
+        raise BossError("Cutout job is over {} bytes when uncompressed. Reduce cutout dimensions.".format(
+            settings.CUTOUT_JOB_MAX_SIZE), ErrorCodes.REQUEST_TOO_LARGE)
+
+    job = CutoutJob.objects.create(creator=request.user, collection=collection, experiment=experiment,
+                                   channel=channel, resolution=req.get_resolution(),
+                                   x_start=req.get_x_start(), y_start=req.get_y_start(), z_start=req.get_z_start(),
+                                   t_start=req.get_time().start, x_stop=req.get_x_stop(), y_stop=req.get_y_stop(),
+                                   z_stop=req.get_z_stop(), t_stop=req.get_time().stop, heartbeat=timezone.now())
+
+    submit_job(CutoutJob, job.id, run_cutout_job, resource, req.get_filter_ids())
+    return job
+
+
+def cancel_cutout_job(request, job_id):
+    """
+    Cancel a queued or running cutout job, or delete the result of a finished one
+
+    Args:
+        request (rest_framework.request.Request): The request. Only the user that created the job can cancel it.
+        job_id (int): Id of the job
+
+    Returns:
+        (bossspatialdb.models.CutoutJob): The updated job
+
+    Raises:
+        BossError: If the job doesn't exist or belongs to another user
+    """
+    job = get_cutout_job(request, job_id)
+
+    # The job's thread stops once it sees the status has changed
+    CutoutJob.objects.filter(id=job.id, status__in=(0, 1)).update(status=4, end_date=timezone.now())
+    if CutoutJob.objects.filter(id=job.id, status=2).update(status=5, expires=timezone.now()):
+        get_result_store().delete(get_result_key(job))
+
+    job.refresh_from_db()
+    return job
+
+
+def purge_expired_cutout_jobs():
+    """
+    Delete the results of cutout jobs that have expired, and fail jobs whose process has stopped
+
+    Returns:
+        None
+    """
+    fail_orphaned_jobs(CutoutJob)
+    store = get_result_store()
+    for job in CutoutJob.objects.filter(status=2, expires__lt=timezone.now()):
+        if CutoutJob.objects.filter(id=job.id, status=2).update(status=5):
+            store.delete(get_result_key(job))
+
+
+def run_cutout_job(job_id, resource, filter_ids=None):
+    """
+    Run a cutout job, saving the result to the result store and recording progress in the database
+
+    The result is saved as a block stream (see bossspatialdb.stream), so it can be cut out and written one block at a
+    time and downloaded in the same format as a streamed cutout.
+
+    Args:
+        job_id (int): Id of the CutoutJob
+        resource (spdb.project.BossResource): Resource for the channel
+        filter_ids (numpy.ndarray): Optional sorted ids to filter an annotation cutout on
+
+    Returns:
+        None
+    """
+    store = get_result_store()
+    try:
+        if not CutoutJob.objects.filter(id=job_id, status=0).update(status=1):
+            # Cancelled before it started
+            return
+        job = CutoutJob.objects.get(id=job_id)
+
+        corner = (job.x_start, job.y_start, job.z_start)
+        extent = (job.x_stop - job.x_start, job.y_stop - job.y_start, job.z_stop - job.z_start)
+        time_range = [job.t_start, job.t_stop]
+        blocks = plan_blocks(corner, extent, get_cuboid_size(job.resolution), resource.get_bit_depth() / 8,
+                             num_time_samples=job.t_stop - job.t_start, max_bytes=settings.CUTOUT_STREAM_BLOCK_SIZE)
+
+        job.blocks_total = len(blocks)
+        job.manifest = json.dumps(get_manifest(blocks, corner, extent, job.resolution), separators=(',', ':'))
+        job.save(update_fields=['blocks_total', 'manifest'])
+
+        def track_progress(stream):
+            for index, chunk in enumerate(stream):
+                yield chunk
+                # The first chunk is the stream header, then there is one per block
+                if index and not CutoutJob.objects.filter(id=job_id, status=1).update(blocks_complete=index):
+                    raise JobCancelled()
+
+        with get_spatialdb() as cache:
+            stream = cutout_stream(cache, resource, blocks, corner, extent, job.resolution, time_range,
+                                   filter_ids=filter_ids)
+            size = store.write(get_result_key(job), track_progress(stream))
+
+        now = timezone.now()
+        if not CutoutJob.objects.filter(id=job_id, status=1).update(
+                status=2, result_size=size, end_date=now,
+                expires=now + timedelta(seconds=settings.CUTOUT_JOB_RESULT_TTL)):
+            # Cancelled after the last block was written
+            store.delete(get_result_key(job))
+    except JobCancelled:
+        pass
+    except Exception as e:
+        BossLogger().logger.exception("Cutout job {} failed".format(job_id))
+        CutoutJob.objects.filter(id=job_id).update(status=3, error=str(e), end_date=timezone.now())
+    finally:
+        finish_job(CutoutJob, job_id)
+        # Each thread gets its own database connection, which isn't closed by the request cycle
+        connection.close()
@@ -13,5 +13,101 @@
 # limitations under the License.
 
 from django.db import models
+from django.conf import settings
 
-# Create your models here.
+
+class DownsampleJob(models.Model):
+    """
+    Django Model representing a job that builds the resolution hierarchy of a channel
+    """
+    creator = models.ForeignKey(settings.AUTH_USER_MODEL)
+    start_date = models.DateTimeField(auto_now_add=True)
+    end_date = models.DateTimeField(null=True)
+    DOWNSAMPLE_STATUS_OPTIONS = (
+            (0, 'Queued'),
+            (1, 'Running'),
+            (2, 'Complete'),
+            (3, 'Failed'),
+        )
+    status = models.IntegerField(choices=DOWNSAMPLE_STATUS_OPTIONS, default=0)
+    method = models.CharField(max_length=32)
+    error = models.TextField(blank=True)
+
+    collection = models.CharField(max_length=128)
+    experiment = models.CharField(max_length=128)
+    channel = models.CharField(max_length=128)
+
+    # Region of the starting resolution to downsample from
+    start_resolution = models.IntegerField()
+    x_start = models.IntegerField()
+    y_start = models.IntegerField()
+    z_start = models.IntegerField()
+    t_start = models.IntegerField()
+    x_stop = models.IntegerField()
+    y_stop = models.IntegerField()
+    z_stop = models.IntegerField()
+    t_stop = models.IntegerField()
+
+    # Progress through the level currently being built
+    current_resolution = models.IntegerField(null=True)
+    blocks_complete = models.IntegerField(default=0)
+    blocks_total = models.IntegerField(default=0)
+
+    # Last time the process running the job reported it was still alive
+    heartbeat = models.DateTimeField(null=True)
+
+    class Meta:
+        db_table = u"downsample_job"
+
+    def __str__(self):
+        return "{}".format(self.id)
+
+
+class CutoutJob(models.Model):
+    """
+    Django Model representing a cutout that is run in the background and saved for later download
+    """
+    creator = models.ForeignKey(settings.AUTH_USER_MODEL)
+    start_date = models.DateTimeField(auto_now_add=True)
+    end_date = models.DateTimeField(null=True)
+    CUTOUT_STATUS_OPTIONS = (
+            (0, 'Queued'),
+            (1, 'Running'),
+            (2, 'Complete'),
+            (3, 'Failed'),
+            (4, 'Cancelled'),
+            (5, 'Expired'),
+        )
+    status = models.IntegerField(choices=CUTOUT_STATUS_OPTIONS, default=0)
+    error = models.TextField(blank=True)
+
+    collection = models.CharField(max_length=128)
+    experiment = models.CharField(max_length=128)
+    channel = models.CharField(max_length=128)
+
+    # Region to cut out
+    resolution = models.IntegerField()
+    x_start = models.IntegerField()
+    y_start = models.IntegerField()
+    z_start = models.IntegerField()
+    t_start = models.IntegerField()
+    x_stop = models.IntegerField()
+    y_stop = models.IntegerField()
+    z_stop = models.IntegerField()
+    t_stop = models.IntegerField()
+
+    # Progress and the saved result. The manifest describes the layout of the blocks in the result.
+    blocks_complete = models.IntegerField(default=0)
+    blocks_total = models.IntegerField(default=0)
+    result_size = models.BigIntegerField(default=0)
+    manifest = models.TextField(blank=True)
+    expires = models.DateTimeField(null=True)
+
+    # Last time the process running the job reported it was still alive
+    heartbeat = models.DateTimeField(null=True)
+
+    class Meta:
+        db_table = u"cutout_job"
+
+    def __str__(self):
+        return "{}".format(self.id)
@@ -0,0 +1,198 @@
+# Copyright 2016 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Neuroglancer precomputed volumes
+#
+# A channel is served as a neuroglancer precomputed volume with one scale per resolution. The info file describes each
+# scale's bounds, voxel size in nanometers and chunk size, which is the cuboid size at that resolution. Neuroglancer's
+# chunk grid starts at the scale's voxel offset while cuboids are aligned to 0, so each chunk is read from exactly one
+# cuboid only when the offset is a multiple of the cuboid size. Otherwise a chunk straddles up to 8 cuboids. Chunks are
+# named x0-x1_y0-y1_z0-z1 in the scale's voxel coordinates and are clipped to the scale's bounds.
+#
+# Image channels use the raw encoding: little-endian voxels with x varying fastest. Annotation channels use the
+# compressed_segmentation encoding. Either is gzip compressed on the wire when the client accepts it.
+from collections import namedtuple
+import gzip
+import re
+
+import numpy as np
+from django.conf import settings
+
+from bosscore.error import BossError, ErrorCodes
+
+from .blocks import get_cuboid_size
+from .downsample import LevelBounds, get_next_bounds, get_scale_factors
+from .sparse import CSEG_BLOCK_SIZE, CSEG_DATATYPES, CSEG_HEADER, encode_compressed_segmentation
+
+# Size of a coordinate frame voxel unit in nanometers, the unit Neuroglancer expects
+VOXEL_UNIT_NM = {'nanometers': 1, 'micrometers': 1e3, 'millimeters': 1e6, 'centimeters': 1e7}
+
+CHUNK_NAME = re.compile(r"^(\d+)-(\d+)_(\d+)-(\d+)_(\d+)-(\d+)$")
+
+# Bounds and voxel size of a scale. bounds is a LevelBounds and voxel_size an (x, y, z) tuple in nanometers.
+Scale = namedtuple('Scale', ['resolution', 'bounds', 'voxel_size'])
+
+
+def get_scales(experiment, frame):
+    """
+    Get the bounds and voxel size of each resolution of an experiment
+
+    Args:
+        experiment (bosscore.models.Experiment): The experiment
+        frame (bosscore.models.CoordinateFrame): The experiment's coordinate frame
+
+    Returns:
+        (list(Scale)): One scale per resolution, native resolution first
+    """
+    voxel_size = (frame.x_voxel_size, frame.y_voxel_size, frame.z_voxel_size)
+    unit = VOXEL_UNIT_NM[frame.voxel_unit]
+    bounds = LevelBounds((frame.x_start, frame.y_start, frame.z_start), (frame.x_stop, frame.y_stop, frame.z_stop))
+    size = tuple(s * unit for s in voxel_size)
+
+    scales = []
+    for resolution in range(experiment.num_hierarchy_levels):
+        scales.append(Scale(resolution, bounds, size))
+        factors = get_scale_factors(experiment.hierarchy_method, voxel_size, resolution)
+        bounds = get_next_bounds(bounds, factors)
+        size = tuple(s * f for s, f in zip(size, factors))
+    return scales
+
+
+def get_encoding(channel):
+    """
+    Get the precomputed encoding a channel's chunks are sent with
+
+    Args:
+        channel (bosscore.models.Channel): The channel
+
+    Returns:
+        (str): compressed_segmentation or raw
+    """
+    if channel.type == 'annotation' and channel.datatype in CSEG_DATATYPES:
+        return 'compressed_segmentation'
+    return 'raw'
+
+
+def get_info(experiment, frame, channel):
+    """
+    Build the precomputed info file of a channel
+
+    Args:
+        experiment (bosscore.models.Experiment): Experiment the channel belongs to
+        frame (bosscore.models.CoordinateFrame): The experiment's coordinate frame
+        channel (bosscore.models.Channel): The channel
+
+    Returns:
+        (dict): The info file
+    """
+    encoding = get_encoding(channel)
+    scales = []
+    for scale in get_scales(experiment, frame):
+        info = {
+            "key": str(scale.resolution),
+            "size": [b - a for a, b in zip(scale.bounds.start, scale.bounds.stop)],
+            "voxel_offset": list(scale.bounds.start),
+            "resolution": list(scale.voxel_size),
+            "chunk_sizes": [list(get_cuboid_size(scale.resolution))],
+            "encoding": encoding,
+        }
+        if encoding == 'compressed_segmentation':
+            info["compressed_segmentation_block_size"] = list(CSEG_BLOCK_SIZE)
+        scales.append(info)
+
+    return {
+        "@type": "neuroglancer_multiscale_volume",
+        "type": "segmentation" if channel.type == 'annotation' else "image",
+        "data_type": channel.datatype,
+        "num_channels": 1,
+        "scales": scales,
+    }
+
+
+def parse_chunk(name, bounds, chunk_size):
+    """
+    Parse and validate a chunk name
+
+    A chunk must be on the scale's chunk grid, which starts at the scale's voxel offset, and be clipped to its bounds.
+
+    Args:
+        name (str): Chunk name formatted as x0-x1_y0-y1_z0-z1
+        bounds (LevelBounds): Bounds of the chunk's scale
+        chunk_size ((int, int, int)): (x, y, z) chunk size of the scale
+
+    Returns:
+        ((int, int, int), (int, int, int)): (x, y, z) corner and extent of the chunk
+
+    Raises:
+        BossError: If the name is invalid or the chunk isn't on the grid
+    """
+    m = CHUNK_NAME.match(name)
+    if not m:
+        raise BossError("Invalid chunk '{}'. Must be formatted as x0-x1_y0-y1_z0-z1".format(name),
+                        ErrorCodes.INVALID_CUTOUT_ARGS)
+
+    values = [int(v) for v in m.groups()]
+    corner, stop = tuple(values[0::2]), tuple(values[1::2])
+    for dim in range(3):
+        start_ok = bounds.start[dim] <= corner[dim] < bounds.stop[dim] and \
+            (corner[dim] - bounds.start[dim]) % chunk_size[dim] == 0
+        if not start_ok or stop[dim] != min(corner[dim] + chunk_size[dim], bounds.stop[dim]):
+            raise BossError("Chunk '{}' is not on the chunk grid of the scale".format(name),
+                            ErrorCodes.INVALID_CUTOUT_ARGS)
+    return corner, tuple(b - a for a, b in zip(corner, stop))
+
+
+def encode_chunk(data, encoding):
+    """
+    Encode a chunk
+
+    Args:
+        data (numpy.ndarray): 3D (z, y, x) matrix
+        encoding (str): raw or compressed_segmentation
+
+    Returns:
+        (bytes): The encoded chunk
+    """
+    if encoding == 'compressed_segmentation':
+        # The precomputed format has the channel offsets and data, without the header the cutout service adds
+        return encode_compressed_segmentation(data[np.newaxis])[CSEG_HEADER.size:]
+    return data.astype(data.dtype.newbyteorder('<'), copy=False).tobytes()
+
+
+def accepts_gzip(request):
+    """
+    Check if a client accepts gzip compressed responses
+
+    Args:
+        request (rest_framework.request.Request): The request
+
+    Returns:
+        (bool)
+    """
+    accept = request.META.get('HTTP_ACCEPT_ENCODING', '')
+    return settings.NEUROGLANCER_GZIP_LEVEL > 0 and \
+        any(e.split(';')[0].strip() == 'gzip' for e in accept.split(','))
+
+
+def compress_chunk(content):
+    """
+    gzip compress an encoded chunk
+
+    Args:
+        content (bytes): The encoded chunk
+
+    Returns:
+        (bytes): The compressed chunk
+    """
+    return gzip.compress(content, compresslevel=settings.NEUROGLANCER_GZIP_LEVEL)
@@ -0,0 +1,26 @@
+# Copyright 2016 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from django.conf.urls import url
+from . import views
+
+urlpatterns = [
+    # Url to get the precomputed info file of a channel, optionally for a time sample
+    url(r'^(?P<collection>[\w_-]+)/(?P<experiment>[\w_-]+)/(?P<channel>[\w_-]+)/(?:(?P<t_idx>\d+)/)?info/?$',
+        views.NeuroglancerInfo.as_view()),
+
+    # Url to get a precomputed chunk of a channel at a resolution, optionally for a time sample
+    url(r'^(?P<collection>[\w_-]+)/(?P<experiment>[\w_-]+)/(?P<channel>[\w_-]+)/(?:(?P<t_idx>\d+)/)?(?P<resolution>\d)/(?P<chunk>\d+-\d+_\d+-\d+_\d+-\d+)/?$',
+        views.NeuroglancerChunk.as_view()),
+]
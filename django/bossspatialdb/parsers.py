@@ -15,33 +15,53 @@
 from rest_framework.parsers import BaseParser
 from django.conf import settings
 
-import blosc
 import numpy as np
 import zlib
 import io
+import struct
 
 from bosscore.request import BossRequest
 from bosscore.error import BossParserError, BossError, ErrorCodes
 
+from .compression import BloscCodec, ZlibCodec, BLOSC_HEADER_SIZE, get_blosc_nbytes, get_codec
+from .sparse import decode_rle, decode_coo, decode_compressed_segmentation
+
 import spdb
 
+# Number of bytes read from the request stream at a time when decompressing incrementally
+PARSER_CHUNK_SIZE = 2 ** 20
+
+# Upper bound on the bytes pickle adds around an array packed with blosc.pack_array()
+BLOSC_PICKLE_OVERHEAD = 2 ** 16
+
+# Upper bound on the bytes the headers of the sparse encodings add around the data
+SPARSE_OVERHEAD = 2 ** 16
+
+# Magic string that starts an npy file and an upper bound on the size of its header
+NPY_MAGIC = b'\x93NUMPY'
+NPY_HEADER_MAX_SIZE = 2 ** 16 + 10
 
-class BloscParser(BaseParser):
+
+class CutoutParser(BaseParser):
     """
-    Parser that handles blosc compressed binary data
+    Base parser for compressed cutout data POSTed to the Cutout service
+
+    Validates the request and rejects uploads that are too large or can't match the extents in the URL using only
+    the URL and the Content-Length header, before any of the body is read. Subclasses implement decode() to
+    decompress the body into an array of the channel's datatype, using an instance of their `codec` class configured
+    from the Content-Type parameters.
     """
-    media_type = 'application/blosc'
+    media_type = None
+    codec = None
 
     def parse(self, stream, media_type=None, parser_context=None):
-        """Method to decompress bytes from a POST that contains blosc compressed matrix data
-
-           **Bytes object decompressed should be C-ordered**
+        """Method to validate a cutout POST and decompress its body
 
         :param stream: Request stream
         stream type: django.core.handlers.wsgi.WSGIRequest
         :param media_type:
         :param parser_context:
-        :return:
+        :return: tuple of (BossRequest, BossResource, numpy.ndarray) or a BossParserError
         """
         # Process request and validate
         try:
@@ -72,6 +92,7 @@ class BloscParser(BaseParser):
         # Get bit depth
         try:
             bit_depth = resource.get_bit_depth()
+            dtype = np.dtype(resource.get_numpy_data_type())
         except ValueError:
             return BossParserError("Unsupported data type provided to parser: {}".format(resource.get_data_type()),
                                    ErrorCodes.TYPE_ERROR)
@@ -82,161 +103,464 @@ class BloscParser(BaseParser):
             return BossParserError("Cutout request is over 1GB when uncompressed. Reduce cutout dimensions.",
                                    ErrorCodes.REQUEST_TOO_LARGE)
 
-        try:
-            # Decompress
-            raw_data = blosc.decompress(stream.read())
-            data_mat = np.fromstring(raw_data, dtype=resource.get_numpy_data_type())
-        except:
-            return BossParserError("Failed to decompress data. Verify the datatype/bitdepth of your data "
-                                   "matches the channel.", ErrorCodes.DATATYPE_DOES_NOT_MATCH)
-
-        # Reshape and return
-        try:
-            if req.time_request:
-                # Time series request (even if single time point) - Get 4D matrix
-                parsed_data = np.reshape(data_mat,
-                                         (len(req.get_time()),
-                                          req.get_z_span(),
-                                          req.get_y_span(),
-                                          req.get_x_span()),
-                                         order='C')
-            else:
-                # Not a time series request (time range [0,1] auto-populated) - Get 3D matrix
-                parsed_data = np.reshape(data_mat, (req.get_z_span(), req.get_y_span(), req.get_x_span()), order='C')
-        except ValueError:
-            return BossParserError("Failed to unpack data. Verify the datatype of your POSTed data and "
+        if req.time_request:
+            # Time series request (even if single time point) - Get 4D matrix
+            shape = (len(req.get_time()), req.get_z_span(), req.get_y_span(), req.get_x_span())
+        else:
+            # Not a time series request (time range [0,1] auto-populated) - Get 3D matrix
+            shape = (req.get_z_span(), req.get_y_span(), req.get_x_span())
+
+        # Reject bodies that can't possibly hold the data described by the URL before reading them
+        max_length = self.max_content_length(int(total_bytes))
+        content_length = get_content_length(parser_context['request'])
+        if content_length is None:
+            # No Content-Length (eg. a chunked upload), so the limit is enforced on what is actually sent
+            data_bytes = read_body(stream, max_length)
+            if data_bytes is not None:
+                stream, content_length = io.BytesIO(data_bytes), len(data_bytes)
+        if content_length is None or content_length > max_length:
+            return BossParserError("POSTed data is larger than expected. Verify the datatype of your POSTed data and "
                                    "xyz dimensions used in the POST URL.", ErrorCodes.DATA_DIMENSION_MISMATCH)
 
+        try:
+            codec = get_codec(self, media_type, resource.get_data_type())
+            parsed_data = self.decode(stream, content_length, shape, dtype, codec)
+        except BossError as err:
+            return BossParserError(err.message, err.error_code)
+
         return req, resource, parsed_data
 
+    def max_content_length(self, num_bytes):
+        """
+        Largest encoded body that could hold num_bytes of uncompressed data
+
+        Args:
+            num_bytes (int): Number of uncompressed bytes described by the URL
+
+        Returns:
+            (int): Maximum valid Content-Length
+        """
+        raise NotImplementedError
+
+    def decode(self, stream, content_length, shape, dtype, codec):
+        """
+        Decompress the request body into an array
+
+        Args:
+            stream: Request stream
+            content_length (int): Number of bytes in the body
+            shape (tuple(int)): Shape the data must have based on the URL
+            dtype (numpy.dtype): Datatype of the channel
+            codec: Instance of the parser's codec class
+
+        Returns:
+            (numpy.ndarray): The decoded data
+
+        Raises:
+            BossError: If the body can't be decoded
+        """
+        raise NotImplementedError
 
-class BloscPythonParser(BaseParser):
+
+class BloscParser(CutoutParser):
+    """
+    Parser that handles blosc compressed binary data
+    """
+    media_type = 'application/blosc'
+    codec = BloscCodec
+
+    def max_content_length(self, num_bytes):
+        return num_bytes + BLOSC_HEADER_SIZE
+
+    def decode(self, stream, content_length, shape, dtype, codec):
+        """Method to decompress bytes from a POST that contains blosc compressed matrix data
+
+           **Bytes object decompressed should be C-ordered**
+
+        The data is decompressed directly into a preallocated array of the channel's datatype.
+        """
+        data_bytes = stream.read(content_length)
+
+        # Check the uncompressed size stored in the blosc header before allocating anything
+        num_bytes = get_blosc_nbytes(data_bytes)
+        if num_bytes is None:
+            raise BossError("Failed to decompress data. Verify the datatype/bitdepth of your data "
+                            "matches the channel.", ErrorCodes.DATATYPE_DOES_NOT_MATCH)
+        if num_bytes != int(np.prod(shape)) * dtype.itemsize:
+            raise BossError("Failed to unpack data. Verify the datatype of your POSTed data and "
+                            "xyz dimensions used in the POST URL.", ErrorCodes.DATA_DIMENSION_MISMATCH)
+
+        parsed_data = np.empty(shape, dtype=dtype)
+        try:
+            codec.decompress_into(data_bytes, parsed_data)
+        except Exception:
+            raise BossError("Failed to decompress data. Verify the datatype/bitdepth of your data "
+                            "matches the channel.", ErrorCodes.DATATYPE_DOES_NOT_MATCH)
+
+        return parsed_data
+
+
+class BloscPythonParser(CutoutParser):
     """
     Parser that handles blosc compressed binary data in python numpy format
     """
     media_type = 'application/blosc-python'
+    codec = BloscCodec
 
-    def parse(self, stream, media_type=None, parser_context=None):
+    def max_content_length(self, num_bytes):
+        return num_bytes + BLOSC_HEADER_SIZE + BLOSC_PICKLE_OVERHEAD
+
+    def decode(self, stream, content_length, shape, dtype, codec):
         """Method to decompress bytes from a POST that contains blosc compressed numpy ndarray
 
         Only should be used if data sent was compressed using blosc.pack_array()
-
-        :param stream: Request stream
-        stream type: django.core.handlers.wsgi.WSGIRequest
-        :param media_type:
-        :param parser_context:
-        :return:
         """
+        data_bytes = stream.read(content_length)
+
+        # The pickled array has to be at least as large as the data described by the URL
+        num_bytes = get_blosc_nbytes(data_bytes)
+        expected_bytes = int(np.prod(shape)) * dtype.itemsize
+        if num_bytes is None or not expected_bytes <= num_bytes <= expected_bytes + BLOSC_PICKLE_OVERHEAD:
+            raise BossError("Failed to unpack data. Verify the datatype of your POSTed data and "
+                            "xyz dimensions used in the POST URL.", ErrorCodes.DATA_DIMENSION_MISMATCH)
+
+        # Decompress and return
         try:
-            request_args = {
-                "service": "cutout",
-                "collection_name": parser_context['kwargs']['collection'],
-                "experiment_name": parser_context['kwargs']['experiment'],
-                "channel_name": parser_context['kwargs']['channel'],
-                "resolution": parser_context['kwargs']['resolution'],
-                "x_args": parser_context['kwargs']['x_range'],
-                "y_args": parser_context['kwargs']['y_range'],
-                "z_args": parser_context['kwargs']['z_range'],
-            }
-            if 't_range' in parser_context['kwargs']:
-                request_args["time_args"] = parser_context['kwargs']['t_range']
-            else:
-                request_args["time_args"] = None
+            parsed_data = codec.unpack_array(data_bytes)
+        except Exception:
+            raise BossError("Failed to unpack data. Verify the datatype of your POSTed data and "
+                            "xyz dimensions used in the POST URL.", ErrorCodes.DATA_DIMENSION_MISMATCH)
 
-            req = BossRequest(parser_context['request'], request_args)
-        except BossError as err:
-            return BossParserError(err.message, err.status_code)
-        except Exception as err:
-            return BossParserError(str(err), ErrorCodes.UNHANDLED_EXCEPTION)
+        return parsed_data
 
-        # Convert to Resource
-        resource = spdb.project.BossResourceDjango(req)
 
-        # Get bit depth
+class NpygzParser(CutoutParser):
+    """
+    Parser that handles npygz compressed binary data
+    """
+    media_type = 'application/npygz'
+    codec = ZlibCodec
+
+    def max_content_length(self, num_bytes):
+        # Worst case expansion of incompressible data, from zlib's deflateBound(), plus the headers and sync flush
+        # markers of data compressed in independent blocks or written as several gzip members
+        num_bytes += NPY_HEADER_MAX_SIZE
+        return num_bytes + (num_bytes >> 12) + (num_bytes >> 14) + (num_bytes >> 25) + (num_bytes >> 11) + 64
+
+    def decode(self, stream, content_length, shape, dtype, codec):
+        """Method to decompress bytes from a POST that contains a gzipped npy saved numpy ndarray
+
+        The body is read and decompressed a chunk at a time, and may be a zlib stream or one or more gzip members.
+        Once the npy header has been decompressed it is validated against the URL and the remaining data is
+        decompressed directly into a preallocated array.
+        """
+        header = b''
+        parsed_data = None
+        output = None
+        position = 0
+
         try:
-            bit_depth = resource.get_bit_depth()
-        except ValueError:
-            return BossParserError("Unsupported data type provided to parser: {}".format(resource.get_data_type()),
-                                   ErrorCodes.TYPE_ERROR)
+            for data_bytes in codec.decompress_stream(read_chunks(stream, content_length), PARSER_CHUNK_SIZE):
+                if output is None:
+                    # Still accumulating the npy header
+                    header += data_bytes
+                    if not header.startswith(NPY_MAGIC[:len(header)]):
+                        raise BossError("Failed to unpack data. The POSTed data is not a valid npy file.",
+                                        ErrorCodes.DESERIALIZATION_ERROR)
+                    header_size = get_npy_header_size(header)
+                    if header_size is None or len(header) < header_size:
+                        continue
+
+                    parsed_data, output = self._allocate(header[:header_size], shape, dtype)
+                    data_bytes = header[header_size:]
+                    header = None
+
+                if position + len(data_bytes) > output.size:
+                    raise BossError("Failed to unpack data. Verify the datatype of your POSTed data and "
+                                    "xyz dimensions used in the POST URL.", ErrorCodes.DATA_DIMENSION_MISMATCH)
+                output[position:position + len(data_bytes)] = np.frombuffer(data_bytes, dtype=np.uint8)
+                position += len(data_bytes)
+        except zlib.error:
+            raise BossError("Failed to decompress data. Verify your data was compressed with zlib or gzip.",
+                            ErrorCodes.DESERIALIZATION_ERROR)
+
+        if output is None or position != output.size:
+            raise BossError("Failed to unpack data. Verify the datatype of your POSTed data and "
+                            "xyz dimensions used in the POST URL.", ErrorCodes.DATA_DIMENSION_MISMATCH)
+
+        return parsed_data
+
+    @staticmethod
+    def _allocate(header, shape, dtype):
+        """
+        Validate an npy header and allocate the array it describes
 
-        # Make sure cutout request is under 1GB UNCOMPRESSED
-        total_bytes = req.get_x_span() * req.get_y_span() * req.get_z_span() * len(req.get_time()) * bit_depth / 8
-        if total_bytes > settings.CUTOUT_MAX_SIZE:
-            return BossParserError("Cutout request is over 1GB when uncompressed. Reduce cutout dimensions.",
-                                   ErrorCodes.REQUEST_TOO_LARGE)
+        Args:
+            header (bytes): The complete npy header
+            shape (tuple(int)): Shape the data must have based on the URL
+            dtype (numpy.dtype): Datatype of the channel
 
-        # Decompress and return
+        Returns:
+            (numpy.ndarray, numpy.ndarray): The allocated array and a flat uint8 view of its memory
+        """
         try:
-            parsed_data = blosc.unpack_array(stream.read())
-        except EOFError:
-            return BossParserError("Failed to unpack data. Verify the datatype of your POSTed data and "
-                                   "xyz dimensions used in the POST URL.", ErrorCodes.DATA_DIMENSION_MISMATCH)
+            header_obj = io.BytesIO(header)
+            version = np.lib.format.read_magic(header_obj)
+            if version == (1, 0):
+                npy_shape, fortran_order, npy_dtype = np.lib.format.read_array_header_1_0(header_obj)
+            else:
+                npy_shape, fortran_order, npy_dtype = np.lib.format.read_array_header_2_0(header_obj)
+        except ValueError:
+            raise BossError("Failed to unpack data. The POSTed data is not a valid npy file.",
+                            ErrorCodes.DESERIALIZATION_ERROR)
 
-        return req, resource, parsed_data
+        if npy_dtype != dtype:
+            raise BossError("Datatype does not match channel", ErrorCodes.DATATYPE_DOES_NOT_MATCH)
+        if tuple(npy_shape) != tuple(shape):
+            raise BossError("Data dimensions in URL do not match POSTed data.", ErrorCodes.DATA_DIMENSION_MISMATCH)
 
+        order = 'F' if fortran_order else 'C'
+        parsed_data = np.empty(shape, dtype=dtype, order=order)
+        return parsed_data, parsed_data.reshape(-1, order=order).view(np.uint8)
 
-class NpygzParser(BaseParser):
+
+class RawParser(CutoutParser):
     """
-    Parser that handles npygz compressed binary data
+    Parser that handles uncompressed, C-ordered binary data
+
+    If the X-Boss-Dtype (numpy dtype string, eg. <u2) or X-Boss-Shape headers are sent they are checked against the
+    channel and URL.
     """
-    media_type = 'application/npygz'
+    media_type = 'application/octet-stream'
+    codec = None
+    dtype_header = None
+    shape_header = None
 
     def parse(self, stream, media_type=None, parser_context=None):
-        """Method to decompress bytes from a POST that contains a gzipped npy saved numpy ndarray
+        meta = parser_context['request'].META
+        self.dtype_header = meta.get('HTTP_X_BOSS_DTYPE')
+        self.shape_header = meta.get('HTTP_X_BOSS_SHAPE')
+        return super().parse(stream, media_type, parser_context)
+
+    def max_content_length(self, num_bytes):
+        return num_bytes
+
+    def decode(self, stream, content_length, shape, dtype, codec):
+        """Method to read uncompressed bytes from a POST directly into a preallocated array
+        """
+        if self.dtype_header is not None:
+            try:
+                header_dtype = np.dtype(self.dtype_header)
+            except TypeError:
+                raise BossError("Invalid X-Boss-Dtype header", ErrorCodes.INVALID_ARGUMENT)
+            if header_dtype != dtype:
+                raise BossError("Datatype does not match channel", ErrorCodes.DATATYPE_DOES_NOT_MATCH)
+        if self.shape_header is not None and self.shape_header.replace(" ", "") not in (
+                ",".join(str(dim) for dim in shape), ",".join(str(dim) for dim in (1,) + tuple(shape))):
+            raise BossError("Data dimensions in URL do not match POSTed data.", ErrorCodes.DATA_DIMENSION_MISMATCH)
+        if content_length != int(np.prod(shape)) * dtype.itemsize:
+            raise BossError("Failed to unpack data. Verify the datatype of your POSTed data and "
+                            "xyz dimensions used in the POST URL.", ErrorCodes.DATA_DIMENSION_MISMATCH)
+
+        parsed_data = np.empty(shape, dtype=dtype)
+        output = parsed_data.reshape(-1).view(np.uint8)
+        position = 0
+        while position < content_length:
+            chunk = stream.read(min(PARSER_CHUNK_SIZE, content_length - position))
+            if not chunk:
+                break
+            output[position:position + len(chunk)] = np.frombuffer(chunk, dtype=np.uint8)
+            position += len(chunk)
+
+        if position != content_length:
+            raise BossError("Failed to read data. The POSTed data is truncated.", ErrorCodes.DATA_DIMENSION_MISMATCH)
+        return parsed_data
+
+
+class SparseParser(CutoutParser):
+    """
+    Base parser for the annotation encodings in bossspatialdb.sparse
+
+    The encodings always hold a 4D matrix, so the expected shape is extended with a time axis before decoding and the
+    decoded data is reshaped to match the URL.
+    """
+    def decode(self, stream, content_length, shape, dtype, codec):
+        data_bytes = stream.read(content_length)
+        expected_shape = shape if len(shape) == 4 else (1,) + tuple(shape)
+        parsed_data = self.decode_bytes(data_bytes, codec, dtype, expected_shape)
+        return parsed_data.reshape(shape)
+
+    def decode_bytes(self, data_bytes, codec, dtype, shape):
+        """
+        Decode the request body
+
+        Args:
+            data_bytes (bytes): The request body
+            codec: Instance of the parser's codec class
+            dtype (numpy.dtype): Datatype of the channel
+            shape (tuple(int)): 4D shape the data must have based on the URL
+
+        Returns:
+            (numpy.ndarray): The decoded 4D data
+
+        Raises:
+            BossError: If the body can't be decoded
+        """
+        raise NotImplementedError
+
+
+class RLEParser(SparseParser):
+    """
+    Parser that handles run-length encoded annotation data
+    """
+    media_type = 'application/rle'
+    codec = BloscCodec
+
+    def max_content_length(self, num_bytes):
+        # Every voxel can be its own run, with a uint32 length
+        return 5 * num_bytes + SPARSE_OVERHEAD
+
+    def decode_bytes(self, data_bytes, codec, dtype, shape):
+        return decode_rle(data_bytes, codec, dtype, shape)
+
+
+class COOParser(SparseParser):
+    """
+    Parser that handles annotation data encoded as the coordinates and ids of non-zero voxels
+    """
+    media_type = 'application/coo'
+    codec = BloscCodec
+
+    def max_content_length(self, num_bytes):
+        # Every voxel can be non-zero, with four uint32 coordinates
+        return 17 * num_bytes + SPARSE_OVERHEAD
+
+    def decode_bytes(self, data_bytes, codec, dtype, shape):
+        return decode_coo(data_bytes, codec, dtype, shape)
+
+
+class CompressedSegmentationParser(SparseParser):
+    """
+    Parser that handles annotation data in neuroglancer's compressed segmentation format
+    """
+    media_type = 'application/compressed-segmentation'
+    codec = None
+
+    def max_content_length(self, num_bytes):
+        # Worst case is a table with every value in the block plus 32 bit indices into it
+        return 3 * num_bytes + SPARSE_OVERHEAD
+
+    def decode_bytes(self, data_bytes, codec, dtype, shape):
+        return decode_compressed_segmentation(data_bytes, dtype, shape)
+
+
+class FilterIdsParser(BaseParser):
+    """
+    Parser that handles a list of filter ids as packed little-endian uint64 values
+    """
+    media_type = 'application/octet-stream'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        """Method to read a packed list of filter ids
 
         :param stream: Request stream
-        stream type: django.core.handlers.wsgi.WSGIRequest
         :param media_type:
         :param parser_context:
-        :return:
+        :return: numpy.ndarray of uint64 ids or a BossParserError
         """
-        try:
-            request_args = {
-                "service": "cutout",
-                "collection_name": parser_context['kwargs']['collection'],
-                "experiment_name": parser_context['kwargs']['experiment'],
-                "channel_name": parser_context['kwargs']['channel'],
-                "resolution": parser_context['kwargs']['resolution'],
-                "x_args": parser_context['kwargs']['x_range'],
-                "y_args": parser_context['kwargs']['y_range'],
-                "z_args": parser_context['kwargs']['z_range'],
-            }
-            if 't_range' in parser_context['kwargs']:
-                request_args["time_args"] = parser_context['kwargs']['t_range']
-            else:
-                request_args["time_args"] = None
+        # Reject bodies that hold too many ids before reading them
+        max_length = 8 * settings.CUTOUT_FILTER_MAX_IDS
+        content_length = get_content_length(parser_context['request'])
+        if content_length is None:
+            data_bytes = read_body(stream, max_length)
+            content_length = len(data_bytes) if data_bytes is not None else max_length + 1
+        else:
+            data_bytes = None
+
+        if content_length > max_length:
+            return BossParserError("Cutouts can be filtered on at most {} ids".format(settings.CUTOUT_FILTER_MAX_IDS),
+                                   ErrorCodes.REQUEST_TOO_LARGE)
+        if content_length % 8:
+            return BossParserError("Filter ids must be packed as little-endian uint64 values.",
+                                   ErrorCodes.INVALID_POST_ARGUMENT)
 
-            req = BossRequest(parser_context['request'], request_args)
-        except BossError as err:
-            return BossParserError(err.message, err.status_code)
-        except Exception as err:
-            return BossParserError(str(err), ErrorCodes.UNHANDLED_EXCEPTION)
+        if data_bytes is None:
+            data_bytes = stream.read(content_length) if content_length else b''
+        if len(data_bytes) != content_length:
+            return BossParserError("Failed to read filter ids. The body is truncated.",
+                                   ErrorCodes.INVALID_POST_ARGUMENT)
+        return np.frombuffer(data_bytes, dtype='<u8')
 
-        # Convert to Resource
-        resource = spdb.project.BossResourceDjango(req)
 
-        # Get bit depth
-        try:
-            bit_depth = resource.get_bit_depth()
-        except ValueError:
-            return BossParserError("Unsupported data type provided to parser: {}".format(resource.get_data_type()),
-                                   ErrorCodes.TYPE_ERROR)
+def get_content_length(request):
+    """
+    Get the size of a request body from its headers
 
-        # Make sure cutout request is under 1GB UNCOMPRESSED
-        total_bytes = req.get_x_span() * req.get_y_span() * req.get_z_span() * len(req.get_time()) * bit_depth / 8
-        if total_bytes > settings.CUTOUT_MAX_SIZE:
-            return BossParserError("Cutout request is over 1GB when uncompressed. Reduce cutout dimensions.",
-                                   ErrorCodes.REQUEST_TOO_LARGE)
+    Args:
+        request: The DRF request
 
-        # Decompress and return
-        try:
-            data_bytes = zlib.decompress(stream.read())
+    Returns:
+        (int): Number of bytes in the body, None if not provided
+    """
+    try:
+        return int(request.META.get('CONTENT_LENGTH', request.META.get('HTTP_CONTENT_LENGTH')))
+    except (ValueError, TypeError):
+        return None
 
-            # Open
-            data_obj = io.BytesIO(data_bytes)
-            parsed_data = np.load(data_obj)
-        except EOFError:
-            return BossParserError("Failed to unpack data. Verify the datatype of your POSTed data and "
-                                   "xyz dimensions used in the POST URL.", ErrorCodes.DATA_DIMENSION_MISMATCH)
 
-        return req, resource, parsed_data
+def read_body(stream, max_length):
+    """
+    Read a request body sent without a Content-Length header, stopping once it is over the limit
+
+    Args:
+        stream: Request stream
+        max_length (int): Largest number of bytes accepted
+
+    Returns:
+        (bytes): The body, or None if it is larger than max_length
+    """
+    data_bytes = b''.join(read_chunks(stream, max_length + 1))
+    if len(data_bytes) > max_length:
+        return None
+    return data_bytes
+
+
+def get_npy_header_size(data_bytes):
+    """
+    Compute the total size of an npy header from the first bytes of the file
+
+    Args:
+        data_bytes (bytes): Start of an npy file
+
+    Returns:
+        (int): Size of the header in bytes, or None if not enough bytes have been provided yet
+    """
+    # Magic string (6), version (2), then a 2 byte (v1) or 4 byte (v2+) little-endian header length
+    if len(data_bytes) < 10:
+        return None
+    if data_bytes[6] == 1:
+        return 10 + struct.unpack('<H', data_bytes[8:10])[0]
+    if len(data_bytes) < 12:
+        return None
+    return 12 + struct.unpack('<I', data_bytes[8:12])[0]
+
+
+def read_chunks(stream, content_length, chunk_size=PARSER_CHUNK_SIZE):
+    """
+    Read a request body a chunk at a time
+
+    Args:
+        stream: Request stream
+        content_length (int): Number of bytes in the body
+        chunk_size (int): Largest number of bytes to read at a time
+
+    Returns:
+        (generator): bytes, stopping early if the stream ends before content_length bytes
+    """
+    remaining = content_length
+    while remaining > 0:
+        chunk = stream.read(min(chunk_size, remaining))
+        if not chunk:
+            break
+        remaining -= len(chunk)
+        yield chunk
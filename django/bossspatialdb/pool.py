@@ -0,0 +1,235 @@
+# Copyright 2016 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Process level pool of SpatialDB instances shared by all views
+#
+# Creating a SpatialDB opens redis connections and boto3 sessions/clients, so views check an instance out of the pool
+# instead of building a new one for every request:
+#
+#     with get_spatialdb() as cache:
+#         data = cache.cutout(...)
+#
+# There is one pool per process for each unique set of spdb settings.
+from contextlib import contextmanager
+import collections
+import threading
+import time
+
+from django.conf import settings
+from redis.exceptions import ConnectionError as RedisConnectionError, TimeoutError as RedisTimeoutError
+from botocore.exceptions import EndpointConnectionError
+
+from spdb.spatialdb import spatialdb
+
+# Errors that indicate an instance's connections are broken and it shouldn't be reused
+CONNECTION_ERRORS = (RedisConnectionError, RedisTimeoutError, EndpointConnectionError)
+
+
+class SpatialDBPool(object):
+    """
+    Pool of SpatialDB instances
+
+    Acquiring never blocks. If there are no idle instances a new one is created, and at most `max_idle` instances are
+    kept once released. Idle instances that haven't been used for `health_check_interval` seconds have their redis
+    connections pinged before being handed out, and are replaced if the check fails.
+    """
+    def __init__(self, factory, max_idle, health_check_interval):
+        """
+        Args:
+            factory (callable): Function that creates a new SpatialDB instance
+            max_idle (int): Maximum number of idle instances to keep
+            health_check_interval (int|float): Seconds an instance can sit idle before it is health checked
+        """
+        self.factory = factory
+        self.max_idle = max_idle
+        self.health_check_interval = health_check_interval
+
+        self._idle = collections.deque()
+        self._lock = threading.Lock()
+        self.stats = {'created': 0, 'reused': 0, 'discarded': 0}
+
+    def acquire(self):
+        """
+        Check an instance out of the pool
+
+        Returns:
+            (spdb.spatialdb.SpatialDB)
+        """
+        while True:
+            with self._lock:
+                if not self._idle:
+                    break
+                instance, last_used = self._idle.pop()
+
+            if time.time() - last_used < self.health_check_interval or self.is_healthy(instance):
+                self._count('reused')
+                return instance
+            self.discard(instance)
+
+        self._count('created')
+        return self.factory()
+
+    def release(self, instance):
+        """
+        Return an instance to the pool
+
+        Args:
+            instance (spdb.spatialdb.SpatialDB): Instance from acquire()
+        """
+        with self._lock:
+            if len(self._idle) < self.max_idle:
+                self._idle.append((instance, time.time()))
+                return
+        self.discard(instance)
+
+    def discard(self, instance):
+        """
+        Drop an instance instead of returning it to the pool
+
+        Args:
+            instance (spdb.spatialdb.SpatialDB): Instance from acquire()
+        """
+        self._count('discarded')
+
+    def clear(self):
+        """
+        Drop all idle instances
+        """
+        with self._lock:
+            self._idle.clear()
+
+    def _count(self, stat):
+        with self._lock:
+            self.stats[stat] += 1
+
+    @contextmanager
+    def connection(self):
+        """
+        Context manager that checks an instance out and returns it when done
+
+        If a connection error escapes the block the instance is discarded so the next request gets a fresh one.
+
+        Yields:
+            (spdb.spatialdb.SpatialDB)
+        """
+        instance = self.acquire()
+        healthy = True
+        try:
+            yield instance
+        except CONNECTION_ERRORS:
+            healthy = False
+            raise
+        finally:
+            if healthy:
+                self.release(instance)
+            else:
+                self.discard(instance)
+
+    def release_after(self, instance, iterable):
+        """
+        Generator that yields from iterable and then returns the instance to the pool
+
+        Used by streaming responses, where the instance is still needed after the view returns.
+
+        Args:
+            instance (spdb.spatialdb.SpatialDB): Instance from acquire()
+            iterable: The response content
+
+        Yields:
+            Items from iterable
+        """
+        healthy = True
+        try:
+            yield from iterable
+        except CONNECTION_ERRORS:
+            healthy = False
+            raise
+        finally:
+            if healthy:
+                self.release(instance)
+            else:
+                self.discard(instance)
+
+    @staticmethod
+    def is_healthy(instance):
+        """
+        Ping the redis connections held by an instance
+
+        Args:
+            instance (spdb.spatialdb.SpatialDB): Instance to check
+
+        Returns:
+            (bool): True if all connections responded
+        """
+        clients = [getattr(getattr(instance, 'kvio', None), 'cache_client', None),
+                   getattr(getattr(instance, 'cache_state', None), 'status_client', None)]
+        try:
+            for client in clients:
+                if client is not None:
+                    client.ping()
+        except Exception:
+            return False
+        return True
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def _create_spatialdb():
+    """
+    Create a SpatialDB instance from the current settings
+
+    Returns:
+        (spdb.spatialdb.SpatialDB)
+    """
+    return spatialdb.SpatialDB(settings.KVIO_SETTINGS,
+                               settings.STATEIO_CONFIG,
+                               settings.OBJECTIO_CONFIG)
+
+
+def get_pool():
+    """
+    Get this process's pool for the current spdb settings
+
+    Returns:
+        (SpatialDBPool)
+    """
+    key = (spatialdb.SpatialDB, repr((settings.KVIO_SETTINGS, settings.STATEIO_CONFIG, settings.OBJECTIO_CONFIG)))
+    with _pools_lock:
+        if key not in _pools:
+            _pools[key] = SpatialDBPool(_create_spatialdb,
+                                        settings.SPATIALDB_POOL_SIZE,
+                                        settings.SPATIALDB_POOL_HEALTH_CHECK_INTERVAL)
+        return _pools[key]
+
+
+def get_spatialdb():
+    """
+    Check a SpatialDB instance out of this process's pool. Use as a context manager.
+
+    Returns:
+        Context manager yielding a spdb.spatialdb.SpatialDB instance
+    """
+    return get_pool().connection()
+
+
+def clear_pools():
+    """
+    Drop all pools, so new SpatialDB instances are created on the next request
+    """
+    with _pools_lock:
+        for pool in _pools.values():
+            pool.clear()
+        _pools.clear()
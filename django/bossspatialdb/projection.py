@@ -0,0 +1,165 @@
+# Copyright 2016 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Methods to reduce a cutout to a maximum, minimum or mean intensity projection along one axis
+#
+# The region is cut out in cuboid aligned blocks. Each block is reduced along the projection axis as soon as it is cut
+# out and combined into the 2D result, so only one block and the result are held in memory at a time.
+import numpy as np
+from django.conf import settings
+from spdb.spatialdb import Cube
+
+from bosscore.error import BossError, ErrorCodes
+
+from .blocks import get_cuboid_size, plan_blocks
+from .filtering import filter_cutout
+
+# Supported projection operations
+PROJECTIONS = ('max', 'min', 'mean')
+
+# Index of each axis in a (t, z, y, x) cutout, and in an (x, y, z) corner or extent
+PROJECTION_AXES = {'x': (3, 0), 'y': (2, 1), 'z': (1, 2)}
+
+
+def get_projection(params, axis=None):
+    """ Method to read the projection options from a request's query parameters
+
+    Args:
+        params (dict): Query parameters. `project` is the operation and `axis` the axis to project along (default z).
+        axis (str): The only axis that can be projected along, if the request only supports one
+
+    Returns:
+        (tuple(str, str)): (operation, axis), or None if a projection wasn't requested
+
+    Raises:
+        BossError: If the operation or axis is invalid
+    """
+    operation = params.get("project")
+    if operation is None:
+        if "axis" in params:
+            raise BossError("An axis can only be provided with a projection", ErrorCodes.INVALID_ARGUMENT)
+        return None
+
+    operation = operation.lower()
+    if operation not in PROJECTIONS:
+        raise BossError("Unsupported projection '{}'. Supported projections: {}".format(
+            operation, ", ".join(PROJECTIONS)), ErrorCodes.INVALID_ARGUMENT)
+
+    requested = params.get("axis", axis or "z").lower()
+    if requested not in PROJECTION_AXES or (axis is not None and requested != axis):
+        raise BossError("Invalid projection axis '{}'. Must be {}".format(requested, axis or "x, y or z"),
+                        ErrorCodes.INVALID_ARGUMENT)
+    return operation, requested
+
+
+def get_projected_extent(extent, axis):
+    """ Method to get the size of the result of a projection
+
+    Args:
+        extent ((int, int, int)): (x, y, z) size of the region being projected
+        axis (str): Axis to project along
+
+    Returns:
+        ((int, int, int)): (x, y, z) size of the projection, with the projected axis reduced to 1
+    """
+    projected = list(extent)
+    projected[PROJECTION_AXES[axis][1]] = 1
+    return tuple(projected)
+
+
+def check_projection_size(extent, num_time_samples, bytes_per_voxel, axis):
+    """ Method to make sure a projection is small enough to run
+
+    Projections are reduced block by block, so the region can be up to settings.CUTOUT_PROJECTION_MAX_SIZE and only
+    the result is limited to settings.CUTOUT_MAX_SIZE.
+
+    Args:
+        extent ((int, int, int)): (x, y, z) size of the region being projected
+        num_time_samples (int): Number of time samples in the region
+        bytes_per_voxel (int|float): Number of bytes in a single voxel
+        axis (str): Axis to project along
+
+    Raises:
+        BossError: If the region or the result is too large
+    """
+    projected_extent = get_projected_extent(extent, axis)
+    total_bytes = extent[0] * extent[1] * extent[2] * num_time_samples * bytes_per_voxel
+    projected_bytes = projected_extent[0] * projected_extent[1] * projected_extent[2] * num_time_samples * \
+        bytes_per_voxel
+    if total_bytes > settings.CUTOUT_PROJECTION_MAX_SIZE or projected_bytes > settings.CUTOUT_MAX_SIZE:
+        raise BossError("Projection request is over {} bytes when uncompressed. Reduce cutout "
+                        "dimensions.".format(settings.CUTOUT_PROJECTION_MAX_SIZE), ErrorCodes.REQUEST_TOO_LARGE)
+
+
+def project_cutout(cache, resource, corner, extent, resolution, time_range, operation, axis, filter_ids=None,
+                   max_bytes=None):
+    """ Method to cut out a region and reduce it to a projection along one axis
+
+    The mean is rounded to the nearest integer so the projection has the channel's datatype and can be sent with any
+    of the cutout and tile renderers.
+
+    Args:
+        cache (spdb.spatialdb.SpatialDB): Interface to the spatial database
+        resource (spdb.project.BossResource): Resource for the channel being cut out
+        corner ((int, int, int)): (x, y, z) corner of the region
+        extent ((int, int, int)): (x, y, z) size of the region
+        resolution (int): Resolution of the cutout
+        time_range (list(int)): [start, stop) time samples of the cutout
+        operation (str): One of PROJECTIONS
+        axis (str): Axis to project along
+        filter_ids (numpy.ndarray): Optional sorted ids to filter an annotation cutout on before it is projected
+        max_bytes (int): Maximum number of uncompressed bytes to cut out at a time. If None the region is cut out
+            at once.
+
+    Returns:
+        (spdb.spatialdb.Cube): The projection. Its data is 4D (t, z, y, x) with the projected axis reduced to 1.
+    """
+    dtype = np.dtype(resource.get_numpy_data_type())
+    data_axis, extent_axis = PROJECTION_AXES[axis]
+    projected_extent = get_projected_extent(extent, axis)
+    shape = (time_range[1] - time_range[0], projected_extent[2], projected_extent[1], projected_extent[0])
+
+    if operation == 'mean':
+        output = np.zeros(shape, dtype=np.float64)
+    elif operation == 'max':
+        output = np.full(shape, np.iinfo(dtype).min, dtype=dtype)
+    else:
+        output = np.full(shape, np.iinfo(dtype).max, dtype=dtype)
+
+    blocks = plan_blocks(corner, extent, get_cuboid_size(resolution), dtype.itemsize, shape[0], max_bytes)
+    for block in blocks:
+        data = cache.cutout(resource, block.corner, block.extent, resolution, time_range).data
+        data = filter_cutout(data, filter_ids)
+
+        # Part of the result this block projects onto
+        offset = [c - o for c, o in zip(block.corner, corner)]
+        size = list(block.extent)
+        offset[extent_axis] = 0
+        size[extent_axis] = 1
+        target = output[:, offset[2]:offset[2] + size[2], offset[1]:offset[1] + size[1],
+                        offset[0]:offset[0] + size[0]]
+
+        if operation == 'mean':
+            target += data.sum(axis=data_axis, keepdims=True, dtype=np.float64)
+        elif operation == 'max':
+            np.maximum(target, data.max(axis=data_axis, keepdims=True), out=target)
+        else:
+            np.minimum(target, data.min(axis=data_axis, keepdims=True), out=target)
+
+    if operation == 'mean':
+        output = np.rint(output / extent[extent_axis]).astype(dtype)
+
+    cube = Cube.create_cube(resource, list(projected_extent), time_range)
+    cube.data = output
+    return cube
@@ -13,10 +13,47 @@
 # limitations under the License.
 
 from rest_framework import renderers
-import blosc
+from django.conf import settings
+from django.http import HttpResponse, FileResponse
 import numpy as np
-import zlib
 import io
+import tempfile
+
+from bosscore.error import BossError, BossHTTPError
+
+from .compression import BloscCodec, ZlibCodec
+from .stream import encode_stream_header, encode_block, encode_batch_header, encode_batch_item
+from .sparse import encode_rle, encode_coo, encode_compressed_segmentation, CSEG_DATATYPES
+
+
+def get_render_codec(renderer, data, renderer_context):
+    """ Get the codec negotiated by the view, or the datatype's defaults if the view didn't set one
+
+    :param renderer: The renderer instance
+    :param data: Data passed to the renderer
+    :param renderer_context: DRF renderer context
+    :return: codec instance
+    """
+    view = renderer_context.get('view') if renderer_context else None
+    codec = getattr(view, 'codec', None)
+    if codec is None:
+        codec = renderer.codec.from_media_type(None, data["data"].data.dtype.name)
+    return codec
+
+
+def render_error(err, renderer_context):
+    """ Replace the response with an error that was only found while encoding the data
+
+    :param err: The error raised by the encoder
+    :type err: bosscore.error.BossError
+    :param renderer_context: DRF renderer context
+    :return: JSON encoded error body
+    """
+    error = BossHTTPError(err.message, err.error_code)
+    response = renderer_context['response']
+    response.status_code = error.status_code
+    response['Content-Type'] = 'application/json'
+    return error.content
 
 
 class BloscPythonRenderer(renderers.BaseRenderer):
@@ -28,17 +65,20 @@ class BloscPythonRenderer(renderers.BaseRenderer):
     format = 'bin'
     charset = None
     render_style = 'binary'
+    codec = BloscCodec
 
     def render(self, data, media_type=None, renderer_context=None):
 
+        codec = get_render_codec(self, data, renderer_context)
+
         if not data["data"].data.flags['C_CONTIGUOUS']:
             data["data"].data = np.ascontiguousarray(data["data"].data, dtype=data["data"].data.dtype)
 
         # Return data, squeezing time dimension if only a single point
         if data["time_request"]:
-            return blosc.pack_array(data["data"].data)
+            return codec.pack_array(data["data"].data)
         else:
-            return blosc.pack_array(np.squeeze(data["data"].data, axis=(0,)))
+            return codec.pack_array(np.squeeze(data["data"].data, axis=(0,)))
 
 
 class BloscRenderer(renderers.BaseRenderer):
@@ -49,18 +89,20 @@ class BloscRenderer(renderers.BaseRenderer):
     format = 'bin'
     charset = None
     render_style = 'binary'
+    codec = BloscCodec
 
     def render(self, data, media_type=None, renderer_context=None):
 
+        codec = get_render_codec(self, data, renderer_context)
+
         if not data["data"].data.flags['C_CONTIGUOUS']:
             data["data"].data = np.ascontiguousarray(data["data"].data, dtype=data["data"].data.dtype)
 
         # Return data, squeezing time dimension if only a single point
         if data["time_request"]:
-            return blosc.compress(data["data"].data, typesize=renderer_context['view'].bit_depth)
+            return codec.compress(data["data"].data)
         else:
-            return blosc.compress(np.squeeze(data["data"].data, axis=(0,)),
-                                  typesize=renderer_context['view'].bit_depth)
+            return codec.compress(np.squeeze(data["data"].data, axis=(0,)))
 
 
 class NpygzRenderer(renderers.BaseRenderer):
@@ -72,24 +114,197 @@ class NpygzRenderer(renderers.BaseRenderer):
     format = 'bin'
     charset = None
     render_style = 'binary'
+    codec = ZlibCodec
 
     def render(self, data, media_type=None, renderer_context=None):
 
-        if not data["data"].data.flags['C_CONTIGUOUS']:
-            data["data"].data = np.ascontiguousarray(data["data"].data, dtype=data["data"].data.dtype)
+        codec = get_render_codec(self, data, renderer_context)
 
         # Return data, squeezing time dimension if only a single point
-        if not data["time_request"]:
-            data["data"].data = np.squeeze(data["data"].data, axis=(0,))
+        if data["time_request"]:
+            return b''.join(encode_npygz(data["data"].data, codec))
+        else:
+            return b''.join(encode_npygz(np.squeeze(data["data"].data, axis=(0,)), codec))
+
+
+def encode_npygz(data, codec):
+    """ Encode an array as a zlib compressed npy file, a block at a time
+
+    Only the npy header is built separately. The array's buffer is compressed in place, without saving it to an
+    in-memory npy file first.
+
+    :param data: Array to encode
+    :type data: numpy.ndarray
+    :param codec: Codec to compress with
+    :type codec: bossspatialdb.compression.ZlibCodec
+    :return: generator of bytes
+    """
+    if not data.flags['C_CONTIGUOUS']:
+        data = np.ascontiguousarray(data)
+
+    header = io.BytesIO()
+    np.lib.format.write_array_header_1_0(header, np.lib.format.header_data_from_array_1_0(data))
+    return codec.compress_stream([header.getvalue(), data.reshape(-1).view(np.uint8)])
+
+
+class BloscStreamRenderer(renderers.BaseRenderer):
+    """ A DRF renderer for a framed stream of independently blosc compressed blocks
 
-        # Save Data to npy
-        npy_file = io.BytesIO()
-        np.save(npy_file, data["data"].data, allow_pickle=False)
+    The Cutout view streams this format block by block directly. This renderer is used for content negotiation and
+    to encode data that was already cut out as a single block stream. See bossspatialdb.stream for the format.
+    """
+    media_type = 'application/blosc-stream'
+    format = 'bin'
+    charset = None
+    render_style = 'binary'
+    codec = BloscCodec
+
+    def render(self, data, media_type=None, renderer_context=None):
+
+        codec = get_render_codec(self, data, renderer_context)
+
+        cube_data = data["data"].data
+        return encode_stream_header(cube_data.dtype, cube_data.shape, 1) + encode_block(cube_data, (0, 0, 0, 0),
+                                                                                        codec)
+
+
+class BloscBatchRenderer(renderers.BaseRenderer):
+    """ A DRF renderer for a batch of blosc compressed regions
+
+    The CutoutBatch view streams this format directly. This renderer is used for content negotiation and to encode a
+    list of 4D matrices that were already cut out. See bossspatialdb.stream for the format.
+    """
+    media_type = 'application/blosc-batch'
+    format = 'bin'
+    charset = None
+    render_style = 'binary'
+    codec = BloscCodec
+
+    def render(self, data, media_type=None, renderer_context=None):
+
+        view = renderer_context.get('view') if renderer_context else None
+        codec = getattr(view, 'codec', None)
+
+        output = [encode_batch_header(len(data["data"]))]
+        for index, region_data in enumerate(data["data"]):
+            output.append(encode_batch_item(index, region_data, codec))
+        return b''.join(output)
+
+
+class RLERenderer(renderers.BaseRenderer):
+    """ A DRF renderer for run-length encoded annotation data
+
+    Runs of the same id are stored as blosc compressed lengths and ids. The data is always encoded as a 4D matrix.
+    See bossspatialdb.sparse for the format.
+    """
+    media_type = 'application/rle'
+    format = 'bin'
+    charset = None
+    render_style = 'binary'
+    codec = BloscCodec
+
+    def render(self, data, media_type=None, renderer_context=None):
+
+        codec = get_render_codec(self, data, renderer_context)
+        return encode_rle(data["data"].data, codec)
+
+
+class COORenderer(renderers.BaseRenderer):
+    """ A DRF renderer for the non-zero voxels of annotation data as blosc compressed coordinates and ids
+
+    The data is always encoded as a 4D matrix. See bossspatialdb.sparse for the format.
+    """
+    media_type = 'application/coo'
+    format = 'bin'
+    charset = None
+    render_style = 'binary'
+    codec = BloscCodec
+
+    def render(self, data, media_type=None, renderer_context=None):
+
+        codec = get_render_codec(self, data, renderer_context)
+        return encode_coo(data["data"].data, codec)
+
+
+class CompressedSegmentationRenderer(renderers.BaseRenderer):
+    """ A DRF renderer for annotation data in neuroglancer's compressed segmentation format
+
+    Each time sample is encoded as a channel. Only uint32 and uint64 channels are supported.
+    See bossspatialdb.sparse for the format.
+    """
+    media_type = 'application/compressed-segmentation'
+    format = 'bin'
+    charset = None
+    render_style = 'binary'
+    codec = None
+    datatypes = CSEG_DATATYPES
+
+    def render(self, data, media_type=None, renderer_context=None):
+
+        try:
+            return encode_compressed_segmentation(data["data"].data)
+        except BossError as err:
+            # The encoded size is only known once the data has been encoded
+            return render_error(err, renderer_context)
+
+
+class RawRenderer(renderers.BaseRenderer):
+    """ A DRF renderer for an uncompressed, C-ordered cube of data
+
+    For fast networks where compression costs more than it saves. The numpy dtype string (eg. <u2) and shape are sent
+    in the X-Boss-Dtype and X-Boss-Shape headers. The Cutout view sends this format with get_raw_response() instead of
+    rendering it, so the array buffer isn't copied into a bytes object.
+    """
+    media_type = 'application/octet-stream'
+    format = 'bin'
+    charset = None
+    render_style = 'binary'
+    codec = None
+
+    def render(self, data, media_type=None, renderer_context=None):
+
+        # Return data, squeezing time dimension if only a single point
+        cube_data = data["data"].data if data["time_request"] else data["data"].data[0]
+        if renderer_context and 'response' in renderer_context:
+            set_raw_headers(renderer_context['response'], cube_data)
+        return np.ascontiguousarray(cube_data).tobytes()
+
+
+def set_raw_headers(response, data):
+    """ Add the headers that describe an uncompressed array to a response
+
+    :param response: The response
+    :param data: The array being sent
+    :type data: numpy.ndarray
+    :return: None
+    """
+    response['X-Boss-Dtype'] = data.dtype.str
+    response['X-Boss-Shape'] = ",".join(str(dim) for dim in data.shape)
+
+
+def get_raw_response(data):
+    """ Build a response that sends an array uncompressed
+
+    Arrays larger than settings.CUTOUT_RAW_SENDFILE_SIZE are written directly from their buffer to an unlinked temp
+    file, and sent with a FileResponse so the WSGI server can use sendfile (wsgi.file_wrapper) and the bytes don't
+    pass through Python again.
+
+    :param data: C-ordered array to send
+    :type data: numpy.ndarray
+    :return: django.http.HttpResponse
+    """
+    if not data.flags['C_CONTIGUOUS']:
+        data = np.ascontiguousarray(data)
 
-        # Compress npy
-        npy_gz = zlib.compress(npy_file.getvalue())
+    if data.nbytes > settings.CUTOUT_RAW_SENDFILE_SIZE:
+        fh = tempfile.TemporaryFile()
+        data.tofile(fh)
+        fh.seek(0)
+        response = FileResponse(fh, content_type=RawRenderer.media_type)
+        response.block_size = 2 ** 20
+    else:
+        response = HttpResponse(data.tobytes(), content_type=RawRenderer.media_type)
 
-        # Send file
-        npy_gz_file = io.BytesIO(npy_gz)
-        npy_gz_file.seek(0)
-        return npy_gz_file.read()
+    response['Content-Length'] = data.nbytes
+    set_raw_headers(response, data)
+    return response
@@ -0,0 +1,118 @@
+# Copyright 2016 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Storage for the results of background cutout jobs
+#
+# Results are written once, as a sequence of chunks, and then read back for download. The store only needs to support
+# that access pattern, so an object store can be used in place of the local disk store by implementing the same
+# methods.
+#
+# The job is run by the server it was submitted to and any server can be asked for the result, so with more than one
+# API server settings.CUTOUT_JOB_RESULT_DIR must be shared storage mounted on every server. Otherwise a result is only
+# available from the server that ran its job.
+import os
+
+from django.conf import settings
+
+
+class LocalResultStore(object):
+    """
+    Result store that keeps each result as a file in a directory on local disk
+
+    Results are written to a temporary file and renamed once complete, so a partially written result is never read.
+    """
+    def __init__(self, root):
+        """
+        Args:
+            root (str): Directory to store results in. Created if it doesn't exist.
+        """
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def get_path(self, key):
+        """
+        Get the path of the file a result is stored in
+
+        Args:
+            key (str): Result key
+
+        Returns:
+            (str): Path
+        """
+        return os.path.join(self.root, key)
+
+    def write(self, key, chunks):
+        """
+        Save a result
+
+        Args:
+            key (str): Result key
+            chunks: Iterable of bytes that make up the result, in order
+
+        Returns:
+            (int): Size of the result in bytes
+        """
+        path = self.get_path(key)
+        partial = path + ".partial"
+        size = 0
+        try:
+            with open(partial, 'wb') as fh:
+                for chunk in chunks:
+                    fh.write(chunk)
+                    size += len(chunk)
+            os.replace(partial, path)
+        finally:
+            if os.path.exists(partial):
+                os.remove(partial)
+        return size
+
+    def open(self, key):
+        """
+        Open a saved result for reading
+
+        Args:
+            key (str): Result key
+
+        Returns:
+            (file): Binary file object
+
+        Raises:
+            FileNotFoundError: If the result doesn't exist
+        """
+        return open(self.get_path(key), 'rb')
+
+    def delete(self, key):
+        """
+        Delete a saved result, if it exists
+
+        Args:
+            key (str): Result key
+
+        Returns:
+            None
+        """
+        try:
+            os.remove(self.get_path(key))
+        except FileNotFoundError:
+            pass
+
+
+def get_result_store():
+    """
+    Get the store for cutout job results from the current settings
+
+    Returns:
+        (LocalResultStore)
+    """
+    return LocalResultStore(settings.CUTOUT_JOB_RESULT_DIR)
@@ -0,0 +1,37 @@
+# Copyright 2016 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from rest_framework import serializers
+from .models import DownsampleJob, CutoutJob
+
+
+class DownsampleJobSerializer(serializers.ModelSerializer):
+    """
+    Serializer to report the status of a downsample job
+    """
+    class Meta:
+        model = DownsampleJob
+        fields = ('id', 'collection', 'experiment', 'channel', 'status', 'method', 'start_resolution',
+                  'current_resolution', 'blocks_complete', 'blocks_total', 'start_date', 'end_date', 'error')
+
+
+class CutoutJobSerializer(serializers.ModelSerializer):
+    """
+    Serializer to report the status of a cutout job
+    """
+    class Meta:
+        model = CutoutJob
+        fields = ('id', 'collection', 'experiment', 'channel', 'status', 'resolution', 'x_start', 'x_stop', 'y_start',
+                  'y_stop', 'z_start', 'z_stop', 't_start', 't_stop', 'blocks_complete', 'blocks_total',
+                  'result_size', 'start_date', 'end_date', 'expires', 'error')
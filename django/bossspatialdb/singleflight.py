@@ -0,0 +1,325 @@
+# Copyright 2016 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Single-flight reads from the spatial database
+#
+# When many clients ask for the same region at the same moment (eg. viewers of a shared dataset requesting the same
+# tiles), only one of the identical concurrent reads goes to the cache and object store, and the others share its
+# result. Reads are identified by the region and the write generations of the cuboids it touches, so a read is never
+# shared with a request that started after the data was rewritten.
+#
+# Reads are always coalesced between the threads of a process. With settings.SINGLE_FLIGHT_BACKEND = 'redis' they are
+# also coalesced between processes and servers: the process that takes a lock in the cache-state redis database does
+# the read, and the others count themselves as waiting and poll for its result. The result is only published if
+# another process is waiting, so an uncontended read costs a lock and a check of the waiter count, without encoding or
+# uploading any data. Reads larger than settings.SINGLE_FLIGHT_MAX_SHARED_SIZE are never published, so they are made
+# without the lock. The 'local' backend needs workers that serve requests on several threads to have any effect.
+#
+# Each process logs its counters every settings.SINGLE_FLIGHT_LOG_INTERVAL reads.
+#
+# Reads go through the process's cuboid cache (see cuboidcache.py), so only the cuboids it doesn't hold are read.
+#
+# Shared cutouts are read-only, and every caller gets its own Cube object, so a caller can replace `cube.data` but
+# must copy the data before modifying it.
+import copy
+import json
+import threading
+import time
+
+import blosc
+import numpy as np
+from django.conf import settings
+from redis.exceptions import LockError
+from spdb.spatialdb import Cube
+
+from bossutils.logger import BossLogger
+
+from .cuboidcache import cached_cutout
+from .versioning import get_client, get_cuboid_fields, get_generations, make_etag
+
+LOCK_KEY = "SINGLE-FLIGHT-LOCK&{}"
+RESULT_KEY = "SINGLE-FLIGHT-RESULT&{}"
+WAITERS_KEY = "SINGLE-FLIGHT-WAITERS&{}"
+STATS_KEY = "SINGLE-FLIGHT-STATS"
+
+# How often (in seconds) a process waiting on another process's read checks for the result
+POLL_INTERVAL = 0.01
+
+
+class SingleFlight(object):
+    """
+    Coalesces identical concurrent calls between the threads of a process
+
+    The first caller for a key runs the function. Callers that arrive while it is running wait for it to finish and
+    get the same result, or the same exception.
+    """
+    def __init__(self, log_interval=0):
+        """
+        Args:
+            log_interval (int): Log the stats every this many calls. 0 to never log them.
+        """
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.log_interval = log_interval
+        self.stats = {'calls': 0, 'executed': 0, 'shared': 0, 'published': 0, 'shared_remote': 0, 'timeouts': 0}
+
+    def do(self, key, func):
+        """
+        Call a function, unless an identical call is already running
+
+        Args:
+            key (str): Identifies calls that would return the same result
+            func (callable): Function to call with no arguments
+
+        Returns:
+            (object, bool): The result, and True if it was shared from a call made by another thread
+        """
+        report = None
+        with self._lock:
+            self.stats['calls'] += 1
+            if self.log_interval and self.stats['calls'] % self.log_interval == 0:
+                report = dict(self.stats)
+            call = self._calls.get(key)
+            if call is None:
+                call = self._calls[key] = _Call()
+                leader = True
+                self.stats['executed'] += 1
+            else:
+                leader = False
+                self.stats['shared'] += 1
+
+        if report is not None:
+            BossLogger().logger.info("Single-flight reads: {}".format(report))
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = func()
+        except Exception as err:
+            call.error = err
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result, False
+
+    def count(self, stat):
+        """
+        Increment one of the stats
+
+        Args:
+            stat (str): Name of the stat
+        """
+        with self._lock:
+            self.stats[stat] += 1
+
+    def get_stats(self):
+        """
+        Get the stats
+
+        Returns:
+            (dict): Copy of the stats
+        """
+        with self._lock:
+            return dict(self.stats)
+
+
+class _Call(object):
+    """
+    A call in progress
+    """
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+_flight = SingleFlight(settings.SINGLE_FLIGHT_LOG_INTERVAL)
+
+
+def get_stats():
+    """
+    Get how many reads this process made and how many were shared
+
+    Returns:
+        (dict): Number of reads requested ('calls'), made by this process ('executed'), shared between threads of this
+        process ('shared'), published for another process ('published'), shared from another process
+        ('shared_remote') and that stopped waiting on another process ('timeouts'). With the redis backend, the totals
+        of shared_remote and timeouts across all processes are kept in the STATS_KEY hash.
+    """
+    return _flight.get_stats()
+
+
+def coalesced_cutout(cache, resource, corner, extent, resolution, time_range, generations=None):
+    """
+    Cut out a region, sharing the read with identical concurrent requests
+
+    Args:
+        cache (spdb.spatialdb.SpatialDB): Interface to the spatial database
+        resource (spdb.project.BossResource): Resource for the channel being cut out
+        corner ((int, int, int)): (x, y, z) corner of the region
+        extent ((int, int, int)): (x, y, z) size of the region
+        resolution (int): Resolution of the cutout
+        time_range (list(int)): [start, stop) time samples of the cutout
+        generations ((str, list(int))): Write generations of the region from versioning.get_generations(), if the
+            caller has already read them
+
+    Returns:
+        (spdb.spatialdb.Cube): The cutout. Its data is read-only.
+    """
+    if generations is None:
+        generations = get_generations(resource, resolution,
+                                      get_cuboid_fields(corner, extent, resolution, time_range))
+    key = make_etag(resource, resolution, corner, extent, time_range, ["read"], *generations).strip('"')
+
+    def cutout():
+        return cached_cutout(cache, resource, corner, extent, resolution, time_range, generations)
+
+    def read():
+        if settings.SINGLE_FLIGHT_BACKEND == 'redis':
+            cube = _redis_read(key, resource, extent, time_range, cutout)
+        else:
+            cube = cutout()
+        cube.data.setflags(write=False)
+        return cube
+
+    cube, _ = _flight.do(key, read)
+    return copy.copy(cube)
+
+
+def _redis_read(key, resource, extent, time_range, read):
+    """
+    Make a read, or wait for another process making the same read to publish its result
+
+    If the other process doesn't publish a result within settings.SINGLE_FLIGHT_WAIT seconds, the read is made
+    without it. Reads too large to publish are made straight away, so identical ones run in parallel instead of
+    waiting on each other.
+
+    Args:
+        key (str): Identifies the read
+        resource (spdb.project.BossResource): Resource for the channel being cut out
+        extent ((int, int, int)): (x, y, z) size of the region
+        time_range (list(int)): [start, stop) time samples of the cutout
+        read (callable): Function that makes the read and returns a Cube
+
+    Returns:
+        (spdb.spatialdb.Cube)
+    """
+    num_bytes = int(np.prod(extent)) * (time_range[1] - time_range[0]) * \
+        np.dtype(resource.get_numpy_data_type()).itemsize
+    if num_bytes > settings.SINGLE_FLIGHT_MAX_SHARED_SIZE:
+        return read()
+
+    client = get_client()
+    lock = client.lock(LOCK_KEY.format(key), timeout=settings.SINGLE_FLIGHT_WAIT)
+    if lock.acquire(blocking=False):
+        return _lead(client, lock, key, read)
+
+    # Count this process as waiting, so the process making the read publishes its result
+    wait_ms = int(settings.SINGLE_FLIGHT_WAIT * 1000)
+    pipe = client.pipeline(transaction=False)
+    pipe.incr(WAITERS_KEY.format(key))
+    pipe.pexpire(WAITERS_KEY.format(key), wait_ms)
+    pipe.execute()
+
+    deadline = time.time() + settings.SINGLE_FLIGHT_WAIT
+    while True:
+        cached = client.get(RESULT_KEY.format(key))
+        if cached is not None:
+            _record('shared_remote')
+            cube = Cube.create_cube(resource, list(extent), time_range)
+            cube.data = decode_result(cached)
+            return cube
+
+        # The read finished without publishing a result, because it failed or finished before this process counted
+        # itself as waiting
+        if lock.acquire(blocking=False):
+            return _lead(client, lock, key, read)
+
+        if time.time() > deadline:
+            _record('timeouts')
+            return read()
+        time.sleep(POLL_INTERVAL)
+
+
+def _lead(client, lock, key, read):
+    """
+    Make a read while holding its lock, and publish the result if another process is waiting for it
+
+    Args:
+        client (redis.StrictRedis): Cache-state redis client
+        lock (redis.lock.Lock): The acquired lock of the read
+        key (str): Identifies the read
+        read (callable): Function that makes the read and returns a Cube
+
+    Returns:
+        (spdb.spatialdb.Cube)
+    """
+    try:
+        cube = read()
+        if int(client.get(WAITERS_KEY.format(key)) or 0) > 0:
+            client.set(RESULT_KEY.format(key), encode_result(cube.data),
+                       px=int(settings.SINGLE_FLIGHT_RESULT_TTL * 1000))
+            _flight.count('published')
+    finally:
+        # Release checks the lock is still ours in one step, so a lock another process took after ours expired is
+        # left alone
+        try:
+            lock.release()
+        except LockError:
+            pass
+    return cube
+
+
+def _record(stat):
+    """
+    Count a read that was shared from, or timed out waiting on, another process, here and in redis
+    """
+    _flight.count(stat)
+    get_client().hincrby(STATS_KEY, stat, 1)
+
+
+def encode_result(data):
+    """
+    Serialize a cutout to share it through redis
+
+    Args:
+        data (numpy.ndarray): Cutout data
+
+    Returns:
+        (bytes): JSON header with the dtype and shape, a newline, then the blosc compressed data
+    """
+    data = np.ascontiguousarray(data)
+    header = json.dumps([data.dtype.str, data.shape]).encode()
+    return header + b'\n' + blosc.compress(data, typesize=data.dtype.itemsize, cname='lz4', clevel=1)
+
+
+def decode_result(data_bytes):
+    """
+    Deserialize a cutout shared through redis
+
+    Args:
+        data_bytes (bytes): Output of encode_result()
+
+    Returns:
+        (numpy.ndarray): Cutout data
+    """
+    header, payload = data_bytes.split(b'\n', 1)
+    dtype, shape = json.loads(header.decode())
+    return np.frombuffer(blosc.decompress(payload), dtype=np.dtype(dtype)).reshape(shape)
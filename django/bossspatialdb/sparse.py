@@ -0,0 +1,430 @@
+# Copyright 2016 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+# Sparse encodings for annotation cutouts
+#
+# Annotation volumes are mostly zero or long runs of the same id, so they can be sent much more compactly than a
+# dense matrix:
+#
+#   RLE:  run lengths and run values of the C-ordered data
+#   COO:  t/z/y/x coordinates and ids of every non-zero voxel
+#   Compressed segmentation: the neuroglancer compressed_segmentation format. Each 8x8x8 block stores a table of the
+#         ids it contains and a bit-packed index into that table for every voxel.
+#
+# RLE and COO start with SPARSE_HEADER and are followed by blosc compressed arrays, each prefixed with its compressed
+# size as a little-endian uint64. Compressed segmentation starts with CSEG_HEADER and is followed by the
+# neuroglancer encoding, with time samples as channels.
+#
+#   SPARSE_HEADER: magic (4s), version (B), numpy dtype string (8s), shape t/z/y/x (4Q), count (Q)
+#   CSEG_HEADER:   magic (4s), version (B), numpy dtype string (8s), shape t/z/y/x (4Q), block size x/y/z (3I)
+import struct
+
+import numpy as np
+
+from bosscore.error import BossError, ErrorCodes
+
+from .compression import BloscCodec, get_blosc_nbytes
+
+SPARSE_VERSION = 1
+RLE_MAGIC = b'BRLE'
+COO_MAGIC = b'BCOO'
+CSEG_MAGIC = b'BCSG'
+SPARSE_HEADER = struct.Struct('<4sB8s4QQ')
+CSEG_HEADER = struct.Struct('<4sB8s4Q3I')
+SECTION_HEADER = struct.Struct('<Q')
+
+# Runs are stored as uint32 lengths. Longer runs are split.
+MAX_RUN_LENGTH = 2 ** 32 - 1
+
+# Block size and the number of bits an index into a block's table can be encoded with
+CSEG_BLOCK_SIZE = (8, 8, 8)
+CSEG_BITS = (0, 1, 2, 4, 8, 16, 32)
+
+# Offsets in the compressed segmentation block headers are 24 bits
+CSEG_MAX_OFFSET = 2 ** 24 - 1
+
+# Datatypes the compressed segmentation encoding supports
+CSEG_DATATYPES = ('uint32', 'uint64')
+
+
+def _pack_header(header, magic, data, *extra):
+    return header.pack(magic, SPARSE_VERSION, data.dtype.str.encode(), *data.shape, *extra)
+
+
+def _unpack_header(header, magic, data_bytes, expected_dtype=None, expected_shape=None):
+    """ Method to validate and unpack the header of an encoded buffer
+
+    The dtype and shape are checked against the expected values before any data is decoded, so a small body can't
+    cause a large allocation.
+
+    Returns:
+        (numpy.dtype, tuple(int), tuple): The dtype, 4D shape and any remaining header fields
+    """
+    if len(data_bytes) < header.size:
+        raise BossError("Failed to decode data. The data is truncated.", ErrorCodes.DESERIALIZATION_ERROR)
+    fields = header.unpack_from(data_bytes)
+    if fields[0] != magic or fields[1] != SPARSE_VERSION:
+        raise BossError("Failed to decode data. Unsupported encoding.", ErrorCodes.DESERIALIZATION_ERROR)
+    try:
+        dtype = np.dtype(fields[2].rstrip(b'\x00').decode())
+    except (TypeError, UnicodeDecodeError):
+        raise BossError("Failed to decode data. Invalid datatype.", ErrorCodes.DESERIALIZATION_ERROR)
+    shape = tuple(fields[3:7])
+
+    if expected_dtype is not None and dtype != expected_dtype:
+        raise BossError("Datatype does not match channel", ErrorCodes.DATATYPE_DOES_NOT_MATCH)
+    if expected_shape is not None and shape != tuple(expected_shape):
+        raise BossError("Data dimensions in URL do not match POSTed data.", ErrorCodes.DATA_DIMENSION_MISMATCH)
+    return dtype, shape, tuple(fields[7:])
+
+
+def _pack_section(array, codec):
+    payload = codec.compress(np.ascontiguousarray(array))
+    return SECTION_HEADER.pack(len(payload)) + payload
+
+
+def _unpack_section(data_bytes, offset, dtype, count, codec):
+    """ Method to decompress one array out of an encoded buffer
+
+    Returns:
+        (numpy.ndarray, int): The array and the offset of the next section
+    """
+    if offset + SECTION_HEADER.size > len(data_bytes):
+        raise BossError("Failed to decode data. The data is truncated.", ErrorCodes.DESERIALIZATION_ERROR)
+    nbytes = SECTION_HEADER.unpack_from(data_bytes, offset)[0]
+    offset += SECTION_HEADER.size
+    if offset + nbytes > len(data_bytes):
+        raise BossError("Failed to decode data. The data is truncated.", ErrorCodes.DESERIALIZATION_ERROR)
+
+    output = np.empty(count, dtype=dtype)
+    if count:
+        payload = bytes(data_bytes[offset:offset + nbytes])
+        if get_blosc_nbytes(payload) != output.nbytes:
+            raise BossError("Failed to decode data. Section size does not match the header.",
+                            ErrorCodes.DESERIALIZATION_ERROR)
+        codec.decompress_into(payload, output)
+    return output, offset + nbytes
+
+
+def encode_rle(data, codec=None):
+    """ Method to run-length encode a matrix
+
+    Args:
+        data (numpy.ndarray): 4D (t, z, y, x) matrix
+        codec (bossspatialdb.compression.BloscCodec): Codec used to compress the runs
+
+    Returns:
+        (bytes): The encoded data
+    """
+    codec = codec or BloscCodec.from_media_type(None, data.dtype.name)
+    flat = np.ascontiguousarray(data).reshape(-1)
+
+    if flat.size:
+        starts = np.concatenate(([0], np.flatnonzero(flat[1:] != flat[:-1]) + 1))
+        lengths = np.diff(np.append(starts, flat.size))
+        values = flat[starts]
+
+        # Split runs that don't fit in a uint32
+        if lengths.max() > MAX_RUN_LENGTH:
+            pieces = -(-lengths // MAX_RUN_LENGTH)
+            values = np.repeat(values, pieces)
+            split = np.repeat(lengths, pieces)
+            first = np.cumsum(pieces) - pieces
+            index = np.arange(split.size) - np.repeat(first, pieces)
+            lengths = np.minimum(split - index * MAX_RUN_LENGTH, MAX_RUN_LENGTH)
+    else:
+        lengths = np.zeros(0, dtype=np.uint32)
+        values = flat
+
+    return (_pack_header(SPARSE_HEADER, RLE_MAGIC, data, values.size) +
+            _pack_section(lengths.astype(np.uint32), codec) +
+            _pack_section(values, codec))
+
+
+def decode_rle(data_bytes, codec=None, expected_dtype=None, expected_shape=None):
+    """ Method to decode run-length encoded data
+
+    Args:
+        data_bytes (bytes): The encoded data
+        codec (bossspatialdb.compression.BloscCodec): Codec used to decompress the runs
+        expected_dtype (numpy.dtype): If provided, the datatype the data must have
+        expected_shape (tuple(int)): If provided, the 4D shape the data must have
+
+    Returns:
+        (numpy.ndarray): 4D (t, z, y, x) matrix
+
+    Raises:
+        BossError: If the data is invalid
+    """
+    codec = codec or BloscCodec()
+    dtype, shape, (num_runs,) = _unpack_header(SPARSE_HEADER, RLE_MAGIC, data_bytes, expected_dtype,
+                                               expected_shape)
+    if num_runs > np.prod(shape):
+        raise BossError("Failed to decode data. More runs than the shape holds.",
+                        ErrorCodes.DATA_DIMENSION_MISMATCH)
+    lengths, offset = _unpack_section(data_bytes, SPARSE_HEADER.size, np.uint32, num_runs, codec)
+    values, _ = _unpack_section(data_bytes, offset, dtype, num_runs, codec)
+
+    if int(lengths.sum(dtype=np.uint64)) != int(np.prod(shape)):
+        raise BossError("Failed to decode data. Run lengths do not match the shape.",
+                        ErrorCodes.DATA_DIMENSION_MISMATCH)
+    return np.repeat(values, lengths).reshape(shape)
+
+
+def encode_coo(data, codec=None):
+    """ Method to encode the non-zero voxels of a matrix as coordinates and ids
+
+    Args:
+        data (numpy.ndarray): 4D (t, z, y, x) matrix
+        codec (bossspatialdb.compression.BloscCodec): Codec used to compress the coordinates and ids
+
+    Returns:
+        (bytes): The encoded data
+    """
+    codec = codec or BloscCodec.from_media_type(None, data.dtype.name)
+    flat = np.ascontiguousarray(data).reshape(-1)
+    index = np.flatnonzero(flat)
+
+    # Coordinates are stored one axis at a time, which compresses better than interleaved tuples
+    coords = np.array(np.unravel_index(index, data.shape), dtype=np.uint32).reshape(4, -1)
+    return (_pack_header(SPARSE_HEADER, COO_MAGIC, data, index.size) +
+            _pack_section(coords, codec) +
+            _pack_section(flat[index], codec))
+
+
+def decode_coo(data_bytes, codec=None, expected_dtype=None, expected_shape=None):
+    """ Method to decode coordinate encoded data
+
+    Args:
+        data_bytes (bytes): The encoded data
+        codec (bossspatialdb.compression.BloscCodec): Codec used to decompress the coordinates and ids
+        expected_dtype (numpy.dtype): If provided, the datatype the data must have
+        expected_shape (tuple(int)): If provided, the 4D shape the data must have
+
+    Returns:
+        (numpy.ndarray): 4D (t, z, y, x) matrix
+
+    Raises:
+        BossError: If the data is invalid
+    """
+    codec = codec or BloscCodec()
+    dtype, shape, (count,) = _unpack_header(SPARSE_HEADER, COO_MAGIC, data_bytes, expected_dtype,
+                                            expected_shape)
+    if count > np.prod(shape):
+        raise BossError("Failed to decode data. More voxels than the shape holds.",
+                        ErrorCodes.DATA_DIMENSION_MISMATCH)
+    coords, offset = _unpack_section(data_bytes, SPARSE_HEADER.size, np.uint32, 4 * count, codec)
+    values, _ = _unpack_section(data_bytes, offset, dtype, count, codec)
+
+    coords = coords.reshape(4, count)
+    if count and np.any(coords.max(axis=1) >= np.array(shape)):
+        raise BossError("Failed to decode data. Coordinates are outside the shape.",
+                        ErrorCodes.DATA_DIMENSION_MISMATCH)
+
+    output = np.zeros(shape, dtype=dtype)
+    output[tuple(coords)] = values
+    return output
+
+
+def _get_num_bits(num_values):
+    """ Method to get the number of bits needed to index each of a set of block tables
+
+    Args:
+        num_values (numpy.ndarray): Number of unique values in each block
+
+    Returns:
+        (numpy.ndarray): Bits per index for each block, one of CSEG_BITS
+    """
+    bits = np.full(num_values.shape, CSEG_BITS[-1], dtype=np.uint32)
+    for num_bits in reversed(CSEG_BITS[:-1]):
+        bits[num_values <= 2 ** num_bits] = num_bits
+    return bits
+
+
+def _encode_channel(volume, block_size):
+    """ Method to encode a single 3D (z, y, x) volume in the compressed segmentation format
+
+    Args:
+        volume (numpy.ndarray): 3D matrix of uint32 or uint64
+        block_size ((int, int, int)): (x, y, z) block size
+
+    Returns:
+        (numpy.ndarray): The encoding as uint32 words
+    """
+    bx, by, bz = block_size
+    z, y, x = volume.shape
+    gz, gy, gx = -(-z // bz), -(-y // by), -(-x // bx)
+    block_voxels = bx * by * bz
+
+    # Pad partial blocks by repeating the edge so padding never adds a value to a block's table, and group each block's
+    # voxels in x, y, z order
+    padded = np.pad(volume, ((0, gz * bz - z), (0, gy * by - y), (0, gx * bx - x)), mode='edge')
+    blocks = padded.reshape(gz, bz, gy, by, gx, bx).transpose(0, 2, 4, 1, 3, 5).reshape(-1, block_voxels)
+    num_blocks = blocks.shape[0]
+
+    # Rank each voxel within its block's sorted table of unique values
+    order = np.argsort(blocks, axis=1, kind='mergesort')
+    rows = np.arange(num_blocks)[:, np.newaxis]
+    ordered = blocks[rows, order]
+    is_new = np.ones(ordered.shape, dtype=bool)
+    is_new[:, 1:] = ordered[:, 1:] != ordered[:, :-1]
+    ranks = np.empty(blocks.shape, dtype=np.uint32)
+    ranks[rows, order] = np.cumsum(is_new, axis=1) - 1
+
+    num_values = is_new.sum(axis=1)
+    bits = _get_num_bits(num_values)
+    words_per_value = volume.dtype.itemsize // 4
+
+    # Layout is block headers, then every table, then every block's packed indices
+    table_words = num_values.astype(np.int64) * words_per_value
+    value_words = bits.astype(np.int64) * block_voxels // 32
+    table_offsets = 2 * num_blocks + np.cumsum(table_words) - table_words
+    values_start = 2 * num_blocks + int(table_words.sum())
+    value_offsets = values_start + np.cumsum(value_words) - value_words
+    if num_blocks and max(table_offsets[-1], value_offsets[-1]) > CSEG_MAX_OFFSET:
+        raise BossError("Cutout is too large for the compressed segmentation encoding. Reduce cutout dimensions.",
+                        ErrorCodes.REQUEST_TOO_LARGE)
+
+    output = np.zeros(values_start + int(value_words.sum()), dtype=np.uint32)
+    headers = output[:2 * num_blocks].reshape(-1, 2)
+    headers[:, 0] = table_offsets | (bits.astype(np.int64) << 24)
+    headers[:, 1] = value_offsets
+
+    # Tables are the unique values of each block, already in block order
+    tables = np.ascontiguousarray(ordered[is_new]).view(np.uint32)
+    output[2 * num_blocks:values_start] = tables
+
+    for num_bits in CSEG_BITS[1:]:
+        selected = np.flatnonzero(bits == num_bits)
+        if not selected.size:
+            continue
+        per_word = 32 // num_bits
+        shifts = (np.arange(per_word, dtype=np.uint32) * num_bits)
+        packed = np.bitwise_or.reduce(ranks[selected].reshape(selected.size, -1, per_word) << shifts, axis=2)
+        positions = value_offsets[selected][:, np.newaxis] + np.arange(packed.shape[1])
+        output[positions] = packed
+
+    return output
+
+
+def _decode_channel(words, shape, dtype, block_size):
+    """ Method to decode a single 3D (z, y, x) volume from the compressed segmentation format
+
+    Args:
+        words (numpy.ndarray): The channel's encoding as uint32 words
+        shape ((int, int, int)): (z, y, x) shape of the volume
+        dtype (numpy.dtype): uint32 or uint64
+        block_size ((int, int, int)): (x, y, z) block size
+
+    Returns:
+        (numpy.ndarray): 3D matrix
+    """
+    bx, by, bz = block_size
+    z, y, x = shape
+    gz, gy, gx = -(-z // bz), -(-y // by), -(-x // bx)
+    block_voxels = bx * by * bz
+    num_blocks = gz * gy * gx
+    words_per_value = dtype.itemsize // 4
+
+    if words.size < 2 * num_blocks:
+        raise BossError("Failed to decode data. The data is truncated.", ErrorCodes.DESERIALIZATION_ERROR)
+    headers = words[:2 * num_blocks].reshape(-1, 2)
+    table_offsets = (headers[:, 0] & CSEG_MAX_OFFSET).astype(np.int64)
+    bits = headers[:, 0] >> 24
+    value_offsets = headers[:, 1].astype(np.int64)
+
+    ranks = np.zeros((num_blocks, block_voxels), dtype=np.int64)
+    for num_bits in np.unique(bits):
+        if num_bits == 0:
+            continue
+        if num_bits not in CSEG_BITS:
+            raise BossError("Failed to decode data. Invalid block encoding.", ErrorCodes.DESERIALIZATION_ERROR)
+        selected = np.flatnonzero(bits == num_bits)
+        per_word = 32 // num_bits
+        positions = value_offsets[selected][:, np.newaxis] + np.arange(block_voxels // per_word)
+        if positions.max() >= words.size:
+            raise BossError("Failed to decode data. The data is truncated.", ErrorCodes.DESERIALIZATION_ERROR)
+        shifts = np.arange(per_word, dtype=np.uint32) * num_bits
+        mask = np.uint32(2 ** int(num_bits) - 1)
+        unpacked = (words[positions][:, :, np.newaxis] >> shifts) & mask
+        ranks[selected] = unpacked.reshape(selected.size, block_voxels)
+
+    positions = table_offsets[:, np.newaxis] + ranks * words_per_value
+    if positions.size and positions.max() + words_per_value > words.size:
+        raise BossError("Failed to decode data. The data is truncated.", ErrorCodes.DESERIALIZATION_ERROR)
+    values = words[positions].astype(dtype)
+    if words_per_value == 2:
+        values |= words[positions + 1].astype(dtype) << np.uint64(32)
+
+    volume = values.reshape(gz, gy, gx, bz, by, bx).transpose(0, 3, 1, 4, 2, 5).reshape(gz * bz, gy * by, gx * bx)
+    return volume[:z, :y, :x]
+
+
+def encode_compressed_segmentation(data, block_size=CSEG_BLOCK_SIZE):
+    """ Method to encode a matrix in the neuroglancer compressed segmentation format
+
+    Args:
+        data (numpy.ndarray): 4D (t, z, y, x) matrix of uint32 or uint64
+        block_size ((int, int, int)): (x, y, z) block size. The number of voxels in a block must be a multiple of 32.
+
+    Returns:
+        (bytes): The encoded data
+
+    Raises:
+        BossError: If the datatype isn't supported or the cutout is too large to encode
+    """
+    if data.dtype.name not in CSEG_DATATYPES:
+        raise BossError("The compressed segmentation encoding only supports {} data".format(
+            " and ".join(CSEG_DATATYPES)), ErrorCodes.DATATYPE_NOT_SUPPORTED)
+
+    channels = [_encode_channel(volume, block_size) for volume in data]
+
+    # Channel offsets are in 32-bit words from the start of the encoding
+    offsets = len(channels) + np.cumsum([0] + [c.size for c in channels[:-1]])
+    return (_pack_header(CSEG_HEADER, CSEG_MAGIC, data, *block_size) + offsets.astype('<u4').tobytes() +
+            b''.join(c.astype('<u4').tobytes() for c in channels))
+
+
+def decode_compressed_segmentation(data_bytes, expected_dtype=None, expected_shape=None):
+    """ Method to decode data in the neuroglancer compressed segmentation format
+
+    Args:
+        data_bytes (bytes): The encoded data
+        expected_dtype (numpy.dtype): If provided, the datatype the data must have
+        expected_shape (tuple(int)): If provided, the 4D shape the data must have
+
+    Returns:
+        (numpy.ndarray): 4D (t, z, y, x) matrix
+
+    Raises:
+        BossError: If the data is invalid
+    """
+    dtype, shape, block_size = _unpack_header(CSEG_HEADER, CSEG_MAGIC, data_bytes, expected_dtype, expected_shape)
+    if dtype.name not in CSEG_DATATYPES:
+        raise BossError("The compressed segmentation encoding only supports {} data".format(
+            " and ".join(CSEG_DATATYPES)), ErrorCodes.DATATYPE_NOT_SUPPORTED)
+    if (len(data_bytes) - CSEG_HEADER.size) % 4 or (block_size[0] * block_size[1] * block_size[2]) % 32:
+        raise BossError("Failed to decode data. Invalid compressed segmentation data.",
+                        ErrorCodes.DESERIALIZATION_ERROR)
+
+    words = np.frombuffer(data_bytes, dtype='<u4', offset=CSEG_HEADER.size)
+    if words.size < shape[0]:
+        raise BossError("Failed to decode data. The data is truncated.", ErrorCodes.DESERIALIZATION_ERROR)
+    offsets = list(words[:shape[0]].astype(np.int64)) + [words.size]
+
+    output = np.empty(shape, dtype=dtype)
+    for t in range(shape[0]):
+        output[t] = _decode_channel(words[offsets[t]:offsets[t + 1]], shape[1:], dtype, block_size)
+    return output
@@ -0,0 +1,261 @@
+# Copyright 2016 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Statistics and histograms of a region of a channel
+#
+# The region is split into pieces along cuboid boundaries. A partial aggregate is computed for each piece and time
+# sample, which is an exact histogram with one bin per value. Partials are cached in the cache-state redis database
+# under the piece and the write generation of its cuboid, so a write only invalidates the partials of the cuboids it
+# touched. The partials of a region are added together and the statistics computed from the result, so repeated and
+# overlapping requests only compute the pieces that haven't been seen before.
+from concurrent.futures import ThreadPoolExecutor
+import itertools
+import math
+import threading
+import zlib
+
+import numpy as np
+from django.conf import settings
+
+from bosscore.error import BossError, ErrorCodes
+
+from .blocks import CutoutBlock, get_cuboid_size, split_axis
+from .pool import get_spatialdb
+from .versioning import get_client, get_generation_key, get_generations
+
+# Cache key of a partial: channel and resolution, epoch, time sample, piece corner and extent, generation
+PARTIAL_KEY = "STATISTICS&{}&{}&{}&{}&{}&{}"
+
+# Channel datatypes statistics can be computed for, since every possible value gets its own histogram bin
+STATISTICS_DATATYPES = ('uint8', 'uint16')
+
+DEFAULT_PERCENTILES = (1, 5, 50, 95, 99)
+DEFAULT_HISTOGRAM_BINS = 256
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """
+    Get this process's thread pool for computing partial aggregates
+
+    Returns:
+        (concurrent.futures.ThreadPoolExecutor)
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=settings.STATISTICS_WORKERS)
+        return _executor
+
+
+def get_statistics_args(params):
+    """
+    Read the histogram and percentile options from a request's query parameters
+
+    Args:
+        params (dict): Query parameters. `bins` is the number of histogram bins and `percentiles` a comma separated
+            list of percentiles from 0 to 100.
+
+    Returns:
+        (int, list(float)): Number of bins and the percentiles
+
+    Raises:
+        BossError: If an option is invalid
+    """
+    try:
+        bins = int(params.get("bins", DEFAULT_HISTOGRAM_BINS))
+        if "percentiles" in params:
+            percentiles = [float(p) for p in params["percentiles"].split(",")]
+        else:
+            percentiles = list(DEFAULT_PERCENTILES)
+    except ValueError:
+        raise BossError("bins must be an integer and percentiles a comma separated list of numbers",
+                        ErrorCodes.INVALID_ARGUMENT)
+    if not 1 <= bins <= 2 ** 16:
+        raise BossError("bins must be between 1 and {}".format(2 ** 16), ErrorCodes.INVALID_ARGUMENT)
+    if not all(0 <= p <= 100 for p in percentiles):
+        raise BossError("percentiles must be between 0 and 100", ErrorCodes.INVALID_ARGUMENT)
+    return bins, percentiles
+
+
+def encode_histogram(histogram):
+    """
+    Serialize a histogram for caching. Only the non-empty bins are kept.
+
+    Args:
+        histogram (numpy.ndarray): Count of each value
+
+    Returns:
+        (bytes)
+    """
+    values = np.flatnonzero(histogram).astype('<u4')
+    counts = histogram[values].astype('<u8')
+    return zlib.compress(values.tobytes() + counts.tobytes(), 1)
+
+
+def decode_histogram(data_bytes, num_values):
+    """
+    Deserialize a cached histogram
+
+    Args:
+        data_bytes (bytes): Output of encode_histogram()
+        num_values (int): Number of possible values
+
+    Returns:
+        (numpy.ndarray): Count of each value
+    """
+    data_bytes = zlib.decompress(data_bytes)
+    num_bins = len(data_bytes) // 12
+    histogram = np.zeros(num_values, dtype=np.int64)
+    histogram[np.frombuffer(data_bytes, dtype='<u4', count=num_bins)] = \
+        np.frombuffer(data_bytes, dtype='<u8', count=num_bins, offset=4 * num_bins)
+    return histogram
+
+
+def get_pieces(corner, extent, resolution):
+    """
+    Split a region along cuboid boundaries
+
+    Args:
+        corner ((int, int, int)): (x, y, z) corner of the region
+        extent ((int, int, int)): (x, y, z) size of the region
+        resolution (int): Resolution level
+
+    Returns:
+        (list((CutoutBlock, (int, int, int)))): Each piece of the region and the (x, y, z) index of its cuboid
+    """
+    cuboid_size = get_cuboid_size(resolution)
+    axes = [split_axis(corner[dim], corner[dim] + extent[dim], cuboid_size[dim]) for dim in range(3)]
+    pieces = []
+    for (z0, z1), (y0, y1), (x0, x1) in itertools.product(axes[2], axes[1], axes[0]):
+        pieces.append((CutoutBlock((x0, y0, z0), (x1 - x0, y1 - y0, z1 - z0)),
+                       (x0 // cuboid_size[0], y0 // cuboid_size[1], z0 // cuboid_size[2])))
+    return pieces
+
+
+def compute_histograms(resource, resolution, piece, time_samples, num_values):
+    """
+    Cut out a piece of a region and compute the histogram of each time sample
+
+    Args:
+        resource (spdb.project.BossResource): Resource for the channel
+        resolution (int): Resolution level
+        piece (CutoutBlock): Region to cut out, within a single cuboid
+        time_samples (list(int)): Sorted time samples to compute histograms for
+        num_values (int): Number of possible values
+
+    Returns:
+        (list(numpy.ndarray)): Histogram of each time sample
+    """
+    time_range = [time_samples[0], time_samples[-1] + 1]
+    with get_spatialdb() as cache:
+        data = cache.cutout(resource, piece.corner, piece.extent, resolution, time_range).data
+    return [np.bincount(data[t - time_range[0]].reshape(-1), minlength=num_values).astype(np.int64)
+            for t in time_samples]
+
+
+def get_region_histogram(resource, resolution, corner, extent, time_range):
+    """
+    Compute the exact histogram of a region, using cached partial histograms where they are current
+
+    Args:
+        resource (spdb.project.BossResource): Resource for the channel
+        resolution (int): Resolution level
+        corner ((int, int, int)): (x, y, z) corner of the region
+        extent ((int, int, int)): (x, y, z) size of the region
+        time_range (list(int)): [start, stop) time samples of the region
+
+    Returns:
+        (numpy.ndarray, int, int): Count of each value, the number of partials and the number read from the cache
+    """
+    num_values = 2 ** (np.dtype(resource.get_numpy_data_type()).itemsize * 8)
+    items = list(itertools.product(range(time_range[0], time_range[1]), get_pieces(corner, extent, resolution)))
+
+    # Read the generations before any data, so a partial is never cached under a newer generation than its data
+    epoch, generations = get_generations(resource, resolution,
+                                         ["{}&{}&{}&{}".format(t, *index) for t, (_, index) in items])
+    lookup = get_generation_key(resource, resolution)
+    keys = [PARTIAL_KEY.format(lookup, epoch, t, "&".join(str(c) for c in piece.corner),
+                               "&".join(str(e) for e in piece.extent), generation)
+            for (t, (piece, _)), generation in zip(items, generations)]
+
+    client = get_client()
+    histogram = np.zeros(num_values, dtype=np.int64)
+    missing = {}
+    for (t, (piece, _)), key, cached in zip(items, keys, client.mget(keys)):
+        if cached is None:
+            missing.setdefault(piece, []).append((t, key))
+        else:
+            histogram += decode_histogram(cached, num_values)
+    num_cached = len(items) - sum(len(samples) for samples in missing.values())
+
+    # Compute the missing partials on the worker pool, with one cutout per piece for all of its time samples
+    executor = get_executor()
+    futures = [(samples, executor.submit(compute_histograms, resource, resolution, piece, [t for t, _ in samples],
+                                         num_values))
+               for piece, samples in missing.items()]
+    pipe = client.pipeline(transaction=False)
+    for samples, future in futures:
+        for (_, key), partial in zip(samples, future.result()):
+            histogram += partial
+            pipe.setex(key, settings.STATISTICS_CACHE_TTL, encode_histogram(partial))
+    pipe.execute()
+
+    return histogram, len(items), num_cached
+
+
+def summarize(histogram, bins, percentiles):
+    """
+    Compute summary statistics and a histogram with fewer bins from an exact histogram
+
+    Percentiles use the nearest rank method, so each one is a value that occurs in the region.
+
+    Args:
+        histogram (numpy.ndarray): Count of each value
+        bins (int): Number of bins. Reduced if there are fewer distinct values between the minimum and maximum.
+        percentiles (list(float)): Percentiles to compute, from 0 to 100
+
+    Returns:
+        (dict): JSON serializable statistics
+    """
+    values = np.flatnonzero(histogram)
+    counts = histogram[values]
+    count = int(counts.sum())
+    low, high = int(values[0]), int(values[-1]) + 1
+
+    mean = float(np.dot(values.astype(np.float64), counts) / count)
+    std = math.sqrt(float(np.dot((values - mean) ** 2, counts) / count))
+
+    cumulative = np.cumsum(counts)
+    ranks = [max(1, int(math.ceil(p / 100 * count))) for p in percentiles]
+    percentile_values = values[np.searchsorted(cumulative, ranks)]
+
+    # Equal width bins from the minimum to the maximum value
+    bins = min(bins, high - low)
+    binned = np.bincount((values - low) * bins // (high - low), weights=counts, minlength=bins)
+
+    return {
+        "count": count,
+        "min": low,
+        "max": high - 1,
+        "mean": mean,
+        "std": std,
+        "percentiles": {"{:g}".format(p): int(v) for p, v in zip(percentiles, percentile_values)},
+        "histogram": {
+            "bin_edges": np.linspace(low, high, bins + 1).tolist(),
+            "counts": binned.astype(np.int64).tolist()
+        }
+    }
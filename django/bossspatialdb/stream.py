@@ -0,0 +1,286 @@
+# Copyright 2016 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Methods to encode and decode the framed block stream used by streaming cutouts
+#
+# A stream is a single STREAM_HEADER followed by `num_blocks` frames. Each frame is a BLOCK_HEADER followed by
+# `nbytes` of blosc compressed, C-ordered data for that block. All integers are little-endian.
+#
+#   STREAM_HEADER: magic (4s), version (B), numpy dtype string (8s), shape t/z/y/x (4Q), num_blocks (Q)
+#   BLOCK_HEADER:  offset t/z/y/x into the full cutout (4Q), shape t/z/y/x (4Q), nbytes (Q)
+#
+# Because the number of blocks is sent up front, a client can detect a stream that was truncated by a server error
+# after the response headers were already sent.
+#
+# Batch cutouts use a similar framing, with one item per requested region. Items are sent in the order their data is
+# fetched, so the index of the region in the request is included with each item.
+#
+#   BATCH_HEADER: magic (4s), version (B), num_items (Q)
+#   ITEM_HEADER:  region index (Q), numpy dtype string (8s), shape t/z/y/x (4Q), nbytes (Q)
+from collections import namedtuple
+import struct
+
+import blosc
+import numpy as np
+
+from .compression import BloscCodec
+from .filtering import filter_cutout
+
+STREAM_MAGIC = b'BOSS'
+STREAM_VERSION = 1
+STREAM_HEADER = struct.Struct('<4sB8s4QQ')
+BLOCK_HEADER = struct.Struct('<4Q4QQ')
+
+BATCH_MAGIC = b'BOSB'
+BATCH_VERSION = 1
+BATCH_HEADER = struct.Struct('<4sBQ')
+ITEM_HEADER = struct.Struct('<Q8s4QQ')
+
+# A single cutout run for a batch request, and the requested regions (index, CutoutBlock) that are sliced out of it
+BatchFetch = namedtuple('BatchFetch', ['resource', 'resolution', 'time_range', 'filter_ids', 'codec', 'block',
+                                       'regions'])
+
+
+def encode_stream_header(dtype, shape, num_blocks):
+    """ Method to pack the header that starts a block stream
+
+    Args:
+        dtype (numpy.dtype): Datatype of the full cutout
+        shape ((int, int, int, int)): (t, z, y, x) shape of the full cutout
+        num_blocks (int): Number of blocks that will follow
+
+    Returns:
+        (bytes): The packed header
+    """
+    return STREAM_HEADER.pack(STREAM_MAGIC, STREAM_VERSION, np.dtype(dtype).str.encode(), *shape, num_blocks)
+
+
+def encode_block(data, offset, codec=None):
+    """ Method to compress a single block and pack it into a frame
+
+    Args:
+        data (numpy.ndarray): 4D (t, z, y, x) matrix of data for the block
+        offset ((int, int, int, int)): (t, z, y, x) offset of the block into the full cutout
+        codec (bossspatialdb.compression.BloscCodec): Codec to compress with. Defaults to the dtype's defaults.
+
+    Returns:
+        (bytes): The frame, header followed by the compressed payload
+    """
+    if not data.flags['C_CONTIGUOUS']:
+        data = np.ascontiguousarray(data, dtype=data.dtype)
+
+    if codec is None:
+        codec = BloscCodec.from_media_type(None, data.dtype.name)
+
+    payload = codec.compress(data)
+    return BLOCK_HEADER.pack(*offset, *data.shape, len(payload)) + payload
+
+
+def get_manifest(blocks, corner, extent, resolution):
+    """ Method to describe the layout of the blocks in a stream
+
+    Blocks are planned on a grid, so the layout is sent as the boundaries of the grid along each axis instead of a
+    list of every block. Block i covers the cell at (i % nx, (i // nx) % ny, i // (nx * ny)) where nx and ny are the
+    number of cells along x and y.
+
+    Args:
+        blocks (list(bossspatialdb.blocks.CutoutBlock)): Blocks in the order they will be streamed
+        corner ((int, int, int)): (x, y, z) corner of the full cutout
+        extent ((int, int, int)): (x, y, z) size of the full cutout
+        resolution (int): Resolution of the cutout
+
+    Returns:
+        (dict): JSON serializable manifest
+    """
+    boundaries = []
+    for dim in range(3):
+        edges = sorted(set(block.corner[dim] for block in blocks))
+        boundaries.append(edges + [corner[dim] + extent[dim]])
+
+    return {"version": STREAM_VERSION,
+            "resolution": resolution,
+            "corner": list(corner),
+            "extent": list(extent),
+            "num_blocks": len(blocks),
+            "order": "zyx",
+            "x": boundaries[0],
+            "y": boundaries[1],
+            "z": boundaries[2]}
+
+
+def cutout_stream(cache, resource, blocks, corner, extent, resolution, time_range, filter_ids=None, codec=None):
+    """ Generator that runs a cutout block by block and yields the framed stream
+
+    Only a single block is held in memory at a time, so memory use is bounded by the block size and not the
+    size of the full cutout.
+
+    Args:
+        cache (spdb.spatialdb.SpatialDB): Interface to the spatial database
+        resource (spdb.project.BossResource): Resource for the channel being cut out
+        blocks (list(bossspatialdb.blocks.CutoutBlock)): Blocks that tile the requested region
+        corner ((int, int, int)): (x, y, z) corner of the full cutout, used to compute block offsets
+        extent ((int, int, int)): (x, y, z) size of the full cutout
+        resolution (int): Resolution of the cutout
+        time_range (list(int)): [start, stop) time samples of the cutout
+        filter_ids (numpy.ndarray): Optional sorted ids to filter an annotation cutout on
+        codec (bossspatialdb.compression.BloscCodec): Codec used to compress each block
+
+    Yields:
+        (bytes): The stream header, then one frame per block
+
+    """
+    num_time_samples = time_range[1] - time_range[0]
+    yield encode_stream_header(resource.get_numpy_data_type(),
+                               (num_time_samples, extent[2], extent[1], extent[0]),
+                               len(blocks))
+
+    for block in blocks:
+        data = cache.cutout(resource, block.corner, block.extent, resolution, time_range)
+        offset = (0, block.corner[2] - corner[2], block.corner[1] - corner[1], block.corner[0] - corner[0])
+        yield encode_block(filter_cutout(data.data, filter_ids), offset, codec)
+
+
+def read_stream(stream):
+    """ Method to decode a block stream back into a single matrix
+
+    Args:
+        stream (file-like): Object with a read() method positioned at the start of the stream
+
+    Returns:
+        (numpy.ndarray): 4D (t, z, y, x) matrix of the full cutout
+
+    Raises:
+        ValueError: If the stream is malformed or truncated
+    """
+    header = stream.read(STREAM_HEADER.size)
+    if len(header) != STREAM_HEADER.size:
+        raise ValueError("Stream is truncated")
+    magic, version, dtype, t, z, y, x, num_blocks = STREAM_HEADER.unpack(header)
+    if magic != STREAM_MAGIC or version != STREAM_VERSION:
+        raise ValueError("Unsupported stream format")
+
+    dtype = np.dtype(dtype.rstrip(b'\x00').decode())
+    output = np.zeros((t, z, y, x), dtype=dtype)
+
+    for _ in range(num_blocks):
+        frame = stream.read(BLOCK_HEADER.size)
+        if len(frame) != BLOCK_HEADER.size:
+            raise ValueError("Stream is truncated")
+        frame = BLOCK_HEADER.unpack(frame)
+        offset, shape, nbytes = frame[0:4], frame[4:8], frame[8]
+        payload = stream.read(nbytes)
+        if len(payload) != nbytes:
+            raise ValueError("Stream is truncated")
+
+        block = np.frombuffer(blosc.decompress(payload), dtype=dtype).reshape(shape)
+        output[tuple(slice(o, o + s) for o, s in zip(offset, shape))] = block
+
+    return output
+
+
+def encode_batch_header(num_items):
+    """ Method to pack the header that starts a batch response
+
+    Args:
+        num_items (int): Number of items that will follow
+
+    Returns:
+        (bytes): The packed header
+    """
+    return BATCH_HEADER.pack(BATCH_MAGIC, BATCH_VERSION, num_items)
+
+
+def encode_batch_item(index, data, codec=None):
+    """ Method to compress the data for a single region of a batch and pack it into a frame
+
+    Args:
+        index (int): Index of the region in the batch request
+        data (numpy.ndarray): 4D (t, z, y, x) matrix of data for the region
+        codec (bossspatialdb.compression.BloscCodec): Codec to compress with. Defaults to the dtype's defaults.
+
+    Returns:
+        (bytes): The frame, header followed by the compressed payload
+    """
+    if not data.flags['C_CONTIGUOUS']:
+        data = np.ascontiguousarray(data, dtype=data.dtype)
+
+    if codec is None:
+        codec = BloscCodec.from_media_type(None, data.dtype.name)
+
+    payload = codec.compress(data)
+    return ITEM_HEADER.pack(index, data.dtype.str.encode(), *data.shape, len(payload)) + payload
+
+
+def cutout_batch_stream(cache, fetches, num_items):
+    """ Generator that runs the cutouts for a batch request and yields the framed response
+
+    Each fetch is cut out once and every region it contains is sliced out of the result, so regions that share
+    cuboids only read them from the cache a single time.
+
+    Args:
+        cache (spdb.spatialdb.SpatialDB): Interface to the spatial database
+        fetches (list(BatchFetch)): Cutouts to run
+        num_items (int): Total number of regions in the batch
+
+    Yields:
+        (bytes): The batch header, then one frame per region
+    """
+    yield encode_batch_header(num_items)
+
+    for fetch in fetches:
+        data = cache.cutout(fetch.resource, fetch.block.corner, fetch.block.extent, fetch.resolution,
+                            fetch.time_range)
+        data.data = filter_cutout(data.data, fetch.filter_ids)
+        for index, region in fetch.regions:
+            x0, y0, z0 = (c - b for c, b in zip(region.corner, fetch.block.corner))
+            x1, y1, z1 = (o + e for o, e in zip((x0, y0, z0), region.extent))
+            yield encode_batch_item(index, data.data[:, z0:z1, y0:y1, x0:x1], fetch.codec)
+
+
+def read_batch(stream):
+    """ Method to decode a batch response
+
+    Args:
+        stream (file-like): Object with a read() method positioned at the start of the response
+
+    Returns:
+        (list(numpy.ndarray)): 4D (t, z, y, x) matrix for each region, in the order they were requested
+
+    Raises:
+        ValueError: If the response is malformed or truncated
+    """
+    header = stream.read(BATCH_HEADER.size)
+    if len(header) != BATCH_HEADER.size:
+        raise ValueError("Stream is truncated")
+    magic, version, num_items = BATCH_HEADER.unpack(header)
+    if magic != BATCH_MAGIC or version != BATCH_VERSION:
+        raise ValueError("Unsupported stream format")
+
+    output = [None] * num_items
+    for _ in range(num_items):
+        frame = stream.read(ITEM_HEADER.size)
+        if len(frame) != ITEM_HEADER.size:
+            raise ValueError("Stream is truncated")
+        frame = ITEM_HEADER.unpack(frame)
+        index, dtype, shape, nbytes = frame[0], frame[1], frame[2:6], frame[6]
+        if index >= num_items:
+            raise ValueError("Invalid region index {}".format(index))
+        payload = stream.read(nbytes)
+        if len(payload) != nbytes:
+            raise ValueError("Stream is truncated")
+
+        dtype = np.dtype(dtype.rstrip(b'\x00').decode())
+        output[index] = np.frombuffer(blosc.decompress(payload), dtype=dtype).reshape(shape)
+
+    return output
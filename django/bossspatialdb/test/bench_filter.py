@@ -0,0 +1,107 @@
+# Copyright 2016 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Benchmark of filtering annotation cutouts on a list of ids
+#
+# Compares bossspatialdb.filtering against checking each voxel against every id, and against numpy's in1d. Not run as
+# part of the test suite. From the django directory:
+#
+#     python -m bossspatialdb.test.bench_filter
+import argparse
+import time
+
+import numpy as np
+
+from bossspatialdb.filtering import filter_cutout
+
+
+def make_labels(shape, label_size, seed=0):
+    """ Method to generate a synthetic label volume of boxes of random ids
+
+    Args:
+        shape (tuple(int)): 4D (t, z, y, x) shape, each a multiple of label_size
+        label_size (tuple(int)): (z, y, x) size of each box
+        seed (int): Random seed
+
+    Returns:
+        (numpy.ndarray): uint64 label volume
+    """
+    rng = np.random.RandomState(seed)
+    coarse = rng.randint(1, 2 ** 48, (shape[0],) + tuple(s // l for s, l in zip(shape[1:], label_size)))
+    labels = coarse.astype(np.uint64)
+    for axis, size in enumerate(label_size):
+        labels = np.repeat(labels, size, axis=axis + 1)
+    return labels
+
+
+def filter_per_id(data, ids):
+    """ Method to filter by comparing the data against each id in turn """
+    keep = np.zeros(data.shape, dtype=bool)
+    for value in ids:
+        keep |= data == value
+    data[~keep] = 0
+    return data
+
+
+def filter_in1d(data, ids):
+    """ Method to filter with numpy's set membership test """
+    data[~np.in1d(data, ids).reshape(data.shape)] = 0
+    return data
+
+
+def time_filter(method, data, ids, repeat):
+    best = None
+    for _ in range(repeat):
+        copy = data.copy()
+        start = time.perf_counter()
+        result = method(copy, ids)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark filtering annotation cutouts on a list of ids")
+    parser.add_argument("--shape", type=int, nargs=4, default=[1, 16, 1024, 1024], help="t z y x")
+    parser.add_argument("--label-size", type=int, nargs=3, default=[4, 16, 16], help="z y x size of each label")
+    parser.add_argument("--ids", type=int, nargs='+', default=[1, 10, 100, 10000, 100000])
+    parser.add_argument("--max-per-id", type=int, default=100, help="Largest id count to run the per-id method on")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    data = make_labels(tuple(args.shape), tuple(args.label_size))
+    labels = np.unique(data)
+    rng = np.random.RandomState(1)
+
+    print("{} voxels, {} labels".format(data.size, labels.size))
+    print("{:>8}{:>12}{:>12}{:>12}".format("ids", "filter s", "in1d s", "per id s"))
+    for num_ids in args.ids:
+        # Half the ids are in the cutout, the rest aren't
+        present = rng.choice(labels, min(num_ids // 2 + 1, labels.size), replace=False)
+        absent = rng.randint(2 ** 48, 2 ** 49, num_ids - present.size).astype(np.uint64)
+        ids = np.unique(np.concatenate((present, absent)))
+
+        filter_time, expected = time_filter(filter_cutout, data, ids, args.repeat)
+        in1d_time, result = time_filter(filter_in1d, data, ids, args.repeat)
+        np.testing.assert_array_equal(result, expected)
+        per_id = "-"
+        if num_ids <= args.max_per_id:
+            per_id_time, result = time_filter(filter_per_id, data, ids, args.repeat)
+            np.testing.assert_array_equal(result, expected)
+            per_id = "{:.3f}".format(per_id_time)
+        print("{:>8}{:>12.3f}{:>12.3f}{:>12}".format(ids.size, filter_time, in1d_time, per_id))
+
+
+if __name__ == '__main__':
+    main()
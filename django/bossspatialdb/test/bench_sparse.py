@@ -0,0 +1,119 @@
+# Copyright 2016 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Benchmark of the sparse annotation encodings against the blosc encoding used by the Cutout service
+#
+# Not run as part of the test suite. From the django directory:
+#
+#     python -m bossspatialdb.test.bench_sparse
+import argparse
+import time
+
+import numpy as np
+
+from bossspatialdb.compression import BloscCodec
+from bossspatialdb.sparse import encode_rle, decode_rle, encode_coo, decode_coo
+from bossspatialdb.sparse import encode_compressed_segmentation, decode_compressed_segmentation
+
+
+def make_labels(shape, num_labels, background=0.5, seed=0):
+    """ Method to generate a synthetic label volume
+
+    Labels are blobs grown from random seed points, with a fraction of the volume left as background.
+
+    Args:
+        shape (tuple(int)): 4D (t, z, y, x) shape
+        num_labels (int): Number of labels
+        background (float): Fraction of the volume that is background
+        seed (int): Random seed
+
+    Returns:
+        (numpy.ndarray): uint64 label volume
+    """
+    rng = np.random.RandomState(seed)
+    points = rng.rand(num_labels, 3) * np.array(shape[1:])
+    ids = rng.randint(1, 2 ** 48, num_labels).astype(np.uint64)
+
+    # Assign every voxel the id of its nearest seed point, one slice at a time to bound memory use
+    zz, yy, xx = np.meshgrid(np.arange(shape[1]), np.arange(shape[2]), np.arange(shape[3]), indexing='ij')
+    labels = np.empty(shape[1:], dtype=np.uint64)
+    for z in range(shape[1]):
+        voxels = np.stack((zz[z].ravel(), yy[z].ravel(), xx[z].ravel()), axis=1)
+        nearest = np.zeros(voxels.shape[0], dtype=np.int64)
+        best = np.full(voxels.shape[0], np.inf)
+        for index, point in enumerate(points):
+            dist = ((voxels - point) ** 2).sum(axis=1)
+            closer = dist < best
+            best[closer] = dist[closer]
+            nearest[closer] = index
+        labels[z] = ids[nearest].reshape(shape[2:])
+
+    # Blank out a band along x as background
+    labels[:, :, :int(shape[3] * background)] = 0
+    return np.broadcast_to(labels, shape).copy()
+
+
+def run(name, encode, decode, data, repeat):
+    """ Method to time an encoding
+
+    Returns:
+        (tuple): name, encoded size, encode MB/s, decode MB/s
+    """
+    start = time.perf_counter()
+    for _ in range(repeat):
+        encoded = encode(data)
+    encode_time = (time.perf_counter() - start) / repeat
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        decoded = decode(encoded)
+    decode_time = (time.perf_counter() - start) / repeat
+
+    np.testing.assert_array_equal(decoded.reshape(data.shape), data)
+    mb = data.nbytes / 2 ** 20
+    return name, len(encoded), mb / encode_time, mb / decode_time
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the sparse annotation encodings")
+    parser.add_argument("--shape", type=int, nargs=4, default=[1, 16, 512, 512], help="t z y x")
+    parser.add_argument("--labels", type=int, default=200, help="Number of labels")
+    parser.add_argument("--dtype", default="uint64", choices=["uint32", "uint64"])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    data = make_labels(tuple(args.shape), args.labels).astype(args.dtype)
+    codec = BloscCodec.from_media_type(None, args.dtype)
+    blosc_encode = codec.compress
+
+    def blosc_decode(data_bytes):
+        output = np.empty(data.shape, dtype=data.dtype)
+        codec.decompress_into(data_bytes, output)
+        return output
+
+    results = [run("blosc", blosc_encode, blosc_decode, data, args.repeat),
+               run("rle", lambda d: encode_rle(d, codec), lambda b: decode_rle(b, codec), data, args.repeat),
+               run("coo", lambda d: encode_coo(d, codec), lambda b: decode_coo(b, codec), data, args.repeat),
+               run("compressed-segmentation", encode_compressed_segmentation, decode_compressed_segmentation, data,
+                   args.repeat)]
+
+    print("{} {} voxels, {} MB uncompressed".format(args.dtype, data.size, data.nbytes / 2 ** 20))
+    print("{:<25}{:>12}{:>8}{:>14}{:>14}".format("encoding", "bytes", "ratio", "encode MB/s", "decode MB/s"))
+    for name, size, encode_rate, decode_rate in results:
+        print("{:<25}{:>12}{:>8.1f}{:>14.1f}{:>14.1f}".format(name, size, data.nbytes / size, encode_rate,
+                                                              decode_rate))
+
+
+if __name__ == '__main__':
+    main()
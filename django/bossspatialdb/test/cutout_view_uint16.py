@@ -20,6 +20,8 @@ from rest_framework.test import force_authenticate
 from rest_framework import status
 
 from bossspatialdb.views import Cutout
+from bossspatialdb.pool import clear_pools
+from bossspatialdb.cuboidcache import clear_cuboid_cache
 
 from bosscore.test.setup_db import SetupTestDB
 from bosscore.error import BossError
@@ -515,6 +517,117 @@ class CutoutInterfaceViewUint16TestMixin(object):
         # Test for data equality (what you put in is what you got back!)
         np.testing.assert_array_equal(data_mat, test_mat)
 
+    def test_channel_uint16_negotiated_codec_blosc(self):
+        """ Test uint16 data, downloaded with the blosc codec, shuffle and threads set by media type parameters"""
+
+        test_mat = np.random.randint(1, 2**16-1, (16, 128, 128))
+        test_mat = test_mat.astype(np.uint16)
+        h = test_mat.tobytes()
+        bb = blosc.compress(h, typesize=16)
+
+        # Create request
+        factory = APIRequestFactory()
+        request = factory.post('/' + version + '/cutout/col1/exp1/channel2/0/0:128/0:128/0:16/', bb,
+                               content_type='application/blosc; nthreads=2')
+        # log in user
+        force_authenticate(request, user=self.user)
+
+        # Make request
+        response = Cutout.as_view()(request, collection='col1', experiment='exp1', channel='channel2',
+                                    resolution='0', x_range='0:128', y_range='0:128', z_range='0:16', t_range=None)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        # Create Request to get data you posted
+        request = factory.get('/' + version + '/cutout/col1/exp1/channel2/0/0:128/0:128/0:16/',
+                              HTTP_ACCEPT='application/blosc; cname=zstd; clevel=3; shuffle=bit; nthreads=2')
+
+        # log in user
+        force_authenticate(request, user=self.user)
+
+        # Make request
+        response = Cutout.as_view()(request, collection='col1', experiment='exp1', channel='channel2',
+                                    resolution='0', x_range='0:128', y_range='0:128', z_range='0:16', t_range=None).render()
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        # Decompress
+        raw_data = blosc.decompress(response.content)
+        data_mat = np.fromstring(raw_data, dtype=np.uint16)
+        data_mat = np.reshape(data_mat, (16, 128, 128), order='C')
+
+        # Test for data equality (what you put in is what you got back!)
+        np.testing.assert_array_equal(data_mat, test_mat)
+
+    def test_channel_uint16_invalid_codec(self):
+        """ Test requesting an unsupported blosc codec"""
+        factory = APIRequestFactory()
+        request = factory.get('/' + version + '/cutout/col1/exp1/channel2/0/0:128/0:128/0:16/',
+                              HTTP_ACCEPT='application/blosc; cname=notacodec')
+
+        # log in user
+        force_authenticate(request, user=self.user)
+
+        # Make request
+        response = Cutout.as_view()(request, collection='col1', experiment='exp1', channel='channel2',
+                                    resolution='0', x_range='0:128', y_range='0:128', z_range='0:16', t_range=None)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_channel_uint16_raw(self):
+        """ Test uint16 data, uploaded and downloaded uncompressed, with and without a temp file for sendfile"""
+
+        test_mat = np.random.randint(1, 2**16-1, (3, 16, 128, 128))
+        test_mat = test_mat.astype(np.uint16)
+
+        # Create request
+        factory = APIRequestFactory()
+        request = factory.post('/' + version + '/cutout/col1/exp1/channel2/0/0:128/0:128/0:16/0:3', test_mat.tobytes(),
+                               content_type='application/octet-stream', HTTP_X_BOSS_DTYPE='<u2',
+                               HTTP_X_BOSS_SHAPE='3,16,128,128')
+        # log in user
+        force_authenticate(request, user=self.user)
+
+        # Make request
+        response = Cutout.as_view()(request, collection='col1', experiment='exp1', channel='channel2',
+                                    resolution='0', x_range='0:128', y_range='0:128', z_range='0:16', t_range='0:3')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        for sendfile_size in (2 ** 30, 0):
+            with self.settings(CUTOUT_RAW_SENDFILE_SIZE=sendfile_size):
+                # Create Request to get data you posted
+                request = factory.get('/' + version + '/cutout/col1/exp1/channel2/0/0:128/0:128/0:16/0:3',
+                                      HTTP_ACCEPT='application/octet-stream')
+
+                # log in user
+                force_authenticate(request, user=self.user)
+
+                # Make request
+                response = Cutout.as_view()(request, collection='col1', experiment='exp1', channel='channel2',
+                                            resolution='0', x_range='0:128', y_range='0:128', z_range='0:16',
+                                            t_range='0:3')
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+                self.assertEqual(response['X-Boss-Shape'], '3,16,128,128')
+                content = b''.join(response.streaming_content) if response.streaming else response.content
+                response.close()
+
+                # Test for data equality (what you put in is what you got back!)
+                data_mat = np.frombuffer(content, dtype=np.dtype(response['X-Boss-Dtype'])).reshape(3, 16, 128, 128)
+                np.testing.assert_array_equal(data_mat, test_mat)
+
+    def test_channel_uint16_raw_wrong_dtype(self):
+        """ Test an uncompressed upload with a dtype header that doesn't match the channel is rejected"""
+        test_mat = np.zeros((16, 128, 64), dtype=np.uint32)
+
+        # Create request
+        factory = APIRequestFactory()
+        request = factory.post('/' + version + '/cutout/col1/exp1/channel2/0/0:128/0:128/0:16/', test_mat.tobytes(),
+                               content_type='application/octet-stream', HTTP_X_BOSS_DTYPE='<u4')
+        # log in user
+        force_authenticate(request, user=self.user)
+
+        # Make request
+        response = Cutout.as_view()(request, collection='col1', experiment='exp1', channel='channel2',
+                                    resolution='0', x_range='0:128', y_range='0:128', z_range='0:16', t_range=None)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
 
 @patch('redis.StrictRedis', mock_strict_redis_client)
 @patch('bossutils.configuration.BossConfig', MockBossConfig)
@@ -544,3 +657,7 @@ class TestCutoutInterfaceView(CutoutInterfaceViewUint16TestMixin, APITestCase):
         # Stop mocking
         self.mock_tests = self.patcher.stop()
         self.mock_spdb = self.spdb_patcher.stop()
+
+        # Drop pooled SpatialDB instances and cached cuboids created with the mocks
+        clear_pools()
+        clear_cuboid_cache()
@@ -19,14 +19,20 @@ from rest_framework.test import APITestCase, APIRequestFactory
 from rest_framework.test import force_authenticate
 from rest_framework import status
 
-from bossspatialdb.views import Cutout
+from bossspatialdb.views import Cutout, CutoutFilter
+from bossspatialdb.pool import clear_pools
+from bossspatialdb.cuboidcache import clear_cuboid_cache
 
 from bosscore.test.setup_db import SetupTestDB
 from bosscore.error import BossError
+from bossspatialdb.sparse import encode_rle, encode_coo, encode_compressed_segmentation
+from bossspatialdb.sparse import decode_rle, decode_coo, decode_compressed_segmentation
 
 import numpy as np
 import zlib
+import gzip
 import io
+import json
 
 from unittest.mock import patch
 from mockredis import mock_strict_redis_client
@@ -291,6 +297,62 @@ class CutoutInterfaceViewUint64TestMixin(object):
         np.testing.assert_array_equal(data_mat, test_mat)
         np.testing.assert_array_equal(np.unique(data_mat), np.arange(1, 2, dtype=np.uint64))
 
+    def test_channel_uint64_filter_post_ids(self):
+        """ Test filter_cutout with thousands of ids POSTed as JSON and as packed uint64 values"""
+        test_mat = np.arange(4 * 128 * 128, dtype=np.uint64).reshape(4, 128, 128) + 2 ** 40
+        bb = blosc.compress(test_mat.tobytes(), typesize=64)
+
+        # Create request
+        factory = APIRequestFactory()
+        request = factory.post('/' + version + '/cutout/col1/exp1/layer1/0/128:256/256:384/16:20/', bb,
+                               content_type='application/blosc')
+        # log in user
+        force_authenticate(request, user=self.user)
+
+        # Make request
+        response = Cutout.as_view()(request, collection='col1', experiment='exp1', channel='layer1',
+                                    resolution='0', x_range='128:256', y_range='256:384', z_range='16:20', t_range=None)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        # Keep every other voxel, plus ids that aren't in the region
+        ids = np.concatenate((test_mat.reshape(-1)[::2], np.arange(1, 5000, dtype=np.uint64)))
+        expected = test_mat.copy()
+        expected.reshape(-1)[1::2] = 0
+
+        for body, content_type in ((json.dumps({"ids": ids.tolist()}), 'application/json'),
+                                   (ids.astype('<u8').tobytes(), 'application/octet-stream')):
+            request = factory.post('/' + version + '/filter/cutout/col1/exp1/layer1/0/128:256/256:384/16:20/', body,
+                                   content_type=content_type, HTTP_ACCEPT='application/blosc')
+
+            # log in user
+            force_authenticate(request, user=self.user)
+
+            # Make request
+            response = CutoutFilter.as_view()(request, collection='col1', experiment='exp1', channel='layer1',
+                                              resolution='0', x_range='128:256', y_range='256:384', z_range='16:20',
+                                              t_range=None).render()
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+            # Decompress
+            data_mat = np.fromstring(blosc.decompress(response.content), dtype=np.uint64).reshape(4, 128, 128)
+            np.testing.assert_array_equal(data_mat, expected)
+
+    def test_channel_uint64_filter_post_invalid_ids(self):
+        """ Test filter_cutout rejects ids that aren't unsigned integers"""
+        factory = APIRequestFactory()
+        request = factory.post('/' + version + '/filter/cutout/col1/exp1/layer1/0/128:256/256:384/16:20/',
+                               json.dumps({"ids": [1, -2]}), content_type='application/json',
+                               HTTP_ACCEPT='application/blosc')
+
+        # log in user
+        force_authenticate(request, user=self.user)
+
+        # Make request
+        response = CutoutFilter.as_view()(request, collection='col1', experiment='exp1', channel='layer1',
+                                          resolution='0', x_range='128:256', y_range='256:384', z_range='16:20',
+                                          t_range=None)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
     def test_channel_uint64_filter_multiple_ids(self):
         """ Test filter_cutout by ids - multiple ids in the filter list"""
 
@@ -896,6 +958,149 @@ class CutoutInterfaceViewUint64TestMixin(object):
         # Test for data equality (what you put in is what you got back!)
         np.testing.assert_array_equal(data_mat, test_mat)
 
+    def test_channel_uint64_npygz_gzip_upload_stream_download(self):
+        """ Test uploading npygz as multi-member gzip, like pigz writes, and downloading it compressed in parallel
+        """
+        test_mat = np.random.randint(1, 256, (4, 128, 128))
+        test_mat = test_mat.astype(np.uint64)
+
+        # Save Data to npy, then gzip it as two independent members
+        npy_file = io.BytesIO()
+        np.save(npy_file, test_mat, allow_pickle=False)
+        npy_bytes = npy_file.getvalue()
+        npy_gz = gzip.compress(npy_bytes[:100000]) + gzip.compress(npy_bytes[100000:])
+
+        # Create request
+        factory = APIRequestFactory()
+        request = factory.post('/' + version + '/cutout/col1/exp1/layer1/0/0:128/0:128/0:4/', npy_gz,
+                               content_type='application/npygz')
+        # log in user
+        force_authenticate(request, user=self.user)
+
+        # Make request
+        response = Cutout.as_view()(request, collection='col1', experiment='exp1', channel='layer1',
+                                    resolution='0', x_range='0:128', y_range='0:128', z_range='0:4', t_range=None)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        # Stream the download, compressing 64 KiB blocks on several threads
+        with self.settings(CUTOUT_NPYGZ_STREAM_SIZE=0), patch('bossspatialdb.compression.ZLIB_BLOCK_SIZE', 2 ** 16):
+            request = factory.get('/' + version + '/cutout/col1/exp1/layer1/0/0:128/0:128/0:4/',
+                                  HTTP_ACCEPT='application/npygz; nthreads=4')
+
+            # log in user
+            force_authenticate(request, user=self.user)
+
+            # Make request
+            response = Cutout.as_view()(request, collection='col1', experiment='exp1', channel='layer1',
+                                        resolution='0', x_range='0:128', y_range='0:128', z_range='0:4',
+                                        t_range=None)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertTrue(response.streaming)
+
+            # The blocks make up a single zlib stream
+            data_bytes = zlib.decompress(b''.join(response.streaming_content))
+
+        # Test for data equality (what you put in is what you got back!)
+        data_mat = np.load(io.BytesIO(data_bytes))
+        np.testing.assert_array_equal(data_mat, test_mat)
+
+    def test_channel_uint64_sparse_download(self):
+        """ Test uint64 data, downloading with each of the sparse annotation encodings"""
+        # Mostly background with a few large labels, like a typical annotation channel
+        test_mat = np.zeros((4, 128, 128), dtype=np.uint64)
+        test_mat[:, 10:60, 20:90] = 2 ** 40 + 1
+        test_mat[1:3, 70:128, 0:50] = 5
+        bb = blosc.compress(test_mat.tobytes(), typesize=64)
+
+        # Create request
+        factory = APIRequestFactory()
+        request = factory.post('/' + version + '/cutout/col1/exp1/layer1/0/0:128/0:128/0:4/', bb,
+                               content_type='application/blosc')
+        # log in user
+        force_authenticate(request, user=self.user)
+
+        # Make request
+        response = Cutout.as_view()(request, collection='col1', experiment='exp1', channel='layer1',
+                                    resolution='0', x_range='0:128', y_range='0:128', z_range='0:4', t_range=None)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        for media_type, decode in (('application/rle', decode_rle),
+                                   ('application/coo', decode_coo),
+                                   ('application/compressed-segmentation', decode_compressed_segmentation)):
+            # Create Request to get data you posted
+            request = factory.get('/' + version + '/cutout/col1/exp1/layer1/0/0:128/0:128/0:4/',
+                                  HTTP_ACCEPT=media_type)
+
+            # log in user
+            force_authenticate(request, user=self.user)
+
+            # Make request
+            response = Cutout.as_view()(request, collection='col1', experiment='exp1', channel='layer1',
+                                        resolution='0', x_range='0:128', y_range='0:128', z_range='0:4',
+                                        t_range=None).render()
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+            # The sparse encodings always hold 4D data
+            data_mat = decode(response.content)
+            np.testing.assert_array_equal(data_mat, test_mat.reshape((1, 4, 128, 128)))
+
+    def test_channel_uint64_sparse_upload(self):
+        """ Test uint64 data, uploading with each of the sparse annotation encodings, with time series support"""
+        test_mat = np.zeros((3, 4, 128, 128), dtype=np.uint64)
+        test_mat[:, :, 30:100, 40:80] = 12345
+        test_mat[1, 2, 5, 7] = 2 ** 63
+
+        for media_type, encode in (('application/rle', encode_rle),
+                                   ('application/coo', encode_coo),
+                                   ('application/compressed-segmentation', encode_compressed_segmentation)):
+            # Create request
+            factory = APIRequestFactory()
+            request = factory.post('/' + version + '/cutout/col1/exp1/layer1/0/0:128/0:128/0:4/10:13',
+                                   encode(test_mat), content_type=media_type)
+            # log in user
+            force_authenticate(request, user=self.user)
+
+            # Make request
+            response = Cutout.as_view()(request, collection='col1', experiment='exp1', channel='layer1',
+                                        resolution='0', x_range='0:128', y_range='0:128', z_range='0:4',
+                                        t_range='10:13')
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+            # Create Request to get data you posted
+            request = factory.get('/' + version + '/cutout/col1/exp1/layer1/0/0:128/0:128/0:4/10:13',
+                                  HTTP_ACCEPT='application/blosc-python')
+
+            # log in user
+            force_authenticate(request, user=self.user)
+
+            # Make request
+            response = Cutout.as_view()(request, collection='col1', experiment='exp1', channel='layer1',
+                                        resolution='0', x_range='0:128', y_range='0:128', z_range='0:4',
+                                        t_range='10:13').render()
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+            # Test for data equality (what you put in is what you got back!)
+            np.testing.assert_array_equal(blosc.unpack_array(response.content), test_mat)
+
+            # Change the data so each encoding is checked against its own write
+            test_mat = test_mat + 1
+
+    def test_channel_uint64_sparse_upload_wrong_dimensions(self):
+        """ Test a sparse upload with a shape that doesn't match the URL is rejected"""
+        test_mat = np.zeros((1, 4, 128, 64), dtype=np.uint64)
+
+        # Create request
+        factory = APIRequestFactory()
+        request = factory.post('/' + version + '/cutout/col1/exp1/layer1/0/0:128/0:128/0:4/',
+                               encode_rle(test_mat), content_type='application/rle')
+        # log in user
+        force_authenticate(request, user=self.user)
+
+        # Make request
+        response = Cutout.as_view()(request, collection='col1', experiment='exp1', channel='layer1',
+                                    resolution='0', x_range='0:128', y_range='0:128', z_range='0:4', t_range=None)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
 
 @patch('redis.StrictRedis', mock_strict_redis_client)
 @patch('bossutils.configuration.BossConfig', MockBossConfig)
@@ -925,3 +1130,7 @@ class TestCutoutInterfaceView(CutoutInterfaceViewUint64TestMixin, APITestCase):
         # Stop mocking
         self.mock_tests = self.patcher.stop()
         self.mock_spdb = self.spdb_patcher.stop()
+
+        # Drop pooled SpatialDB instances and cached cuboids created with the mocks
+        clear_pools()
+        clear_cuboid_cache()
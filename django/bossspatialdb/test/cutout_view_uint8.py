@@ -13,22 +13,35 @@
 # limitations under the License.
 
 from django.conf import settings
+from django.utils import timezone
 import blosc
 
 from rest_framework.test import APITestCase, APIRequestFactory
 from rest_framework.test import force_authenticate
 from rest_framework import status
 
-from bossspatialdb.views import Cutout
+from bossspatialdb.views import Cutout, CutoutBatch, CutoutJobs, CutoutJobDetail, CutoutJobResult, RegionStatistics
+from bossspatialdb.jobs import ORPHANED_JOB_ERROR
+from bossspatialdb.models import CutoutJob
+from bossingest.models import IngestJob
+from bossingest.views import IngestJobCompleteView
+from bossspatialdb import statistics
+from bossspatialdb.pool import clear_pools
+from bossspatialdb.cuboidcache import clear_cuboid_cache
 
 from bosscore.test.setup_db import SetupTestDB
 from bosscore.error import BossError
 
 import numpy as np
+from datetime import timedelta
 import zlib
 import io
+import json
+import tempfile
 
-from unittest.mock import patch
+from bossspatialdb.stream import read_stream, read_batch
+
+from unittest.mock import patch, MagicMock
 from mockredis import mock_strict_redis_client
 
 import spdb
@@ -149,6 +162,31 @@ class CutoutInterfaceViewUint8TestMixin(object):
                                     resolution='0', x_range='0:100', y_range='0:128', z_range='0:16', t_range=None)
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
 
+    def test_channel_uint8_wrong_dimensions_npygz(self):
+        """ Test posting with the wrong xyz dims using the npygz interface"""
+
+        test_mat = np.random.randint(1, 2 ** 16 - 1, (16, 128, 128))
+        test_mat = test_mat.astype(np.uint8)
+
+        # Save Data to npy
+        npy_file = io.BytesIO()
+        np.save(npy_file, test_mat, allow_pickle=False)
+
+        # Compress npy
+        npy_gz = zlib.compress(npy_file.getvalue())
+
+        # Create request
+        factory = APIRequestFactory()
+        request = factory.post('/' + version + '/cutout/col1/exp1/channel1/0/0:100/0:128/0:16/', npy_gz,
+                               content_type='application/npygz')
+        # log in user
+        force_authenticate(request, user=self.user)
+
+        # Make request
+        response = Cutout.as_view()(request, collection='col1', experiment='exp1', channel='channel1',
+                                    resolution='0', x_range='0:100', y_range='0:128', z_range='0:16', t_range=None)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
     def test_channel_uint8_get_too_big(self):
         """ Test getting a cutout that is over 1GB uncompressed"""
         # Create request
@@ -166,6 +204,21 @@ class CutoutInterfaceViewUint8TestMixin(object):
                                     resolution='0', x_range='0:100000', y_range='0:100000', z_range='0:10000', t_range=None)
         self.assertEqual(response.status_code, status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
 
+    def test_channel_uint8_compressed_segmentation_not_supported(self):
+        """ Test the compressed segmentation encoding is rejected for image channels"""
+        # Create request
+        factory = APIRequestFactory()
+        request = factory.get('/' + version + '/cutout/col1/exp1/channel1/0/0:128/0:128/0:16/',
+                              HTTP_ACCEPT='application/compressed-segmentation')
+
+        # log in user
+        force_authenticate(request, user=self.user)
+
+        # Make request
+        response = Cutout.as_view()(request, collection='col1', experiment='exp1', channel='channel1',
+                                    resolution='0', x_range='0:128', y_range='0:128', z_range='0:16', t_range=None)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
     def test_channel_uint8_cuboid_aligned_no_offset_no_time_blosc(self):
         """ Test uint8 data, cuboid aligned, no offset, no time samples"""
 
@@ -754,6 +807,493 @@ class CutoutInterfaceViewUint8TestMixin(object):
         # Test for data equality (what you put in is what you got back!)
         np.testing.assert_array_equal(data_mat, test_mat)
 
+    def test_channel_uint8_cuboid_unaligned_offset_no_time_blosc_stream(self):
+        """ Test uint8 data, not cuboid aligned, offset, no time samples, downloaded as a block stream"""
+
+        test_mat = np.random.randint(1, 254, (17, 300, 500))
+        test_mat = test_mat.astype(np.uint8)
+        bb = blosc.pack_array(test_mat)
+
+        # Create request
+        factory = APIRequestFactory()
+        request = factory.post('/' + version + '/cutout/col1/exp1/channel1/0/100:600/450:750/20:37/', bb,
+                               content_type='application/blosc-python')
+        # log in user
+        force_authenticate(request, user=self.user)
+
+        # Make request
+        response = Cutout.as_view()(request, collection='col1', experiment='exp1', channel='channel1',
+                                    resolution='0', x_range='100:600', y_range='450:750', z_range='20:37',
+                                    t_range=None)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        # Create Request to get data you posted
+        request = factory.get('/' + version + '/cutout/col1/exp1/channel1/0/100:600/450:750/20:37/',
+                              HTTP_ACCEPT='application/blosc-stream')
+
+        # log in user
+        force_authenticate(request, user=self.user)
+
+        # Make request, using a small block size so the stream is split
+        with self.settings(CUTOUT_STREAM_BLOCK_SIZE=512 * 512 * 16):
+            response = Cutout.as_view()(request, collection='col1', experiment='exp1', channel='channel1',
+                                        resolution='0', x_range='100:600', y_range='450:750', z_range='20:37',
+                                        t_range=None)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertTrue(response.streaming)
+            data_mat = read_stream(io.BytesIO(b''.join(response.streaming_content)))
+
+        # Test for data equality (what you put in is what you got back!)
+        np.testing.assert_array_equal(np.squeeze(data_mat, axis=(0,)), test_mat)
+
+    def test_channel_uint8_cuboid_unaligned_offset_no_time_blosc_stream_split(self):
+        """ Test uint8 data over the max cutout size, downloaded as a split block stream"""
+
+        test_mat = np.random.randint(1, 254, (17, 300, 500))
+        test_mat = test_mat.astype(np.uint8)
+        bb = blosc.pack_array(test_mat)
+
+        # Create request
+        factory = APIRequestFactory()
+        request = factory.post('/' + version + '/cutout/col1/exp1/channel1/0/100:600/450:750/20:37/', bb,
+                               content_type='application/blosc-python')
+        # log in user
+        force_authenticate(request, user=self.user)
+
+        # Make request
+        response = Cutout.as_view()(request, collection='col1', experiment='exp1', channel='channel1',
+                                    resolution='0', x_range='100:600', y_range='450:750', z_range='20:37',
+                                    t_range=None)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        with self.settings(CUTOUT_MAX_SIZE=512 * 512 * 16, CUTOUT_STREAM_BLOCK_SIZE=512 * 512 * 16):
+            # Without opting in, the cutout is too big
+            request = factory.get('/' + version + '/cutout/col1/exp1/channel1/0/100:600/450:750/20:37/',
+                                  HTTP_ACCEPT='application/blosc-stream')
+            force_authenticate(request, user=self.user)
+            response = Cutout.as_view()(request, collection='col1', experiment='exp1', channel='channel1',
+                                        resolution='0', x_range='100:600', y_range='450:750', z_range='20:37',
+                                        t_range=None)
+            self.assertEqual(response.status_code, status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+
+            # Opt in to splitting
+            request = factory.get('/' + version + '/cutout/col1/exp1/channel1/0/100:600/450:750/20:37/?split=true',
+                                  HTTP_ACCEPT='application/blosc-stream')
+            force_authenticate(request, user=self.user)
+            response = Cutout.as_view()(request, collection='col1', experiment='exp1', channel='channel1',
+                                        resolution='0', x_range='100:600', y_range='450:750', z_range='20:37',
+                                        t_range=None)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            manifest = json.loads(response['X-Boss-Cutout-Manifest'])
+            data_mat = read_stream(io.BytesIO(b''.join(response.streaming_content)))
+
+        # Blocks are split on cuboid boundaries
+        self.assertEqual(manifest['x'], [100, 512, 600])
+        self.assertEqual(manifest['y'], [450, 512, 750])
+        self.assertEqual(manifest['z'], [20, 32, 37])
+        self.assertEqual(manifest['num_blocks'], 8)
+
+        # Test for data equality (what you put in is what you got back!)
+        np.testing.assert_array_equal(np.squeeze(data_mat, axis=(0,)), test_mat)
+
+    def test_channel_uint8_split_requires_stream(self):
+        """ Test splitting a cutout is rejected for formats that aren't streamed"""
+        factory = APIRequestFactory()
+        request = factory.get('/' + version + '/cutout/col1/exp1/channel1/0/0:100/0:100/0:10/?split=true',
+                              HTTP_ACCEPT='application/blosc')
+        force_authenticate(request, user=self.user)
+        response = Cutout.as_view()(request, collection='col1', experiment='exp1', channel='channel1',
+                                    resolution='0', x_range='0:100', y_range='0:100', z_range='0:10', t_range=None)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_channel_uint8_projection(self):
+        """ Test uint8 data, reduced to a projection along each axis on the server"""
+        test_mat = np.random.randint(1, 254, (17, 300, 500))
+        test_mat = test_mat.astype(np.uint8)
+        bb = blosc.compress(test_mat.tobytes(), typesize=8)
+
+        # Create request
+        factory = APIRequestFactory()
+        request = factory.post('/' + version + '/cutout/col1/exp1/channel1/0/100:600/450:750/20:37/', bb,
+                               content_type='application/blosc')
+        # log in user
+        force_authenticate(request, user=self.user)
+
+        # Make request
+        response = Cutout.as_view()(request, collection='col1', experiment='exp1', channel='channel1',
+                                    resolution='0', x_range='100:600', y_range='450:750', z_range='20:37', t_range=None)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        expected = {'max': test_mat.max(axis=0, keepdims=True),
+                    'min': test_mat.min(axis=1, keepdims=True),
+                    'mean': np.rint(test_mat.mean(axis=2, keepdims=True)).astype(np.uint8)}
+        axes = {'max': 'z', 'min': 'y', 'mean': 'x'}
+        for operation, expected_mat in expected.items():
+            request = factory.get('/' + version + '/cutout/col1/exp1/channel1/0/100:600/450:750/20:37/'
+                                  '?project={}&axis={}'.format(operation, axes[operation]),
+                                  HTTP_ACCEPT='application/blosc')
+            force_authenticate(request, user=self.user)
+            response = Cutout.as_view()(request, collection='col1', experiment='exp1', channel='channel1',
+                                        resolution='0', x_range='100:600', y_range='450:750', z_range='20:37',
+                                        t_range=None).render()
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+            # Only the projection is sent, with a size of 1 along the projected axis
+            data_mat = np.fromstring(blosc.decompress(response.content), dtype=np.uint8)
+            np.testing.assert_array_equal(data_mat.reshape(expected_mat.shape), expected_mat)
+
+    def test_channel_uint8_projection_invalid(self):
+        """ Test invalid projections are rejected"""
+        factory = APIRequestFactory()
+        for query in ('?project=sum', '?project=max&axis=t', '?axis=z'):
+            request = factory.get('/' + version + '/cutout/col1/exp1/channel1/0/0:100/0:100/0:10/' + query,
+                                  HTTP_ACCEPT='application/blosc')
+            force_authenticate(request, user=self.user)
+            response = Cutout.as_view()(request, collection='col1', experiment='exp1', channel='channel1',
+                                        resolution='0', x_range='0:100', y_range='0:100', z_range='0:10',
+                                        t_range=None)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_channel_uint8_not_modified(self):
+        """ Test a cutout isn't sent again until the data it contains is written"""
+
+        test_mat = np.random.randint(1, 254, (16, 128, 128))
+        test_mat = test_mat.astype(np.uint8)
+        bb = blosc.compress(test_mat, typesize=8)
+
+        # Create request
+        factory = APIRequestFactory()
+        request = factory.post('/' + version + '/cutout/col1/exp1/channel1/0/0:128/0:128/0:16/', bb,
+                               content_type='application/blosc')
+        # log in user
+        force_authenticate(request, user=self.user)
+
+        # Make request
+        response = Cutout.as_view()(request, collection='col1', experiment='exp1', channel='channel1',
+                                    resolution='0', x_range='0:128', y_range='0:128', z_range='0:16', t_range=None)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        # Get the data and its ETag
+        request = factory.get('/' + version + '/cutout/col1/exp1/channel1/0/0:128/0:128/0:16/',
+                              HTTP_ACCEPT='application/blosc')
+        force_authenticate(request, user=self.user)
+        response = Cutout.as_view()(request, collection='col1', experiment='exp1', channel='channel1',
+                                    resolution='0', x_range='0:128', y_range='0:128', z_range='0:16', t_range=None)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        etag = response['ETag']
+
+        # The client's copy is current
+        request = factory.get('/' + version + '/cutout/col1/exp1/channel1/0/0:128/0:128/0:16/',
+                              HTTP_ACCEPT='application/blosc', HTTP_IF_NONE_MATCH=etag)
+        force_authenticate(request, user=self.user)
+        response = Cutout.as_view()(request, collection='col1', experiment='exp1', channel='channel1',
+                                    resolution='0', x_range='0:128', y_range='0:128', z_range='0:16', t_range=None)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        # Write to one of the cuboids in the cutout
+        request = factory.post('/' + version + '/cutout/col1/exp1/channel1/0/100:110/100:110/5:6/',
+                               blosc.compress(np.ones((1, 10, 10), dtype=np.uint8), typesize=8),
+                               content_type='application/blosc')
+        force_authenticate(request, user=self.user)
+        response = Cutout.as_view()(request, collection='col1', experiment='exp1', channel='channel1',
+                                    resolution='0', x_range='100:110', y_range='100:110', z_range='5:6', t_range=None)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        # The client's copy is now out of date
+        request = factory.get('/' + version + '/cutout/col1/exp1/channel1/0/0:128/0:128/0:16/',
+                              HTTP_ACCEPT='application/blosc', HTTP_IF_NONE_MATCH=etag)
+        force_authenticate(request, user=self.user)
+        response = Cutout.as_view()(request, collection='col1', experiment='exp1', channel='channel1',
+                                    resolution='0', x_range='0:128', y_range='0:128', z_range='0:16', t_range=None)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_channel_uint8_not_modified_after_ingest(self):
+        """ Test a cutout's ETag changes once an ingest job into its channel completes"""
+        factory = APIRequestFactory()
+        request = factory.get('/' + version + '/cutout/col1/exp1/channel1/0/0:128/0:128/0:16/',
+                              HTTP_ACCEPT='application/blosc')
+        force_authenticate(request, user=self.user)
+        response = Cutout.as_view()(request, collection='col1', experiment='exp1', channel='channel1',
+                                    resolution='0', x_range='0:128', y_range='0:128', z_range='0:16', t_range=None)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        etag = response['ETag']
+
+        # Ingest writes cuboids without bumping their generations
+        ingest_job = IngestJob.objects.create(creator=self.user, status=1, config_data='{}', collection='col1',
+                                              experiment='exp1', channel='channel1', resolution=0, x_start=0,
+                                              y_start=0, z_start=0, t_start=0, x_stop=1024, y_stop=1024, z_stop=16,
+                                              t_stop=1, tile_size_x=512, tile_size_y=512, tile_size_z=1,
+                                              tile_size_t=1)
+        request = factory.post('/' + version + '/ingest/{}/complete'.format(ingest_job.id))
+        force_authenticate(request, user=self.user)
+        with self.settings(DOWNSAMPLE_AFTER_INGEST=False):
+            response = IngestJobCompleteView.as_view()(request, ingest_job_id=str(ingest_job.id))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        # The client's copy may be out of date
+        request = factory.get('/' + version + '/cutout/col1/exp1/channel1/0/0:128/0:128/0:16/',
+                              HTTP_ACCEPT='application/blosc', HTTP_IF_NONE_MATCH=etag)
+        force_authenticate(request, user=self.user)
+        response = Cutout.as_view()(request, collection='col1', experiment='exp1', channel='channel1',
+                                    resolution='0', x_range='0:128', y_range='0:128', z_range='0:16', t_range=None)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_channel_uint8_statistics(self):
+        """ Test the statistics of a region, and that only cuboids that were written are aggregated again"""
+        test_mat = np.random.randint(1, 254, (16, 128, 600))
+        test_mat = test_mat.astype(np.uint8)
+        bb = blosc.compress(test_mat, typesize=8)
+
+        # Create request
+        factory = APIRequestFactory()
+        request = factory.post('/' + version + '/cutout/col1/exp1/channel1/0/0:600/0:128/0:16/', bb,
+                               content_type='application/blosc')
+        # log in user
+        force_authenticate(request, user=self.user)
+
+        # Make request
+        response = Cutout.as_view()(request, collection='col1', experiment='exp1', channel='channel1',
+                                    resolution='0', x_range='0:600', y_range='0:128', z_range='0:16', t_range=None)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        def get_statistics():
+            request = factory.get('/' + version + '/statistics/col1/exp1/channel1/0/0:600/0:128/0:16/'
+                                  '?bins=16&percentiles=0,50,100')
+            force_authenticate(request, user=self.user)
+            with patch('bossspatialdb.statistics.compute_histograms',
+                       wraps=statistics.compute_histograms) as compute:
+                response = RegionStatistics.as_view()(request, collection='col1', experiment='exp1',
+                                                      channel='channel1', resolution='0', x_range='0:600',
+                                                      y_range='0:128', z_range='0:16', t_range=None)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            return response.data, compute.call_count
+
+        # The region covers two cuboids, which are both aggregated
+        result, num_computed = get_statistics()
+        self.assertEqual(num_computed, 2)
+        self.assertEqual(result["count"], test_mat.size)
+        self.assertEqual(result["min"], test_mat.min())
+        self.assertEqual(result["max"], test_mat.max())
+        self.assertAlmostEqual(result["mean"], test_mat.mean())
+        self.assertAlmostEqual(result["std"], test_mat.std())
+        self.assertEqual(result["percentiles"]["0"], test_mat.min())
+        self.assertEqual(result["percentiles"]["100"], test_mat.max())
+        self.assertEqual(len(result["histogram"]["counts"]), 16)
+        self.assertEqual(sum(result["histogram"]["counts"]), test_mat.size)
+
+        # Repeating the request only reads cached aggregates
+        _, num_computed = get_statistics()
+        self.assertEqual(num_computed, 0)
+
+        # Write zeros to the second cuboid
+        request = factory.post('/' + version + '/cutout/col1/exp1/channel1/0/590:600/0:10/0:1/',
+                               blosc.compress(np.zeros((1, 10, 10), dtype=np.uint8), typesize=8),
+                               content_type='application/blosc')
+        force_authenticate(request, user=self.user)
+        response = Cutout.as_view()(request, collection='col1', experiment='exp1', channel='channel1',
+                                    resolution='0', x_range='590:600', y_range='0:10', z_range='0:1', t_range=None)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        # Only the cuboid that was written is aggregated again
+        result, num_computed = get_statistics()
+        self.assertEqual(num_computed, 1)
+        self.assertEqual(result["min"], 0)
+
+    def test_channel_uint8_statistics_invalid(self):
+        """ Test invalid histogram and percentile options are rejected"""
+        factory = APIRequestFactory()
+        for query in ('?bins=0', '?bins=a', '?percentiles=101', '?percentiles=1,a'):
+            request = factory.get('/' + version + '/statistics/col1/exp1/channel1/0/0:100/0:100/0:10/' + query)
+            force_authenticate(request, user=self.user)
+            response = RegionStatistics.as_view()(request, collection='col1', experiment='exp1', channel='channel1',
+                                                  resolution='0', x_range='0:100', y_range='0:100', z_range='0:10',
+                                                  t_range=None)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_channel_uint8_batch(self):
+        """ Test uint8 data, several overlapping and disjoint regions downloaded in a single batch request"""
+
+        test_mat = np.random.randint(1, 254, (17, 300, 500))
+        test_mat = test_mat.astype(np.uint8)
+        bb = blosc.pack_array(test_mat)
+
+        # Create request
+        factory = APIRequestFactory()
+        request = factory.post('/' + version + '/cutout/col1/exp1/channel1/0/100:600/450:750/20:37/', bb,
+                               content_type='application/blosc-python')
+        # log in user
+        force_authenticate(request, user=self.user)
+
+        # Make request
+        response = Cutout.as_view()(request, collection='col1', experiment='exp1', channel='channel1',
+                                    resolution='0', x_range='100:600', y_range='450:750', z_range='20:37',
+                                    t_range=None)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        # Create Request to get several regions of the data you posted
+        body = {"channel": "channel1",
+                "resolution": 0,
+                "regions": [{"x": "100:200", "y": "450:500", "z": "20:25"},
+                            {"x": "150:300", "y": "480:600", "z": "22:37"},
+                            {"x": "550:600", "y": "700:750", "z": "30:37"}]}
+        request = factory.post('/' + version + '/batch/cutout/col1/exp1/', body, format='json',
+                               HTTP_ACCEPT='application/blosc-batch')
+
+        # log in user
+        force_authenticate(request, user=self.user)
+
+        # Make request
+        response = CutoutBatch.as_view()(request, collection='col1', experiment='exp1')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        data = read_batch(io.BytesIO(b''.join(response.streaming_content)))
+
+        # Test for data equality (what you put in is what you got back!)
+        self.assertEqual(len(data), 3)
+        np.testing.assert_array_equal(data[0][0], test_mat[0:5, 0:50, 0:100])
+        np.testing.assert_array_equal(data[1][0], test_mat[2:17, 30:150, 50:200])
+        np.testing.assert_array_equal(data[2][0], test_mat[10:17, 250:300, 450:500])
+
+    def test_channel_uint8_batch_too_many_regions(self):
+        """ Test a batch request with more regions than allowed is rejected"""
+        body = {"channel": "channel1",
+                "resolution": 0,
+                "regions": [{"x": "0:10", "y": "0:10", "z": "0:1"}] * 3}
+
+        factory = APIRequestFactory()
+        request = factory.post('/' + version + '/batch/cutout/col1/exp1/', body, format='json',
+                               HTTP_ACCEPT='application/blosc-batch')
+
+        # log in user
+        force_authenticate(request, user=self.user)
+
+        # Make request
+        with self.settings(CUTOUT_BATCH_MAX_REGIONS=2):
+            response = CutoutBatch.as_view()(request, collection='col1', experiment='exp1')
+        self.assertEqual(response.status_code, status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+
+    def test_channel_uint8_cutout_job(self):
+        """ Test uint8 data, cut out by a background job and downloaded once complete"""
+
+        test_mat = np.random.randint(1, 254, (17, 300, 500))
+        test_mat = test_mat.astype(np.uint8)
+        bb = blosc.pack_array(test_mat)
+
+        # Create request
+        factory = APIRequestFactory()
+        request = factory.post('/' + version + '/cutout/col1/exp1/channel1/0/100:600/450:750/20:37/', bb,
+                               content_type='application/blosc-python')
+        # log in user
+        force_authenticate(request, user=self.user)
+
+        # Make request
+        response = Cutout.as_view()(request, collection='col1', experiment='exp1', channel='channel1',
+                                    resolution='0', x_range='100:600', y_range='450:750', z_range='20:37',
+                                    t_range=None)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        # Run the job in this thread instead of the background pool
+        executor = MagicMock()
+        executor.submit.side_effect = lambda fn, *args: fn(*args)
+        with tempfile.TemporaryDirectory() as result_dir, self.settings(CUTOUT_JOB_RESULT_DIR=result_dir,
+                                                                        CUTOUT_STREAM_BLOCK_SIZE=2 ** 20), \
+                patch('bossspatialdb.jobs.get_executor', return_value=executor), \
+                patch('bossspatialdb.jobs.connection'):
+            # Start the job
+            request = factory.post('/' + version + '/jobs/cutout/col1/exp1/channel1/0/100:600/450:750/20:37/')
+            force_authenticate(request, user=self.user)
+            response = CutoutJobs.as_view()(request, collection='col1', experiment='exp1', channel='channel1',
+                                            resolution='0', x_range='100:600', y_range='450:750', z_range='20:37',
+                                            t_range=None)
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+            job_id = response.data['id']
+
+            # Check the job's status
+            request = factory.get('/' + version + '/jobs/cutout/{}/'.format(job_id))
+            force_authenticate(request, user=self.user)
+            response = CutoutJobDetail.as_view()(request, job_id=str(job_id))
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(response.data['status'], 2)
+            self.assertEqual(response.data['blocks_complete'], response.data['blocks_total'])
+
+            # Download the result
+            request = factory.get('/' + version + '/jobs/cutout/{}/result/'.format(job_id))
+            force_authenticate(request, user=self.user)
+            response = CutoutJobResult.as_view()(request, job_id=str(job_id))
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            data = read_stream(io.BytesIO(b''.join(response.streaming_content)))
+            response.close()
+
+            # Test for data equality (what you put in is what you got back!)
+            np.testing.assert_array_equal(data[0], test_mat)
+
+            # Delete the result
+            request = factory.delete('/' + version + '/jobs/cutout/{}/'.format(job_id))
+            force_authenticate(request, user=self.user)
+            response = CutoutJobDetail.as_view()(request, job_id=str(job_id))
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+            request = factory.get('/' + version + '/jobs/cutout/{}/result/'.format(job_id))
+            force_authenticate(request, user=self.user)
+            response = CutoutJobResult.as_view()(request, job_id=str(job_id))
+            self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_channel_uint8_cutout_job_cancel(self):
+        """ Test a queued cutout job can be cancelled and isn't visible to other users"""
+        factory = APIRequestFactory()
+        with patch('bossspatialdb.jobs.get_executor'):
+            request = factory.post('/' + version + '/jobs/cutout/col1/exp1/channel1/0/0:100/0:100/0:10/')
+            force_authenticate(request, user=self.user)
+            response = CutoutJobs.as_view()(request, collection='col1', experiment='exp1', channel='channel1',
+                                            resolution='0', x_range='0:100', y_range='0:100', z_range='0:10',
+                                            t_range=None)
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+            self.assertEqual(response.data['status'], 0)
+            job_id = response.data['id']
+
+        # Another user can't see the job
+        other_user = SetupTestDB().create_user('otheruser')
+        request = factory.get('/' + version + '/jobs/cutout/{}/'.format(job_id))
+        force_authenticate(request, user=other_user)
+        response = CutoutJobDetail.as_view()(request, job_id=str(job_id))
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+        # Cancel it
+        request = factory.delete('/' + version + '/jobs/cutout/{}/'.format(job_id))
+        force_authenticate(request, user=self.user)
+        response = CutoutJobDetail.as_view()(request, job_id=str(job_id))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['status'], 4)
+
+    def test_channel_uint8_cutout_job_orphaned(self):
+        """ Test a job whose server stopped sending heartbeats is reported as failed"""
+        factory = APIRequestFactory()
+        with patch('bossspatialdb.jobs.get_executor'):
+            request = factory.post('/' + version + '/jobs/cutout/col1/exp1/channel1/0/0:100/0:100/0:10/')
+            force_authenticate(request, user=self.user)
+            response = CutoutJobs.as_view()(request, collection='col1', experiment='exp1', channel='channel1',
+                                            resolution='0', x_range='0:100', y_range='0:100', z_range='0:10',
+                                            t_range=None)
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+            job_id = response.data['id']
+
+        # Still queued while its heartbeat is recent
+        request = factory.get('/' + version + '/jobs/cutout/{}/'.format(job_id))
+        force_authenticate(request, user=self.user)
+        response = CutoutJobDetail.as_view()(request, job_id=str(job_id))
+        self.assertEqual(response.data['status'], 0)
+
+        CutoutJob.objects.filter(id=job_id).update(
+            heartbeat=timezone.now() - timedelta(seconds=settings.BACKGROUND_JOB_HEARTBEAT_TIMEOUT + 1))
+        request = factory.get('/' + version + '/jobs/cutout/{}/'.format(job_id))
+        force_authenticate(request, user=self.user)
+        response = CutoutJobDetail.as_view()(request, job_id=str(job_id))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['status'], 3)
+        self.assertEqual(response.data['error'], ORPHANED_JOB_ERROR)
+
 
 @patch('redis.StrictRedis', mock_strict_redis_client)
 @patch('bossutils.configuration.BossConfig', MockBossConfig)
@@ -783,3 +1323,7 @@ class TestCutoutInterfaceView(CutoutInterfaceViewUint8TestMixin, APITestCase):
         # Stop mocking
         self.mock_tests = self.patcher.stop()
         self.mock_spdb = self.spdb_patcher.stop()
+
+        # Drop pooled SpatialDB instances and cached cuboids created with the mocks
+        clear_pools()
+        clear_cuboid_cache()
@@ -0,0 +1,45 @@
+# Copyright 2016 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from django.test import SimpleTestCase
+
+from bossspatialdb.blocks import CutoutBlock, merge_regions
+
+
+class TestMergeRegions(SimpleTestCase):
+
+    def setUp(self):
+        self.cuboid_size = (512, 512, 16)
+        # C and B share a cuboid, and together span the cuboid A is in, which neither of them touches
+        self.a = CutoutBlock((512, 512, 0), (512, 512, 1))
+        self.b = CutoutBlock((0, 0, 0), (512, 1024, 1))
+        self.c = CutoutBlock((0, 0, 0), (1024, 512, 1))
+
+    def test_merge_grown_group(self):
+        """ Test a group that grows is merged with groups checked before it grew, whatever the input order"""
+        for regions in ([self.a, self.b, self.c], [self.c, self.b, self.a], [self.b, self.a, self.c]):
+            merged = merge_regions(regions, self.cuboid_size, 1)
+            self.assertEqual(len(merged), 1)
+            self.assertEqual(merged[0][0].corner, (0, 0, 0))
+            self.assertEqual(merged[0][0].extent, (1024, 1024, 1))
+            self.assertEqual(merged[0][1], [0, 1, 2])
+
+    def test_merge_max_bytes(self):
+        """ Test regions aren't merged if the group would be too large, or if they don't share a cuboid"""
+        merged = merge_regions([self.a, self.b, self.c], self.cuboid_size, 1, max_bytes=1024 * 1024 - 1)
+        self.assertEqual([indices for _, indices in merged], [[0], [1], [2]])
+
+        far = CutoutBlock((2048, 0, 0), (10, 10, 1))
+        merged = merge_regions([self.b, far], self.cuboid_size, 1)
+        self.assertEqual([indices for _, indices in merged], [[0], [1]])
@@ -0,0 +1,55 @@
+# Copyright 2016 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from django.test import SimpleTestCase
+from unittest.mock import patch
+import numpy as np
+import gzip
+import zlib
+
+from bossspatialdb.compression import ZlibCodec
+
+
+@patch('bossspatialdb.compression.ZLIB_BLOCK_SIZE', 2 ** 12)
+class TestZlibCodec(SimpleTestCase):
+
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        self.header = b'header'
+        self.data = np.repeat(rng.randint(0, 50, 4000), 8).astype(np.uint16)
+
+    def test_compress_stream(self):
+        """ Test data compressed in blocks, on one or several threads, is a single zlib stream"""
+        for nthreads in (1, 4):
+            compressed = b''.join(ZlibCodec(6, nthreads).compress_stream([self.header, self.data]))
+            self.assertEqual(zlib.decompress(compressed), self.header + self.data.tobytes())
+
+    def test_compress_stream_empty(self):
+        """ Test compressing no data"""
+        self.assertEqual(zlib.decompress(b''.join(ZlibCodec(1, 4).compress_stream([b'']))), b'')
+
+    def test_decompress_stream(self):
+        """ Test zlib data and multi-member gzip data are decompressed in small pieces"""
+        data_bytes = self.data.tobytes()
+        multi_member = gzip.compress(data_bytes[:1000]) + gzip.compress(data_bytes[1000:])
+        for compressed in (zlib.compress(data_bytes), multi_member):
+            chunks = [compressed[i:i + 100] for i in range(0, len(compressed), 100)]
+            pieces = list(ZlibCodec().decompress_stream(chunks, 1000))
+            self.assertTrue(all(len(piece) <= 1000 for piece in pieces))
+            self.assertEqual(b''.join(pieces), data_bytes)
+
+    def test_decompress_stream_truncated(self):
+        """ Test a stream that ends early is an error"""
+        with self.assertRaises(zlib.error):
+            list(ZlibCodec().decompress_stream([zlib.compress(self.data.tobytes())[:-10]]))
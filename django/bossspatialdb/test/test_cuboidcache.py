@@ -0,0 +1,131 @@
+# Copyright 2016 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from django.test import SimpleTestCase, override_settings
+from unittest.mock import patch, MagicMock
+import numpy as np
+
+from spdb.spatialdb import Cube
+
+from bossspatialdb.cuboidcache import CuboidCache, cached_cutout, get_morton, invalidate_region
+
+
+class FakeCache(object):
+    """ Stand in for SpatialDB that cuts out of an in-memory volume and counts reads"""
+    def __init__(self, volume):
+        self.volume = volume
+        self.reads = []
+
+    def cutout(self, resource, corner, extent, resolution, time_range):
+        self.reads.append((list(corner), list(extent)))
+        data = np.zeros((time_range[1] - time_range[0], extent[2], extent[1], extent[0]), dtype=self.volume.dtype)
+        src = self.volume[time_range[0]:time_range[1], corner[2]:corner[2] + extent[2],
+                          corner[1]:corner[1] + extent[1], corner[0]:corner[0] + extent[0]]
+        data[:, :src.shape[1], :src.shape[2], :src.shape[3]] = src
+        cube = Cube.create_cube(resource, list(extent), time_range)
+        cube.data = data
+        return cube
+
+
+@override_settings(CUBOID_CACHE_MAX_READ_SIZE=64 * 2 ** 20)
+class TestCuboidCache(SimpleTestCase):
+
+    def setUp(self):
+        self.resource = MagicMock()
+        self.resource.get_lookup_key.return_value = "1&1&1"
+        self.resource.get_numpy_data_type.return_value = np.uint8
+        self.resource.get_data_type.return_value = "uint8"
+
+        # 2x2x2 cuboids at resolution 0
+        self.volume = (np.arange(32 * 1024 * 1024, dtype=np.uint32) % 251).astype(np.uint8).reshape(1, 32, 1024, 1024)
+        self.generations = ("epoch", [0] * 8)
+
+    def test_lru_eviction(self):
+        """ Test the least recently used cuboids are evicted to stay within the byte budget"""
+        cache = CuboidCache(300)
+        for idx in range(3):
+            cache.put(idx, 1, np.zeros(100, dtype=np.uint8))
+        self.assertIsNotNone(cache.get(0, 1))
+        cache.put(3, 1, np.zeros(100, dtype=np.uint8))
+
+        self.assertIsNone(cache.get(1, 1))
+        self.assertIsNotNone(cache.get(0, 1))
+        stats = cache.get_stats()
+        self.assertEqual(stats['evictions'], 1)
+        self.assertEqual(stats['bytes'], 300)
+        self.assertEqual(stats['entries'], 3)
+
+    def test_stale_version(self):
+        """ Test a cuboid cached at an older write generation is a miss"""
+        cache = CuboidCache(1000)
+        cache.put("key", ("epoch", 1), np.zeros(100, dtype=np.uint8))
+        self.assertIsNone(cache.get("key", ("epoch", 2)))
+        self.assertEqual(cache.get_stats()['stale'], 1)
+        self.assertEqual(cache.get_stats()['bytes'], 0)
+
+    def test_morton(self):
+        """ Test morton indices interleave the cuboid indices with x in the lowest bit"""
+        self.assertEqual(get_morton(1, 0, 0), 1)
+        self.assertEqual(get_morton(0, 1, 0), 2)
+        self.assertEqual(get_morton(0, 0, 1), 4)
+        self.assertEqual(get_morton(3, 3, 3), 63)
+        self.assertEqual(get_morton(2, 0, 0), 8)
+
+    def test_cached_cutout(self):
+        """ Test overlapping cutouts only read the cuboids that aren't cached"""
+        fake = FakeCache(self.volume)
+        with patch('bossspatialdb.cuboidcache._cache', CuboidCache(64 * 2 ** 20)):
+            # Touches cuboids (0, 0, 0) and (1, 0, 0)
+            cube = cached_cutout(fake, self.resource, (500, 10, 2), (40, 30, 5), 0, [0, 1], self.generations)
+            np.testing.assert_array_equal(cube.data, self.volume[:, 2:7, 10:40, 500:540])
+            self.assertEqual(fake.reads, [([0, 0, 0], [1024, 512, 16])])
+
+            # Inside cuboid (1, 0, 0), which is cached
+            cube = cached_cutout(fake, self.resource, (600, 100, 0), (16, 16, 16), 0, [0, 1], self.generations)
+            np.testing.assert_array_equal(cube.data, self.volume[:, 0:16, 100:116, 600:616])
+            self.assertEqual(len(fake.reads), 1)
+
+            # Touches cuboids (1, 0, 0) and (1, 0, 1), only the second is read
+            cube = cached_cutout(fake, self.resource, (600, 100, 10), (16, 16, 16), 0, [0, 1], self.generations)
+            np.testing.assert_array_equal(cube.data, self.volume[:, 10:26, 100:116, 600:616])
+            self.assertEqual(fake.reads[1], ([512, 0, 16], [512, 512, 16]))
+
+    def test_cached_cutout_invalidated(self):
+        """ Test cuboids are read again after they are written"""
+        fake = FakeCache(self.volume)
+        with patch('bossspatialdb.cuboidcache._cache', CuboidCache(64 * 2 ** 20)):
+            cached_cutout(fake, self.resource, (0, 0, 0), (16, 16, 16), 0, [0, 1], self.generations)
+
+            # A write through this process
+            self.volume[0, 0, 0, 0] = 255
+            invalidate_region(self.resource, 0, (0, 0, 0), (1, 1, 1), [0, 1])
+            cube = cached_cutout(fake, self.resource, (0, 0, 0), (16, 16, 16), 0, [0, 1], self.generations)
+            self.assertEqual(cube.data[0, 0, 0, 0], 255)
+
+            # A write through another process, seen through its generation
+            self.volume[0, 0, 0, 0] = 254
+            cube = cached_cutout(fake, self.resource, (0, 0, 0), (16, 16, 16), 0, [0, 1], ("epoch", [1]))
+            self.assertEqual(cube.data[0, 0, 0, 0], 254)
+            self.assertEqual(len(fake.reads), 3)
+
+    @override_settings(CUBOID_CACHE_MAX_READ_SIZE=2 ** 20)
+    def test_large_cutout_bypasses_cache(self):
+        """ Test cutouts touching more than CUBOID_CACHE_MAX_READ_SIZE bytes of cuboids are read directly"""
+        fake = FakeCache(self.volume)
+        cuboid_cache = CuboidCache(64 * 2 ** 20)
+        with patch('bossspatialdb.cuboidcache._cache', cuboid_cache):
+            cube = cached_cutout(fake, self.resource, (500, 10, 2), (40, 30, 5), 0, [0, 1], self.generations)
+            np.testing.assert_array_equal(cube.data, self.volume[:, 2:7, 10:40, 500:540])
+            self.assertEqual(fake.reads, [([500, 10, 2], [40, 30, 5])])
+            self.assertEqual(cuboid_cache.get_stats()['entries'], 0)
@@ -0,0 +1,97 @@
+# Copyright 2016 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from django.test import SimpleTestCase
+from unittest.mock import patch, MagicMock
+import numpy as np
+
+from bossspatialdb.blocks import CutoutBlock
+from bossspatialdb.downsample import (LevelBounds, get_scale_factors, get_next_bounds, plan_level, reduce_mean,
+                                      reduce_mode, reduce_slice, downsample_block)
+
+
+class TestDownsample(SimpleTestCase):
+
+    def test_reduce_mean(self):
+        """ Test averaging, including partial blocks at the edge of the matrix"""
+        data = np.arange(2 * 3 * 5 * 5, dtype=np.uint16).reshape(2, 3, 5, 5)
+        reduced = reduce_mean(data, (2, 2, 2))
+
+        self.assertEqual(reduced.shape, (2, 2, 3, 3))
+        self.assertEqual(reduced.dtype, np.uint16)
+        self.assertEqual(reduced[0, 0, 0, 0], np.rint(data[0, 0:2, 0:2, 0:2].mean()))
+        self.assertEqual(reduced[1, 1, 2, 2], data[1, 2, 4, 4])
+
+    def test_reduce_offset(self):
+        """ Test voxels missing before the first block are left out of it"""
+        data = np.full((1, 1, 3, 3), 9, dtype=np.uint8)
+        data[0, 0, 1, 1] = 1
+
+        np.testing.assert_array_equal(reduce_mean(data, (2, 2, 1), (1, 1, 0))[0, 0],
+                                      np.array([[9, 9], [9, 7]], dtype=np.uint8))
+        np.testing.assert_array_equal(reduce_mode(data, (2, 2, 1), (1, 0, 0))[0, 0],
+                                      np.array([[9, 9], [9, 9]], dtype=np.uint8))
+        np.testing.assert_array_equal(reduce_slice(data, (2, 2, 1), (1, 1, 0))[0, 0],
+                                      np.array([[9, 9], [9, 1]], dtype=np.uint8))
+
+    def test_downsample_edge_block(self):
+        """ Test a block starting inside a reduction block at the edge of the level averages only the level's voxels"""
+        cache = MagicMock()
+        cache.cutout.return_value.data = np.full((1, 2, 4, 3), 100, dtype=np.uint8)
+        write_block = CutoutBlock((1, 0, 0), (2, 2, 2))
+        read_block = CutoutBlock((3, 0, 0), (3, 4, 2))
+
+        with patch('bossspatialdb.downsample.get_spatialdb') as mock_spatialdb, \
+                patch('bossspatialdb.downsample.bump_generation'):
+            mock_spatialdb.return_value.__enter__.return_value = cache
+            downsample_block(MagicMock(), 0, (2, 2, 1), write_block, read_block, [0, 1], 'mean')
+
+        args = cache.write_cuboid.call_args[0]
+        self.assertEqual(args[1:3], ((1, 0, 0), 1))
+        np.testing.assert_array_equal(args[3], np.full((1, 2, 2, 2), 100, dtype=np.uint8))
+
+    def test_reduce_slice(self):
+        """ Test taking the first voxel of each block"""
+        data = np.arange(4 * 4 * 4, dtype=np.uint8).reshape(1, 4, 4, 4)
+        np.testing.assert_array_equal(reduce_slice(data, (2, 2, 1)), data[:, :, ::2, ::2])
+
+    def test_reduce_mode(self):
+        """ Test the most common id in each block is kept and no new ids are created"""
+        data = np.zeros((1, 2, 4, 4), dtype=np.uint64)
+        data[0, :, 0:2, 2:4] = 7
+        data[0, 0, 0, 2] = 3
+        data[0, :, 2:4, 0:2] = 5
+        reduced = reduce_mode(data, (2, 2, 2))
+
+        np.testing.assert_array_equal(reduced[0, 0], np.array([[0, 7], [5, 0]], dtype=np.uint64))
+
+    def test_scale_factors(self):
+        """ Test z is only reduced once x/y voxels have caught up for near_iso"""
+        self.assertEqual(get_scale_factors('slice', (4, 4, 40), 5), (2, 2, 1))
+        self.assertEqual(get_scale_factors('iso', (4, 4, 40), 0), (2, 2, 2))
+        self.assertEqual(get_scale_factors('near_iso', (4, 4, 40), 0), (2, 2, 1))
+        self.assertEqual(get_scale_factors('near_iso', (4, 4, 40), 4), (2, 2, 2))
+
+    def test_plan_level(self):
+        """ Test every voxel of the next level is written and reads stay inside the level"""
+        bounds = LevelBounds((3, 0, 0), (1000, 700, 20))
+        plan = plan_level(bounds, (2, 2, 1), 0, 1, 1, 512 * 512 * 16)
+
+        next_bounds = get_next_bounds(bounds, (2, 2, 1))
+        self.assertEqual(next_bounds, LevelBounds((1, 0, 0), (500, 350, 20)))
+        written = sum(w.extent[0] * w.extent[1] * w.extent[2] for w, _ in plan)
+        self.assertEqual(written, 499 * 350 * 20)
+        for _, read_block in plan:
+            self.assertTrue(all(c >= s for c, s in zip(read_block.corner, bounds.start)))
+            self.assertTrue(all(c + e <= s for c, e, s in zip(read_block.corner, read_block.extent, bounds.stop)))
@@ -0,0 +1,68 @@
+# Copyright 2016 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from django.test import SimpleTestCase
+import numpy as np
+
+from bosscore.error import BossError
+from bossspatialdb.filtering import get_filter_ids, filter_cutout
+
+
+class TestFiltering(SimpleTestCase):
+
+    def setUp(self):
+        # Runs of labels along x, like an annotation channel, with some background
+        rng = np.random.RandomState(0)
+        self.data = np.repeat(rng.randint(0, 50, (2, 8, 64, 4)), 16, axis=3).astype(np.uint64)
+
+    def check(self, ids):
+        expected = np.where(np.in1d(self.data, ids).reshape(self.data.shape), self.data, 0)
+        result = filter_cutout(self.data.copy(), get_filter_ids(ids))
+        np.testing.assert_array_equal(result, expected)
+
+    def test_filter_few_ids(self):
+        """ Test filtering on fewer ids than the binary search threshold"""
+        self.check([3, 7])
+
+    def test_filter_many_ids(self):
+        """ Test filtering on many ids, most of them not in the data"""
+        self.check(list(range(0, 20000, 3)))
+
+    def test_filter_noise(self):
+        """ Test filtering data without runs is searched voxel by voxel"""
+        self.data = np.random.RandomState(1).randint(0, 50, (1, 4, 32, 32)).astype(np.uint64)
+        self.check(list(range(10, 40)))
+
+    def test_filter_ids_out_of_range(self):
+        """ Test ids that don't fit in the channel's datatype don't match anything"""
+        data = np.arange(10, dtype=np.uint32)
+        result = filter_cutout(data, get_filter_ids([3, 2 ** 40 + 3]))
+        np.testing.assert_array_equal(result, np.where(data == 3, data, 0))
+
+    def test_filter_no_ids(self):
+        """ Test an empty filter removes everything"""
+        result = filter_cutout(self.data.copy(), get_filter_ids([]))
+        self.assertFalse(result.any())
+
+    def test_get_filter_ids(self):
+        """ Test filter ids are sorted and made unique"""
+        ids = get_filter_ids({"ids": [5, 2 ** 63, 1, 5]})
+        self.assertEqual(ids.dtype, np.uint64)
+        np.testing.assert_array_equal(ids, np.array([1, 5, 2 ** 63], dtype=np.uint64))
+
+    def test_get_filter_ids_invalid(self):
+        """ Test negative or non-integer ids are rejected"""
+        for value in ([1, -1], [1.5], ["1"], "1,2", [[1, 2]]):
+            with self.assertRaises(BossError):
+                get_filter_ids(value)
@@ -0,0 +1,90 @@
+# Copyright 2016 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from django.test import SimpleTestCase
+from unittest.mock import MagicMock
+
+import numpy as np
+
+from bosscore.error import BossError
+from bossspatialdb.blocks import get_cuboid_size
+from bossspatialdb.downsample import LevelBounds
+from bossspatialdb.neuroglancer import get_info, parse_chunk, encode_chunk
+from bossspatialdb.sparse import CSEG_HEADER, decode_compressed_segmentation, encode_compressed_segmentation
+from bossspatialdb.versioning import get_cuboid_fields
+
+
+class TestNeuroglancer(SimpleTestCase):
+
+    def setUp(self):
+        self.experiment = MagicMock(num_hierarchy_levels=3, hierarchy_method='slice')
+        self.frame = MagicMock(x_start=0, x_stop=2000, y_start=100, y_stop=1100, z_start=0, z_stop=40,
+                               x_voxel_size=4, y_voxel_size=4, z_voxel_size=0.04, voxel_unit='micrometers')
+
+    def test_info(self):
+        """ Test each resolution is a scale with its bounds, voxel size in nanometers and cuboid sized chunks"""
+        info = get_info(self.experiment, self.frame, MagicMock(type='image', datatype='uint16'))
+
+        self.assertEqual(info["type"], "image")
+        self.assertEqual(info["data_type"], "uint16")
+        self.assertEqual([scale["key"] for scale in info["scales"]], ["0", "1", "2"])
+        self.assertEqual(info["scales"][1]["size"], [1000, 500, 40])
+        self.assertEqual(info["scales"][1]["voxel_offset"], [0, 50, 0])
+        self.assertEqual(info["scales"][2]["resolution"], [16000, 16000, 40])
+        self.assertEqual(info["scales"][2]["chunk_sizes"], [list(get_cuboid_size(2))])
+        self.assertTrue(all(scale["encoding"] == "raw" for scale in info["scales"]))
+
+        info = get_info(self.experiment, self.frame, MagicMock(type='annotation', datatype='uint64'))
+        self.assertEqual(info["type"], "segmentation")
+        self.assertEqual(info["scales"][0]["encoding"], "compressed_segmentation")
+        self.assertEqual(info["scales"][0]["compressed_segmentation_block_size"], [8, 8, 8])
+
+    def test_parse_chunk(self):
+        """ Test chunks must be on the chunk grid and clipped to the scale's bounds"""
+        bounds = LevelBounds((0, 100, 0), (2000, 1100, 40))
+        self.assertEqual(parse_chunk("512-1024_612-1100_32-40", bounds, (512, 512, 16)),
+                         ((512, 612, 32), (512, 488, 8)))
+
+        for name in ("512-1024_600-1100_32-40", "512-1000_612-1100_32-40", "2048-2560_100-612_0-16", "0-512_100-612"):
+            with self.assertRaises(BossError):
+                parse_chunk(name, bounds, (512, 512, 16))
+
+    def test_parse_chunk_unaligned(self):
+        """ Test the chunk grid of a frame that isn't cuboid aligned starts at its offset, across cuboid boundaries"""
+        self.frame.x_start, self.frame.y_start = 100, 0
+        info = get_info(self.experiment, self.frame, MagicMock(type='image', datatype='uint8'))
+        self.assertEqual(info["scales"][0]["voxel_offset"], [100, 0, 0])
+
+        chunk_size = get_cuboid_size(0)
+        bounds = LevelBounds((100, 0, 0), (2000, 1100, 40))
+        corner, extent = parse_chunk("612-1124_512-1024_16-32", bounds, chunk_size)
+        self.assertEqual((corner, extent), ((612, 512, 16), tuple(chunk_size)))
+        self.assertEqual(sorted(get_cuboid_fields(corner, extent, 0, [0, 1])),
+                         ["0&1&1&1", "0&2&1&1"])
+
+        with self.assertRaises(BossError):
+            parse_chunk("512-1024_512-1024_16-32", bounds, chunk_size)
+
+    def test_encode_chunk(self):
+        """ Test raw chunks are little-endian with x fastest, and compressed segmentation has no cutout header"""
+        data = np.arange(4 * 6 * 10, dtype=np.uint16).reshape(4, 6, 10)
+        content = encode_chunk(data, 'raw')
+        self.assertEqual(content, data.astype('<u2').tobytes())
+        self.assertEqual(np.frombuffer(content, dtype='<u2')[1], data[0, 0, 1])
+
+        labels = (np.arange(4 * 6 * 10) // 7).astype(np.uint64).reshape(4, 6, 10)
+        content = encode_chunk(labels, 'compressed_segmentation')
+        encoded = encode_compressed_segmentation(labels[np.newaxis])
+        self.assertEqual(content, encoded[CSEG_HEADER.size:])
+        np.testing.assert_array_equal(decode_compressed_segmentation(encoded[:CSEG_HEADER.size] + content)[0], labels)
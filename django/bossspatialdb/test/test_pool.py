@@ -0,0 +1,91 @@
+# Copyright 2016 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from django.test import SimpleTestCase
+from redis.exceptions import ConnectionError as RedisConnectionError
+
+from bossspatialdb.pool import SpatialDBPool
+
+
+class FakeClient(object):
+    """Stand in for a redis client that can be made to fail its ping"""
+    def __init__(self):
+        self.alive = True
+
+    def ping(self):
+        if not self.alive:
+            raise RedisConnectionError("connection lost")
+        return True
+
+
+class FakeKVIO(object):
+    def __init__(self):
+        self.cache_client = FakeClient()
+
+
+class FakeSpatialDB(object):
+    def __init__(self):
+        self.kvio = FakeKVIO()
+
+
+class TestSpatialDBPool(SimpleTestCase):
+
+    def test_reuses_released_instance(self):
+        """ Test an instance is handed out again after it is released"""
+        pool = SpatialDBPool(FakeSpatialDB, 2, 30)
+        with pool.connection() as first:
+            pass
+        with pool.connection() as second:
+            pass
+
+        self.assertIs(first, second)
+        self.assertEqual(pool.stats['created'], 1)
+        self.assertEqual(pool.stats['reused'], 1)
+
+    def test_creates_instance_when_none_idle(self):
+        """ Test acquire doesn't block when every instance is checked out"""
+        pool = SpatialDBPool(FakeSpatialDB, 1, 30)
+        with pool.connection() as first:
+            with pool.connection() as second:
+                self.assertIsNot(first, second)
+
+        # Only one instance is kept idle
+        self.assertEqual(pool.stats['discarded'], 1)
+
+    def test_discards_on_connection_error(self):
+        """ Test an instance that raised a connection error isn't reused"""
+        pool = SpatialDBPool(FakeSpatialDB, 2, 30)
+        with self.assertRaises(RedisConnectionError):
+            with pool.connection() as first:
+                raise RedisConnectionError("connection lost")
+
+        with pool.connection() as second:
+            self.assertIsNot(first, second)
+
+    def test_health_check_replaces_dead_instance(self):
+        """ Test an idle instance that fails its ping is replaced"""
+        pool = SpatialDBPool(FakeSpatialDB, 2, 0)
+        with pool.connection() as first:
+            first.kvio.cache_client.alive = False
+
+        with pool.connection() as second:
+            self.assertIsNot(first, second)
+        self.assertEqual(pool.stats['discarded'], 1)
+
+    def test_release_after_stream(self):
+        """ Test an instance used by a streaming response is returned once the stream is consumed"""
+        pool = SpatialDBPool(FakeSpatialDB, 2, 30)
+        instance = pool.acquire()
+        self.assertEqual(list(pool.release_after(instance, iter([b'a', b'b']))), [b'a', b'b'])
+        self.assertIs(pool.acquire(), instance)
@@ -13,7 +13,8 @@
 # limitations under the License.
 
 from django.core.urlresolvers import resolve
-from ..views import Cutout
+from ..views import Cutout, CutoutBatch, CutoutFilter, Downsample, CutoutJobs, CutoutJobDetail, CutoutJobResult
+from ..views import RegionStatistics, NeuroglancerInfo, NeuroglancerChunk
 
 from rest_framework.test import APITestCase
 
@@ -48,3 +49,72 @@ class CutoutInterfaceRoutingTests(APITestCase):
         view_based_cutout = resolve('/' + version + '/cutout/col1/exp1/ds1/2/0:5/0:6/0:2/5:57')
         self.assertEqual(view_based_cutout.func.__name__, Cutout.as_view().__name__)
 
+    def test_batch_cutout_resolves_to_cutout_batch(self):
+        """
+        Test to make sure the batch cutout URL resolves
+        :return:
+        """
+        view_based_cutout = resolve('/' + version + '/batch/cutout/col1/exp1/')
+        self.assertEqual(view_based_cutout.func.__name__, CutoutBatch.as_view().__name__)
+
+    def test_filter_cutout_resolves_to_cutout_filter(self):
+        """
+        Test to make sure the filtered cutout URL resolves
+        :return:
+        """
+        view_based_cutout = resolve('/' + version + '/filter/cutout/col1/exp1/ds1/2/0:5/0:6/0:2/')
+        self.assertEqual(view_based_cutout.func.__name__, CutoutFilter.as_view().__name__)
+
+    def test_cutout_job_urls_resolve(self):
+        """
+        Test to make sure the cutout job URLs resolve
+        :return:
+        """
+        view_based_cutout = resolve('/' + version + '/jobs/cutout/col1/exp1/ds1/2/0:5/0:6/0:2/5:57')
+        self.assertEqual(view_based_cutout.func.__name__, CutoutJobs.as_view().__name__)
+
+        view_based_cutout = resolve('/' + version + '/jobs/cutout/12/')
+        self.assertEqual(view_based_cutout.func.__name__, CutoutJobDetail.as_view().__name__)
+
+        view_based_cutout = resolve('/' + version + '/jobs/cutout/12/result/')
+        self.assertEqual(view_based_cutout.func.__name__, CutoutJobResult.as_view().__name__)
+
+    def test_downsample_resolves_to_downsample(self):
+        """
+        Test to make sure the downsample URL resolves
+        :return:
+        """
+        view_based_cutout = resolve('/' + version + '/downsample/col1/exp1/ds1/')
+        self.assertEqual(view_based_cutout.func.__name__, Downsample.as_view().__name__)
+
+    def test_statistics_resolves_to_region_statistics(self):
+        """
+        Test to make sure the region statistics URL resolves
+        :return:
+        """
+        view_based_cutout = resolve('/' + version + '/statistics/col1/exp1/ds1/2/0:5/0:6/0:2')
+        self.assertEqual(view_based_cutout.func.__name__, RegionStatistics.as_view().__name__)
+
+        view_based_cutout = resolve('/' + version + '/statistics/col1/exp1/ds1/2/0:5/0:6/0:2/5:57')
+        self.assertEqual(view_based_cutout.func.__name__, RegionStatistics.as_view().__name__)
+
+    def test_neuroglancer_resolves_to_info_and_chunk(self):
+        """
+        Test to make sure the neuroglancer precomputed URLs resolve, with and without a time sample
+        :return:
+        """
+        view_based_cutout = resolve('/' + version + '/neuroglancer/col1/exp1/ds1/info')
+        self.assertEqual(view_based_cutout.func.__name__, NeuroglancerInfo.as_view().__name__)
+
+        view_based_cutout = resolve('/' + version + '/neuroglancer/col1/exp1/ds1/3/info')
+        self.assertEqual(view_based_cutout.func.__name__, NeuroglancerInfo.as_view().__name__)
+        self.assertEqual(view_based_cutout.kwargs['t_idx'], '3')
+
+        view_based_cutout = resolve('/' + version + '/neuroglancer/col1/exp1/ds1/2/0-512_512-1024_0-16')
+        self.assertEqual(view_based_cutout.func.__name__, NeuroglancerChunk.as_view().__name__)
+        self.assertEqual(view_based_cutout.kwargs['resolution'], '2')
+        self.assertIsNone(view_based_cutout.kwargs['t_idx'])
+
+        view_based_cutout = resolve('/' + version + '/neuroglancer/col1/exp1/ds1/3/2/0-512_512-1024_0-16')
+        self.assertEqual(view_based_cutout.func.__name__, NeuroglancerChunk.as_view().__name__)
+        self.assertEqual(view_based_cutout.kwargs['t_idx'], '3')
@@ -0,0 +1,146 @@
+# Copyright 2016 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from django.test import SimpleTestCase, override_settings
+from unittest.mock import patch, MagicMock
+import threading
+import numpy as np
+
+from bossspatialdb.singleflight import SingleFlight, encode_result, decode_result, _redis_read
+
+
+class TestSingleFlight(SimpleTestCase):
+
+    def run_concurrently(self, flight, func, num_threads=8):
+        """ Method to make the same call from several threads at once"""
+        results = [None] * num_threads
+
+        def call(idx):
+            try:
+                results[idx] = flight.do("key", func)
+            except Exception as err:
+                results[idx] = err
+
+        threads = [threading.Thread(target=call, args=(idx,)) for idx in range(num_threads)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_concurrent_calls_are_coalesced(self):
+        """ Test identical concurrent calls run the function once and share its result"""
+        flight = SingleFlight()
+        release = threading.Event()
+        calls = []
+
+        def read():
+            calls.append(1)
+            release.wait(5)
+            return "data"
+
+        # Let the other threads queue up behind the first call before it finishes
+        timer = threading.Timer(0.2, release.set)
+        timer.start()
+        results = self.run_concurrently(flight, read)
+        timer.cancel()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual([result for result, _ in results], ["data"] * 8)
+        self.assertEqual(sorted(shared for _, shared in results), [False] + [True] * 7)
+        self.assertEqual(flight.stats['executed'], 1)
+        self.assertEqual(flight.stats['shared'], 7)
+
+    def test_errors_are_shared(self):
+        """ Test callers waiting on a call that fails get its error"""
+        flight = SingleFlight()
+        release = threading.Event()
+
+        def read():
+            release.wait(5)
+            raise ValueError("read failed")
+
+        timer = threading.Timer(0.2, release.set)
+        timer.start()
+        results = self.run_concurrently(flight, read, 4)
+        timer.cancel()
+        self.assertTrue(all(isinstance(result, ValueError) for result in results))
+
+    def test_sequential_calls_are_not_coalesced(self):
+        """ Test a call made after an identical call finished runs again"""
+        flight = SingleFlight()
+        self.assertEqual(flight.do("key", lambda: 1), (1, False))
+        self.assertEqual(flight.do("key", lambda: 2), (2, False))
+
+    def test_stats_are_logged(self):
+        """ Test the stats are logged every log_interval calls"""
+        flight = SingleFlight(log_interval=2)
+        with patch('bossspatialdb.singleflight.BossLogger') as mock_logger:
+            for _ in range(5):
+                flight.do("key", lambda: 1)
+        self.assertEqual(mock_logger.return_value.logger.info.call_count, 2)
+        self.assertEqual(flight.get_stats()['executed'], 5)
+
+    @override_settings(SINGLE_FLIGHT_WAIT=10, SINGLE_FLIGHT_RESULT_TTL=5, SINGLE_FLIGHT_MAX_SHARED_SIZE=4096)
+    def test_redis_read(self):
+        """ Test a read is only published if another process waits for it, and a larger one is made without the lock"""
+        resource = MagicMock()
+        resource.get_numpy_data_type.return_value = 'uint16'
+        cube = MagicMock()
+        cube.data = np.zeros((1, 4, 16, 32), dtype=np.uint16)
+        client = MagicMock()
+        client.lock.return_value.acquire.return_value = True
+        client.get.return_value = None
+
+        with patch('bossspatialdb.singleflight.get_client', return_value=client):
+            self.assertIs(_redis_read("key", resource, (32, 16, 4), [0, 1], lambda: cube), cube)
+            client.set.assert_not_called()
+            client.lock.return_value.release.assert_called_once_with()
+
+            client.reset_mock()
+            client.get.return_value = b'2'
+            self.assertIs(_redis_read("key", resource, (32, 16, 4), [0, 1], lambda: cube), cube)
+            self.assertEqual(client.set.call_count, 1)
+            client.lock.return_value.release.assert_called_once_with()
+
+            client.reset_mock()
+            self.assertIs(_redis_read("key", resource, (32, 16, 8), [0, 1], lambda: cube), cube)
+            client.lock.assert_not_called()
+            client.get.assert_not_called()
+
+    @override_settings(SINGLE_FLIGHT_WAIT=10, SINGLE_FLIGHT_RESULT_TTL=5, SINGLE_FLIGHT_MAX_SHARED_SIZE=4096)
+    def test_redis_read_waits(self):
+        """ Test a read another process is making counts as waiting and gets the published result"""
+        resource = MagicMock()
+        resource.get_numpy_data_type.return_value = 'uint16'
+        data = np.arange(4 * 16 * 32, dtype=np.uint16).reshape(1, 4, 16, 32)
+        client = MagicMock()
+        client.lock.return_value.acquire.return_value = False
+        client.get.side_effect = [None, encode_result(data)]
+        read = MagicMock()
+
+        with patch('bossspatialdb.singleflight.get_client', return_value=client), \
+                patch('bossspatialdb.singleflight.Cube') as mock_cube:
+            cube = _redis_read("key", resource, (32, 16, 4), [0, 1], read)
+
+        read.assert_not_called()
+        self.assertIs(cube, mock_cube.create_cube.return_value)
+        np.testing.assert_array_equal(cube.data, data)
+        client.pipeline.return_value.incr.assert_called_once_with("SINGLE-FLIGHT-WAITERS&key")
+        client.lock.return_value.release.assert_not_called()
+
+    def test_encode_result(self):
+        """ Test a cutout shared through redis is unchanged"""
+        data = np.random.randint(0, 2 ** 16, (2, 4, 16, 32)).astype(np.uint16)
+        np.testing.assert_array_equal(decode_result(encode_result(data)), data)
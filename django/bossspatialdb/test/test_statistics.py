@@ -0,0 +1,50 @@
+# Copyright 2016 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from django.test import SimpleTestCase
+import numpy as np
+
+from bossspatialdb.statistics import encode_histogram, decode_histogram, summarize
+
+
+class TestStatistics(SimpleTestCase):
+
+    def setUp(self):
+        self.data = np.random.RandomState(0).gamma(2.0, 800, 10000).clip(0, 2 ** 16 - 1).astype(np.uint16)
+        self.histogram = np.bincount(self.data, minlength=2 ** 16)
+
+    def test_encode_histogram(self):
+        """ Test a histogram is the same after it is cached"""
+        np.testing.assert_array_equal(decode_histogram(encode_histogram(self.histogram), 2 ** 16), self.histogram)
+
+    def test_summarize(self):
+        """ Test summary statistics match numpy"""
+        result = summarize(self.histogram, 100, [0, 50, 100])
+        self.assertEqual(result["count"], self.data.size)
+        self.assertEqual(result["min"], self.data.min())
+        self.assertEqual(result["max"], self.data.max())
+        self.assertAlmostEqual(result["mean"], self.data.mean())
+        self.assertAlmostEqual(result["std"], self.data.std())
+        self.assertEqual(result["percentiles"], {"0": self.data.min(), "50": np.sort(self.data)[4999],
+                                                 "100": self.data.max()})
+
+        counts, edges = np.histogram(self.data, 100, (self.data.min(), self.data.max() + 1))
+        self.assertEqual(result["histogram"]["counts"], counts.tolist())
+        np.testing.assert_allclose(result["histogram"]["bin_edges"], edges)
+
+    def test_summarize_few_values(self):
+        """ Test there are never more bins than values between the min and max"""
+        result = summarize(np.bincount([5, 5, 7], minlength=256), 256, [50])
+        self.assertEqual(result["histogram"], {"bin_edges": [5.0, 6.0, 7.0, 8.0], "counts": [2, 0, 1]})
+        self.assertEqual(result["percentiles"], {"50": 5})
@@ -0,0 +1,217 @@
+# Copyright 2016 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+# Write generations used to build cache validators (ETags) for cutouts and tiles
+#
+# Each channel and resolution has a hash in the cache-state redis database holding a write generation counter that is
+# incremented by every write, and the generation of the last write that touched each cuboid. A cutout's ETag is a hash
+# of the generations of the cuboids it touches, so it changes whenever any of the data it contains is rewritten and
+# can be checked without reading or compressing any data.
+#
+# The hash also holds a random epoch, so ETags issued before the cache-state database was flushed never match again.
+# Writes that don't bump generations, such as ingest, replace the epoch once they are done instead. Every cache of
+# cutout data (cuboids, slabs, tiles, histograms and shared reads) is versioned with the epoch, so none of them serve
+# data read before the write.
+import hashlib
+import itertools
+import json
+import re
+import threading
+import uuid
+
+import redis
+from django.conf import settings
+
+from .blocks import get_cuboid_size
+
+GENERATION_KEY = "WRITE-GENERATION&{}&{}"
+GENERATION_FIELD = "generation"
+EPOCH_FIELD = "epoch"
+
+ETAG_MATCH = re.compile(r'(?:W/)?"([^"]*)"')
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_client():
+    """
+    Get a client for the cache-state redis database
+
+    Returns:
+        (redis.StrictRedis)
+    """
+    key = (redis.StrictRedis, settings.STATEIO_CONFIG["cache_state_host"], settings.STATEIO_CONFIG["cache_state_db"])
+    with _clients_lock:
+        if key not in _clients:
+            _clients[key] = redis.StrictRedis(host=key[1], db=key[2])
+        return _clients[key]
+
+
+def get_generation_key(resource, resolution):
+    """
+    Get the redis key of the hash holding the write generations for a channel at a resolution
+
+    Args:
+        resource (spdb.project.BossResource): Resource for the channel
+        resolution (int): Resolution level
+
+    Returns:
+        (str)
+    """
+    return GENERATION_KEY.format(resource.get_lookup_key(), resolution)
+
+
+def rotate_epochs(lookup_key, resolutions):
+    """
+    Replace the epoch of a channel's generations, so no ETag or cached data from before now is used again
+
+    Args:
+        lookup_key (str): Lookup key of the channel
+        resolutions (iterable(int)): Resolution levels to replace the epoch of
+
+    Returns:
+        None
+    """
+    client = get_client()
+    for resolution in resolutions:
+        client.hset(GENERATION_KEY.format(lookup_key, resolution), EPOCH_FIELD, uuid.uuid4().hex)
+
+
+def get_cuboid_fields(corner, extent, resolution, time_range):
+    """
+    Get the hash fields for all cuboids that a region touches
+
+    Args:
+        corner ((int, int, int)): (x, y, z) corner of the region
+        extent ((int, int, int)): (x, y, z) size of the region
+        resolution (int): Resolution level
+        time_range (list(int)): [start, stop) time samples of the region
+
+    Returns:
+        (list(str)): A "t&x&y&z" field for each cuboid, using cuboid indices
+    """
+    cuboid_size = get_cuboid_size(resolution)
+    ranges = [range(corner[dim] // cuboid_size[dim], (corner[dim] + extent[dim] - 1) // cuboid_size[dim] + 1)
+              for dim in range(3)]
+    return ["{}&{}&{}&{}".format(t, x, y, z)
+            for t, x, y, z in itertools.product(range(time_range[0], time_range[1]), *ranges)]
+
+
+def bump_generation(resource, resolution, corner, extent, time_range):
+    """
+    Record a write to a region. Call after the data has been written.
+
+    Args:
+        resource (spdb.project.BossResource): Resource for the channel
+        resolution (int): Resolution level
+        corner ((int, int, int)): (x, y, z) corner of the region
+        extent ((int, int, int)): (x, y, z) size of the region
+        time_range (list(int)): [start, stop) time samples of the region
+
+    Returns:
+        (int): The generation of the write
+    """
+    client = get_client()
+    key = get_generation_key(resource, resolution)
+
+    generation = client.hincrby(key, GENERATION_FIELD, 1)
+    client.hsetnx(key, EPOCH_FIELD, uuid.uuid4().hex)
+    client.hmset(key, {field: generation for field in get_cuboid_fields(corner, extent, resolution, time_range)})
+    return generation
+
+
+def get_etag(resource, resolution, corner, extent, time_range, variant):
+    """
+    Compute a strong ETag for a region from the write generations of the cuboids it touches
+
+    Args:
+        resource (spdb.project.BossResource): Resource for the channel
+        resolution (int): Resolution level
+        corner ((int, int, int)): (x, y, z) corner of the region
+        extent ((int, int, int)): (x, y, z) size of the region
+        time_range (list(int)): [start, stop) time samples of the region
+        variant (list): Anything else that changes the response body, such as the media type and its parameters
+
+    Returns:
+        (str): Quoted ETag
+    """
+    epoch, generations = get_generations(resource, resolution,
+                                         get_cuboid_fields(corner, extent, resolution, time_range))
+    return make_etag(resource, resolution, corner, extent, time_range, variant, epoch, generations)
+
+
+def make_etag(resource, resolution, corner, extent, time_range, variant, epoch, generations):
+    """
+    Compute a strong ETag for a region from generations that have already been read
+
+    Args:
+        resource (spdb.project.BossResource): Resource for the channel
+        resolution (int): Resolution level
+        corner ((int, int, int)): (x, y, z) corner of the region
+        extent ((int, int, int)): (x, y, z) size of the region
+        time_range (list(int)): [start, stop) time samples of the region
+        variant (list): Anything else that changes the response body
+        epoch (str): Epoch returned by get_generations()
+        generations (list(int)): Generations returned by get_generations() for the region's get_cuboid_fields()
+
+    Returns:
+        (str): Quoted ETag
+    """
+    key = get_generation_key(resource, resolution)
+    digest = hashlib.sha1(json.dumps([epoch, key, list(corner), list(extent), list(time_range), variant,
+                                      generations]).encode())
+    return '"{}"'.format(digest.hexdigest())
+
+
+def get_generations(resource, resolution, fields):
+    """
+    Get the write generations of a set of cuboids
+
+    Args:
+        resource (spdb.project.BossResource): Resource for the channel
+        resolution (int): Resolution level
+        fields (list(str)): "t&x&y&z" field of each cuboid, from get_cuboid_fields()
+
+    Returns:
+        (str, list(int)): The epoch of the channel's generations, and the generation of each cuboid (0 if it has never
+        been written)
+    """
+    client = get_client()
+    key = get_generation_key(resource, resolution)
+
+    client.hsetnx(key, EPOCH_FIELD, uuid.uuid4().hex)
+    values = client.hmget(key, [EPOCH_FIELD] + list(fields))
+    epoch = values[0].decode() if isinstance(values[0], bytes) else values[0]
+    return epoch, [int(v) if v is not None else 0 for v in values[1:]]
+
+
+def etag_matches(request, etag):
+    """
+    Check if a request's If-None-Match header matches an ETag
+
+    Args:
+        request (rest_framework.request.Request): The request
+        etag (str): Quoted ETag of the current representation
+
+    Returns:
+        (bool): True if the client's copy is current and a 304 can be returned
+    """
+    header = request.META.get("HTTP_IF_NONE_MATCH")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    return etag.strip('"') in ETAG_MATCH.findall(header)
@@ -11,26 +11,66 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+from collections import OrderedDict
+import json
+import re
+
 import numpy as np
 
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import authentication, permissions
 from rest_framework.renderers import JSONRenderer, BrowsableAPIRenderer
-
-from .parsers import BloscParser, BloscPythonParser, NpygzParser
-from .renderers import BloscRenderer, BloscPythonRenderer, NpygzRenderer
-
-from django.http import HttpResponse
+from rest_framework.parsers import JSONParser
+
+from .parsers import BloscParser, BloscPythonParser, NpygzParser, RLEParser, COOParser, CompressedSegmentationParser
+from .parsers import FilterIdsParser, RawParser
+from .renderers import BloscRenderer, BloscPythonRenderer, NpygzRenderer, BloscStreamRenderer, BloscBatchRenderer
+from .renderers import RLERenderer, COORenderer, CompressedSegmentationRenderer, RawRenderer, get_raw_response
+from .renderers import encode_npygz
+from .blocks import CutoutBlock, get_cuboid_size, plan_blocks, merge_regions
+from .stream import BatchFetch, cutout_stream, cutout_batch_stream, get_manifest
+from .compression import get_codec
+from .filtering import get_filter_ids, get_filter_key, filter_cutout
+from .projection import get_projection, check_projection_size, project_cutout
+from .statistics import get_statistics_args, get_region_histogram, summarize, STATISTICS_DATATYPES
+from .pool import get_pool, get_spatialdb
+from .singleflight import coalesced_cutout
+from .cuboidcache import invalidate_region
+from .jobs import create_downsample_job, get_latest_downsample_job
+from .jobs import create_cutout_job, get_cutout_job, cancel_cutout_job, get_result_key, get_channel
+from .results import get_result_store
+from .serializers import DownsampleJobSerializer, CutoutJobSerializer
+from .versioning import bump_generation, get_etag, etag_matches, get_cuboid_fields, get_generations, make_etag
+from .neuroglancer import get_info, get_scales, get_encoding, parse_chunk, encode_chunk, accepts_gzip, compress_chunk
+
+from django.http import HttpResponse, HttpResponseNotModified, StreamingHttpResponse, FileResponse
 from django.conf import settings
+from django.utils.cache import patch_cache_control, patch_vary_headers
 
 from bosscore.request import BossRequest
 from bosscore.error import BossError, BossHTTPError, BossParserError, ErrorCodes
+from bosscore.permissions import BossPermissionManager
 
-from spdb.spatialdb.spatialdb import SpatialDB
 from spdb import project
 
 
+def parse_range(args, axis):
+    """
+    Parse a python style range (eg. 100:200) for an axis out of a JSON request body
+
+    :param args: Dictionary from the request body
+    :param axis: Name of the axis
+    :return: (start, stop) tuple
+    """
+    value = args.get(axis)
+    m = re.match(r"^(?P<start>\d+):(?P<stop>\d+)$", str(value)) if value is not None else None
+    if not m or int(m.group('start')) >= int(m.group('stop')):
+        raise BossError("Invalid {} range '{}'. Must be formatted as start:stop".format(axis, value),
+                        ErrorCodes.INVALID_CUTOUT_ARGS)
+    return int(m.group('start')), int(m.group('stop'))
+
+
 class Cutout(APIView):
     """
     View to handle spatial cutouts by providing all datamodel fields
@@ -38,13 +78,16 @@ class Cutout(APIView):
     * Requires authentication.
     """
     # Set Parser and Renderer
-    parser_classes = (BloscParser, BloscPythonParser, NpygzParser)
-    renderer_classes = (BloscRenderer, BloscPythonRenderer, NpygzRenderer, JSONRenderer, BrowsableAPIRenderer)
+    parser_classes = (BloscParser, BloscPythonParser, NpygzParser, RLEParser, COOParser, CompressedSegmentationParser,
+                      RawParser)
+    renderer_classes = (BloscRenderer, BloscPythonRenderer, NpygzRenderer, BloscStreamRenderer, RLERenderer,
+                        COORenderer, CompressedSegmentationRenderer, RawRenderer, JSONRenderer, BrowsableAPIRenderer)
 
     def __init__(self):
         super().__init__()
         self.data_type = None
         self.bit_depth = None
+        self.codec = None
 
     def get(self, request, collection, experiment, channel, resolution, x_range, y_range, z_range, t_range=None):
         """
@@ -60,6 +103,13 @@ class Cutout(APIView):
         :param y_range: Python style range indicating the Y coordinates of where to post the cuboid (eg. 100:200)
         :param z_range: Python style range indicating the Z coordinates of where to post the cuboid (eg. 100:200)
         :return:
+
+        When requesting application/blosc-stream, add ?split=true to allow cutouts larger than
+        settings.CUTOUT_MAX_SIZE (up to settings.CUTOUT_SPLIT_MAX_SIZE). The region is split into cuboid aligned blocks
+        that are cut out and sent one at a time, and the X-Boss-Cutout-Manifest header describes the block layout.
+
+        Add ?project=max|min|mean&axis=x|y|z to get a projection of the region along an axis (z by default) instead of
+        the full volume. The projected axis has a size of 1 in the result.
         """
         # Check if parsing completed without error. If an error did occur, return to user.
         if "filter" in request.query_params:
@@ -70,10 +120,23 @@ class Cutout(APIView):
         if isinstance(request.data, BossParserError):
             return request.data.to_http()
 
-        # Process request and validate
+        return self.cutout(request, ids, collection, experiment, channel, resolution, x_range, y_range, z_range,
+                           t_range)
+
+    def cutout(self, request, ids, collection, experiment, channel, resolution, x_range, y_range, z_range, t_range):
+        """
+        Method to cut out a cuboid of data and render it in the negotiated format
+
+        :param request: DRF Request object
+        :type request: rest_framework.request.Request
+        :param ids: Comma separated string or array of ids to filter an annotation cutout on, or None
+        :return: Response
+        """
+        # Process request and validate. This is always a read, even when the filter ids are POSTed.
         try:
             request_args = {
                 "service": "cutout",
+                "method": "GET",
                 "collection_name": collection,
                 "experiment_name": experiment,
                 "channel_name": channel,
@@ -97,29 +160,117 @@ class Cutout(APIView):
         except ValueError:
             return BossHTTPError("Unsupported data type: {}".format(resource.get_data_type()), ErrorCodes.TYPE_ERROR)
 
+        # Set up the codec negotiated through the Accept header's media type parameters
+        try:
+            self.codec = get_codec(request.accepted_renderer, request.accepted_media_type, resource.get_data_type())
+        except BossError as err:
+            return err.to_http()
+
+        # Some encodings only support annotation datatypes
+        datatypes = getattr(request.accepted_renderer, 'datatypes', None)
+        if datatypes is not None and resource.get_data_type() not in datatypes:
+            return BossHTTPError("{} only supports {} data".format(request.accepted_renderer.media_type,
+                                                                   " and ".join(datatypes)),
+                                 ErrorCodes.DATATYPE_NOT_SUPPORTED)
+
+        # Clients can opt in to having oversize cutouts split into cuboid aligned blocks and streamed
+        split = request.query_params.get("split", "false").lower() == "true"
+        if split and not isinstance(request.accepted_renderer, BloscStreamRenderer):
+            return BossHTTPError("Splitting a cutout is only supported when requesting {}".format(
+                BloscStreamRenderer.media_type), ErrorCodes.INVALID_ARGUMENT)
+
+        # Clients can ask for a projection along one axis (eg. ?project=max&axis=z) instead of the full volume
+        try:
+            projection = get_projection(request.query_params)
+        except BossError as err:
+            return err.to_http()
+        if projection and isinstance(request.accepted_renderer, BloscStreamRenderer):
+            return BossHTTPError("Projections can't be requested as {}".format(BloscStreamRenderer.media_type),
+                                 ErrorCodes.INVALID_ARGUMENT)
+
         # Make sure cutout request is under 1GB UNCOMPRESSED
         total_bytes = req.get_x_span() * req.get_y_span() * req.get_z_span() * len(req.get_time()) * (self.bit_depth / 8)
-        if total_bytes > settings.CUTOUT_MAX_SIZE:
-            return BossHTTPError("Cutout request is over 1GB when uncompressed. Reduce cutout dimensions.",
+        if projection:
+            try:
+                check_projection_size((req.get_x_span(), req.get_y_span(), req.get_z_span()), len(req.get_time()),
+                                      self.bit_depth / 8, projection[1])
+            except BossError as err:
+                return err.to_http()
+        elif split:
+            if total_bytes > settings.CUTOUT_SPLIT_MAX_SIZE:
+                return BossHTTPError("Cutout request is over {} bytes when uncompressed. Reduce cutout "
+                                     "dimensions.".format(settings.CUTOUT_SPLIT_MAX_SIZE),
+                                     ErrorCodes.REQUEST_TOO_LARGE)
+        elif total_bytes > settings.CUTOUT_MAX_SIZE:
+            return BossHTTPError("Cutout request is over 1GB when uncompressed. Reduce cutout dimensions or add "
+                                 "?split=true and request {}.".format(BloscStreamRenderer.media_type),
                                  ErrorCodes.REQUEST_TOO_LARGE)
 
-        # Get interface to SPDB cache
-        cache = SpatialDB(settings.KVIO_SETTINGS,
-                          settings.STATEIO_CONFIG,
-                          settings.OBJECTIO_CONFIG)
-
         # Get the params to pull data out of the cache
         corner = (req.get_x_start(), req.get_y_start(), req.get_z_start())
         extent = (req.get_x_span(), req.get_y_span(), req.get_z_span())
+        time_range = [req.get_time().start, req.get_time().stop]
+
+        # If the client's copy is current, respond without reading or compressing any data. The generations are
+        # read once and also used to read the cutout.
+        generations = get_generations(resource, req.get_resolution(),
+                                      get_cuboid_fields(corner, extent, req.get_resolution(), time_range))
+        etag = make_etag(resource, req.get_resolution(), corner, extent, time_range,
+                         [request.accepted_media_type, req.time_request, get_filter_key(req.get_filter_ids()), split,
+                          settings.CUTOUT_STREAM_BLOCK_SIZE, projection], *generations)
+        if etag_matches(request, etag):
+            response = HttpResponseNotModified()
+            response['ETag'] = etag
+            return response
+
+        # If a block stream was requested, cut out and send one cuboid aligned block at a time. The interface to the
+        # SPDB cache is returned to the pool once the stream has been sent.
+        if isinstance(request.accepted_renderer, BloscStreamRenderer):
+            pool = get_pool()
+            cache = pool.acquire()
+            blocks = plan_blocks(corner, extent, get_cuboid_size(req.get_resolution()), self.bit_depth / 8,
+                                 num_time_samples=len(req.get_time()), max_bytes=settings.CUTOUT_STREAM_BLOCK_SIZE)
+            stream = cutout_stream(cache, resource, blocks, corner, extent, req.get_resolution(), time_range,
+                                   filter_ids=req.get_filter_ids(), codec=self.codec)
+            response = StreamingHttpResponse(pool.release_after(cache, stream),
+                                             content_type=BloscStreamRenderer.media_type)
+            response['X-Boss-Cutout-Manifest'] = json.dumps(get_manifest(blocks, corner, extent,
+                                                                         req.get_resolution()),
+                                                            separators=(',', ':'))
+            response['ETag'] = etag
+            return response
 
         # Get a Cube instance with all time samples
-        data = cache.cutout(resource, corner, extent, req.get_resolution(), [req.get_time().start, req.get_time().stop],
-                            filter_ids=req.get_filter_ids())
+        if projection:
+            with get_spatialdb() as cache:
+                data = project_cutout(cache, resource, corner, extent, req.get_resolution(), time_range,
+                                      projection[0], projection[1], filter_ids=req.get_filter_ids(),
+                                      max_bytes=settings.CUTOUT_STREAM_BLOCK_SIZE)
+        else:
+            with get_spatialdb() as cache:
+                data = coalesced_cutout(cache, resource, corner, extent, req.get_resolution(), time_range,
+                                        generations)
+            data.data = filter_cutout(data.data, req.get_filter_ids())
+
+        # Uncompressed data is sent straight from the array's buffer instead of being rendered
+        if isinstance(request.accepted_renderer, RawRenderer):
+            response = get_raw_response(data.data if req.time_request else data.data[0])
+            response['ETag'] = etag
+            return response
+
+        # Large npygz cutouts are streamed as they are compressed instead of being rendered all at once
+        if isinstance(request.accepted_renderer, NpygzRenderer) and \
+                data.data.nbytes > settings.CUTOUT_NPYGZ_STREAM_SIZE:
+            response = StreamingHttpResponse(encode_npygz(data.data if req.time_request else data.data[0], self.codec),
+                                             content_type=NpygzRenderer.media_type)
+            response['ETag'] = etag
+            return response
+
         to_renderer = {"time_request": req.time_request,
                        "data": data}
 
         # Send data to renderer
-        return Response(to_renderer)
+        return Response(to_renderer, headers={'ETag': etag})
 
     def post(self, request, collection, experiment, channel, resolution, x_range, y_range, z_range, t_range=None):
         """
@@ -166,20 +317,24 @@ class Cutout(APIView):
             return BossHTTPError("Data dimensions in URL do not match POSTed data.",
                                  ErrorCodes.DATA_DIMENSION_MISMATCH)
 
-        # Get interface to SPDB cache
-        cache = SpatialDB(settings.KVIO_SETTINGS,
-                          settings.STATEIO_CONFIG,
-                          settings.OBJECTIO_CONFIG)
-
         # Write block to cache
         corner = (req.get_x_start(), req.get_y_start(), req.get_z_start())
 
         try:
-            if len(request.data[2].shape) == 4:
-                cache.write_cuboid(resource, corner, req.get_resolution(), request.data[2], req.get_time()[0])
-            else:
-                cache.write_cuboid(resource, corner, req.get_resolution(),
-                                   np.expand_dims(request.data[2], axis=0), req.get_time()[0])
+            with get_spatialdb() as cache:
+                if len(request.data[2].shape) == 4:
+                    cache.write_cuboid(resource, corner, req.get_resolution(), request.data[2], req.get_time()[0])
+                else:
+                    cache.write_cuboid(resource, corner, req.get_resolution(),
+                                       np.expand_dims(request.data[2], axis=0), req.get_time()[0])
+
+            # Invalidate ETags and this process's cached copies of the cuboids that were written
+            bump_generation(resource, req.get_resolution(), corner,
+                            (req.get_x_span(), req.get_y_span(), req.get_z_span()),
+                            [req.get_time().start, req.get_time().stop])
+            invalidate_region(resource, req.get_resolution(), corner,
+                              (req.get_x_span(), req.get_y_span(), req.get_z_span()),
+                              [req.get_time().start, req.get_time().stop])
         except Exception as e:
             # TODO: Eventually remove as this level of detail should not be sent to the user
             return BossHTTPError('Error during write_cuboid: {}'.format(e), ErrorCodes.BOSS_SYSTEM_ERROR)
@@ -187,3 +342,569 @@ class Cutout(APIView):
         # Send data to renderer
         return HttpResponse(status=201)
 
+
+class CutoutFilter(Cutout):
+    """
+    View to handle annotation cutouts filtered on a list of ids that is too long to send in the URL
+
+    The ids are POSTed either as JSON, {"ids": [1, 2, 3]}, or as application/octet-stream packed little-endian uint64
+    values. The response is the filtered cutout in the format negotiated through the Accept header, the same as a
+    Cutout GET.
+
+    * Requires authentication.
+    """
+    # Set Parser and Renderer
+    parser_classes = (JSONParser, FilterIdsParser)
+    http_method_names = ['post', 'options']
+
+    def post(self, request, collection, experiment, channel, resolution, x_range, y_range, z_range, t_range=None):
+        """
+        View to handle POST requests for a filtered cuboid of data while providing all datamodel params
+
+        :param request: DRF Request object
+        :type request: rest_framework.request.Request
+        :param collection: Unique Collection identifier, indicating which collection you want to access
+        :param experiment: Experiment identifier, indicating which experiment you want to access
+        :param channel: Channel identifier, indicating which annotation channel you want to access
+        :param resolution: Integer indicating the level in the resolution hierarchy (0 = native)
+        :param x_range: Python style range indicating the X coordinates of the cutout (eg. 100:200)
+        :param y_range: Python style range indicating the Y coordinates of the cutout (eg. 100:200)
+        :param z_range: Python style range indicating the Z coordinates of the cutout (eg. 100:200)
+        :return:
+        """
+        # Check if parsing completed without error. If an error did occur, return to user.
+        if isinstance(request.data, BossParserError):
+            return request.data.to_http()
+
+        try:
+            ids = get_filter_ids(request.data)
+        except BossError as err:
+            return err.to_http()
+
+        return self.cutout(request, ids, collection, experiment, channel, resolution, x_range, y_range, z_range,
+                           t_range)
+
+
+class CutoutBatch(APIView):
+    """
+    View to handle many cutouts from a single experiment in one request
+
+    The regions to cut out are POSTed as JSON. The channel, resolution and time range can be set once for the whole
+    batch and overridden for individual regions:
+
+        {
+            "channel": "em",
+            "resolution": 0,
+            "t": "0:1",
+            "regions": [
+                {"x": "0:128", "y": "0:128", "z": "0:16"},
+                {"x": "512:640", "y": "0:128", "z": "0:16", "channel": "seg", "resolution": 1}
+            ]
+        }
+
+    Annotation regions can be filtered on a list of ids with a "filter" list in the body, or the filter query param.
+
+    The resource is validated once for each unique channel, resolution and time range. Regions that touch the same
+    cuboids are fetched with a single cutout. The response is a framed stream with one blosc compressed 4D (t, z, y, x)
+    matrix per region. See bossspatialdb.stream for the format.
+
+    * Requires authentication.
+    """
+    # Set Parser and Renderer
+    parser_classes = (JSONParser,)
+    renderer_classes = (BloscBatchRenderer,)
+
+    def group_regions(self, body):
+        """
+        Parse the request body and group the regions by channel, resolution and time range
+
+        :param body: Parsed JSON request body
+        :return: OrderedDict of (channel, resolution, time range) to a list of (region index, CutoutBlock) tuples
+        """
+        if not isinstance(body, dict) or not isinstance(body.get("regions"), list) or not body["regions"]:
+            raise BossError("Batch cutout requests must include a non-empty list of regions",
+                            ErrorCodes.INVALID_POST_ARGUMENT)
+        if len(body["regions"]) > settings.CUTOUT_BATCH_MAX_REGIONS:
+            raise BossError("Batch cutout requests are limited to {} regions".format(settings.CUTOUT_BATCH_MAX_REGIONS),
+                            ErrorCodes.REQUEST_TOO_LARGE)
+
+        groups = OrderedDict()
+        for index, region in enumerate(body["regions"]):
+            if not isinstance(region, dict):
+                raise BossError("Invalid batch region at index {}".format(index), ErrorCodes.INVALID_POST_ARGUMENT)
+
+            channel = region.get("channel", body.get("channel"))
+            resolution = region.get("resolution", body.get("resolution"))
+            time_args = region.get("t", body.get("t"))
+            if channel is None or resolution is None:
+                raise BossError("Batch region at index {} is missing a channel or resolution".format(index),
+                                ErrorCodes.INVALID_POST_ARGUMENT)
+
+            (x0, x1), (y0, y1), (z0, z1) = [parse_range(region, axis) for axis in ("x", "y", "z")]
+            key = (str(channel), str(resolution), str(time_args) if time_args is not None else None)
+            groups.setdefault(key, []).append((index, CutoutBlock((x0, y0, z0), (x1 - x0, y1 - y0, z1 - z0))))
+        return groups
+
+    def post(self, request, collection, experiment):
+        """
+        View to handle POST requests for a batch of cutouts
+
+        :param request: DRF Request object
+        :type request: rest_framework.request.Request
+        :param collection: Unique Collection identifier, indicating which collection you want to access
+        :param experiment: Experiment identifier, indicating which experiment you want to access
+        :return:
+        """
+        if "filter" in request.query_params:
+            ids = request.query_params["filter"]
+        else:
+            ids = None
+
+        try:
+            groups = self.group_regions(request.data)
+
+            # Long lists of filter ids can be included in the body instead of the URL
+            if request.data.get("filter") is not None:
+                ids = get_filter_ids(request.data["filter"])
+        except BossError as err:
+            return err.to_http()
+
+        fetches = []
+        total_bytes = 0
+        for (channel, resolution, time_args), regions in groups.items():
+            # Validate the group once, using the bounding box of all its regions. This is a read, so permissions are
+            # checked as a GET.
+            start = [min(r.corner[dim] for _, r in regions) for dim in range(3)]
+            stop = [max(r.corner[dim] + r.extent[dim] for _, r in regions) for dim in range(3)]
+            try:
+                request_args = {
+                    "service": "cutout",
+                    "method": "GET",
+                    "collection_name": collection,
+                    "experiment_name": experiment,
+                    "channel_name": channel,
+                    "resolution": resolution,
+                    "x_args": "{}:{}".format(start[0], stop[0]),
+                    "y_args": "{}:{}".format(start[1], stop[1]),
+                    "z_args": "{}:{}".format(start[2], stop[2]),
+                    "time_args": time_args,
+                    "ids": ids
+                }
+                req = BossRequest(request, request_args)
+            except BossError as err:
+                return err.to_http()
+
+            # Convert to Resource
+            resource = project.BossResourceDjango(req)
+
+            # Get bit depth
+            try:
+                bytes_per_voxel = resource.get_bit_depth() / 8
+            except ValueError:
+                return BossHTTPError("Unsupported data type: {}".format(resource.get_data_type()),
+                                     ErrorCodes.TYPE_ERROR)
+
+            # Set up the codec negotiated through the Accept header's media type parameters
+            try:
+                codec = get_codec(request.accepted_renderer, request.accepted_media_type, resource.get_data_type())
+            except BossError as err:
+                return err.to_http()
+
+            # Make sure the whole batch is under 1GB UNCOMPRESSED
+            num_time_samples = len(req.get_time())
+            for _, region in regions:
+                num_voxels = region.extent[0] * region.extent[1] * region.extent[2]
+                total_bytes += num_voxels * num_time_samples * bytes_per_voxel
+            if total_bytes > settings.CUTOUT_MAX_SIZE:
+                return BossHTTPError("Batch cutout request is over 1GB when uncompressed. Reduce the number or size of "
+                                     "regions.", ErrorCodes.REQUEST_TOO_LARGE)
+
+            # Merge regions that share cuboids so each cuboid is only read once
+            merged = merge_regions([r for _, r in regions], get_cuboid_size(req.get_resolution()), bytes_per_voxel,
+                                   num_time_samples=num_time_samples, max_bytes=settings.CUTOUT_MAX_SIZE)
+            for block, indices in merged:
+                fetches.append(BatchFetch(resource, req.get_resolution(), [req.get_time().start, req.get_time().stop],
+                                          req.get_filter_ids(), codec, block, [regions[idx] for idx in indices]))
+
+        # Stream one region at a time. The interface to the SPDB cache is returned to the pool once the stream has
+        # been sent.
+        num_items = sum(len(r) for r in groups.values())
+        pool = get_pool()
+        cache = pool.acquire()
+        return StreamingHttpResponse(pool.release_after(cache, cutout_batch_stream(cache, fetches, num_items)),
+                                     content_type=BloscBatchRenderer.media_type)
+
+
+class Downsample(APIView):
+    """
+    View to build the resolution hierarchy of a channel from one of its levels
+
+    POST starts a background job. Optional JSON body parameters:
+
+        {
+            "resolution": 0,      # Level to build from. Defaults to the channel's base resolution.
+            "x": "0:1024",        # Region to downsample. Defaults to the coordinate frame.
+            "y": "0:1024",
+            "z": "0:64",
+            "t": "0:1",           # Time samples to downsample. Defaults to all of them.
+            "method": "mean"      # mean or slice for image channels. Annotation channels always use mode.
+        }
+
+    GET returns the status of the channel's most recent job.
+
+    * Requires authentication.
+    """
+    parser_classes = (JSONParser,)
+
+    def get(self, request, collection, experiment, channel):
+        """
+        View to handle GET requests for the status of the latest downsample job of a channel
+
+        :param request: DRF Request object
+        :type request: rest_framework.request.Request
+        :param collection: Unique Collection identifier, indicating which collection you want to access
+        :param experiment: Experiment identifier, indicating which experiment you want to access
+        :param channel: Channel identifier, indicating which channel you want to access
+        :return:
+        """
+        try:
+            job = get_latest_downsample_job(request, collection, experiment, channel)
+        except BossError as err:
+            return err.to_http()
+        return Response(DownsampleJobSerializer(job).data)
+
+    def post(self, request, collection, experiment, channel):
+        """
+        View to handle POST requests to start a downsample job
+
+        :param request: DRF Request object
+        :type request: rest_framework.request.Request
+        :param collection: Unique Collection identifier, indicating which collection you want to access
+        :param experiment: Experiment identifier, indicating which experiment you want to access
+        :param channel: Channel identifier, indicating which channel you want to access
+        :return:
+        """
+        args = request.data if isinstance(request.data, dict) else {}
+        try:
+            region = None
+            if any(axis in args for axis in ("x", "y", "z")):
+                (x0, x1), (y0, y1), (z0, z1) = [parse_range(args, axis) for axis in ("x", "y", "z")]
+                region = ((x0, y0, z0), (x1, y1, z1))
+            time_range = list(parse_range(args, "t")) if "t" in args else None
+
+            job = create_downsample_job(request, collection, experiment, channel, resolution=args.get("resolution"),
+                                        region=region, time_range=time_range, method=args.get("method"))
+        except BossError as err:
+            return err.to_http()
+
+        return Response(DownsampleJobSerializer(job).data, status=201)
+
+
+class CutoutJobs(APIView):
+    """
+    View to start a cutout that is run in the background and saved for later download
+
+    POST starts a job for the region in the URL and returns its id. Annotation cutouts can be filtered with the filter
+    query param, or a JSON body with a list of ids:
+
+        {
+            "filter": [1, 2, 3]
+        }
+
+    Poll the job's status and progress with GET /jobs/cutout/<job_id>/. Once it is complete, download the result from
+    /jobs/cutout/<job_id>/result/ as an application/blosc-stream.
+
+    * Requires authentication.
+    """
+    parser_classes = (JSONParser,)
+
+    def post(self, request, collection, experiment, channel, resolution, x_range, y_range, z_range, t_range=None):
+        """
+        View to handle POST requests to start a cutout job
+
+        :param request: DRF Request object
+        :type request: rest_framework.request.Request
+        :param collection: Unique Collection identifier, indicating which collection you want to access
+        :param experiment: Experiment identifier, indicating which experiment you want to access
+        :param channel: Channel identifier, indicating which channel you want to access
+        :param resolution: Integer indicating the level in the resolution hierarchy (0 = native)
+        :param x_range: Python style range indicating the X coordinates of the cutout (eg. 100:200)
+        :param y_range: Python style range indicating the Y coordinates of the cutout (eg. 100:200)
+        :param z_range: Python style range indicating the Z coordinates of the cutout (eg. 100:200)
+        :return:
+        """
+        ids = request.query_params.get("filter")
+        try:
+            if isinstance(request.data, dict) and request.data.get("filter") is not None:
+                ids = get_filter_ids(request.data["filter"])
+
+            job = create_cutout_job(request, collection, experiment, channel, resolution, x_range, y_range, z_range,
+                                    t_range, ids)
+        except BossError as err:
+            return err.to_http()
+
+        return Response(CutoutJobSerializer(job).data, status=201)
+
+
+class CutoutJobDetail(APIView):
+    """
+    View to check on or cancel a cutout job
+
+    * Requires authentication.
+    """
+
+    def get(self, request, job_id):
+        """
+        View to handle GET requests for the status of a cutout job
+
+        :param request: DRF Request object
+        :type request: rest_framework.request.Request
+        :param job_id: Id of the cutout job
+        :return:
+        """
+        try:
+            job = get_cutout_job(request, job_id)
+        except BossError as err:
+            return err.to_http()
+        return Response(CutoutJobSerializer(job).data)
+
+    def delete(self, request, job_id):
+        """
+        View to handle DELETE requests to cancel a cutout job, or delete its result if it has finished
+
+        :param request: DRF Request object
+        :type request: rest_framework.request.Request
+        :param job_id: Id of the cutout job
+        :return:
+        """
+        try:
+            job = cancel_cutout_job(request, job_id)
+        except BossError as err:
+            return err.to_http()
+        return Response(CutoutJobSerializer(job).data)
+
+
+class CutoutJobResult(APIView):
+    """
+    View to download the result of a completed cutout job
+
+    The result is sent as an application/blosc-stream. The X-Boss-Cutout-Manifest header describes the block layout.
+
+    * Requires authentication.
+    """
+
+    def get(self, request, job_id):
+        """
+        View to handle GET requests for the result of a cutout job
+
+        :param request: DRF Request object
+        :type request: rest_framework.request.Request
+        :param job_id: Id of the cutout job
+        :return:
+        """
+        try:
+            job = get_cutout_job(request, job_id)
+        except BossError as err:
+            return err.to_http()
+
+        if job.status != 2:
+            return BossHTTPError("Cutout job {} is {} and has no result to download".format(
+                job.id, job.get_status_display().lower()), ErrorCodes.OBJECT_NOT_FOUND)
+
+        try:
+            result = get_result_store().open(get_result_key(job))
+        except FileNotFoundError:
+            return BossHTTPError("The result of cutout job {} is no longer available".format(job.id),
+                                 ErrorCodes.OBJECT_NOT_FOUND)
+
+        response = FileResponse(result, content_type=BloscStreamRenderer.media_type)
+        response['Content-Length'] = job.result_size
+        response['X-Boss-Cutout-Manifest'] = job.manifest
+        return response
+
+
+class RegionStatistics(APIView):
+    """
+    View to compute statistics and a histogram of a region of an image channel
+
+    Returns the voxel count, min, max, mean, standard deviation, percentiles and a histogram with equal width bins
+    between the min and max. Optional query parameters:
+
+        ?bins=256                   Number of histogram bins
+        &percentiles=1,50,99        Percentiles to compute, from 0 to 100
+
+    * Requires authentication.
+    """
+    renderer_classes = (JSONRenderer, BrowsableAPIRenderer)
+
+    def get(self, request, collection, experiment, channel, resolution, x_range, y_range, z_range, t_range=None):
+        """
+        View to handle GET requests for the statistics of a region
+
+        :param request: DRF Request object
+        :type request: rest_framework.request.Request
+        :param collection: Unique Collection identifier, indicating which collection you want to access
+        :param experiment: Experiment identifier, indicating which experiment you want to access
+        :param channel: Channel identifier, indicating which channel you want to access
+        :param resolution: Integer indicating the level in the resolution hierarchy (0 = native)
+        :param x_range: Python style range indicating the X coordinates of the region (eg. 100:200)
+        :param y_range: Python style range indicating the Y coordinates of the region (eg. 100:200)
+        :param z_range: Python style range indicating the Z coordinates of the region (eg. 100:200)
+        :return:
+        """
+        try:
+            request_args = {
+                "service": "cutout",
+                "collection_name": collection,
+                "experiment_name": experiment,
+                "channel_name": channel,
+                "resolution": resolution,
+                "x_args": x_range,
+                "y_args": y_range,
+                "z_args": z_range,
+                "time_args": t_range
+            }
+            req = BossRequest(request, request_args)
+            bins, percentiles = get_statistics_args(request.query_params)
+        except BossError as err:
+            return err.to_http()
+
+        resource = project.BossResourceDjango(req)
+        if resource.get_data_type() not in STATISTICS_DATATYPES:
+            return BossHTTPError("Statistics are only supported for {} channels".format(
+                " and ".join(STATISTICS_DATATYPES)), ErrorCodes.DATATYPE_NOT_SUPPORTED)
+
+        total_bytes = req.get_x_span() * req.get_y_span() * req.get_z_span() * len(req.get_time()) * \
+            (resource.get_bit_depth() / 8)
+        if total_bytes > settings.STATISTICS_MAX_SIZE:
+            return BossHTTPError("Statistics request is over {} bytes when uncompressed. Reduce region "
+                                 "dimensions.".format(settings.STATISTICS_MAX_SIZE), ErrorCodes.REQUEST_TOO_LARGE)
+
+        corner = (req.get_x_start(), req.get_y_start(), req.get_z_start())
+        extent = (req.get_x_span(), req.get_y_span(), req.get_z_span())
+        time_range = [req.get_time().start, req.get_time().stop]
+
+        # If the client's copy is current, respond without reading any data
+        etag = get_etag(resource, req.get_resolution(), corner, extent, time_range, ["statistics", bins, percentiles])
+        if etag_matches(request, etag):
+            response = HttpResponseNotModified()
+            response['ETag'] = etag
+            return response
+
+        histogram, _, _ = get_region_histogram(resource, req.get_resolution(), corner, extent, time_range)
+        return Response(summarize(histogram, bins, percentiles), headers={'ETag': etag})
+
+
+class NeuroglancerInfo(APIView):
+    """
+    View to get the neuroglancer precomputed info file of a channel
+
+    Use https://<host>/v0.7/neuroglancer/<collection>/<experiment>/<channel> as a precomputed data source in
+    Neuroglancer, or add a time sample (eg. .../<channel>/3) to view a time sample other than the channel's default.
+
+    * Requires authentication.
+    """
+    renderer_classes = (JSONRenderer,)
+
+    def get(self, request, collection, experiment, channel, t_idx=None):
+        """
+        View to handle GET requests for the info file of a channel
+
+        :param request: DRF Request object
+        :type request: rest_framework.request.Request
+        :param collection: Unique Collection identifier, indicating which collection you want to access
+        :param experiment: Experiment identifier, indicating which experiment you want to access
+        :param channel: Channel identifier, indicating which channel you want to access
+        :param t_idx: Time sample of the volume. The info file is the same for every time sample.
+        :return:
+        """
+        try:
+            exp, chan = get_channel(collection, experiment, channel)
+            if not BossPermissionManager.check_data_permissions(request.user, chan, 'GET'):
+                raise BossError("Missing read permissions on the resource {}".format(channel),
+                                ErrorCodes.MISSING_PERMISSION)
+        except BossError as err:
+            return err.to_http()
+
+        response = Response(get_info(exp, exp.coord_frame, chan))
+        patch_cache_control(response, private=True, max_age=settings.NEUROGLANCER_INFO_MAX_AGE)
+        return response
+
+
+class NeuroglancerChunk(APIView):
+    """
+    View to get a chunk of a channel in the neuroglancer precomputed format
+
+    Chunks are named x0-x1_y0-y1_z0-z1 and must be on the chunk grid of their scale. Chunks are cuboid sized and the
+    grid starts at the scale's voxel offset, so a chunk is read from a single cuboid if the coordinate frame is cuboid
+    aligned and from up to 8 otherwise. The chunk is gzip compressed if the client accepts it.
+
+    * Requires authentication.
+    """
+    renderer_classes = (RawRenderer,)
+
+    def get(self, request, collection, experiment, channel, resolution, chunk, t_idx=None):
+        """
+        View to handle GET requests for a chunk
+
+        :param request: DRF Request object
+        :type request: rest_framework.request.Request
+        :param collection: Unique Collection identifier, indicating which collection you want to access
+        :param experiment: Experiment identifier, indicating which experiment you want to access
+        :param channel: Channel identifier, indicating which channel you want to access
+        :param resolution: Integer indicating the level in the resolution hierarchy (0 = native), the key of the scale
+        :param chunk: Name of the chunk, formatted as x0-x1_y0-y1_z0-z1
+        :param t_idx: Time sample of the chunk. Defaults to the channel's default time sample.
+        :return:
+        """
+        try:
+            exp, chan = get_channel(collection, experiment, channel)
+            scales = get_scales(exp, exp.coord_frame)
+            if int(resolution) >= len(scales):
+                raise BossError("Invalid resolution {}. The experiment has {} resolutions".format(
+                    resolution, len(scales)), ErrorCodes.INVALID_CUTOUT_ARGS)
+            corner, extent = parse_chunk(chunk, scales[int(resolution)].bounds, get_cuboid_size(int(resolution)))
+
+            request_args = {
+                "service": "cutout",
+                "collection_name": collection,
+                "experiment_name": experiment,
+                "channel_name": channel,
+                "resolution": resolution,
+                "x_args": "{}:{}".format(corner[0], corner[0] + extent[0]),
+                "y_args": "{}:{}".format(corner[1], corner[1] + extent[1]),
+                "z_args": "{}:{}".format(corner[2], corner[2] + extent[2]),
+                "time_args": t_idx
+            }
+            req = BossRequest(request, request_args)
+        except BossError as err:
+            return err.to_http()
+
+        resource = project.BossResourceDjango(req)
+        encoding = get_encoding(chan)
+        gzipped = accepts_gzip(request)
+        time_range = [req.get_time().start, req.get_time().stop]
+
+        # If the client's copy is current, respond without reading any data. The write generations are also the
+        # version of the data read below.
+        generations = get_generations(resource, req.get_resolution(),
+                                      get_cuboid_fields(corner, extent, req.get_resolution(), time_range))
+        etag = make_etag(resource, req.get_resolution(), corner, extent, time_range,
+                         ["neuroglancer", encoding, gzipped], *generations)
+        if etag_matches(request, etag):
+            response = HttpResponseNotModified()
+        else:
+            with get_spatialdb() as cache:
+                data = coalesced_cutout(cache, resource, corner, extent, req.get_resolution(), time_range, generations)
+
+            content = encode_chunk(data.data[0], encoding)
+            if gzipped:
+                content = compress_chunk(content)
+            response = HttpResponse(content, content_type=RawRenderer.media_type)
+            if gzipped:
+                response['Content-Encoding'] = 'gzip'
+
+        response['ETag'] = etag
+        patch_cache_control(response, private=True, max_age=settings.NEUROGLANCER_CHUNK_MAX_AGE)
+        patch_vary_headers(response, ('Accept-Encoding',))
+        return response
@@ -0,0 +1,339 @@
+# Copyright 2016 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Batches of tiles, for viewers that load a whole viewport at once
+#
+# A batch is validated once, and its tiles' write generations are read in a single round trip. Tiles that are already
+# in the tile cache are sent straight away. The rest are grouped so each group is fetched with a single cutout, and
+# are encoded in a pool of settings.TILE_BATCH_WORKERS threads and sent as soon as each is ready.
+#
+# The response is a length-prefixed bundle. All integers are little-endian:
+#
+#   BUNDLE_HEADER: magic (4s), version (B), num_tiles (Q)
+#   TILE_HEADER:   x/y/z tile indices, as in the /tile/ URL (3Q), ETag (40s), nbytes (Q)
+#
+# Each TILE_HEADER is followed by `nbytes` of encoded image. The ETag is the one the /tile/ endpoint sends for the same
+# tile (without quotes), so a client can revalidate tiles from either endpoint. Because the number of tiles is sent up
+# front, a client can detect a bundle that was truncated by a server error after the response headers were sent.
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import struct
+import threading
+
+import numpy as np
+from django.conf import settings
+from spdb.spatialdb import Cube
+
+from bosscore.error import BossError, ErrorCodes
+from bossspatialdb.blocks import CutoutBlock, merge_regions
+from bossspatialdb.pool import get_spatialdb
+from bossspatialdb.versioning import get_cuboid_fields, get_generations
+from bossspatialdb.views import parse_range
+
+from .cache import get_tile_cache
+from .display import render_image
+from .pyramid import PLANE_AXES
+from .slabs import image_cutout
+
+BUNDLE_MAGIC = b'BOST'
+BUNDLE_VERSION = 1
+BUNDLE_HEADER = struct.Struct('<4sBQ')
+TILE_HEADER = struct.Struct('<3Q40sQ')
+
+# Threads shared by every request that reads and encodes a batch of tiles
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_batch_executor():
+    """
+    Get this process's thread pool for reading and encoding batches of tiles
+
+    Returns:
+        (concurrent.futures.ThreadPoolExecutor)
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=settings.TILE_BATCH_WORKERS)
+        return _executor
+
+
+def get_tile_region(orientation, tile_size, tile):
+    """
+    Get the region of a tile, as the /tile/ endpoint computes it
+
+    Args:
+        orientation (str): xy, xz or yz
+        tile_size (int): Tile size
+        tile ((int, int, int)): x/y/z indices of the tile. Along the axis normal to the image plane this is a voxel
+            coordinate, and along the other two it is a tile index.
+
+    Returns:
+        (bossspatialdb.blocks.CutoutBlock): Region of the tile
+    """
+    axes, normal = PLANE_AXES[orientation]
+    corner = [0, 0, 0]
+    extent = [1, 1, 1]
+    for axis in axes:
+        corner[axis] = tile[axis] * tile_size
+        extent[axis] = tile_size
+    corner[normal] = tile[normal]
+    return CutoutBlock(tuple(corner), tuple(extent))
+
+
+def get_viewport_tiles(orientation, tile_size, viewport):
+    """
+    Get the tiles that intersect a viewport
+
+    Args:
+        orientation (str): xy, xz or yz
+        tile_size (int): Tile size
+        viewport (dict): "start:stop" voxel range for each axis of the image plane, and a voxel coordinate for the axis
+            normal to it, eg. {"x": "0:2048", "y": "0:1024", "z": 10} for xy tiles
+
+    Returns:
+        (list((int, int, int))): x/y/z indices of the tiles, in row major order
+
+    Raises:
+        BossError: If the viewport is invalid
+    """
+    axes, normal = PLANE_AXES[orientation]
+    names = ('x', 'y', 'z')
+    try:
+        plane = int(viewport.get(names[normal]))
+    except (TypeError, ValueError):
+        raise BossError("Invalid viewport {} coordinate '{}'".format(names[normal], viewport.get(names[normal])),
+                        ErrorCodes.INVALID_CUTOUT_ARGS)
+
+    ranges = []
+    for axis in axes:
+        start, stop = parse_range(viewport, names[axis])
+        ranges.append(range(start // tile_size, (stop - 1) // tile_size + 1))
+
+    tiles = []
+    for idx1 in ranges[1]:
+        for idx0 in ranges[0]:
+            tile = [plane, plane, plane]
+            tile[axes[0]] = idx0
+            tile[axes[1]] = idx1
+            tiles.append(tuple(tile))
+    return tiles
+
+
+def plan_tile_reads(regions, normal, cuboid_size, bytes_per_voxel, num_time_samples=1, max_bytes=None):
+    """
+    Group tiles so each group is fetched with a single cutout
+
+    Tiles in the same image plane that exactly cover a rectangle, as the tiles of a viewport do, are read with a single
+    cutout of the rectangle if it is within max_bytes. Other tiles are grouped with
+    bossspatialdb.blocks.merge_regions(), which only merges tiles that share cuboids.
+
+    Args:
+        regions (list(CutoutBlock)): Region of each tile. Tiles must be distinct and have the same size.
+        normal (int): Index of the axis normal to the image plane
+        cuboid_size ((int, int, int)): (x, y, z) size of a cuboid at the requested resolution
+        bytes_per_voxel (int|float): Number of bytes in a single voxel
+        num_time_samples (int): Number of time samples included in each cutout
+        max_bytes (int): Maximum number of uncompressed bytes in a group's cutout. If None there is no limit.
+
+    Returns:
+        (list((CutoutBlock, list(int)))): The region to cut out for each group and the indices of the tiles it contains
+    """
+    planes = OrderedDict()
+    for idx, region in enumerate(regions):
+        planes.setdefault(region.corner[normal], []).append(idx)
+
+    reads = []
+    for indices in planes.values():
+        start = [min(regions[idx].corner[dim] for idx in indices) for dim in range(3)]
+        stop = [max(regions[idx].corner[dim] + regions[idx].extent[dim] for idx in indices) for dim in range(3)]
+        extent = tuple(b - a for a, b in zip(start, stop))
+        num_voxels = int(np.prod(extent))
+        tile_voxels = sum(int(np.prod(regions[idx].extent)) for idx in indices)
+
+        if num_voxels == tile_voxels and (max_bytes is None or
+                                          num_voxels * bytes_per_voxel * num_time_samples <= max_bytes):
+            reads.append((CutoutBlock(tuple(start), extent), indices))
+        else:
+            merged = merge_regions([regions[idx] for idx in indices], cuboid_size, bytes_per_voxel,
+                                   num_time_samples=num_time_samples, max_bytes=max_bytes)
+            reads.extend((block, [indices[idx] for idx in group]) for block, group in merged)
+    return reads
+
+
+def encode_bundle_header(num_tiles):
+    """
+    Pack the header that starts a tile bundle
+
+    Args:
+        num_tiles (int): Number of tiles that will follow
+
+    Returns:
+        (bytes): The packed header
+    """
+    return BUNDLE_HEADER.pack(BUNDLE_MAGIC, BUNDLE_VERSION, num_tiles)
+
+
+def encode_bundle_tile(tile, key, content):
+    """
+    Pack an encoded tile into a frame of a tile bundle
+
+    Args:
+        tile ((int, int, int)): x/y/z indices of the tile
+        key (str): Key of the tile, from bosstiles.cache.get_tile_key()
+        content (bytes): The encoded tile
+
+    Returns:
+        (bytes): The frame, header followed by the encoded tile
+    """
+    return TILE_HEADER.pack(*tile, key.encode(), len(content)) + content
+
+
+def read_bundle(stream):
+    """
+    Decode a tile bundle
+
+    Args:
+        stream (file-like): Object with a read() method positioned at the start of the bundle
+
+    Returns:
+        (OrderedDict): (x, y, z) tile indices to a (ETag, encoded tile) tuple, in the order they were sent
+
+    Raises:
+        ValueError: If the bundle is malformed or truncated
+    """
+    header = stream.read(BUNDLE_HEADER.size)
+    if len(header) != BUNDLE_HEADER.size:
+        raise ValueError("Bundle is truncated")
+    magic, version, num_tiles = BUNDLE_HEADER.unpack(header)
+    if magic != BUNDLE_MAGIC or version != BUNDLE_VERSION:
+        raise ValueError("Unsupported bundle format")
+
+    output = OrderedDict()
+    for _ in range(num_tiles):
+        frame = stream.read(TILE_HEADER.size)
+        if len(frame) != TILE_HEADER.size:
+            raise ValueError("Bundle is truncated")
+        x, y, z, key, nbytes = TILE_HEADER.unpack(frame)
+        content = stream.read(nbytes)
+        if len(content) != nbytes:
+            raise ValueError("Bundle is truncated")
+        output[(x, y, z)] = ('"{}"'.format(key.decode()), content)
+    return output
+
+
+def _read_block(resource, orientation, block, resolution, time_range, generations):
+    """
+    Cut out the region a group of tiles is sliced from
+    """
+    with get_spatialdb() as cache:
+        return image_cutout(cache, resource, orientation, block.corner, block.extent, resolution, time_range,
+                            generations).data
+
+
+def _encode_tile(resource, orientation, renderer, data, block, tile, region, key, time_range, display):
+    """
+    Slice a tile out of its group's cutout, encode it and add it to the tile cache
+    """
+    x0, y0, z0 = (c - b for c, b in zip(region.corner, block.corner))
+    x1, y1, z1 = (o + e for o, e in zip((x0, y0, z0), region.extent))
+    cube = Cube.create_cube(resource, list(region.extent), time_range)
+    cube.data = np.ascontiguousarray(data[:, z0:z1, y0:y1, x0:x1])
+    if display:
+        img = render_image(cube, orientation, display)
+    else:
+        img = getattr(cube, "{}_image".format(orientation))()
+    content = renderer().render(img)
+    get_tile_cache().put(key, content)
+    return encode_bundle_tile(tile, key, content)
+
+
+def tile_batch_stream(resource, orientation, resolution, time_range, renderer, cached, reads, generations,
+                      display=None):
+    """
+    Generator that reads and encodes the tiles of a batch and yields the bundle
+
+    Args:
+        resource (spdb.project.BossResource): Resource for the channel
+        orientation (str): xy, xz or yz
+        resolution (int): Resolution of the tiles
+        time_range (list(int)): [start, stop) time samples of the tiles
+        renderer (class): Renderer to encode tiles with
+        cached (list(((int, int, int), str, bytes))): Indices, key and encoded content of tiles from the tile cache
+        reads (list((CutoutBlock, list(((int, int, int), CutoutBlock, str))))): Region to cut out for each group of
+            tiles that need to be rendered, and the indices, region and key of each of its tiles
+        generations ((str, dict)): Epoch and "t&x&y&z" field to write generation of every cuboid the reads touch, from
+            get_batch_generations()
+        display (bosstiles.display.DisplaySettings): Display settings to render tiles with, if any
+
+    Yields:
+        (bytes): The bundle header, then one frame per tile
+    """
+    yield encode_bundle_header(len(cached) + sum(len(tiles) for _, tiles in reads))
+    for tile, key, content in cached:
+        yield encode_bundle_tile(tile, key, content)
+
+    epoch, values = generations
+    executor = get_batch_executor()
+    pending = set()
+    blocks = {}
+    try:
+        for block, tiles in reads:
+            fields = get_cuboid_fields(block.corner, block.extent, resolution, time_range)
+            block_generations = (epoch, [values[field] for field in fields])
+            future = executor.submit(_read_block, resource, orientation, block, resolution, time_range,
+                                     block_generations)
+            blocks[future] = (block, tiles)
+            pending.add(future)
+
+        # Encode each group's tiles as soon as its cutout is ready, and send tiles as soon as they are encoded
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future in blocks:
+                    block, tiles = blocks.pop(future)
+                    data = future.result()
+                    for tile, region, key in tiles:
+                        pending.add(executor.submit(_encode_tile, resource, orientation, renderer, data, block, tile,
+                                                    region, key, time_range, display))
+                else:
+                    yield future.result()
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+def get_batch_generations(resource, resolution, fields, generations=None):
+    """
+    Read the write generations of a set of cuboids in a single round trip
+
+    Args:
+        resource (spdb.project.BossResource): Resource for the channel
+        resolution (int): Resolution of the cuboids
+        fields (iterable(str)): "t&x&y&z" field of each cuboid
+        generations ((str, dict)): Generations that have already been read by a previous call. Only the missing fields
+            are read.
+
+    Returns:
+        (str, dict): The epoch of the channel's generations, and the write generation of each field
+    """
+    epoch, values = generations if generations is not None else (None, {})
+    missing = [field for field in OrderedDict.fromkeys(fields) if field not in values]
+    if missing:
+        read_epoch, read_values = get_generations(resource, resolution, missing)
+        epoch = epoch or read_epoch
+        values = dict(values)
+        values.update(zip(missing, read_values))
+    return epoch, values
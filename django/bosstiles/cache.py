@@ -0,0 +1,336 @@
+# Copyright 2016 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Cache of rendered (encoded) tiles and images
+#
+# Tiles are requested far more often than the data under them changes, so the encoded PNG/JPEG of each tile is kept
+# in up to three tiers, checked in order: an LRU in each process's memory, a directory on the server's local disk and
+# the cache-state redis database shared by all servers. A hit in a lower tier is copied into the tiers above it.
+#
+# Entries are keyed by the tile's ETag, which is computed from the channel, resolution, region, time samples, image
+# plane, format and the write generations of the cuboids under the tile (see bossspatialdb/versioning.py). A write to
+# any of those cuboids, or a completed ingest job into the channel, which replaces the generations' epoch, changes the
+# key, so stale tiles are never served from any tier and are left to be evicted or expire.
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from redis.exceptions import RedisError
+
+from bossspatialdb.versioning import get_client
+from bossutils.logger import BossLogger
+
+TILE_KEY = "TILE&{}"
+
+
+class MemoryTier(object):
+    """
+    LRU of encoded tiles in the process's memory
+    """
+    name = 'memory'
+
+    def __init__(self, max_bytes):
+        """
+        Args:
+            max_bytes (int): Maximum number of bytes of tiles to keep
+        """
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            content = self._entries.get(key)
+            if content is not None:
+                self._entries.move_to_end(key)
+            return content
+
+    def put(self, key, content):
+        if len(content) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self.nbytes -= len(self._entries.pop(key))
+            self._entries[key] = content
+            self.nbytes += len(content)
+            while self.nbytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.nbytes -= len(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+
+class DiskTier(object):
+    """
+    Encoded tiles in a directory on local disk, shared by the server's processes
+
+    Files are touched when they are read, and once this process has written a tenth of the budget the least recently
+    used files are removed until the directory is back under its budget.
+    """
+    name = 'disk'
+
+    def __init__(self, directory, max_bytes):
+        """
+        Args:
+            directory (str): Directory to keep tiles in. It is created if it doesn't exist.
+            max_bytes (int): Maximum number of bytes of tiles to keep in the directory
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._written = 0
+        self._lock = threading.Lock()
+
+    def _get_path(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def get(self, key):
+        path = self._get_path(key)
+        try:
+            with open(path, 'rb') as file_obj:
+                content = file_obj.read()
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return content
+
+    def put(self, key, content):
+        path = self._get_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # Write to a temporary file first so other processes never read a partial tile
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, 'wb') as file_obj:
+                file_obj.write(content)
+            os.replace(tmp_path, path)
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        with self._lock:
+            self._written += len(content)
+            prune = self._written > self.max_bytes // 10
+            if prune:
+                self._written = 0
+        if prune:
+            self.prune()
+
+    def prune(self, max_bytes=None):
+        """
+        Remove the least recently used tiles until the directory is under its budget
+
+        Args:
+            max_bytes (int): Budget to prune to, instead of the tier's
+        """
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        files = []
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def clear(self):
+        self.prune(0)
+
+
+class RedisTier(object):
+    """
+    Encoded tiles in the cache-state redis database, shared by all servers, kept for settings.TILE_CACHE_REDIS_TTL
+    seconds
+    """
+    name = 'redis'
+
+    def __init__(self, ttl):
+        """
+        Args:
+            ttl (int): Number of seconds a tile is kept
+        """
+        self.ttl = ttl
+
+    def get(self, key):
+        return get_client().get(TILE_KEY.format(key))
+
+    def put(self, key, content):
+        get_client().setex(TILE_KEY.format(key), self.ttl, content)
+
+    def clear(self):
+        client = get_client()
+        for key in client.scan_iter(TILE_KEY.format('*')):
+            client.delete(key)
+
+
+class TileCache(object):
+    """
+    Layered cache of encoded tiles
+
+    A tier that fails (eg. the disk is full or redis is unreachable) is logged and skipped, so the tile is rendered
+    instead of the request failing.
+    """
+    def __init__(self, tiers):
+        """
+        Args:
+            tiers (list): Tiers to check in order, fastest first
+        """
+        self.tiers = tiers
+        self._lock = threading.Lock()
+        self.stats = {'misses': 0, 'errors': 0}
+        self.stats.update({'{}_hits'.format(tier.name): 0 for tier in tiers})
+
+    def get(self, key):
+        """
+        Get an encoded tile
+
+        Args:
+            key (str): Key of the tile, from get_tile_key()
+
+        Returns:
+            (bytes|None): The encoded tile, or None if no tier has it
+        """
+        for idx, tier in enumerate(self.tiers):
+            content = self._call(tier, 'get', key)
+            if content is not None:
+                self._count('{}_hits'.format(tier.name))
+                for upper in self.tiers[:idx]:
+                    self._call(upper, 'put', key, content)
+                return content
+        self._count('misses')
+        return None
+
+    def put(self, key, content):
+        """
+        Add an encoded tile to every tier
+
+        Args:
+            key (str): Key of the tile, from get_tile_key()
+            content (bytes): The encoded tile
+        """
+        if len(content) > settings.TILE_CACHE_MAX_TILE_SIZE:
+            return
+        for tier in self.tiers:
+            self._call(tier, 'put', key, content)
+
+    def clear(self):
+        """
+        Drop all tiles from every tier
+        """
+        for tier in self.tiers:
+            self._call(tier, 'clear')
+
+    def get_stats(self):
+        """
+        Get the cache's counters
+
+        Returns:
+            (dict): Number of hits in each tier ('<tier>_hits'), misses, and tier operations that failed ('errors')
+        """
+        with self._lock:
+            return dict(self.stats)
+
+    def _count(self, stat):
+        with self._lock:
+            self.stats[stat] += 1
+
+    def _call(self, tier, method, *args):
+        try:
+            return getattr(tier, method)(*args)
+        except (OSError, RedisError) as err:
+            self._count('errors')
+            BossLogger().logger.warning("Tile cache {} tier {} failed: {}".format(tier.name, method, err))
+            return None
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_tile_cache():
+    """
+    Get the process's tile cache, with the tiers listed in settings.TILE_CACHE_TIERS
+
+    Returns:
+        (TileCache)
+    """
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            tiers = []
+            for name in settings.TILE_CACHE_TIERS:
+                if name == 'memory':
+                    tiers.append(MemoryTier(settings.TILE_CACHE_MEMORY_SIZE))
+                elif name == 'disk':
+                    tiers.append(DiskTier(settings.TILE_CACHE_DIR, settings.TILE_CACHE_DISK_SIZE))
+                elif name == 'redis':
+                    tiers.append(RedisTier(settings.TILE_CACHE_REDIS_TTL))
+                else:
+                    raise ValueError("Unknown tile cache tier: {}".format(name))
+            _cache = TileCache(tiers)
+        return _cache
+
+
+def clear_tile_cache():
+    """
+    Drop all tiles from every tier of the process's tile cache
+    """
+    get_tile_cache().clear()
+
+
+def get_tile_key(etag):
+    """
+    Get the cache key of a tile
+
+    Args:
+        etag (str): Quoted ETag of the tile, which covers the region, its write generations and the rendering options
+
+    Returns:
+        (str)
+    """
+    return etag.strip('"')
+
+
+def cache_rendered_tile(key):
+    """
+    Get a post-render callback that adds a response's encoded tile to the cache
+
+    Args:
+        key (str): Key of the tile, from get_tile_key()
+
+    Returns:
+        (callable): Pass to Response.add_post_render_callback()
+    """
+    def callback(response):
+        if response.status_code == 200:
+            get_tile_cache().put(key, response.content)
+
+    return callback
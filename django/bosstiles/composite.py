@@ -0,0 +1,241 @@
+# Copyright 2016 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Composite images of several channels of an experiment
+#
+# Other channels can be overlaid on the channel of a tile or image with ?overlay=<channel>[,<colormap>[,<window>]],
+# repeated for each channel. The layers are read concurrently and blended in order into one RGB image:
+#
+#   * uint8 and uint16 channels are rendered through the lookup table of their window and colormap, like a single
+#     channel with display settings, and added together. This is the usual way to combine fluorescence channels.
+#   * uint32 and uint64 (annotation) channels are drawn over the layers below them with
+#     settings.TILE_COMPOSITE_ANNOTATION_OPACITY. Id 0 is transparent. The ids colormap gives each id its own color,
+#     any other colormap draws every id in the colormap's brightest color.
+from concurrent.futures import ThreadPoolExecutor
+import re
+import threading
+
+import numpy as np
+from django.conf import settings
+from PIL import Image
+
+from bosscore.error import BossError, ErrorCodes
+from bosscore.request import BossRequest
+from bossspatialdb.pool import get_spatialdb
+from bossspatialdb.statistics import STATISTICS_DATATYPES
+from spdb import project
+
+from .display import COLORMAPS, DisplaySettings, get_display_args, get_display_settings, get_colormap_table, \
+    get_lut, get_plane
+from .slabs import image_cutout
+
+# Colormap of an annotation layer that gives each id its own color
+IDS_COLORMAP = 'ids'
+
+OVERLAY = re.compile(r"^(?P<channel>[\w_-]+)(,(?P<colormap>[\w_-]*))?(,(?P<window>\d+:\d+|auto))?$")
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_composite_executor():
+    """
+    Get this process's thread pool for reading the layers of composite images
+
+    Returns:
+        (concurrent.futures.ThreadPoolExecutor)
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=settings.TILE_COMPOSITE_WORKERS)
+        return _executor
+
+
+def get_overlay_args(params):
+    """
+    Parse the channels to overlay out of request parameters
+
+    Args:
+        params (django.http.QueryDict): Query parameters. Each overlay parameter is <channel>[,<colormap>[,<window>]].
+
+    Returns:
+        (list(dict)): Channel name, colormap (None for the default) and window (None for the channel's default) of
+        each overlay, in order
+
+    Raises:
+        BossError: If an overlay is invalid or there are too many
+    """
+    overlays = []
+    for value in params.getlist("overlay"):
+        m = OVERLAY.match(value)
+        if not m:
+            raise BossError("Invalid overlay '{}'. Must be formatted as channel[,colormap[,low:high|auto]]".format(
+                value), ErrorCodes.INVALID_ARGUMENT)
+        colormap = m.group('colormap') or None
+        if colormap is not None and colormap not in COLORMAPS and colormap != IDS_COLORMAP:
+            raise BossError("Invalid colormap '{}'. Supported colormaps: {}".format(
+                colormap, ", ".join(sorted(COLORMAPS) + [IDS_COLORMAP])), ErrorCodes.INVALID_ARGUMENT)
+        overlays.append({"channel": m.group('channel'), "colormap": colormap, "window": m.group('window')})
+
+    if len(overlays) + 1 > settings.TILE_COMPOSITE_MAX_CHANNELS:
+        raise BossError("A composite can have at most {} channels".format(settings.TILE_COMPOSITE_MAX_CHANNELS),
+                        ErrorCodes.INVALID_ARGUMENT)
+    return overlays
+
+
+def get_overlays(request, request_args, args, experiment, frame, time_sample):
+    """
+    Look up the channels to overlay and resolve their display settings
+
+    Args:
+        request (rest_framework.request.Request): The request. The user must be able to read every channel.
+        request_args (dict): BossRequest arguments of the tile or image, used for each channel in turn
+        args (list(dict)): Output of get_overlay_args()
+        experiment (bosscore.models.Experiment): Experiment the channels belong to
+        frame (bosscore.models.CoordinateFrame): The experiment's coordinate frame
+        time_sample (int): Time sample default windows are computed for
+
+    Returns:
+        (list((spdb.project.BossResource, DisplaySettings))): Resource and display settings of each overlay
+
+    Raises:
+        BossError: If a channel doesn't exist, can't be read or can't be rendered with its settings
+    """
+    overlays = []
+    for arg in args:
+        req = BossRequest(request, dict(request_args, channel_name=arg["channel"]))
+        resource = project.BossResourceDjango(req)
+
+        if resource.get_data_type() in STATISTICS_DATATYPES:
+            if arg["colormap"] == IDS_COLORMAP:
+                raise BossError("The {} colormap is only supported for annotation channels".format(IDS_COLORMAP),
+                                ErrorCodes.INVALID_ARGUMENT)
+            display_args = get_display_args({"window": arg["window"], "colormap": arg["colormap"] or "gray"})
+            display = get_display_settings(display_args, resource, experiment, frame, time_sample)
+        else:
+            display = DisplaySettings(None, None, arg["colormap"] or IDS_COLORMAP)
+        overlays.append((resource, display))
+    return overlays
+
+
+def get_composite_settings(request, request_args, resource, req):
+    """
+    Resolve the display settings of a tile or image and the channels to overlay on it
+
+    The tile or image's channel is the bottom layer of a composite. If no display settings are given for it, it is
+    rendered in gray with its default window.
+
+    Args:
+        request (rest_framework.request.Request): The request
+        request_args (dict): BossRequest arguments of the tile or image
+        resource (spdb.project.BossResource): Resource for the tile or image's channel
+        req (bosscore.request.BossRequest): The validated tile or image request
+
+    Returns:
+        (DisplaySettings|None, list((spdb.project.BossResource, DisplaySettings))): Display settings of the channel,
+        and the resource and display settings of each overlay
+
+    Raises:
+        BossError: If a setting or overlay is invalid
+    """
+    display_args = get_display_args(request.query_params)
+    overlay_args = get_overlay_args(request.query_params)
+    if overlay_args and display_args is None:
+        display_args = get_display_args({"colormap": "gray"})
+
+    time_sample = req.get_time().start
+    display = get_display_settings(display_args, resource, req.experiment, req.coord_frame, time_sample)
+    return display, get_overlays(request, request_args, overlay_args, req.experiment, req.coord_frame, time_sample)
+
+
+def _read_layer(resource, orientation, corner, extent, resolution, time_range, generations):
+    with get_spatialdb() as cache:
+        return image_cutout(cache, resource, orientation, corner, extent, resolution, time_range, generations)
+
+
+def read_layers(layers, orientation, corner, extent, resolution, time_range):
+    """
+    Read the image of each layer of a composite concurrently
+
+    Args:
+        layers (list((spdb.project.BossResource, (str, list(int))))): Resource of each layer and its generations, from
+            get_generations()
+        orientation (str): xy, xz or yz
+        corner ((int, int, int)): (x, y, z) corner of the image
+        extent ((int, int, int)): (x, y, z) size of the image
+        resolution (int): Resolution of the image
+        time_range (list(int)): [start, stop) time samples of the image
+
+    Returns:
+        (list(spdb.spatialdb.Cube)): Cutout of each layer, in order
+    """
+    executor = get_composite_executor()
+    futures = [executor.submit(_read_layer, resource, orientation, corner, extent, resolution, time_range, generations)
+               for resource, generations in layers]
+    return [future.result() for future in futures]
+
+
+def get_id_colors(ids):
+    """
+    Get a color for each annotation id. Colors are bright enough to stand out over dark images.
+
+    Args:
+        ids (numpy.ndarray): Annotation ids
+
+    Returns:
+        (numpy.ndarray): uint8 RGB color of each id, with a trailing axis of size 3
+    """
+    hashed = ids.astype(np.uint64) * np.uint64(0x9E3779B97F4A7C15)
+    channels = [(hashed >> np.uint64(shift)) & np.uint64(0xFF) for shift in (40, 48, 56)]
+    return (64 + np.stack(channels, axis=-1) % 192).astype(np.uint8)
+
+
+def render_composite(cubes, orientation, displays):
+    """
+    Blend the images of several channels into one RGB image
+
+    Args:
+        cubes (list(spdb.spatialdb.Cube)): Cutout of each layer, one voxel thick along the axis normal to the image
+            plane
+        orientation (str): xy, xz or yz
+        displays (list(DisplaySettings)): Display settings of each layer. Annotation layers have no window.
+
+    Returns:
+        (PIL.Image.Image): RGB image
+    """
+    rgb = None
+    for cube, display in zip(cubes, displays):
+        plane = get_plane(cube, orientation)
+        if rgb is None:
+            rgb = np.zeros(plane.shape + (3,), dtype=np.uint16)
+
+        if display.window is not None:
+            lut = get_lut(2 ** (plane.dtype.itemsize * 8), display.window, display.gamma, display.colormap)
+            if lut.ndim == 1:
+                lut = get_colormap_table(display.colormap)[lut]
+            rgb += lut[plane]
+            continue
+
+        np.minimum(rgb, 255, out=rgb)
+        labeled = plane != 0
+        if display.colormap == IDS_COLORMAP:
+            colors = get_id_colors(plane[labeled])
+        else:
+            colors = get_colormap_table(display.colormap)[255]
+        opacity = settings.TILE_COMPOSITE_ANNOTATION_OPACITY
+        rgb[labeled] = np.rint(rgb[labeled] * (1 - opacity) + colors * opacity).astype(np.uint16)
+
+    np.minimum(rgb, 255, out=rgb)
+    return Image.fromarray(rgb.astype(np.uint8), 'RGB')
@@ -0,0 +1,279 @@
+# Copyright 2016 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Display settings for tiles and images: intensity window, gamma and colormap
+#
+# uint8 and uint16 images can be rendered through a lookup table instead of the spatial database's image conversion.
+# The table maps every possible voxel value to an 8-bit gray level or RGB color, so rendering is a single vectorized
+# indexing pass over the image, and tables are built once per set of display settings.
+#
+# The window is the [low, high] range of values stretched over the display range, so the equivalent window width is
+# high - low and the level is their midpoint. When no window is given, or window=auto, a default is computed for the
+# channel from percentiles of its histogram at the coarsest resolution. The histogram uses the cached partials of
+# bossspatialdb/statistics.py and the resulting window is kept in memory for settings.TILE_DEFAULT_WINDOW_TTL seconds.
+# If the coarsest resolution is over settings.STATISTICS_MAX_SIZE bytes, the default window is the full range of the
+# datatype, so a tile request never reads more than a statistics request may.
+from collections import namedtuple
+import functools
+import re
+import threading
+import time
+
+import numpy as np
+from django.conf import settings
+from PIL import Image
+
+from bosscore.error import BossError, ErrorCodes
+from bossspatialdb.downsample import LevelBounds
+from bossspatialdb.statistics import STATISTICS_DATATYPES, get_region_histogram
+
+from .pyramid import get_level_bounds
+
+# Colors of each colormap at positions from 0 to 1. Colors in between are interpolated.
+COLORMAPS = {
+    'gray': [(0, (0, 0, 0)), (1, (255, 255, 255))],
+    'red': [(0, (0, 0, 0)), (1, (255, 0, 0))],
+    'green': [(0, (0, 0, 0)), (1, (0, 255, 0))],
+    'blue': [(0, (0, 0, 0)), (1, (0, 0, 255))],
+    'cyan': [(0, (0, 0, 0)), (1, (0, 255, 255))],
+    'magenta': [(0, (0, 0, 0)), (1, (255, 0, 255))],
+    'yellow': [(0, (0, 0, 0)), (1, (255, 255, 0))],
+    'hot': [(0, (0, 0, 0)), (0.375, (255, 0, 0)), (0.75, (255, 255, 0)), (1, (255, 255, 255))],
+    'jet': [(0, (0, 0, 128)), (0.125, (0, 0, 255)), (0.375, (0, 255, 255)), (0.625, (255, 255, 0)),
+            (0.875, (255, 0, 0)), (1, (128, 0, 0))],
+    'viridis': [(0, (68, 1, 84)), (0.25, (59, 82, 139)), (0.5, (33, 145, 140)), (0.75, (94, 201, 98)),
+                (1, (253, 231, 37))],
+}
+
+MAX_GAMMA = 10
+
+# Intensity window (low, high), gamma and colormap name. Part of the ETag of an image rendered with them.
+DisplaySettings = namedtuple('DisplaySettings', ['window', 'gamma', 'colormap'])
+
+_default_windows = {}
+_default_windows_lock = threading.Lock()
+
+
+def get_display_args(params):
+    """
+    Parse display settings out of request parameters
+
+    Args:
+        params (dict): Query parameters or request body. window is "low:high" or "auto", gamma is a positive number
+            (values over 1 brighten mid-tones) and colormap is a key of COLORMAPS.
+
+    Returns:
+        (dict|None): Parsed settings, with window None for the channel's default. None if no setting was given.
+
+    Raises:
+        BossError: If a setting is invalid
+    """
+    if not any(params.get(name) is not None for name in DisplaySettings._fields):
+        return None
+
+    window = params.get("window")
+    if window is not None and str(window) != "auto":
+        m = re.match(r"^(?P<low>\d+):(?P<high>\d+)$", str(window))
+        if not m or int(m.group('low')) >= int(m.group('high')):
+            raise BossError("Invalid window '{}'. Must be formatted as low:high or auto".format(window),
+                            ErrorCodes.INVALID_ARGUMENT)
+        window = (int(m.group('low')), int(m.group('high')))
+    else:
+        window = None
+
+    try:
+        gamma = float(params.get("gamma", 1))
+    except (TypeError, ValueError):
+        gamma = None
+    if gamma is None or not 0 < gamma <= MAX_GAMMA:
+        raise BossError("Invalid gamma '{}'. Must be a number greater than 0 and at most {}".format(
+            params.get("gamma"), MAX_GAMMA), ErrorCodes.INVALID_ARGUMENT)
+
+    colormap = params.get("colormap", "gray")
+    if colormap not in COLORMAPS:
+        raise BossError("Invalid colormap '{}'. Supported colormaps: {}".format(
+            colormap, ", ".join(sorted(COLORMAPS))), ErrorCodes.INVALID_ARGUMENT)
+
+    return {"window": window, "gamma": gamma, "colormap": colormap}
+
+
+def get_display_settings(args, resource, experiment, frame, time_sample):
+    """
+    Resolve parsed display settings for a channel, computing its default window if needed
+
+    Args:
+        args (dict|None): Output of get_display_args()
+        resource (spdb.project.BossResource): Resource for the channel
+        experiment (bosscore.models.Experiment): Experiment the channel belongs to
+        frame (bosscore.models.CoordinateFrame): The experiment's coordinate frame
+        time_sample (int): Time sample the window is computed for
+
+    Returns:
+        (DisplaySettings|None): The settings, or None if args is None
+
+    Raises:
+        BossError: If the channel's datatype can't be rendered with display settings
+    """
+    if args is None:
+        return None
+
+    if resource.get_data_type() not in STATISTICS_DATATYPES:
+        raise BossError("Display settings are only supported for {} channels".format(
+            " and ".join(STATISTICS_DATATYPES)), ErrorCodes.DATATYPE_NOT_SUPPORTED)
+
+    window = args["window"]
+    if window is None:
+        window = get_default_window(resource, experiment, frame, time_sample)
+    return DisplaySettings(window, args["gamma"], args["colormap"])
+
+
+def get_default_window(resource, experiment, frame, time_sample):
+    """
+    Get a channel's default window from percentiles of its histogram at the coarsest resolution
+
+    Zero is left out of the histogram, since it is what unwritten regions hold. If there is no other value, or the
+    coarsest resolution is over settings.STATISTICS_MAX_SIZE bytes, the window is the full range of the datatype.
+
+    Args:
+        resource (spdb.project.BossResource): Resource for the channel
+        experiment (bosscore.models.Experiment): Experiment the channel belongs to
+        frame (bosscore.models.CoordinateFrame): The experiment's coordinate frame
+        time_sample (int): Time sample to compute the window for
+
+    Returns:
+        ((int, int)): (low, high) window
+    """
+    key = (resource.get_lookup_key(), time_sample)
+    with _default_windows_lock:
+        cached = _default_windows.get(key)
+    if cached is not None and cached[0] > time.time():
+        return cached[1]
+
+    resolution = experiment.num_hierarchy_levels - 1
+    bounds = get_level_bounds(LevelBounds((frame.x_start, frame.y_start, frame.z_start),
+                                          (frame.x_stop, frame.y_stop, frame.z_stop)),
+                              experiment.hierarchy_method,
+                              (frame.x_voxel_size, frame.y_voxel_size, frame.z_voxel_size),
+                              experiment.num_hierarchy_levels)[resolution]
+    extent = [b - a for a, b in zip(bounds.start, bounds.stop)]
+    if int(np.prod(extent)) * resource.get_bit_depth() // 8 > settings.STATISTICS_MAX_SIZE:
+        histogram = None
+        count = 0
+    else:
+        histogram, _, _ = get_region_histogram(resource, resolution, bounds.start, extent,
+                                               [time_sample, time_sample + 1])
+        histogram[0] = 0
+        count = int(histogram.sum())
+
+    if count == 0:
+        window = (0, 2 ** resource.get_bit_depth() - 1)
+    else:
+        cumulative = np.cumsum(histogram)
+        low, high = settings.TILE_DEFAULT_WINDOW_PERCENTILES
+        low = int(np.searchsorted(cumulative, max(1, int(np.ceil(low / 100 * count)))))
+        high = int(np.searchsorted(cumulative, max(1, int(np.ceil(high / 100 * count)))))
+        window = (low, max(high, low + 1))
+
+    with _default_windows_lock:
+        _default_windows[key] = (time.time() + settings.TILE_DEFAULT_WINDOW_TTL, window)
+    return window
+
+
+def clear_default_windows():
+    """
+    Drop the default windows cached by this process
+    """
+    with _default_windows_lock:
+        _default_windows.clear()
+
+
+@functools.lru_cache(maxsize=64)
+def get_colormap_table(colormap):
+    """
+    Get the 256 RGB colors of a colormap
+
+    Args:
+        colormap (str): Key of COLORMAPS
+
+    Returns:
+        (numpy.ndarray): (256, 3) uint8 table
+    """
+    positions = [position for position, _ in COLORMAPS[colormap]]
+    levels = np.linspace(0, 1, 256)
+    table = np.empty((256, 3), dtype=np.uint8)
+    for channel in range(3):
+        colors = [color[channel] for _, color in COLORMAPS[colormap]]
+        table[:, channel] = np.rint(np.interp(levels, positions, colors))
+    return table
+
+
+@functools.lru_cache(maxsize=64)
+def get_lut(num_values, window, gamma, colormap):
+    """
+    Build the lookup table for a set of display settings
+
+    Args:
+        num_values (int): Number of possible voxel values (256 or 65536)
+        window ((int, int)): (low, high) values mapped to the ends of the display range
+        gamma (float): Gamma. Values over 1 brighten mid-tones.
+        colormap (str): Key of COLORMAPS
+
+    Returns:
+        (numpy.ndarray): Read-only (num_values,) uint8 gray levels for the gray colormap, otherwise (num_values, 3)
+        uint8 RGB colors
+    """
+    low, high = window
+    levels = np.clip((np.arange(num_values, dtype=np.float64) - low) / (high - low), 0, 1)
+    if gamma != 1:
+        levels **= 1 / gamma
+    levels = np.rint(levels * 255).astype(np.uint8)
+
+    lut = levels if colormap == 'gray' else get_colormap_table(colormap)[levels]
+    lut.setflags(write=False)
+    return lut
+
+
+def get_plane(cube, orientation):
+    """
+    Get the image plane of a cutout. Like the spatial database's image conversion, the first time sample is used.
+
+    Args:
+        cube (spdb.spatialdb.Cube): Cutout one voxel thick along the axis normal to the image plane
+        orientation (str): xy, xz or yz
+
+    Returns:
+        (numpy.ndarray): 2D image
+    """
+    if orientation == 'xy':
+        return cube.data[0, 0, :, :]
+    elif orientation == 'xz':
+        return cube.data[0, :, 0, :]
+    return cube.data[0, :, :, 0]
+
+
+def render_image(cube, orientation, display):
+    """
+    Render the image of a cutout through the lookup table of its display settings
+
+    Args:
+        cube (spdb.spatialdb.Cube): Cutout one voxel thick along the axis normal to the image plane
+        orientation (str): xy, xz or yz
+        display (DisplaySettings): Display settings
+
+    Returns:
+        (PIL.Image.Image): 8-bit gray or RGB image
+    """
+    plane = get_plane(cube, orientation)
+    lut = get_lut(2 ** (plane.dtype.itemsize * 8), display.window, display.gamma, display.colormap)
+    return Image.fromarray(lut[plane], 'L' if lut.ndim == 1 else 'RGB')
@@ -0,0 +1,290 @@
+# Copyright 2016 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Background jobs that pre-render the tile pyramid of a channel
+#
+# Jobs run in the background job thread pool of bossspatialdb.jobs and render their blocks with a pool of
+# settings.TILE_RENDER_WORKERS threads. The render_tiles management command renders with a pool of processes instead.
+import time
+
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+
+from bosscore.error import BossError, ErrorCodes
+from bosscore.request import BossRequest
+from bossspatialdb.downsample import LevelBounds
+from bossspatialdb.jobs import JobCancelled, get_channel, submit_job, finish_job, fail_orphaned_jobs
+from bossutils.logger import BossLogger
+from spdb import project
+
+from .models import TileRenderJob
+from .pyramid import ORIENTATIONS, RENDERERS, get_level_bounds, plan_pyramid, render_pyramid
+
+OUTPUTS = ('cache', 'directory')
+
+# Minimum number of seconds between progress updates of a job
+PROGRESS_INTERVAL = 1
+
+
+def get_render_resource(request, collection, experiment, channel):
+    """
+    Check a user can pre-render the tiles of a channel and get its resource
+
+    Args:
+        request (rest_framework.request.Request): Request that is starting the job. The user must be able to add data
+                                                  to the channel.
+        collection (str): Collection name
+        experiment (str): Experiment name
+        channel (str): Channel name
+
+    Returns:
+        (bosscore.models.Experiment, bosscore.models.Channel, spdb.project.BossResource)
+
+    Raises:
+        BossError: If the channel doesn't exist, isn't an image channel or the user can't write to it
+    """
+    exp, chan = get_channel(collection, experiment, channel)
+    if chan.type != 'image':
+        raise BossError("Tiles can only be pre-rendered for image channels", ErrorCodes.INVALID_ARGUMENT)
+
+    frame = exp.coord_frame
+    request_args = {
+        "service": "cutout",
+        "method": "POST",
+        "collection_name": collection,
+        "experiment_name": experiment,
+        "channel_name": channel,
+        "resolution": chan.base_resolution,
+        "x_args": "{}:{}".format(frame.x_start, frame.x_stop),
+        "y_args": "{}:{}".format(frame.y_start, frame.y_stop),
+        "z_args": "{}:{}".format(frame.z_start, frame.z_stop),
+        "time_args": None,
+    }
+    return exp, chan, project.BossResourceDjango(BossRequest(request, request_args))
+
+
+def plan_render(exp, chan, resource, orientations=None, tile_sizes=None, formats=None, resolutions=None,
+                time_range=None):
+    """
+    Validate what to pre-render for a channel and split it into blocks
+
+    Args:
+        exp (bosscore.models.Experiment): Experiment the channel belongs to
+        chan (bosscore.models.Channel): The channel
+        resource (spdb.project.BossResource): Resource for the channel
+        orientations (list(str)): Image planes to render. Defaults to xy.
+        tile_sizes (list(int)): Tile sizes to render. Defaults to settings.TILE_RENDER_TILE_SIZES.
+        formats (list(str)): Formats to render (png or jpg). Defaults to png.
+        resolutions ((int, int)): [start, stop) resolutions to render. Defaults to all of the experiment's levels.
+        time_range (list(int)): [start, stop) time samples to render. Defaults to the channel's default time sample.
+
+    Returns:
+        (dict, list(bosstiles.pyramid.RenderBlock)): The arguments with defaults filled in, and the blocks
+
+    Raises:
+        BossError: If the arguments are invalid or there are more than settings.TILE_RENDER_MAX_TILES tiles
+    """
+    orientations = orientations or ['xy']
+    tile_sizes = tile_sizes or settings.TILE_RENDER_TILE_SIZES
+    formats = formats or ['png']
+    if resolutions is None:
+        resolutions = (0, exp.num_hierarchy_levels)
+    if time_range is None:
+        time_range = [chan.default_time_sample, chan.default_time_sample + 1]
+
+    for orientation in orientations:
+        if orientation not in ORIENTATIONS:
+            raise BossError("Invalid orientation '{}'. Supported orientations: {}".format(
+                orientation, ", ".join(ORIENTATIONS)), ErrorCodes.INVALID_ARGUMENT)
+    for fmt in formats:
+        if fmt not in RENDERERS:
+            raise BossError("Invalid tile format '{}'. Supported formats: {}".format(
+                fmt, ", ".join(sorted(RENDERERS))), ErrorCodes.INVALID_ARGUMENT)
+    try:
+        tile_sizes = [int(size) for size in tile_sizes]
+        resolutions = [int(res) for res in resolutions]
+        time_range = [int(t) for t in time_range]
+    except (TypeError, ValueError):
+        raise BossError("Tile sizes, resolutions and time samples must be integers", ErrorCodes.TYPE_ERROR)
+    if any(size <= 0 for size in tile_sizes):
+        raise BossError("Tile sizes must be positive", ErrorCodes.INVALID_ARGUMENT)
+    if not 0 <= resolutions[0] < resolutions[1] <= exp.num_hierarchy_levels:
+        raise BossError("Invalid resolution range {}:{}. The experiment has {} levels".format(
+            resolutions[0], resolutions[1], exp.num_hierarchy_levels), ErrorCodes.INVALID_ARGUMENT)
+    if not 0 <= time_range[0] < time_range[1] <= exp.num_time_samples:
+        raise BossError("Invalid time range {}:{}. The experiment has {} time samples".format(
+            time_range[0], time_range[1], exp.num_time_samples), ErrorCodes.INVALID_ARGUMENT)
+
+    frame = exp.coord_frame
+    frame_bounds = LevelBounds((frame.x_start, frame.y_start, frame.z_start),
+                               (frame.x_stop, frame.y_stop, frame.z_stop))
+    level_bounds = get_level_bounds(frame_bounds, exp.hierarchy_method,
+                                    (frame.x_voxel_size, frame.y_voxel_size, frame.z_voxel_size),
+                                    exp.num_hierarchy_levels)
+    blocks = plan_pyramid(frame_bounds, level_bounds, range(*resolutions), orientations, tile_sizes, time_range,
+                          resource.get_bit_depth() // 8, settings.TILE_RENDER_BLOCK_SIZE)
+
+    num_tiles = sum(block.tiles for block in blocks) * len(formats)
+    if num_tiles > settings.TILE_RENDER_MAX_TILES:
+        raise BossError("Pre-rendering {} tiles is over the limit of {}. Render fewer resolutions, orientations, tile "
+                        "sizes or time samples.".format(num_tiles, settings.TILE_RENDER_MAX_TILES),
+                        ErrorCodes.REQUEST_TOO_LARGE)
+
+    args = {"orientations": orientations, "tile_sizes": tile_sizes, "formats": formats, "resolutions": resolutions,
+            "time_range": time_range}
+    return args, blocks
+
+
+def create_render_job(request, collection, experiment, channel, orientations=None, tile_sizes=None, formats=None,
+                      resolutions=None, time_range=None, output=None):
+    """
+    Validate a tile pre-rendering request, record the job and start it in the background
+
+    Args:
+        request (rest_framework.request.Request): Request that is starting the job. The user must be able to add data
+                                                  to the channel.
+        collection (str): Collection name
+        experiment (str): Experiment name
+        channel (str): Channel name
+        orientations (list(str)): Image planes to render. Defaults to xy.
+        tile_sizes (list(int)): Tile sizes to render. Defaults to settings.TILE_RENDER_TILE_SIZES.
+        formats (list(str)): Formats to render (png or jpg). Defaults to png.
+        resolutions ((int, int)): [start, stop) resolutions to render. Defaults to all of the experiment's levels.
+        time_range (list(int)): [start, stop) time samples to render. Defaults to the channel's default time sample.
+        output (str): 'cache' to add tiles to the tile cache (default) or 'directory' to write them to
+                      settings.TILE_RENDER_DIR
+
+    Returns:
+        (bosstiles.models.TileRenderJob): The job
+
+    Raises:
+        BossError: If the request is invalid
+    """
+    output = output or 'cache'
+    if output not in OUTPUTS:
+        raise BossError("Invalid output '{}'. Supported outputs: {}".format(output, ", ".join(OUTPUTS)),
+                        ErrorCodes.INVALID_ARGUMENT)
+
+    exp, chan, resource = get_render_resource(request, collection, experiment, channel)
+    args, blocks = plan_render(exp, chan, resource, orientations, tile_sizes, formats, resolutions, time_range)
+
+    job = TileRenderJob.objects.create(creator=request.user, collection=collection, experiment=experiment,
+                                       channel=channel, orientations=",".join(args["orientations"]),
+                                       tile_sizes=",".join(str(size) for size in args["tile_sizes"]),
+                                       formats=",".join(args["formats"]), start_resolution=args["resolutions"][0],
+                                       stop_resolution=args["resolutions"][1], t_start=args["time_range"][0],
+                                       t_stop=args["time_range"][1], output=output,
+                                       tiles_total=sum(block.tiles for block in blocks) * len(args["formats"]),
+                                       heartbeat=timezone.now())
+
+    directory = settings.TILE_RENDER_DIR if output == 'directory' else None
+    submit_job(TileRenderJob, job.id, run_render_job, resource, blocks, args["formats"], directory)
+    return job
+
+
+def get_render_job(request, job_id):
+    """
+    Get a tile pre-rendering job
+
+    Args:
+        request (rest_framework.request.Request): The request. Only the user that created the job can access it.
+        job_id (int): Id of the job
+
+    Returns:
+        (bosstiles.models.TileRenderJob): The job
+
+    Raises:
+        BossError: If the job doesn't exist or belongs to another user
+    """
+    fail_orphaned_jobs(TileRenderJob)
+    try:
+        job = TileRenderJob.objects.get(id=job_id)
+    except TileRenderJob.DoesNotExist:
+        raise BossError("The tile render job with id {} does not exist".format(job_id), ErrorCodes.OBJECT_NOT_FOUND)
+    if job.creator != request.user:
+        raise BossError("Only the creator can access tile render job {}".format(job_id),
+                        ErrorCodes.MISSING_PERMISSION)
+    return job
+
+
+def cancel_render_job(request, job_id):
+    """
+    Cancel a queued or running tile pre-rendering job. Tiles that have already been rendered are kept.
+
+    Args:
+        request (rest_framework.request.Request): The request. Only the user that created the job can cancel it.
+        job_id (int): Id of the job
+
+    Returns:
+        (bosstiles.models.TileRenderJob): The updated job
+
+    Raises:
+        BossError: If the job doesn't exist or belongs to another user
+    """
+    job = get_render_job(request, job_id)
+
+    # The job's thread stops once it sees the status has changed
+    TileRenderJob.objects.filter(id=job.id, status__in=(0, 1)).update(status=4, end_date=timezone.now())
+    job.refresh_from_db()
+    return job
+
+
+def run_render_job(job_id, resource, blocks, formats, directory=None):
+    """
+    Run a tile pre-rendering job, recording its progress and throughput in the database
+
+    Args:
+        job_id (int): Id of the TileRenderJob
+        resource (spdb.project.BossResource): Resource for the channel
+        blocks (list(bosstiles.pyramid.RenderBlock)): Blocks to render
+        formats (list(str)): Formats to render each tile in
+        directory (str): Directory to write tiles to. If None tiles are added to the tile cache.
+
+    Returns:
+        None
+    """
+    try:
+        if not TileRenderJob.objects.filter(id=job_id, status=0).update(status=1):
+            # Cancelled before it started
+            return
+
+        last_update = [0]
+
+        def progress(block, tiles_complete, tiles_per_second):
+            now = time.time()
+            if now - last_update[0] < PROGRESS_INTERVAL:
+                return
+            last_update[0] = now
+            if not TileRenderJob.objects.filter(id=job_id, status=1).update(
+                    current_resolution=block.resolution, tiles_complete=tiles_complete,
+                    tiles_per_second=tiles_per_second):
+                raise JobCancelled()
+
+        start = time.time()
+        tiles_complete = render_pyramid(resource, blocks, formats, directory, settings.TILE_RENDER_WORKERS,
+                                        progress=progress)
+
+        TileRenderJob.objects.filter(id=job_id, status=1).update(
+            status=2, end_date=timezone.now(), tiles_complete=tiles_complete,
+            tiles_per_second=tiles_complete / max(time.time() - start, 1e-6))
+    except JobCancelled:
+        pass
+    except Exception as e:
+        BossLogger().logger.exception("Tile render job {} failed".format(job_id))
+        TileRenderJob.objects.filter(id=job_id).update(status=3, error=str(e), end_date=timezone.now())
+    finally:
+        finish_job(TileRenderJob, job_id)
+        # Each thread gets its own database connection, which isn't closed by the request cycle
+        connection.close()
@@ -0,0 +1,111 @@
+# Copyright 2016 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from bosscore.error import BossError
+from bosstiles.jobs import OUTPUTS, PROGRESS_INTERVAL, get_render_resource, plan_render
+from bosstiles.pyramid import ORIENTATIONS, RENDERERS, render_pyramid
+
+
+class _CommandRequest(object):
+    """
+    The parts of a request that BossRequest needs to check the user's permissions
+    """
+    def __init__(self, user):
+        self.user = user
+        self.method = 'POST'
+        self.version = settings.BOSS_VERSION
+
+
+def _parse_range(value):
+    """
+    Parse a python style range (eg. 0:5)
+    """
+    try:
+        start, stop = [int(part) for part in value.split(':')]
+    except ValueError:
+        raise CommandError("Invalid range '{}'. Must be formatted as start:stop".format(value))
+    return start, stop
+
+
+class Command(BaseCommand):
+    help = ("Pre-render the tile pyramid of an image channel into the tile cache, or into a directory the web server "
+            "can send tiles from, using a pool of processes")
+
+    def add_arguments(self, parser):
+        parser.add_argument('collection')
+        parser.add_argument('experiment')
+        parser.add_argument('channel')
+        parser.add_argument('--user', required=True,
+                            help="User to render as. They must be able to add data to the channel.")
+        parser.add_argument('--orientation', action='append', choices=ORIENTATIONS, dest='orientations',
+                            help="Image plane to render. Can be repeated. Defaults to xy.")
+        parser.add_argument('--tile-size', action='append', type=int, dest='tile_sizes',
+                            help="Tile size to render. Can be repeated. Defaults to settings.TILE_RENDER_TILE_SIZES.")
+        parser.add_argument('--format', action='append', choices=sorted(RENDERERS), dest='formats',
+                            help="Tile format to render. Can be repeated. Defaults to png.")
+        parser.add_argument('--resolutions', help="Resolutions to render (eg. 0:5). Defaults to all levels.")
+        parser.add_argument('--time', help="Time samples to render (eg. 0:1). Defaults to the default time sample.")
+        parser.add_argument('--output', choices=OUTPUTS, default='cache',
+                            help="Add tiles to the tile cache or write them to a directory. Defaults to cache.")
+        parser.add_argument('--directory', default=settings.TILE_RENDER_DIR,
+                            help="Directory to write tiles to. Defaults to settings.TILE_RENDER_DIR.")
+        parser.add_argument('--workers', type=int, default=settings.TILE_RENDER_WORKERS,
+                            help="Number of processes to render with")
+
+    def handle(self, *args, **options):
+        try:
+            user = get_user_model().objects.get(username=options['user'])
+        except get_user_model().DoesNotExist:
+            raise CommandError("User {} does not exist".format(options['user']))
+
+        resolutions = _parse_range(options['resolutions']) if options['resolutions'] else None
+        time_range = list(_parse_range(options['time'])) if options['time'] else None
+        try:
+            exp, chan, resource = get_render_resource(_CommandRequest(user), options['collection'],
+                                                      options['experiment'], options['channel'])
+            render_args, blocks = plan_render(exp, chan, resource, options['orientations'], options['tile_sizes'],
+                                              options['formats'], resolutions, time_range)
+        except BossError as err:
+            raise CommandError(err.message)
+
+        formats = render_args['formats']
+        tiles_total = sum(block.tiles for block in blocks) * len(formats)
+        self.stdout.write("Rendering {} tiles in {} blocks".format(tiles_total, len(blocks)))
+
+        last_update = [0]
+
+        def progress(block, tiles_complete, tiles_per_second):
+            now = time.time()
+            if now - last_update[0] < PROGRESS_INTERVAL and tiles_complete < tiles_total:
+                return
+            last_update[0] = now
+            self.stdout.write("Resolution {}: {}/{} tiles ({:.1f} tiles/s)".format(
+                block.resolution, tiles_complete, tiles_total, tiles_per_second))
+
+        # The worker processes are forked, so don't share this process's database connection with them
+        connection.close()
+
+        start = time.time()
+        directory = options['directory'] if options['output'] == 'directory' else None
+        tiles_complete = render_pyramid(resource, blocks, formats, directory, options['workers'], processes=True,
+                                        progress=progress)
+        elapsed = time.time() - start
+        self.stdout.write(self.style.SUCCESS("Rendered {} tiles in {:.1f}s ({:.1f} tiles/s)".format(
+            tiles_complete, elapsed, tiles_complete / max(elapsed, 1e-6))))
@@ -1,3 +1,62 @@
+# Copyright 2016 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
 from django.db import models
+from django.conf import settings
 
-# Create your models here.
+
+class TileRenderJob(models.Model):
+    """
+    Django Model representing a job that pre-renders the tile pyramid of a channel
+    """
+    creator = models.ForeignKey(settings.AUTH_USER_MODEL)
+    start_date = models.DateTimeField(auto_now_add=True)
+    end_date = models.DateTimeField(null=True)
+    RENDER_STATUS_OPTIONS = (
+            (0, 'Queued'),
+            (1, 'Running'),
+            (2, 'Complete'),
+            (3, 'Failed'),
+            (4, 'Cancelled'),
+        )
+    status = models.IntegerField(choices=RENDER_STATUS_OPTIONS, default=0)
+    error = models.TextField(blank=True)
+
+    collection = models.CharField(max_length=128)
+    experiment = models.CharField(max_length=128)
+    channel = models.CharField(max_length=128)
+
+    # What to render, as comma separated lists, and where to: the tile cache or settings.TILE_RENDER_DIR
+    orientations = models.CharField(max_length=32)
+    tile_sizes = models.CharField(max_length=128)
+    formats = models.CharField(max_length=32)
+    start_resolution = models.IntegerField()
+    stop_resolution = models.IntegerField()
+    t_start = models.IntegerField()
+    t_stop = models.IntegerField()
+    output = models.CharField(max_length=32)
+
+    # Progress. Tiles in each format count separately.
+    current_resolution = models.IntegerField(null=True)
+    tiles_complete = models.BigIntegerField(default=0)
+    tiles_total = models.BigIntegerField(default=0)
+    tiles_per_second = models.FloatField(default=0)
+
+    # Last time the process running the job reported it was still alive
+    heartbeat = models.DateTimeField(null=True)
+
+    class Meta:
+        db_table = u"tile_render_job"
+
+    def __str__(self):
+        return "{}".format(self.id)
@@ -0,0 +1,232 @@
+# Copyright 2016 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Prefetching of the tiles a viewer is likely to request next
+#
+# Viewers step through the axis normal to the image plane one plane at a time and pan to neighbouring tiles. Once a
+# tile or image has been served, the settings.TILE_PREFETCH_DEPTH nearest planes on either side and the neighbouring
+# tiles in the same plane are rendered in the background, warming the cuboid, slab and tile caches.
+#
+# Prefetches run in their own pool of settings.TILE_PREFETCH_WORKERS threads, so they never hold the threads that
+# serve requests. Each user can have at most settings.TILE_PREFETCH_USER_BUDGET prefetches queued or running, and a
+# process at most settings.TILE_PREFETCH_MAX_PENDING. Prefetches over either limit, and tiles that are already queued,
+# are dropped rather than queued.
+from concurrent.futures import ThreadPoolExecutor
+import threading
+
+from django.conf import settings
+
+from bossspatialdb.downsample import LevelBounds
+from bossspatialdb.pool import get_spatialdb
+from bossspatialdb.versioning import get_cuboid_fields, get_generations, make_etag
+from bossutils.logger import BossLogger
+
+from .cache import get_tile_cache, get_tile_key
+from .display import render_image
+from .pyramid import PLANE_AXES
+from .slabs import image_cutout
+
+
+class Prefetcher(object):
+    """
+    Bounded background queue of prefetches, with a budget for each user
+    """
+    def __init__(self, num_workers, user_budget, max_pending):
+        """
+        Args:
+            num_workers (int): Number of threads that run prefetches
+            user_budget (int): Maximum number of prefetches a user can have queued or running
+            max_pending (int): Maximum number of prefetches queued or running
+        """
+        self.user_budget = user_budget
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=num_workers)
+        self._lock = threading.Lock()
+        self._users = {}
+        self._keys = set()
+        self.stats = {'queued': 0, 'dropped': 0, 'completed': 0, 'errors': 0}
+
+    def submit(self, user, key, func, *args):
+        """
+        Queue a prefetch, unless it is already queued or over budget
+
+        Args:
+            user (int): Id of the user the prefetch is for
+            key (hashable): Identifies the prefetch, so the same one is only queued once
+            func (callable): Called with args to run the prefetch
+
+        Returns:
+            (bool): True if the prefetch was queued
+        """
+        with self._lock:
+            if key in self._keys:
+                return False
+            if self._users.get(user, 0) >= self.user_budget or len(self._keys) >= self.max_pending:
+                self.stats['dropped'] += 1
+                return False
+            self._users[user] = self._users.get(user, 0) + 1
+            self._keys.add(key)
+            self.stats['queued'] += 1
+
+        self._executor.submit(self._run, user, key, func, args)
+        return True
+
+    def _run(self, user, key, func, args):
+        stat = 'completed'
+        try:
+            func(*args)
+        except Exception as err:
+            stat = 'errors'
+            BossLogger().logger.warning("Tile prefetch failed: {}".format(err))
+        finally:
+            with self._lock:
+                self.stats[stat] += 1
+                self._keys.discard(key)
+                self._users[user] -= 1
+                if not self._users[user]:
+                    del self._users[user]
+
+    def get_stats(self):
+        """
+        Get the prefetcher's counters
+
+        Returns:
+            (dict): Number of prefetches queued, dropped, completed and failed, and currently pending
+        """
+        with self._lock:
+            stats = dict(self.stats)
+            stats['pending'] = len(self._keys)
+            return stats
+
+
+_prefetcher = None
+_prefetcher_lock = threading.Lock()
+
+
+def get_prefetcher():
+    """
+    Get the process's prefetcher
+
+    Returns:
+        (Prefetcher)
+    """
+    global _prefetcher
+    with _prefetcher_lock:
+        if _prefetcher is None:
+            _prefetcher = Prefetcher(settings.TILE_PREFETCH_WORKERS, settings.TILE_PREFETCH_USER_BUDGET,
+                                     settings.TILE_PREFETCH_MAX_PENDING)
+        return _prefetcher
+
+
+def get_neighbors(orientation, corner, extent, frame, depth):
+    """
+    Get the regions a viewer is likely to request after an image, nearest first
+
+    Args:
+        orientation (str): xy, xz or yz
+        corner ((int, int, int)): (x, y, z) corner of the image
+        extent ((int, int, int)): (x, y, z) size of the image
+        frame (bossspatialdb.downsample.LevelBounds): Coordinate frame. Regions outside it are left out.
+        depth (int): Number of planes to include on either side along the axis normal to the image plane
+
+    Returns:
+        (list(((int, int, int), (int, int, int)))): (x, y, z) corner and extent of each region
+    """
+    axes, normal = PLANE_AXES[orientation]
+    shifts = []
+    for distance in range(1, depth + 1):
+        shifts.extend([(normal, distance), (normal, -distance)])
+    for axis in axes:
+        shifts.extend([(axis, extent[axis]), (axis, -extent[axis])])
+
+    neighbors = []
+    for axis, shift in shifts:
+        neighbor = list(corner)
+        neighbor[axis] += shift
+        if all(frame.start[dim] <= neighbor[dim] and neighbor[dim] + extent[dim] <= frame.stop[dim]
+               for dim in range(3)):
+            neighbors.append((tuple(neighbor), tuple(extent)))
+    return neighbors
+
+
+def prefetch_tile(resource, orientation, resolution, corner, extent, time_range, variant, renderer, display):
+    """
+    Render a tile into the tile cache, unless it is already there
+
+    Args:
+        resource (spdb.project.BossResource): Resource for the channel
+        orientation (str): xy, xz or yz
+        resolution (int): Resolution of the tile
+        corner ((int, int, int)): (x, y, z) corner of the tile
+        extent ((int, int, int)): (x, y, z) size of the tile
+        time_range (list(int)): [start, stop) time samples of the tile
+        variant (list): ETag variant the tile is served with
+        renderer (class): Renderer to encode the tile with
+        display (bosstiles.display.DisplaySettings): Display settings to render with, if any
+
+    Returns:
+        None
+    """
+    generations = get_generations(resource, resolution, get_cuboid_fields(corner, extent, resolution, time_range))
+    key = get_tile_key(make_etag(resource, resolution, corner, extent, time_range, variant, *generations))
+    tile_cache = get_tile_cache()
+    if tile_cache.get(key) is not None:
+        return
+
+    with get_spatialdb() as cache:
+        data = image_cutout(cache, resource, orientation, corner, extent, resolution, time_range, generations)
+    if display:
+        img = render_image(data, orientation, display)
+    else:
+        img = getattr(data, "{}_image".format(orientation))()
+    tile_cache.put(key, renderer().render(img))
+
+
+def prefetch_neighbors(user, resource, orientation, resolution, corner, extent, time_range, variant, renderer,
+                       display, frame):
+    """
+    Get a post-render callback that prefetches the neighbours of a tile or image once it has been served
+
+    Args:
+        user (int): Id of the user the image was served to, whose prefetch budget is used
+        resource (spdb.project.BossResource): Resource for the channel
+        orientation (str): xy, xz or yz
+        resolution (int): Resolution of the image
+        corner ((int, int, int)): (x, y, z) corner of the image
+        extent ((int, int, int)): (x, y, z) size of the image
+        time_range (list(int)): [start, stop) time samples of the image
+        variant (list): ETag variant the image is served with
+        renderer (class): Renderer the image is encoded with
+        display (bosstiles.display.DisplaySettings): Display settings the image is rendered with, if any
+        frame (bosscore.models.CoordinateFrame): The experiment's coordinate frame
+
+    Returns:
+        (callable): Pass to Response.add_post_render_callback()
+    """
+    frame_bounds = LevelBounds((frame.x_start, frame.y_start, frame.z_start),
+                               (frame.x_stop, frame.y_stop, frame.z_stop))
+
+    def callback(response):
+        if not settings.TILE_PREFETCH or response.status_code != 200:
+            return
+
+        prefetcher = get_prefetcher()
+        neighbors = get_neighbors(orientation, corner, extent, frame_bounds, settings.TILE_PREFETCH_DEPTH)
+        for neighbor_corner, neighbor_extent in neighbors:
+            key = (resource.get_lookup_key(), resolution, neighbor_corner, neighbor_extent, tuple(time_range),
+                   repr(variant))
+            prefetcher.submit(user, key, prefetch_tile, resource, orientation, resolution, neighbor_corner,
+                              neighbor_extent, time_range, variant, renderer, display)
+
+    return callback
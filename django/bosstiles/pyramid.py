@@ -0,0 +1,302 @@
+# Copyright 2016 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Pre-rendering of the tile pyramid of a channel
+#
+# Tiles are rendered exactly as the /tile/ endpoint renders them and are either added to the shared tiers of the tile
+# cache (see cache.py) under the key the endpoint looks them up with, or written to a directory laid out like the
+# tile URLs so a web server can send them directly:
+#
+#     <directory>/<collection>/<experiment>/<channel>/<orientation>/<tile_size>/<resolution>/<x>/<y>/<z>/<t>.<format>
+#
+# The pyramid is split into blocks that are each cut out once: a block covers one tile of the image plane and a
+# cuboid aligned range of the axis normal to it, so a single cutout renders many tiles. Coarse resolutions are
+# rendered first, since they are small and are what viewers load first.
+from collections import namedtuple, deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import os
+import tempfile
+import time
+
+import numpy as np
+from spdb.project import BossResourceBasic
+from spdb.spatialdb import Cube
+
+from bossspatialdb.blocks import get_cuboid_size
+from bossspatialdb.downsample import get_scale_factors, get_next_bounds
+from bossspatialdb.pool import get_spatialdb
+from bossspatialdb.versioning import get_cuboid_fields, get_generations, make_etag
+
+from .cache import get_tile_cache, get_tile_key, MemoryTier, TileCache
+from .renderers import PNGRenderer, JPEGRenderer
+
+ORIENTATIONS = ('xy', 'xz', 'yz')
+
+# (x, y, z) index of the two axes of each image plane and of the axis normal to it
+PLANE_AXES = {'xy': ((0, 1), 2), 'xz': ((0, 2), 1), 'yz': ((1, 2), 0)}
+
+# Renderer for each tile format
+RENDERERS = {renderer.format: renderer for renderer in (PNGRenderer, JPEGRenderer)}
+
+# A cutout that renders several tiles. corner and extent are (x, y, z) tuples at the block's resolution, and tiles
+# is the number of tiles it renders in each format.
+RenderBlock = namedtuple('RenderBlock', ['resolution', 'orientation', 'tile_size', 'time_sample', 'corner', 'extent',
+                                         'tiles'])
+
+
+def get_level_bounds(frame_bounds, hierarchy_method, voxel_size, num_levels):
+    """
+    Get the region that holds data at each resolution
+
+    Args:
+        frame_bounds (LevelBounds): Coordinate frame at resolution 0
+        hierarchy_method (str): Experiment hierarchy method (slice, iso or near_iso)
+        voxel_size ((float, float, float)): (x, y, z) voxel size at resolution 0
+        num_levels (int): Number of levels in the experiment's hierarchy
+
+    Returns:
+        (list(LevelBounds)): Bounds of each resolution
+    """
+    bounds = [frame_bounds]
+    for resolution in range(num_levels - 1):
+        bounds.append(get_next_bounds(bounds[-1], get_scale_factors(hierarchy_method, voxel_size, resolution)))
+    return bounds
+
+
+def _get_tile_range(frame_bounds, level_bounds, axis, tile_size):
+    """
+    Get the tile indices along an axis of the image plane that the tile endpoint accepts and that hold data
+
+    The endpoint only accepts tiles that are entirely inside the coordinate frame.
+    """
+    start = -(-frame_bounds.start[axis] // tile_size)
+    stop = frame_bounds.stop[axis] // tile_size
+    start = max(start, level_bounds.start[axis] // tile_size)
+    stop = min(stop, -(-level_bounds.stop[axis] // tile_size))
+    return range(start, stop)
+
+
+def plan_pyramid(frame_bounds, level_bounds, resolutions, orientations, tile_sizes, time_range, bytes_per_voxel,
+                 max_bytes):
+    """
+    Split the tile pyramid of a channel into blocks
+
+    Args:
+        frame_bounds (LevelBounds): Coordinate frame at resolution 0
+        level_bounds (list(LevelBounds)): Region that holds data at each resolution, from get_level_bounds()
+        resolutions (iterable(int)): Resolutions to render
+        orientations (iterable(str)): Image planes to render
+        tile_sizes (iterable(int)): Tile sizes to render
+        time_range (list(int)): [start, stop) time samples to render
+        bytes_per_voxel (int): Number of bytes per voxel of the channel
+        max_bytes (int): Maximum number of uncompressed bytes to cut out for a block
+
+    Returns:
+        (list(RenderBlock)): Blocks, coarsest resolution first
+    """
+    blocks = []
+    for resolution in sorted(resolutions, reverse=True):
+        cuboid_size = get_cuboid_size(resolution)
+        bounds = level_bounds[resolution]
+        for orientation in orientations:
+            (axis0, axis1), normal = PLANE_AXES[orientation]
+            normal_start = max(frame_bounds.start[normal], bounds.start[normal])
+            normal_stop = min(frame_bounds.stop[normal], bounds.stop[normal])
+
+            for tile_size in tile_sizes:
+                # Stay on cuboid boundaries along the normal axis unless a cuboid's worth of tiles is too large
+                depth = max(1, min(cuboid_size[normal], max_bytes // (tile_size * tile_size * bytes_per_voxel)))
+                ranges = []
+                current = normal_start
+                while current < normal_stop:
+                    boundary = min((current // depth + 1) * depth, normal_stop)
+                    ranges.append((current, boundary))
+                    current = boundary
+
+                for t in range(time_range[0], time_range[1]):
+                    for idx0 in _get_tile_range(frame_bounds, bounds, axis0, tile_size):
+                        for idx1 in _get_tile_range(frame_bounds, bounds, axis1, tile_size):
+                            for start, stop in ranges:
+                                corner = [0, 0, 0]
+                                extent = [tile_size, tile_size, tile_size]
+                                corner[axis0] = idx0 * tile_size
+                                corner[axis1] = idx1 * tile_size
+                                corner[normal] = start
+                                extent[normal] = stop - start
+                                blocks.append(RenderBlock(resolution, orientation, tile_size, t, tuple(corner),
+                                                          tuple(extent), stop - start))
+    return blocks
+
+
+def get_tile_path(directory, resource, orientation, tile_size, resolution, corner, time_sample, fmt):
+    """
+    Get the path of a tile in a directory laid out like the tile URLs
+
+    Args:
+        directory (str): Root of the directory
+        resource (spdb.project.BossResource): Resource for the channel
+        orientation (str): Image plane
+        tile_size (int): Tile size
+        resolution (int): Resolution
+        corner ((int, int, int)): (x, y, z) corner of the tile
+        time_sample (int): Time sample
+        fmt (str): Tile format
+
+    Returns:
+        (str)
+    """
+    (axis0, axis1), _ = PLANE_AXES[orientation]
+    indices = list(corner)
+    indices[axis0] //= tile_size
+    indices[axis1] //= tile_size
+    return os.path.join(directory, resource.get_collection().name, resource.get_experiment().name,
+                        resource.get_channel().name, orientation, str(tile_size), str(resolution),
+                        *[str(idx) for idx in indices], "{}.{}".format(time_sample, fmt))
+
+
+def _write_file(path, content):
+    """
+    Write a file atomically, so a web server never sends a partial tile
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+    with os.fdopen(fd, 'wb') as file_obj:
+        file_obj.write(content)
+    os.replace(tmp_path, path)
+
+
+def render_block(resource, block, formats, directory=None):
+    """
+    Cut out a block and render each of its tiles
+
+    Args:
+        resource (spdb.project.BossResource): Resource for the channel
+        block (RenderBlock): The block
+        formats (list(str)): Formats to render each tile in (keys of RENDERERS)
+        directory (str): Directory to write tiles to. If None tiles are added to the shared tiers of the tile cache.
+
+    Returns:
+        (int): Number of tiles rendered
+    """
+    _, normal = PLANE_AXES[block.orientation]
+    time_range = [block.time_sample, block.time_sample + 1]
+
+    if directory is None:
+        # Workers don't serve tiles, so there is no point filling their memory
+        cache = TileCache([tier for tier in get_tile_cache().tiers if not isinstance(tier, MemoryTier)])
+
+        # Read the write generations before the data, so a write made while rendering is never hidden
+        fields = get_cuboid_fields(block.corner, block.extent, block.resolution, time_range)
+        epoch, generations = get_generations(resource, block.resolution, fields)
+        generations = dict(zip(fields, generations))
+
+    with get_spatialdb() as spatialdb:
+        data = spatialdb.cutout(resource, block.corner, block.extent, block.resolution, time_range).data
+
+    for idx in range(block.tiles):
+        corner = list(block.corner)
+        extent = list(block.extent)
+        corner[normal] += idx
+        extent[normal] = 1
+
+        index = [slice(None)] * 4
+        index[3 - normal] = slice(idx, idx + 1)
+        cube = Cube.create_cube(resource, extent, time_range)
+        cube.data = np.ascontiguousarray(data[tuple(index)])
+        img = getattr(cube, "{}_image".format(block.orientation))()
+
+        for fmt in formats:
+            renderer = RENDERERS[fmt]
+            content = renderer().render(img)
+            if directory is None:
+                tile_generations = [generations[field]
+                                    for field in get_cuboid_fields(corner, extent, block.resolution, time_range)]
+                etag = make_etag(resource, block.resolution, corner, extent, time_range,
+                                 [renderer.media_type, block.orientation], epoch, tile_generations)
+                cache.put(get_tile_key(etag), content)
+            else:
+                _write_file(get_tile_path(directory, resource, block.orientation, block.tile_size, block.resolution,
+                                          corner, block.time_sample, fmt), content)
+    return block.tiles
+
+
+_process_resource = {}
+
+
+def _render_block_in_process(resource_dict, block, formats, directory):
+    """
+    Render a block in a worker process. The resource is rebuilt once per process from its dictionary form.
+    """
+    key = resource_dict['lookup_key']
+    if key not in _process_resource:
+        _process_resource[key] = BossResourceBasic(resource_dict)
+    return render_block(_process_resource[key], block, formats, directory)
+
+
+def render_pyramid(resource, blocks, formats, directory=None, num_workers=4, processes=False, progress=None):
+    """
+    Render the tiles of a set of blocks in parallel
+
+    Args:
+        resource (spdb.project.BossResource): Resource for the channel
+        blocks (list(RenderBlock)): Blocks to render, from plan_pyramid()
+        formats (list(str)): Formats to render each tile in
+        directory (str): Directory to write tiles to. If None tiles are added to the shared tiers of the tile cache.
+        num_workers (int): Number of blocks to render at once
+        processes (bool): Render in a pool of processes instead of threads. Only use from a process that doesn't
+            hold open connections, such as a management command, since they are shared with the forked workers.
+        progress (callable): Called as progress(block, tiles_complete, tiles_per_second) after each block. It can
+            raise to stop rendering.
+
+    Returns:
+        (int): Number of tiles rendered (each format counts separately)
+    """
+    start = time.time()
+    tiles_complete = 0
+
+    if processes:
+        executor = ProcessPoolExecutor(max_workers=num_workers)
+        resource_dict = resource.to_dict()
+
+        def submit(block):
+            return executor.submit(_render_block_in_process, resource_dict, block, formats, directory)
+    else:
+        executor = ThreadPoolExecutor(max_workers=num_workers)
+
+        def submit(block):
+            return executor.submit(render_block, resource, block, formats, directory)
+
+    pending = deque()
+
+    def collect():
+        nonlocal tiles_complete
+        block, future = pending.popleft()
+        tiles_complete += future.result() * len(formats)
+        if progress:
+            progress(block, tiles_complete, tiles_complete / max(time.time() - start, 1e-6))
+
+    try:
+        # Keep a bounded number of blocks queued so their cutouts aren't all held in memory at once
+        for block in blocks:
+            pending.append((block, submit(block)))
+            if len(pending) >= num_workers * 2:
+                collect()
+        while pending:
+            collect()
+    finally:
+        for _, future in pending:
+            future.cancel()
+        executor.shutdown(wait=True)
+
+    return tiles_complete
@@ -24,6 +24,10 @@ class PNGRenderer(renderers.BaseRenderer):
     render_style = 'binary'
 
     def render(self, data, media_type=None, renderer_context=None):
+        # Tiles served from the tile cache are already encoded
+        if isinstance(data, bytes):
+            return data
+
         file_obj = io.BytesIO()
         data.save(file_obj, "PNG")
         file_obj.seek(0)
@@ -39,8 +43,32 @@ class JPEGRenderer(renderers.BaseRenderer):
     render_style = 'binary'
 
     def render(self, data, media_type=None, renderer_context=None):
+        # Tiles served from the tile cache are already encoded
+        if isinstance(data, bytes):
+            return data
+
         file_obj = io.BytesIO()
         data.save(file_obj, "JPEG")
         file_obj.seek(0)
         return file_obj.read()
 
+
+class TileBundleRenderer(renderers.BaseRenderer):
+    """ A DRF renderer for a bundle of encoded tiles
+
+    The TileBatch view streams this format directly. This renderer is used for content negotiation and to encode a list
+    of tiles that were already rendered. See bosstiles.batch for the format.
+    """
+    media_type = 'application/tile-bundle'
+    format = 'bundle'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, media_type=None, renderer_context=None):
+        # Imported here since the batch module uses the image renderers
+        from .batch import encode_bundle_header, encode_bundle_tile
+
+        output = [encode_bundle_header(len(data["tiles"]))]
+        for tile, key, content in data["tiles"]:
+            output.append(encode_bundle_tile(tile, key, content))
+        return b''.join(output)
@@ -0,0 +1,27 @@
+# Copyright 2016 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from rest_framework import serializers
+from .models import TileRenderJob
+
+
+class TileRenderJobSerializer(serializers.ModelSerializer):
+    """
+    Serializer to report the status of a tile pre-rendering job
+    """
+    class Meta:
+        model = TileRenderJob
+        fields = ('id', 'collection', 'experiment', 'channel', 'status', 'orientations', 'tile_sizes', 'formats',
+                  'start_resolution', 'stop_resolution', 't_start', 't_stop', 'output', 'current_resolution',
+                  'tiles_complete', 'tiles_total', 'tiles_per_second', 'start_date', 'end_date', 'error')
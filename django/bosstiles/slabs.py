@@ -0,0 +1,147 @@
+# Copyright 2016 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Read path for xz and yz images
+#
+# An xz or yz image is one voxel thick along the axis normal to it, but the spatial database reads and decompresses
+# whole cuboids, which are much deeper along y and x than along z. So each orthogonal image costs as much as reading
+# hundreds of its neighbours.
+#
+# Instead, orthogonal images are cut out of slabs of up to settings.TILE_SLAB_DEPTH consecutive planes, aligned so a
+# slab never crosses a cuboid boundary along the normal axis. A slab is read once, stored one contiguous plane after
+# another, and kept in an LRU (settings.TILE_SLAB_CACHE_SIZE bytes per process), so a viewer stepping through
+# neighbouring planes is served from memory. Concurrent requests for planes of the same slab share a single read.
+#
+# A slab touches exactly the same cuboids as each of its planes, so it is versioned with the write generations that
+# the views already read to build the image's ETag: a write to any of the cuboids makes the slab a miss.
+import threading
+
+import numpy as np
+from django.conf import settings
+from spdb.spatialdb import Cube
+
+from bossspatialdb.blocks import get_cuboid_size
+from bossspatialdb.cuboidcache import CuboidCache
+from bossspatialdb.singleflight import SingleFlight, coalesced_cutout
+
+# Index of the axis normal to each orthogonal image plane
+NORMAL_AXIS = {'xz': 1, 'yz': 0}
+
+_flight = SingleFlight()
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_slab_cache():
+    """
+    Get the process's slab cache
+
+    Returns:
+        (bossspatialdb.cuboidcache.CuboidCache)
+    """
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = CuboidCache(settings.TILE_SLAB_CACHE_SIZE)
+        return _cache
+
+
+def clear_slab_cache():
+    """
+    Drop all slabs from the process's cache
+    """
+    get_slab_cache().clear()
+
+
+def get_slab(orientation, corner, extent, resolution, depth):
+    """
+    Get the slab an orthogonal image plane is cut out of
+
+    Args:
+        orientation (str): xz or yz
+        corner ((int, int, int)): (x, y, z) corner of the image
+        extent ((int, int, int)): (x, y, z) size of the image. It must be 1 along the normal axis.
+        resolution (int): Resolution of the image
+        depth (int): Maximum number of planes in the slab
+
+    Returns:
+        ((int, int, int), (int, int, int)): (x, y, z) corner and extent of the slab
+    """
+    normal = NORMAL_AXIS[orientation]
+    cuboid_depth = get_cuboid_size(resolution)[normal]
+    depth = max(1, min(depth, cuboid_depth))
+
+    # Stay inside the cuboid the plane is in, even when the depth doesn't divide the cuboid size
+    cuboid_start = corner[normal] // cuboid_depth * cuboid_depth
+    start = cuboid_start + (corner[normal] - cuboid_start) // depth * depth
+    stop = min(start + depth, cuboid_start + cuboid_depth)
+
+    slab_corner = list(corner)
+    slab_extent = list(extent)
+    slab_corner[normal] = start
+    slab_extent[normal] = stop - start
+    return tuple(slab_corner), tuple(slab_extent)
+
+
+def image_cutout(cache, resource, orientation, corner, extent, resolution, time_range, generations):
+    """
+    Cut out the data for an image, reading orthogonal planes through the slab cache
+
+    Slabs are made shallower to stay within settings.TILE_SLAB_MAX_SIZE bytes. Images that aren't a single xz or yz
+    plane, or that are larger than that on their own, are cut out with bossspatialdb.singleflight.coalesced_cutout().
+
+    Args:
+        cache (spdb.spatialdb.SpatialDB): Interface to the spatial database
+        resource (spdb.project.BossResource): Resource for the channel
+        orientation (str): xy, xz or yz
+        corner ((int, int, int)): (x, y, z) corner of the image
+        extent ((int, int, int)): (x, y, z) size of the image
+        resolution (int): Resolution of the image
+        time_range (list(int)): [start, stop) time samples of the image
+        generations ((str, list(int))): Output of bossspatialdb.versioning.get_generations() for the image's
+            get_cuboid_fields()
+
+    Returns:
+        (spdb.spatialdb.Cube): The cutout. Its data is read-only.
+    """
+    normal = NORMAL_AXIS.get(orientation)
+    if normal is None or extent[normal] != 1:
+        return coalesced_cutout(cache, resource, corner, extent, resolution, time_range, generations)
+
+    bytes_per_voxel = np.dtype(resource.get_numpy_data_type()).itemsize
+    plane_bytes = extent[0] * extent[1] * extent[2] * (time_range[1] - time_range[0]) * bytes_per_voxel
+    depth = min(settings.TILE_SLAB_DEPTH, settings.TILE_SLAB_MAX_SIZE // plane_bytes)
+    if depth < 1:
+        return coalesced_cutout(cache, resource, corner, extent, resolution, time_range, generations)
+
+    slab_corner, slab_extent = get_slab(orientation, corner, extent, resolution, depth)
+
+    slab_cache = get_slab_cache()
+    key = (resource.get_lookup_key(), resolution, tuple(time_range), orientation, slab_corner, slab_extent)
+    version = (generations[0], tuple(generations[1]))
+
+    planes = slab_cache.get(key, version)
+    if planes is None:
+        def read():
+            data = cache.cutout(resource, slab_corner, slab_extent, resolution, time_range).data
+            # Make each plane along the normal axis contiguous: (normal, t, z, y|x)
+            result = np.ascontiguousarray(np.moveaxis(data, 3 - normal, 0))
+            slab_cache.put(key, version, result)
+            return result
+
+        planes, _ = _flight.do(repr((key, version)), read)
+
+    cube = Cube.create_cube(resource, list(extent), time_range)
+    cube.data = np.expand_dims(planes[corner[normal] - slab_corner[normal]], axis=3 - normal)
+    return cube
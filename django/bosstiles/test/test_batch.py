@@ -0,0 +1,76 @@
+# Copyright 2016 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from django.test import SimpleTestCase
+from unittest.mock import patch, MagicMock
+import io
+
+import numpy as np
+from PIL import Image
+
+from bossspatialdb.blocks import CutoutBlock
+from bosstiles.batch import get_tile_region, get_viewport_tiles, plan_tile_reads, tile_batch_stream, read_bundle
+from bosstiles.cache import MemoryTier, TileCache
+from bosstiles.renderers import PNGRenderer
+
+
+class TestTileBatch(SimpleTestCase):
+
+    def test_tile_region(self):
+        """ Test tile regions match the /tile/ endpoint"""
+        self.assertEqual(get_tile_region('xy', 512, (1, 2, 7)), CutoutBlock((512, 1024, 7), (512, 512, 1)))
+        self.assertEqual(get_tile_region('xz', 512, (1, 7, 2)), CutoutBlock((512, 7, 1024), (512, 1, 512)))
+        self.assertEqual(get_tile_region('yz', 512, (7, 1, 2)), CutoutBlock((7, 512, 1024), (1, 512, 512)))
+
+    def test_viewport_tiles(self):
+        """ Test a viewport returns every tile that intersects it"""
+        tiles = get_viewport_tiles('xy', 512, {"x": "100:1100", "y": "0:512", "z": 3})
+        self.assertEqual(tiles, [(0, 0, 3), (1, 0, 3), (2, 0, 3)])
+
+        tiles = get_viewport_tiles('yz', 256, {"x": 9, "y": "256:512", "z": "0:300"})
+        self.assertEqual(tiles, [(9, 1, 0), (9, 1, 1)])
+
+    def test_plan_viewport_single_read(self):
+        """ Test tiles that cover a rectangle are read with one cutout, and scattered tiles are not merged"""
+        regions = [get_tile_region('xy', 512, (x, y, 3)) for y in range(2) for x in range(3)]
+        regions.append(get_tile_region('xy', 512, (5, 5, 4)))
+        regions.append(get_tile_region('xy', 512, (0, 0, 4)))
+        reads = plan_tile_reads(regions, 2, (512, 512, 16), 1, max_bytes=64 * 2 ** 20)
+
+        self.assertEqual(reads[0], (CutoutBlock((0, 0, 3), (1536, 1024, 1)), list(range(6))))
+        self.assertEqual(sorted(indices for _, indices in reads[1:]), [[6], [7]])
+
+    def test_stream_bundle(self):
+        """ Test cached tiles are sent as is and the rest are sliced out of their group's cutout and encoded"""
+        volume = (np.arange(2 * 64 * 64) % 251).astype(np.uint8).reshape(1, 2, 64, 64)
+        resource = MagicMock()
+        block = CutoutBlock((0, 0, 1), (64, 32, 1))
+        tiles = [((x, 0, 1), get_tile_region('xy', 32, (x, 0, 1)), "{:040d}".format(x)) for x in range(2)]
+        tile_cache = TileCache([MemoryTier(2 ** 20)])
+
+        with patch('bosstiles.batch._read_block', return_value=volume[:, 1:2, 0:32, :]) as mock_read, \
+                patch('bosstiles.batch.get_tile_cache', return_value=tile_cache):
+            stream = tile_batch_stream(resource, 'xy', 0, [0, 1], PNGRenderer,
+                                       [((5, 5, 1), "f" * 40, b"cached")], [(block, tiles)], ("epoch", {"0&0&0&0": 0}))
+            bundle = read_bundle(io.BytesIO(b''.join(stream)))
+
+        self.assertEqual(mock_read.call_count, 1)
+        self.assertEqual(list(bundle)[0], (5, 5, 1))
+        self.assertEqual(bundle[(5, 5, 1)], ('"{}"'.format("f" * 40), b"cached"))
+        for x in range(2):
+            etag, content = bundle[(x, 0, 1)]
+            self.assertEqual(etag, '"{:040d}"'.format(x))
+            np.testing.assert_array_equal(np.array(Image.open(io.BytesIO(content))),
+                                          volume[0, 1, 0:32, 32 * x:32 * (x + 1)])
+            self.assertEqual(tile_cache.get("{:040d}".format(x)), content)
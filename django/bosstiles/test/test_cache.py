@@ -0,0 +1,84 @@
+# Copyright 2016 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from django.test import SimpleTestCase, override_settings
+from unittest.mock import patch
+import os
+import tempfile
+import time
+
+from bosstiles.cache import MemoryTier, DiskTier, TileCache
+
+
+@override_settings(TILE_CACHE_MAX_TILE_SIZE=2 ** 20)
+class TestTileCache(SimpleTestCase):
+
+    def test_memory_tier_lru(self):
+        """ Test the least recently used tiles are evicted to stay within the byte budget"""
+        tier = MemoryTier(30)
+        tier.put("a", b"0" * 10)
+        tier.put("b", b"1" * 10)
+        tier.put("c", b"2" * 10)
+        tier.get("a")
+        tier.put("d", b"3" * 10)
+
+        self.assertIsNone(tier.get("b"))
+        self.assertEqual(tier.get("a"), b"0" * 10)
+        self.assertEqual(tier.nbytes, 30)
+
+    def test_disk_tier_prune(self):
+        """ Test the least recently used tiles on disk are removed once the directory is over its budget"""
+        with tempfile.TemporaryDirectory() as directory:
+            tier = DiskTier(directory, 100)
+            for idx in range(5):
+                tier.put("key{}".format(idx), b"x" * 20)
+                # Make sure each file gets a distinct modification time
+                path = tier._get_path("key{}".format(idx))
+                os.utime(path, (time.time() - 100 + idx, time.time() - 100 + idx))
+            tier.get("key0")
+            tier.put("key5", b"x" * 20)
+
+            self.assertEqual(tier.get("key0"), b"x" * 20)
+            self.assertIsNone(tier.get("key1"))
+            self.assertEqual(tier.get("key5"), b"x" * 20)
+
+    def test_lower_tier_hits_are_promoted(self):
+        """ Test a tile found in a lower tier is copied into the tiers above it"""
+        with tempfile.TemporaryDirectory() as directory:
+            memory = MemoryTier(2 ** 20)
+            disk = DiskTier(directory, 2 ** 20)
+            cache = TileCache([memory, disk])
+
+            disk.put("key", b"tile")
+            self.assertIsNone(memory.get("key"))
+            self.assertEqual(cache.get("key"), b"tile")
+            self.assertEqual(memory.get("key"), b"tile")
+            self.assertEqual(cache.get("key"), b"tile")
+
+            self.assertIsNone(cache.get("other"))
+            stats = cache.get_stats()
+            self.assertEqual((stats['memory_hits'], stats['disk_hits'], stats['misses']), (1, 1, 1))
+
+    def test_failing_tier_is_skipped(self):
+        """ Test a tier that raises is skipped instead of failing the request"""
+        with tempfile.TemporaryDirectory() as directory:
+            memory = MemoryTier(2 ** 20)
+            disk = DiskTier(directory, 2 ** 20)
+            cache = TileCache([memory, disk])
+
+            with patch.object(DiskTier, 'put', side_effect=OSError("disk full")), patch('bosstiles.cache.BossLogger'):
+                cache.put("key", b"tile")
+            self.assertEqual(cache.get("key"), b"tile")
+            self.assertIsNone(disk.get("key"))
+            self.assertEqual(cache.get_stats()['errors'], 1)
@@ -0,0 +1,90 @@
+# Copyright 2016 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from django.http import QueryDict
+from django.test import SimpleTestCase, override_settings
+from unittest.mock import patch, MagicMock
+
+import numpy as np
+
+from bosscore.error import BossError
+from bosstiles.composite import get_overlay_args, read_layers, render_composite, get_id_colors
+from bosstiles.display import DisplaySettings
+
+
+def make_cube(plane):
+    cube = MagicMock()
+    cube.data = plane[np.newaxis, np.newaxis]
+    return cube
+
+
+@override_settings(TILE_COMPOSITE_MAX_CHANNELS=3, TILE_COMPOSITE_ANNOTATION_OPACITY=0.5, TILE_COMPOSITE_WORKERS=4)
+class TestComposite(SimpleTestCase):
+
+    def test_overlay_args(self):
+        """ Test overlays are parsed in order and validated"""
+        args = get_overlay_args(QueryDict("overlay=gfp,green,100:2000&overlay=synapses"))
+        self.assertEqual(args, [{"channel": "gfp", "colormap": "green", "window": "100:2000"},
+                                {"channel": "synapses", "colormap": None, "window": None}])
+        self.assertEqual(get_overlay_args(QueryDict("format=png")), [])
+
+        for query in ("overlay=gfp,teal", "overlay=gfp,green,100", "overlay=a&overlay=b&overlay=c"):
+            with self.assertRaises(BossError):
+                get_overlay_args(QueryDict(query))
+
+    def test_fluorescence_channels_are_added(self):
+        """ Test image layers are rendered through their windows and colormaps and added together"""
+        red = np.array([[0, 1000], [2000, 2000]], dtype=np.uint16)
+        green = np.array([[0, 0], [255, 128]], dtype=np.uint8)
+        img = render_composite([make_cube(red), make_cube(green)], 'xy',
+                               [DisplaySettings((0, 2000), 1.0, 'red'), DisplaySettings((0, 255), 1.0, 'green')])
+
+        rgb = np.array(img)
+        self.assertEqual(img.mode, 'RGB')
+        np.testing.assert_array_equal(rgb[..., 0], [[0, 128], [255, 255]])
+        np.testing.assert_array_equal(rgb[..., 1], [[0, 0], [255, 128]])
+        np.testing.assert_array_equal(rgb[..., 2], 0)
+
+        img = render_composite([make_cube(green), make_cube(green)], 'xy',
+                               [DisplaySettings((0, 255), 1.0, 'gray'), DisplaySettings((0, 255), 1.0, 'gray')])
+        np.testing.assert_array_equal(np.array(img)[..., 1], [[0, 0], [255, 255]])
+
+    def test_annotation_is_drawn_over(self):
+        """ Test annotation layers are blended over the layers below, with id 0 transparent"""
+        em = np.full((2, 2), 100, dtype=np.uint8)
+        ids = np.array([[0, 5], [7, 5]], dtype=np.uint64)
+
+        img = render_composite([make_cube(em), make_cube(ids)], 'xy',
+                               [DisplaySettings((0, 255), 1.0, 'gray'), DisplaySettings(None, None, 'red')])
+        rgb = np.array(img)
+        np.testing.assert_array_equal(rgb[0, 0], [100, 100, 100])
+        np.testing.assert_array_equal(rgb[0, 1], [178, 50, 50])
+
+        img = render_composite([make_cube(em), make_cube(ids)], 'xy',
+                               [DisplaySettings((0, 255), 1.0, 'gray'), DisplaySettings(None, None, 'ids')])
+        rgb = np.array(img)
+        np.testing.assert_array_equal(rgb[0, 1], rgb[1, 1])
+        np.testing.assert_array_equal(rgb[0, 1], np.rint(100 * 0.5 + get_id_colors(ids[0, 1:]) * 0.5)[0])
+        self.assertFalse(np.array_equal(rgb[0, 1], rgb[1, 0]))
+
+    def test_read_layers(self):
+        """ Test every layer is read with its own generations and returned in order"""
+        resources = [MagicMock(name="base"), MagicMock(name="overlay")]
+        with patch('bosstiles.composite.get_spatialdb'), \
+                patch('bosstiles.composite.image_cutout', side_effect=lambda *args: args[1]) as mock_cutout:
+            cubes = read_layers([(resources[0], ("epoch", [1])), (resources[1], ("epoch", [2]))], 'xz',
+                                (0, 5, 0), (64, 1, 16), 0, [0, 1])
+
+        self.assertEqual(cubes, resources)
+        self.assertEqual(sorted(c[0][-1][1] for c in mock_cutout.call_args_list), [[1], [2]])
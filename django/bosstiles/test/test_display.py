@@ -0,0 +1,114 @@
+# Copyright 2016 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from django.test import SimpleTestCase, override_settings
+from unittest.mock import patch, MagicMock
+
+import numpy as np
+
+from spdb.spatialdb import Cube
+
+from bosscore.error import BossError
+from bosstiles.display import DisplaySettings, get_display_args, get_lut, get_default_window, render_image, \
+    clear_default_windows
+
+
+@override_settings(TILE_DEFAULT_WINDOW_PERCENTILES=(1, 99), TILE_DEFAULT_WINDOW_TTL=300)
+class TestDisplay(SimpleTestCase):
+
+    def tearDown(self):
+        clear_default_windows()
+
+    def test_display_args(self):
+        """ Test display settings are parsed and validated"""
+        self.assertIsNone(get_display_args({"format": "png"}))
+        self.assertEqual(get_display_args({"window": "100:4000", "gamma": "2"}),
+                         {"window": (100, 4000), "gamma": 2.0, "colormap": "gray"})
+        self.assertEqual(get_display_args({"colormap": "hot"}), {"window": None, "gamma": 1.0, "colormap": "hot"})
+        self.assertEqual(get_display_args({"window": "auto"})["window"], None)
+
+        for params in ({"window": "4000:100"}, {"window": "abc"}, {"gamma": "0"}, {"gamma": "x"},
+                       {"colormap": "rainbow"}):
+            with self.assertRaises(BossError):
+                get_display_args(params)
+
+    def test_lut(self):
+        """ Test the window is stretched over the display range, and gamma and the colormap are applied"""
+        lut = get_lut(2 ** 16, (1000, 2000), 1.0, 'gray')
+        self.assertEqual(lut.shape, (2 ** 16,))
+        self.assertEqual((lut[0], lut[1000], lut[1500], lut[2000], lut[60000]), (0, 0, 128, 255, 255))
+
+        lut = get_lut(2 ** 16, (1000, 2000), 2.0, 'gray')
+        self.assertEqual(lut[1250], 128)
+
+        lut = get_lut(2 ** 8, (0, 255), 1.0, 'red')
+        self.assertEqual(lut.shape, (256, 3))
+        np.testing.assert_array_equal(lut[255], [255, 0, 0])
+        np.testing.assert_array_equal(lut[0], [0, 0, 0])
+
+    def test_render_image(self):
+        """ Test every orientation is rendered through the lookup table"""
+        data = (np.arange(4 * 8 * 8, dtype=np.uint16) * 100).reshape(1, 4, 8, 8)
+        display = DisplaySettings((0, 25600), 1.0, 'gray')
+        lut = get_lut(2 ** 16, (0, 25600), 1.0, 'gray')
+
+        cube = Cube.create_cube(MagicMock(), [8, 8, 1], [0, 1])
+        cube.data = data[:, 2:3, :, :]
+        np.testing.assert_array_equal(np.array(render_image(cube, 'xy', display)), lut[data[0, 2]])
+
+        cube.data = data[:, :, 3:4, :]
+        np.testing.assert_array_equal(np.array(render_image(cube, 'xz', display)), lut[data[0, :, 3, :]])
+
+        cube.data = data[:, :, :, 5:6]
+        image = render_image(cube, 'yz', DisplaySettings((0, 25600), 1.0, 'viridis'))
+        self.assertEqual(image.mode, 'RGB')
+        self.assertEqual(image.size, (8, 4))
+
+    def test_default_window(self):
+        """ Test the default window ignores zeros, uses the configured percentiles and is cached"""
+        histogram = np.zeros(2 ** 16, dtype=np.int64)
+        histogram[0] = 10 ** 6
+        histogram[100] = 1
+        histogram[500:1500] = 10
+        histogram[60000] = 1
+
+        resource = MagicMock()
+        resource.get_lookup_key.return_value = "1&1&1"
+        resource.get_bit_depth.return_value = 16
+        experiment = MagicMock(num_hierarchy_levels=2, hierarchy_method='slice')
+        frame = MagicMock(x_start=0, y_start=0, z_start=0, x_stop=1024, y_stop=1024, z_stop=16,
+                          x_voxel_size=1, y_voxel_size=1, z_voxel_size=1)
+
+        with patch('bosstiles.display.get_region_histogram', return_value=(histogram, 1, 0)) as mock_histogram:
+            window = get_default_window(resource, experiment, frame, 0)
+            self.assertEqual(get_default_window(resource, experiment, frame, 0), window)
+
+        self.assertEqual(window, (509, 1490))
+        self.assertEqual(mock_histogram.call_count, 1)
+        args = mock_histogram.call_args[0]
+        self.assertEqual((args[1], tuple(args[2]), list(args[3])), (1, (0, 0, 0), [512, 512, 16]))
+
+    @override_settings(STATISTICS_MAX_SIZE=512 * 512 * 16 * 2 - 1)
+    def test_default_window_too_large(self):
+        """ Test the default window of a channel too large to take statistics of is the datatype's full range"""
+        resource = MagicMock()
+        resource.get_lookup_key.return_value = "1&1&1"
+        resource.get_bit_depth.return_value = 16
+        experiment = MagicMock(num_hierarchy_levels=2, hierarchy_method='slice')
+        frame = MagicMock(x_start=0, y_start=0, z_start=0, x_stop=1024, y_stop=1024, z_stop=16,
+                          x_voxel_size=1, y_voxel_size=1, z_voxel_size=1)
+
+        with patch('bosstiles.display.get_region_histogram') as mock_histogram:
+            self.assertEqual(get_default_window(resource, experiment, frame, 0), (0, 65535))
+        mock_histogram.assert_not_called()
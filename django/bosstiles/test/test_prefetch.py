@@ -0,0 +1,99 @@
+# Copyright 2016 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from django.test import SimpleTestCase, override_settings
+from unittest.mock import patch, MagicMock
+import io
+import threading
+
+import numpy as np
+from PIL import Image
+
+from bossspatialdb.downsample import LevelBounds
+from bosstiles.cache import MemoryTier, TileCache
+from bosstiles.prefetch import Prefetcher, get_neighbors, prefetch_tile, prefetch_neighbors
+from bosstiles.renderers import PNGRenderer
+
+
+class TestTilePrefetch(SimpleTestCase):
+
+    def test_neighbors(self):
+        """ Test the nearest planes come first, then the tiles around the image, all inside the frame"""
+        frame = LevelBounds((0, 0, 0), (1024, 1024, 10))
+        neighbors = get_neighbors('xy', (512, 0, 1), (512, 512, 1), frame, 2)
+        self.assertEqual([corner for corner, _ in neighbors],
+                         [(512, 0, 2), (512, 0, 0), (512, 0, 3), (0, 0, 1), (512, 512, 1)])
+        self.assertTrue(all(extent == (512, 512, 1) for _, extent in neighbors))
+
+        neighbors = get_neighbors('yz', (5, 0, 0), (1, 512, 10), frame, 1)
+        self.assertEqual([corner for corner, _ in neighbors], [(6, 0, 0), (4, 0, 0), (5, 512, 0)])
+
+    def test_user_budget(self):
+        """ Test a user over budget, and a prefetch already queued, are dropped without holding up other users"""
+        release = threading.Event()
+        prefetcher = Prefetcher(1, 2, 3)
+
+        self.assertTrue(prefetcher.submit(1, 'a', release.wait))
+        self.assertFalse(prefetcher.submit(1, 'a', release.wait))
+        self.assertTrue(prefetcher.submit(1, 'b', release.wait))
+        self.assertFalse(prefetcher.submit(1, 'c', release.wait))
+        self.assertTrue(prefetcher.submit(2, 'd', release.wait))
+        self.assertFalse(prefetcher.submit(3, 'e', release.wait))
+
+        release.set()
+        prefetcher._executor.shutdown()
+        self.assertEqual(prefetcher.get_stats(), {'queued': 3, 'dropped': 2, 'completed': 3, 'errors': 0,
+                                                  'pending': 0})
+        self.assertEqual(prefetcher._users, {})
+
+    def test_prefetch_tile(self):
+        """ Test a prefetched tile is rendered into the tile cache, and a cached tile isn't read again"""
+        resource = MagicMock()
+        resource.get_lookup_key.return_value = "1&2&3"
+        plane = (np.arange(64 * 64) % 251).astype(np.uint8).reshape(1, 1, 64, 64)
+        tile_cache = TileCache([MemoryTier(2 ** 20)])
+        cube = MagicMock()
+        cube.xy_image.return_value = Image.fromarray(plane[0, 0])
+
+        with patch('bosstiles.prefetch.get_generations', return_value=("epoch", [0])), \
+                patch('bosstiles.prefetch.get_tile_cache', return_value=tile_cache), \
+                patch('bosstiles.prefetch.get_spatialdb'), \
+                patch('bosstiles.prefetch.image_cutout', return_value=cube) as mock_cutout:
+            for _ in range(2):
+                prefetch_tile(resource, 'xy', 0, (0, 0, 4), (64, 64, 1), [0, 1], ['image/png', 'xy'], PNGRenderer,
+                              None)
+
+        self.assertEqual(mock_cutout.call_count, 1)
+        self.assertEqual(tile_cache.get_stats(), {'misses': 1, 'errors': 0, 'memory_hits': 1})
+        key = next(iter(tile_cache.tiers[0]._entries))
+        np.testing.assert_array_equal(np.array(Image.open(io.BytesIO(tile_cache.get(key)))), plane[0, 0])
+
+    def test_callback(self):
+        """ Test neighbours are queued once an image has been served, and only if prefetching is enabled"""
+        frame = MagicMock(x_start=0, y_start=0, z_start=0, x_stop=512, y_stop=512, z_stop=100)
+        resource = MagicMock()
+        callback = prefetch_neighbors(7, resource, 'xy', 0, (0, 0, 50), (512, 512, 1), [0, 1], ['image/png', 'xy'],
+                                      PNGRenderer, None, frame)
+        prefetcher = MagicMock()
+
+        with patch('bosstiles.prefetch.get_prefetcher', return_value=prefetcher):
+            with override_settings(TILE_PREFETCH=False, TILE_PREFETCH_DEPTH=2):
+                callback(MagicMock(status_code=200))
+            with override_settings(TILE_PREFETCH=True, TILE_PREFETCH_DEPTH=2):
+                callback(MagicMock(status_code=404))
+                self.assertEqual(prefetcher.submit.call_count, 0)
+                callback(MagicMock(status_code=200))
+
+        self.assertEqual([c[0][0] for c in prefetcher.submit.call_args_list], [7] * 4)
+        self.assertEqual([c[0][6][2] for c in prefetcher.submit.call_args_list], [51, 49, 52, 48])
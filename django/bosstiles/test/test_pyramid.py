@@ -0,0 +1,69 @@
+# Copyright 2016 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from django.test import SimpleTestCase
+from unittest.mock import MagicMock
+import os
+
+from bossspatialdb.downsample import LevelBounds
+from bosstiles.pyramid import get_level_bounds, plan_pyramid, get_tile_path
+
+
+class TestTilePyramid(SimpleTestCase):
+
+    def setUp(self):
+        self.frame = LevelBounds((0, 0, 0), (1024, 1024, 32))
+        self.levels = get_level_bounds(self.frame, 'slice', (1, 1, 1), 3)
+
+    def test_level_bounds(self):
+        """ Test the region holding data shrinks with the hierarchy"""
+        self.assertEqual(self.levels[1], LevelBounds((0, 0, 0), (512, 512, 32)))
+        self.assertEqual(self.levels[2], LevelBounds((0, 0, 0), (256, 256, 32)))
+
+    def test_plan_xy(self):
+        """ Test xy tiles are grouped into cuboid deep blocks, coarsest resolution first"""
+        blocks = plan_pyramid(self.frame, self.levels, range(3), ['xy'], [512], [0, 1], 1, 64 * 2 ** 20)
+
+        self.assertEqual([block.resolution for block in blocks], [2] * 2 + [1] * 2 + [0] * 8)
+        self.assertEqual(sum(block.tiles for block in blocks), 32 + 32 + 4 * 32)
+        self.assertTrue(all(block.extent == (512, 512, 16) for block in blocks))
+        self.assertEqual(sorted({block.corner for block in blocks if block.resolution == 0}),
+                         [(x, y, z) for x in (0, 512) for y in (0, 512) for z in (0, 16)])
+
+    def test_plan_limits_block_size(self):
+        """ Test blocks are made shallower than a cuboid when a cuboid's worth of tiles is too large"""
+        frame = LevelBounds((0, 0, 0), (1024, 1024, 1024))
+        levels = get_level_bounds(frame, 'iso', (1, 1, 1), 1)
+        blocks = plan_pyramid(frame, levels, [0], ['xz'], [512], [0, 1], 1, 64 * 2 ** 20)
+
+        self.assertEqual(len(blocks), 2 * 2 * 4)
+        self.assertTrue(all(block.extent == (512, 256, 512) for block in blocks))
+        self.assertEqual(sum(block.tiles for block in blocks), 2 * 2 * 1024)
+
+    def test_plan_skips_tiles_outside_frame(self):
+        """ Test tiles the tile endpoint would reject are not planned"""
+        # The frame is only 32 deep, so no 512 xz tile fits in it
+        blocks = plan_pyramid(self.frame, self.levels, range(3), ['xz'], [512], [0, 1], 1, 64 * 2 ** 20)
+        self.assertEqual(blocks, [])
+
+    def test_tile_path(self):
+        """ Test tile files are laid out like the tile URLs"""
+        resource = MagicMock()
+        resource.get_collection.return_value.name = "col1"
+        resource.get_experiment.return_value.name = "exp1"
+        resource.get_channel.return_value.name = "channel1"
+
+        path = get_tile_path("/tiles", resource, 'xz', 512, 1, (1024, 7, 512), 0, 'png')
+        self.assertEqual(path, os.path.join("/tiles", "col1", "exp1", "channel1", "xz", "512", "1", "2", "7", "1",
+                                            "0.png"))
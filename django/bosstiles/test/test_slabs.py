@@ -0,0 +1,92 @@
+# Copyright 2016 The Johns Hopkins University Applied Physics Laboratory
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from django.test import SimpleTestCase, override_settings
+from unittest.mock import patch, MagicMock
+import numpy as np
+
+from spdb.spatialdb import Cube
+
+from bosstiles.slabs import get_slab, image_cutout, clear_slab_cache
+
+
+class FakeCache(object):
+    """ Stand in for SpatialDB that cuts out of an in-memory volume and counts reads"""
+    def __init__(self, volume):
+        self.volume = volume
+        self.reads = []
+
+    def cutout(self, resource, corner, extent, resolution, time_range):
+        self.reads.append((tuple(corner), tuple(extent)))
+        cube = Cube.create_cube(resource, list(extent), time_range)
+        cube.data = self.volume[time_range[0]:time_range[1], corner[2]:corner[2] + extent[2],
+                                corner[1]:corner[1] + extent[1], corner[0]:corner[0] + extent[0]].copy()
+        return cube
+
+
+@override_settings(TILE_SLAB_DEPTH=16, TILE_SLAB_CACHE_SIZE=2 ** 20, TILE_SLAB_MAX_SIZE=2 ** 20)
+class TestSlabs(SimpleTestCase):
+
+    def setUp(self):
+        self.resource = MagicMock()
+        self.resource.get_lookup_key.return_value = "1&1&1"
+        self.resource.get_numpy_data_type.return_value = np.uint8
+        self.resource.get_data_type.return_value = "uint8"
+
+        self.volume = (np.arange(16 * 64 * 64) % 251).astype(np.uint8).reshape(1, 16, 64, 64)
+        self.cache = FakeCache(self.volume)
+        self.generations = ("epoch", [0])
+        clear_slab_cache()
+
+    def tearDown(self):
+        clear_slab_cache()
+
+    def test_slab_stays_in_cuboid(self):
+        """ Test slabs are aligned to their depth and never cross a cuboid boundary along the normal axis"""
+        self.assertEqual(get_slab('xz', (0, 37, 0), (512, 1, 16), 0, 16), ((0, 32, 0), (512, 16, 16)))
+        self.assertEqual(get_slab('yz', (37, 0, 0), (1, 512, 16), 0, 16), ((32, 0, 0), (16, 512, 16)))
+        self.assertEqual(get_slab('xz', (0, 505, 0), (512, 1, 16), 0, 24), ((0, 504, 0), (512, 8, 16)))
+
+    def test_neighbouring_planes_share_a_read(self):
+        """ Test planes of the same slab are served from a single cutout"""
+        for y in range(16):
+            cube = image_cutout(self.cache, self.resource, 'xz', (0, y, 0), (64, 1, 16), 0, [0, 1], self.generations)
+            np.testing.assert_array_equal(cube.data, self.volume[:, :, y:y + 1, :])
+        for x in (3, 7):
+            cube = image_cutout(self.cache, self.resource, 'yz', (x, 0, 0), (1, 64, 16), 0, [0, 1], self.generations)
+            np.testing.assert_array_equal(cube.data, self.volume[:, :, :, x:x + 1])
+
+        self.assertEqual(self.cache.reads, [((0, 0, 0), (64, 16, 16)), ((0, 0, 0), (16, 64, 16))])
+
+        image_cutout(self.cache, self.resource, 'xz', (0, 16, 0), (64, 1, 16), 0, [0, 1], self.generations)
+        self.assertEqual(self.cache.reads[-1], ((0, 16, 0), (64, 16, 16)))
+
+    def test_write_makes_slab_stale(self):
+        """ Test a slab is read again once a cuboid under it has been written"""
+        image_cutout(self.cache, self.resource, 'xz', (0, 3, 0), (64, 1, 16), 0, [0, 1], self.generations)
+        self.volume[0, 0, 4, 0] = 255
+        cube = image_cutout(self.cache, self.resource, 'xz', (0, 4, 0), (64, 1, 16), 0, [0, 1], ("epoch", [1]))
+
+        self.assertEqual(len(self.cache.reads), 2)
+        self.assertEqual(cube.data[0, 0, 0, 0], 255)
+
+    def test_large_and_xy_images_are_not_slabbed(self):
+        """ Test xy images and planes over the slab size limit use a regular cutout"""
+        with patch('bosstiles.slabs.coalesced_cutout') as mock_cutout:
+            image_cutout(self.cache, self.resource, 'xy', (0, 0, 3), (64, 64, 1), 0, [0, 1], self.generations)
+            with override_settings(TILE_SLAB_MAX_SIZE=512):
+                image_cutout(self.cache, self.resource, 'xz', (0, 3, 0), (64, 1, 16), 0, [0, 1], self.generations)
+
+        self.assertEqual(mock_cutout.call_count, 2)
+        self.assertEqual(self.cache.reads, [])
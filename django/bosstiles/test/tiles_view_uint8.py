@@ -12,15 +12,24 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 from django.conf import settings
+from django.test import override_settings
 import blosc
+import io
+import tempfile
 
 from rest_framework.test import APITestCase, APIRequestFactory
 from rest_framework.test import force_authenticate
 from rest_framework import status
 
-from bosstiles.views import Tile, CutoutTile
+from bosstiles.views import Tile, CutoutTile, TileBatch
+from bosstiles.batch import read_bundle
+from bosstiles.cache import clear_tile_cache, get_tile_cache
+from bosstiles.slabs import clear_slab_cache
 from bossspatialdb.views import Cutout
+from bossspatialdb.cuboidcache import clear_cuboid_cache
 
+from bossingest.models import IngestJob
+from bossingest.views import IngestJobCompleteView
 from bosscore.test.setup_db import SetupTestDB
 from bosscore.error import BossError
 
@@ -87,6 +96,36 @@ class ImageInterfaceViewTestMixin(object):
 
         np.testing.assert_equal(test_img, self.test_data_8[1, 0:128, 0:128])
 
+    def test_png_uint8_xy_not_modified(self):
+        """ Test a png xy slice is not sent again when the client's copy is current"""
+        factory = APIRequestFactory()
+
+        # Get an image file
+        request = factory.get('/' + version + '/image/col1/exp1/channel1/xy/0/0:128/0:128/1/',
+                              Accept='image/png')
+        force_authenticate(request, user=self.user)
+        response = CutoutTile.as_view()(request, collection='col1', experiment='exp1', channel='channel1',
+                                        orientation='xy', resolution='0', x_args='0:128', y_args='0:128', z_args='1')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        etag = response['ETag']
+
+        # Get it again, providing the ETag
+        request = factory.get('/' + version + '/image/col1/exp1/channel1/xy/0/0:128/0:128/1/',
+                              Accept='image/png', HTTP_IF_NONE_MATCH=etag)
+        force_authenticate(request, user=self.user)
+        response = CutoutTile.as_view()(request, collection='col1', experiment='exp1', channel='channel1',
+                                        orientation='xy', resolution='0', x_args='0:128', y_args='0:128', z_args='1')
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response['ETag'], etag)
+
+        # A different orientation is a different representation
+        request = factory.get('/' + version + '/image/col1/exp1/channel1/xz/0/0:128/1/0:16/',
+                              Accept='image/png', HTTP_IF_NONE_MATCH=etag)
+        force_authenticate(request, user=self.user)
+        response = CutoutTile.as_view()(request, collection='col1', experiment='exp1', channel='channel1',
+                                        orientation='xz', resolution='0', x_args='0:128', y_args='1', z_args='0:16')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
     def test_png_uint8_xz(self):
         """ Test a png xz slice"""
         # Post data to the database
@@ -125,6 +164,34 @@ class ImageInterfaceViewTestMixin(object):
 
         np.testing.assert_equal(test_img, np.squeeze(self.test_data_8[0:16, 20:400, 5]))
 
+    def test_png_uint8_xy_max_projection(self):
+        """ Test a png maximum intensity projection of an xy stack"""
+        factory = APIRequestFactory()
+
+        # Get an image file
+        request = factory.get('/' + version + '/image/col1/exp1/channel1/xy/0/0:128/0:128/0:16/?project=max',
+                              Accept='image/png')
+        force_authenticate(request, user=self.user)
+        # Make request
+        response = CutoutTile.as_view()(request, collection='col1', experiment='exp1', channel='channel1',
+                                        orientation='xy', resolution='0', x_args='0:128', y_args='0:128', z_args='0:16')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        # Check data is correct (this is pre-renderer)
+        test_img = np.array(response.data, dtype="uint8")
+
+        np.testing.assert_equal(test_img, self.test_data_8[0:16, 0:128, 0:128].max(axis=0))
+
+    def test_png_uint8_projection_wrong_axis(self):
+        """ Test an image can only be projected along the axis normal to its plane"""
+        factory = APIRequestFactory()
+        request = factory.get('/' + version + '/image/col1/exp1/channel1/xy/0/0:128/0:128/0:16/?project=max&axis=x',
+                              Accept='image/png')
+        force_authenticate(request, user=self.user)
+        response = CutoutTile.as_view()(request, collection='col1', experiment='exp1', channel='channel1',
+                                        orientation='xy', resolution='0', x_args='0:128', y_args='0:128', z_args='0:16')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
 
 class TestImageInterfaceView(ImageInterfaceViewTestMixin, APITestCase):
 
@@ -155,6 +222,11 @@ class TestImageInterfaceView(ImageInterfaceViewTestMixin, APITestCase):
         self.mock_tests = self.patcher.stop()
         self.mock_spdb = self.spdb_patcher.stop()
 
+        # Drop cuboids and tiles cached with the mocks
+        clear_cuboid_cache()
+        clear_tile_cache()
+        clear_slab_cache()
+
     @classmethod
     def setUpClass(cls):
         """ Setup data to read
@@ -266,6 +338,119 @@ class TileInterfaceViewTestMixin(object):
 
         np.testing.assert_equal(test_img, np.squeeze(self.test_data_8[8:12, 28:32, 0]))
 
+    def test_batch_viewport_clipped_to_frame(self):
+        """ Test a batch viewport only returns the tiles that fit in the coordinate frame"""
+        factory = APIRequestFactory()
+
+        # The viewport touches tiles 194 and 195 along x. Tile 195 runs past the end of the frame at x=100000.
+        request = factory.post('/' + version + '/batch/tile/col1/exp1/channel1/xy/512/0/',
+                               {"viewport": {"x": "99500:100000", "y": "0:512", "z": 5}}, format='json')
+        force_authenticate(request, user=self.user)
+        # Make request
+        response = TileBatch.as_view()(request, collection='col1', experiment='exp1', channel='channel1',
+                                       orientation='xy', tile_size='512', resolution='0')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        bundle = read_bundle(io.BytesIO(b''.join(response.streaming_content)))
+        self.assertEqual(list(bundle), [(194, 0, 5)])
+
+    def test_batch_viewport_past_frame(self):
+        """ Test a batch viewport that reaches past the end of the coordinate frame returns the tiles inside it"""
+        factory = APIRequestFactory()
+
+        # The viewport runs 600 voxels past the end of the frame at x=100000
+        request = factory.post('/' + version + '/batch/tile/col1/exp1/channel1/xy/512/0/',
+                               {"viewport": {"x": "99000:100600", "y": "0:512", "z": 5}}, format='json')
+        force_authenticate(request, user=self.user)
+        # Make request
+        response = TileBatch.as_view()(request, collection='col1', experiment='exp1', channel='channel1',
+                                       orientation='xy', tile_size='512', resolution='0')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        bundle = read_bundle(io.BytesIO(b''.join(response.streaming_content)))
+        self.assertEqual(list(bundle), [(193, 0, 5), (194, 0, 5)])
+
+    def test_png_uint8_xy_colormap_default_window(self):
+        """ Test a tile with a colormap and no window is rendered with the channel's default window"""
+        histogram = np.zeros(256, dtype=np.uint64)
+        histogram[[10, 200]] = 1000
+        factory = APIRequestFactory()
+
+        # Get an image file
+        request = factory.get('/' + version + '/tile/col1/exp1/channel1/xy/512/0/0/0/5/', {'colormap': 'hot'},
+                              Accept='image/png')
+        force_authenticate(request, user=self.user)
+        # Make request
+        with patch('bosstiles.display.get_region_histogram', return_value=(histogram, None, None)) as mock_hist:
+            response = Tile.as_view()(request, collection='col1', experiment='exp1', channel='channel1',
+                                      orientation='xy', tile_size='512', resolution='0',
+                                      x_idx='0', y_idx='0', z_idx='5')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data.mode, 'RGB')
+
+        # The default window comes from the histogram of the experiment's coarsest resolution
+        self.assertEqual(mock_hist.call_args[0][1], 9)
+
+    @override_settings(TILE_PREFETCH=True, TILE_PREFETCH_DEPTH=2)
+    def test_png_uint8_xy_prefetch(self):
+        """ Test the neighbours of a tile inside the coordinate frame are queued once it has been served"""
+        factory = APIRequestFactory()
+
+        # Get an image file
+        request = factory.get('/' + version + '/tile/col1/exp1/channel1/xy/512/0/0/0/5/',
+                              Accept='image/png')
+        force_authenticate(request, user=self.user)
+        # Make request
+        with patch('bosstiles.prefetch.get_prefetcher') as mock_prefetcher:
+            response = Tile.as_view()(request, collection='col1', experiment='exp1', channel='channel1',
+                                      orientation='xy', tile_size='512', resolution='0',
+                                      x_idx='0', y_idx='0', z_idx='5')
+            response.render()
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        # Nearest planes first, then the tiles around it. The tile at x=-512 is outside the frame.
+        submit = mock_prefetcher.return_value.submit
+        self.assertEqual([c[0][6] for c in submit.call_args_list],
+                         [(0, 0, 6), (0, 0, 4), (0, 0, 7), (0, 0, 3), (512, 0, 5), (0, 512, 5)])
+        self.assertTrue(all(c[0][7] == (512, 512, 1) for c in submit.call_args_list))
+
+    def test_png_uint8_xy_cached_tile_not_served_after_ingest(self):
+        """ Test tiles cached on disk and in redis are rendered again once an ingest job into the channel completes"""
+        factory = APIRequestFactory()
+
+        def get_tile():
+            request = factory.get('/' + version + '/tile/col1/exp1/channel1/xy/512/0/0/0/5/',
+                                  Accept='image/png')
+            force_authenticate(request, user=self.user)
+            response = Tile.as_view()(request, collection='col1', experiment='exp1', channel='channel1',
+                                      orientation='xy', tile_size='512', resolution='0',
+                                      x_idx='0', y_idx='0', z_idx='5')
+            response.render()
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            return response['ETag']
+
+        with tempfile.TemporaryDirectory() as tile_dir, patch('bosstiles.cache._cache', None), \
+                self.settings(TILE_CACHE_TIERS=['disk', 'redis'], TILE_CACHE_DIR=tile_dir,
+                              DOWNSAMPLE_AFTER_INGEST=False):
+            etag = get_tile()
+            self.assertEqual(get_tile(), etag)
+            self.assertEqual(get_tile_cache().get_stats()['disk_hits'], 1)
+
+            # Ingest writes cuboids without bumping their generations
+            ingest_job = IngestJob.objects.create(creator=self.user, status=1, config_data='{}', collection='col1',
+                                                  experiment='exp1', channel='channel1', resolution=0, x_start=0,
+                                                  y_start=0, z_start=0, t_start=0, x_stop=1024, y_stop=1024,
+                                                  z_stop=16, t_stop=1, tile_size_x=512, tile_size_y=512,
+                                                  tile_size_z=1, tile_size_t=1)
+            request = factory.post('/' + version + '/ingest/{}/complete'.format(ingest_job.id))
+            force_authenticate(request, user=self.user)
+            response = IngestJobCompleteView.as_view()(request, ingest_job_id=str(ingest_job.id))
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+            self.assertNotEqual(get_tile(), etag)
+            stats = get_tile_cache().get_stats()
+            self.assertEqual((stats['disk_hits'], stats['redis_hits'], stats['misses']), (1, 0, 2))
+
 
 class TestTileInterfaceView(TileInterfaceViewTestMixin, APITestCase):
 
@@ -296,6 +481,11 @@ class TestTileInterfaceView(TileInterfaceViewTestMixin, APITestCase):
         self.mock_tests = self.patcher.stop()
         self.mock_spdb = self.spdb_patcher.stop()
 
+        # Drop cuboids and tiles cached with the mocks
+        clear_cuboid_cache()
+        clear_tile_cache()
+        clear_slab_cache()
+
     @classmethod
     def setUpTestData(cls):
         """ Setup data to read
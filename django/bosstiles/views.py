@@ -11,17 +11,40 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+from collections import OrderedDict
+import itertools
+
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
+from rest_framework.parsers import JSONParser
 from django.conf import settings
+from django.http import HttpResponseNotModified, StreamingHttpResponse
 
 from bosscore.request import BossRequest
 from bosscore.error import BossError, BossHTTPError, ErrorCodes
+from bosscore.models import Experiment
 
 import spdb
-
-from .renderers import PNGRenderer, JPEGRenderer
+from bossspatialdb.blocks import get_cuboid_size
+from bossspatialdb.pool import get_spatialdb
+from bossspatialdb.projection import get_projection, check_projection_size, project_cutout
+from bossspatialdb.versioning import get_cuboid_fields, get_generations, make_etag, etag_matches
+from bossspatialdb.views import parse_range
+
+from .batch import get_tile_region, get_viewport_tiles, get_batch_generations, plan_tile_reads, tile_batch_stream
+from .cache import get_tile_cache, get_tile_key, cache_rendered_tile
+from .composite import get_composite_settings, read_layers, render_composite
+from .display import get_display_args, get_display_settings, render_image
+from .jobs import create_render_job, get_render_job, cancel_render_job
+from .prefetch import prefetch_neighbors
+from .pyramid import PLANE_AXES, RENDERERS
+from .renderers import PNGRenderer, JPEGRenderer, TileBundleRenderer
+from .serializers import TileRenderJobSerializer
+from .slabs import image_cutout
+
+# Axis normal to each image plane, which is the axis an image is projected along
+PROJECTION_AXIS = {'xy': 'z', 'xz': 'y', 'yz': 'x'}
 
 
 class CutoutTile(APIView):
@@ -52,6 +75,15 @@ class CutoutTile(APIView):
         :param y_args: Python style range indicating the Y coordinates of where to post the cuboid (eg. 100:200)
         :param z_args: Python style range indicating the Z coordinates of where to post the cuboid (eg. 100:200)
         :return:
+
+        Add ?project=max|min|mean to render a projection of the region along the axis normal to the image plane.
+
+        Add ?window=low:high|auto, ?gamma=<number> and/or ?colormap=<name> to render a uint8 or uint16 channel with an
+        intensity window, gamma and colormap. The window defaults to one computed from the channel's statistics.
+
+        Add ?overlay=<channel>[,<colormap>[,<low:high>|auto]] once per channel to blend other channels of the
+        experiment over this one into a single RGB image. uint8 and uint16 channels are added together, annotation
+        channels are drawn on top with a color per id (the ids colormap) or the colormap's color.
         """
         # Process request and validate
         try:
@@ -80,27 +112,87 @@ class CutoutTile(APIView):
         except ValueError:
             return BossHTTPError("Datatype does not match channel", ErrorCodes.DATATYPE_DOES_NOT_MATCH)
 
+        try:
+            projection = get_projection(request.query_params, PROJECTION_AXIS.get(orientation))
+            display, overlays = get_composite_settings(request, request_args, resource, req)
+            if projection and overlays:
+                raise BossError("Projections can't be overlaid with other channels", ErrorCodes.INVALID_ARGUMENT)
+        except BossError as err:
+            return err.to_http()
+
         # Make sure cutout request is under 1GB UNCOMPRESSED
         total_bytes = req.get_x_span() * req.get_y_span() * req.get_z_span() * len(req.get_time()) * (self.bit_depth/8)
-        if total_bytes > settings.CUTOUT_MAX_SIZE:
+        if projection:
+            try:
+                check_projection_size((req.get_x_span(), req.get_y_span(), req.get_z_span()), len(req.get_time()),
+                                      self.bit_depth / 8, projection[1])
+            except BossError as err:
+                return err.to_http()
+        elif total_bytes > settings.CUTOUT_MAX_SIZE:
             return BossHTTPError("Cutout request is over 1GB when uncompressed. Reduce cutout dimensions.",
                                  ErrorCodes.REQUEST_TOO_LARGE)
 
-        # Get interface to SPDB cache
-        cache = spdb.spatialdb.SpatialDB(settings.KVIO_SETTINGS,
-                                         settings.STATEIO_CONFIG,
-                                         settings.OBJECTIO_CONFIG)
-
         # Get the params to pull data out of the cache
         corner = (req.get_x_start(), req.get_y_start(), req.get_z_start())
         extent = (req.get_x_span(), req.get_y_span(), req.get_z_span())
+        time_range = [req.get_time().start, req.get_time().stop]
+
+        # If the client's copy is current, respond without reading or rendering any data. The write generations are
+        # also the version of the data read below.
+        fields = get_cuboid_fields(corner, extent, req.get_resolution(), time_range)
+        generations = get_generations(resource, req.get_resolution(), fields)
+        overlay_generations = [get_generations(overlay, req.get_resolution(), fields) for overlay, _ in overlays]
+        variant = [request.accepted_media_type, orientation, projection]
+        if display:
+            variant.append(display)
+        if overlays:
+            variant.append([[overlay.get_lookup_key(), overlay_display, *overlay_gens]
+                            for (overlay, overlay_display), overlay_gens in zip(overlays, overlay_generations)])
+        etag = make_etag(resource, req.get_resolution(), corner, extent, time_range, variant, *generations)
+        if etag_matches(request, etag):
+            response = HttpResponseNotModified()
+            response['ETag'] = etag
+            return response
+
+        # Once the image is served, warm the caches with the planes and images a viewer is likely to ask for next
+        prefetch = None
+        if not projection and not overlays:
+            prefetch = prefetch_neighbors(request.user.pk, resource, orientation, req.get_resolution(), corner, extent,
+                                          time_range, variant, type(request.accepted_renderer), display,
+                                          req.coord_frame)
+
+        # Serve the encoded image if it has already been rendered
+        tile_key = get_tile_key(etag)
+        content = get_tile_cache().get(tile_key)
+        if content is not None:
+            response = Response(content, headers={'ETag': etag})
+            if prefetch:
+                response.add_post_render_callback(prefetch)
+            return response
+
+        # Read every layer of a composite concurrently and blend them into one image
+        if overlays:
+            layers = [(resource, generations)] + [(overlay, overlay_gens) for (overlay, _), overlay_gens
+                                                  in zip(overlays, overlay_generations)]
+            cubes = read_layers(layers, orientation, corner, extent, req.get_resolution(), time_range)
+            displays = [display] + [overlay_display for _, overlay_display in overlays]
+            response = Response(render_composite(cubes, orientation, displays), headers={'ETag': etag})
+            response.add_post_render_callback(cache_rendered_tile(tile_key))
+            return response
 
         # Do a cutout as specified
-        data = cache.cutout(resource, corner, extent, req.get_resolution(),
-                            [req.get_time().start, req.get_time().stop])
+        with get_spatialdb() as cache:
+            if projection:
+                data = project_cutout(cache, resource, corner, extent, req.get_resolution(), time_range,
+                                      projection[0], projection[1], max_bytes=settings.CUTOUT_STREAM_BLOCK_SIZE)
+            else:
+                data = image_cutout(cache, resource, orientation, corner, extent, req.get_resolution(), time_range,
+                                    generations)
 
         # Covert the cutout back to an image and return it
-        if orientation == 'xy':
+        if display:
+            img = render_image(data, orientation, display)
+        elif orientation == 'xy':
             img = data.xy_image()
         elif orientation == 'yz':
             img = data.yz_image()
@@ -110,7 +202,11 @@ class CutoutTile(APIView):
             return BossHTTPError("Invalid orientation: {}".format(orientation),
                                  ErrorCodes.INVALID_CUTOUT_ARGS)
 
-        return Response(img)
+        response = Response(img, headers={'ETag': etag})
+        response.add_post_render_callback(cache_rendered_tile(tile_key))
+        if prefetch:
+            response.add_post_render_callback(prefetch)
+        return response
 
 
 class Tile(APIView):
@@ -141,6 +237,13 @@ class Tile(APIView):
         :param z_idx: the tile index in the Z dimension
         :param t_idx: the tile index in the T dimension
         :return:
+
+        Add ?window=low:high|auto, ?gamma=<number> and/or ?colormap=<name> to render a uint8 or uint16 channel with an
+        intensity window, gamma and colormap. The window defaults to one computed from the channel's statistics.
+
+        Add ?overlay=<channel>[,<colormap>[,<low:high>|auto]] once per channel to blend other channels of the
+        experiment over this one into a single RGB image. uint8 and uint16 channels are added together, annotation
+        channels are drawn on top with a color per id (the ids colormap) or the colormap's color.
         """
         # TODO: DMK Merge Tile and Image view once updated request validation is sorted out
 
@@ -179,21 +282,69 @@ class Tile(APIView):
             return BossHTTPError("Cutout request is over 1GB when uncompressed. Reduce cutout dimensions.",
                                  ErrorCodes.REQUEST_TOO_LARGE)
 
-        # Get interface to SPDB cache
-        cache = spdb.spatialdb.SpatialDB(settings.KVIO_SETTINGS,
-                                         settings.STATEIO_CONFIG,
-                                         settings.OBJECTIO_CONFIG)
+        # Window, gamma and colormap to render the tile with, and any channels to blend over it
+        try:
+            display, overlays = get_composite_settings(request, request_args, resource, req)
+        except BossError as err:
+            return err.to_http()
 
         # Get the params to pull data out of the cache
         corner = (req.get_x_start(), req.get_y_start(), req.get_z_start())
         extent = (req.get_x_span(), req.get_y_span(), req.get_z_span())
+        time_range = [req.get_time().start, req.get_time().stop]
+
+        # If the client's copy is current, respond without reading or rendering any data. The write generations are
+        # also the version of the data read below.
+        fields = get_cuboid_fields(corner, extent, req.get_resolution(), time_range)
+        generations = get_generations(resource, req.get_resolution(), fields)
+        overlay_generations = [get_generations(overlay, req.get_resolution(), fields) for overlay, _ in overlays]
+        variant = [request.accepted_media_type, orientation]
+        if display:
+            variant.append(display)
+        if overlays:
+            variant.append([[overlay.get_lookup_key(), overlay_display, *overlay_gens]
+                            for (overlay, overlay_display), overlay_gens in zip(overlays, overlay_generations)])
+        etag = make_etag(resource, req.get_resolution(), corner, extent, time_range, variant, *generations)
+        if etag_matches(request, etag):
+            response = HttpResponseNotModified()
+            response['ETag'] = etag
+            return response
+
+        # Once the tile is served, warm the caches with the tiles a viewer is likely to ask for next
+        prefetch = None
+        if not overlays:
+            prefetch = prefetch_neighbors(request.user.pk, resource, orientation, req.get_resolution(), corner, extent,
+                                          time_range, variant, type(request.accepted_renderer), display,
+                                          req.coord_frame)
+
+        # Serve the encoded image if it has already been rendered
+        tile_key = get_tile_key(etag)
+        content = get_tile_cache().get(tile_key)
+        if content is not None:
+            response = Response(content, headers={'ETag': etag})
+            if prefetch:
+                response.add_post_render_callback(prefetch)
+            return response
+
+        # Read every layer of a composite concurrently and blend them into one image
+        if overlays:
+            layers = [(resource, generations)] + [(overlay, overlay_gens) for (overlay, _), overlay_gens
+                                                  in zip(overlays, overlay_generations)]
+            cubes = read_layers(layers, orientation, corner, extent, req.get_resolution(), time_range)
+            displays = [display] + [overlay_display for _, overlay_display in overlays]
+            response = Response(render_composite(cubes, orientation, displays), headers={'ETag': etag})
+            response.add_post_render_callback(cache_rendered_tile(tile_key))
+            return response
 
         # Do a cutout as specified
-        data = cache.cutout(resource, corner, extent, req.get_resolution(),
-                            [req.get_time().start, req.get_time().stop])
+        with get_spatialdb() as cache:
+            data = image_cutout(cache, resource, orientation, corner, extent, req.get_resolution(), time_range,
+                                generations)
 
         # Covert the cutout back to an image and return it
-        if orientation == 'xy':
+        if display:
+            img = render_image(data, orientation, display)
+        elif orientation == 'xy':
             img = data.xy_image()
         elif orientation == 'yz':
             img = data.yz_image()
@@ -203,4 +354,287 @@ class Tile(APIView):
             return BossHTTPError("Invalid orientation: {}".format(orientation),
                                  ErrorCodes.INVALID_CUTOUT_ARGS)
 
-        return Response(img)
+        response = Response(img, headers={'ETag': etag})
+        response.add_post_render_callback(cache_rendered_tile(tile_key))
+        if prefetch:
+            response.add_post_render_callback(prefetch)
+        return response
+
+
+class TileBatch(APIView):
+    """
+    View to fetch many tiles of one image plane, tile size and resolution in one request
+
+    The tiles are POSTed as JSON, either as a list of tile indices as used in the /tile/ URL, or as a viewport in voxel
+    coordinates. A viewport returns every tile that intersects it and is inside the coordinate frame:
+
+        {
+            "tiles": [[0, 0, 10], [1, 0, 10]],                  # x/y/z indices of each tile, or
+            "viewport": {"x": "0:2048", "y": "0:1024", "z": 10}, # ranges along the image plane and the plane's position
+            "t": 0,                                              # Time sample. Defaults to the channel's default.
+            "format": "png",                                     # png or jpg. Defaults to png.
+            "window": "0:4000", "gamma": 1.0, "colormap": "gray" # Optional display settings, as for /tile/
+        }
+
+    The request is validated once. Tiles that are already rendered are served from the tile cache, and the rest are
+    read with as few cutouts as possible and encoded in parallel. The response is a bundle of encoded tiles, each with
+    the ETag /tile/ would send for it. See bosstiles.batch for the format.
+
+    * Requires authentication.
+    """
+    parser_classes = (JSONParser,)
+    renderer_classes = (TileBundleRenderer,)
+
+    def __init__(self):
+        super().__init__()
+        self.bit_depth = None
+
+    def get_tiles(self, body, orientation, tile_size):
+        """
+        Parse the tiles out of the request body
+
+        :param body: Parsed JSON request body
+        :param orientation: Image plane
+        :param tile_size: Tile size
+        :return: List of unique (x, y, z) tile indices in the order they were requested
+        """
+        if not isinstance(body, dict):
+            raise BossError("Batch tile requests must include a list of tiles or a viewport",
+                            ErrorCodes.INVALID_POST_ARGUMENT)
+        if isinstance(body.get("viewport"), dict):
+            tiles = get_viewport_tiles(orientation, tile_size, body["viewport"])
+        elif isinstance(body.get("tiles"), list) and body["tiles"]:
+            try:
+                tiles = [tuple(int(idx) for idx in tile) for tile in body["tiles"]]
+            except (TypeError, ValueError):
+                raise BossError("Tiles must be lists of x, y and z indices", ErrorCodes.INVALID_POST_ARGUMENT)
+            if any(len(tile) != 3 or min(tile) < 0 for tile in tiles):
+                raise BossError("Tiles must be lists of x, y and z indices", ErrorCodes.INVALID_POST_ARGUMENT)
+        else:
+            raise BossError("Batch tile requests must include a list of tiles or a viewport",
+                            ErrorCodes.INVALID_POST_ARGUMENT)
+
+        if len(tiles) > settings.TILE_BATCH_MAX_TILES:
+            raise BossError("Batch tile requests are limited to {} tiles".format(settings.TILE_BATCH_MAX_TILES),
+                            ErrorCodes.REQUEST_TOO_LARGE)
+        return list(OrderedDict.fromkeys(tiles))
+
+    def post(self, request, collection, experiment, channel, orientation, tile_size, resolution):
+        """
+        View to handle POST requests for a batch of tiles
+
+        :param request: DRF Request object
+        :type request: rest_framework.request.Request
+        :param collection: Unique Collection identifier, indicating which collection you want to access
+        :param experiment: Experiment identifier, indicating which experiment you want to access
+        :param channel: Channel identifier, indicating which channel you want to access
+        :param orientation: Image plane requested. Vaid options include xy,xz or yz
+        :param tile_size: Size of each tile
+        :param resolution: Integer indicating the level in the resolution hierarchy (0 = native)
+        :return:
+        """
+        tile_size = int(tile_size)
+        try:
+            if tile_size <= 0:
+                raise BossError("Tile size must be positive", ErrorCodes.INVALID_CUTOUT_ARGS)
+            tiles = self.get_tiles(request.data, orientation, tile_size)
+            fmt = request.data.get("format", "png")
+            if fmt not in RENDERERS:
+                raise BossError("Invalid tile format '{}'. Supported formats: {}".format(
+                    fmt, ", ".join(sorted(RENDERERS))), ErrorCodes.INVALID_ARGUMENT)
+            viewport = request.data.get("viewport") if isinstance(request.data.get("viewport"), dict) else None
+            display_args = get_display_args(request.data)
+        except BossError as err:
+            return err.to_http()
+
+        # Validate the batch once, using the viewport or the bounding box of the tiles. This is a read, so permissions
+        # are checked as a GET.
+        regions = [get_tile_region(orientation, tile_size, tile) for tile in tiles]
+        if viewport is not None:
+            _, normal = PLANE_AXES[orientation]
+            start = [regions[0].corner[normal]] * 3
+            stop = [regions[0].corner[normal] + 1] * 3
+            for axis in PLANE_AXES[orientation][0]:
+                start[axis], stop[axis] = parse_range(viewport, 'xyz'[axis])
+
+            # A viewport can reach past the edge of the frame, so validate the part of it inside the frame. A missing
+            # experiment is left for BossRequest to report.
+            exp = Experiment.objects.filter(name=experiment, collection__name=collection).first()
+            if exp is not None:
+                frame = exp.coord_frame
+                start = [max(a, b) for a, b in zip(start, (frame.x_start, frame.y_start, frame.z_start))]
+                stop = [min(a, b) for a, b in zip(stop, (frame.x_stop, frame.y_stop, frame.z_stop))]
+        else:
+            start = [min(r.corner[dim] for r in regions) for dim in range(3)]
+            stop = [max(r.corner[dim] + r.extent[dim] for r in regions) for dim in range(3)]
+        try:
+            request_args = {
+                "service": "cutout",
+                "method": "GET",
+                "collection_name": collection,
+                "experiment_name": experiment,
+                "channel_name": channel,
+                "resolution": resolution,
+                "x_args": "{}:{}".format(start[0], stop[0]),
+                "y_args": "{}:{}".format(start[1], stop[1]),
+                "z_args": "{}:{}".format(start[2], stop[2]),
+                "time_args": str(request.data["t"]) if request.data.get("t") is not None else None,
+            }
+            req = BossRequest(request, request_args)
+        except BossError as err:
+            return err.to_http()
+
+        # Convert to Resource
+        resource = spdb.project.BossResourceDjango(req)
+
+        # Get bit depth
+        try:
+            self.bit_depth = resource.get_bit_depth()
+        except ValueError:
+            return BossHTTPError("Datatype does not match channel", ErrorCodes.DATATYPE_DOES_NOT_MATCH)
+
+        # Drop the tiles of a viewport that run past the edge of the frame, where the /tile/ endpoint wouldn't serve
+        # them
+        if viewport is not None:
+            frame = req.coord_frame
+            frame_start = (frame.x_start, frame.y_start, frame.z_start)
+            frame_stop = (frame.x_stop, frame.y_stop, frame.z_stop)
+            inside = [all(r.corner[dim] >= frame_start[dim] and r.corner[dim] + r.extent[dim] <= frame_stop[dim]
+                          for dim in range(3)) for r in regions]
+            tiles = [tile for tile, keep in zip(tiles, inside) if keep]
+            regions = [region for region, keep in zip(regions, inside) if keep]
+
+        resolution = req.get_resolution()
+        time_range = [req.get_time().start, req.get_time().stop]
+        renderer = RENDERERS[fmt]
+        try:
+            display = get_display_settings(display_args, resource, req.experiment, req.coord_frame,
+                                           time_range[0])
+        except BossError as err:
+            return err.to_http()
+        variant = [renderer.media_type, orientation]
+        if display:
+            variant.append(display)
+
+        # Read the write generations of every tile in one round trip, and serve the tiles that are already rendered
+        tile_fields = [get_cuboid_fields(r.corner, r.extent, resolution, time_range) for r in regions]
+        generations = get_batch_generations(resource, resolution, itertools.chain(*tile_fields))
+        tile_cache = get_tile_cache()
+        cached = []
+        missing = []
+        for tile, region, fields in zip(tiles, regions, tile_fields):
+            etag = make_etag(resource, resolution, region.corner, region.extent, time_range, variant, generations[0],
+                             [generations[1][field] for field in fields])
+            key = get_tile_key(etag)
+            content = tile_cache.get(key)
+            if content is not None:
+                cached.append((tile, key, content))
+            else:
+                missing.append((tile, region, key))
+
+        # Make sure the tiles to render are under 1GB UNCOMPRESSED
+        total_bytes = len(missing) * tile_size * tile_size * len(req.get_time()) * (self.bit_depth / 8)
+        if total_bytes > settings.CUTOUT_MAX_SIZE:
+            return BossHTTPError("Batch tile request is over 1GB when uncompressed. Request fewer tiles.",
+                                 ErrorCodes.REQUEST_TOO_LARGE)
+
+        # Group the tiles to render so each group is read with a single cutout
+        _, normal = PLANE_AXES[orientation]
+        planned = plan_tile_reads([region for _, region, _ in missing], normal, get_cuboid_size(resolution),
+                                  self.bit_depth / 8, len(req.get_time()), settings.TILE_BATCH_MAX_READ_SIZE)
+        reads = [(block, [missing[idx] for idx in indices]) for block, indices in planned]
+        generations = get_batch_generations(resource, resolution, itertools.chain(
+            *[get_cuboid_fields(block.corner, block.extent, resolution, time_range) for block, _ in reads]),
+            generations)
+
+        return StreamingHttpResponse(tile_batch_stream(resource, orientation, resolution, time_range, renderer, cached,
+                                                       reads, generations, display),
+                                     content_type=TileBundleRenderer.media_type)
+
+
+class TileRenderJobs(APIView):
+    """
+    View to pre-render the tile pyramid of an image channel in the background
+
+    POST starts a job and returns its id. Optional JSON body parameters:
+
+        {
+            "orientations": ["xy"],   # Image planes to render (xy, xz, yz). Defaults to xy.
+            "tile_sizes": [512],      # Tile sizes to render. Defaults to settings.TILE_RENDER_TILE_SIZES.
+            "formats": ["png"],       # png and/or jpg. Defaults to png.
+            "resolution": "0:5",      # Resolutions to render. Defaults to all of the experiment's levels.
+            "t": "0:1",               # Time samples to render. Defaults to the channel's default time sample.
+            "output": "cache"         # Add tiles to the tile cache (cache) or write them to settings.TILE_RENDER_DIR
+                                      # for the web server to send (directory). Defaults to cache.
+        }
+
+    Poll the job's progress and throughput with GET /jobs/tiles/<job_id>/.
+
+    * Requires authentication.
+    """
+    parser_classes = (JSONParser,)
+
+    def post(self, request, collection, experiment, channel):
+        """
+        View to handle POST requests to start a tile pre-rendering job
+
+        :param request: DRF Request object
+        :type request: rest_framework.request.Request
+        :param collection: Unique Collection identifier, indicating which collection you want to access
+        :param experiment: Experiment identifier, indicating which experiment you want to access
+        :param channel: Channel identifier, indicating which channel you want to access
+        :return:
+        """
+        args = request.data if isinstance(request.data, dict) else {}
+        try:
+            for key in ("orientations", "tile_sizes", "formats"):
+                if key in args and not isinstance(args[key], list):
+                    raise BossError("{} must be a list".format(key), ErrorCodes.INVALID_ARGUMENT)
+            resolutions = parse_range(args, "resolution") if "resolution" in args else None
+            time_range = list(parse_range(args, "t")) if "t" in args else None
+
+            job = create_render_job(request, collection, experiment, channel, orientations=args.get("orientations"),
+                                    tile_sizes=args.get("tile_sizes"), formats=args.get("formats"),
+                                    resolutions=resolutions, time_range=time_range, output=args.get("output"))
+        except BossError as err:
+            return err.to_http()
+
+        return Response(TileRenderJobSerializer(job).data, status=201)
+
+
+class TileRenderJobDetail(APIView):
+    """
+    View to check on or cancel a tile pre-rendering job
+
+    * Requires authentication.
+    """
+
+    def get(self, request, job_id):
+        """
+        View to handle GET requests for the status of a tile pre-rendering job
+
+        :param request: DRF Request object
+        :type request: rest_framework.request.Request
+        :param job_id: Id of the job
+        :return:
+        """
+        try:
+            job = get_render_job(request, job_id)
+        except BossError as err:
+            return err.to_http()
+        return Response(TileRenderJobSerializer(job).data)
+
+    def delete(self, request, job_id):
+        """
+        View to handle DELETE requests to cancel a tile pre-rendering job
+
+        :param request: DRF Request object
+        :type request: rest_framework.request.Request
+        :param job_id: Id of the job
+        :return:
+        """
+        try:
+            job = cancel_render_job(request, job_id)
+        except BossError as err:
+            return err.to_http()
+        return Response(TileRenderJobSerializer(job).data)